@@ -1,10 +1,20 @@
 #!/usr/bin/env python3
+import argparse
+import json
 import os
-import subprocess
-import re
-from datetime import datetime
+import sys
 from colorama import Fore, Style, init
 
+from en1gma.batch import expand_inputs, run_batch
+from en1gma.cache import DEFAULT_CACHE_SIZE, PayloadCache, default_cache_dir
+from en1gma.deepcheck import DEEP_CHECKS
+from en1gma.engine import Extracted, extract
+from en1gma.filters import CaptureFilter, parse_time
+from en1gma.ingest import READERS
+from en1gma.sinks import SINKS, container_path
+from en1gma.signatures import FILE_TYPES, LOAD_ERRORS, SignatureError, add_signature_files, categories, select_types
+from en1gma.stats import Stats
+
 # Initialize colorama
 init()
 
@@ -18,108 +28,341 @@ BANNER = (Fore.CYAN + r"""
               Created by: EN1GMA
 """ + Style.RESET_ALL)
 
-FILE_TYPES = {
-    # Image formats
-    'jpg': {'header': b'\xff\xd8\xff', 'footer': b'\xff\xd9', 'validate': lambda x: x.startswith(b'\xff\xd8') and x.endswith(b'\xff\xd9')},
-    'png': {'header': b'\x89PNG\r\n\x1a\n', 'footer': b'IEND\xaeB`\x82', 'validate': lambda x: x.startswith(b'\x89PNG') and b'IEND' in x},
-    'gif': {'header': b'GIF', 'footer': b'\x00\x3b', 'validate': lambda x: x.startswith((b'GIF87a', b'GIF89a')) and x.endswith(b'\x00\x3b')},
-    'bmp': {'header': b'BM', 'footer': None, 'validate': lambda x: x.startswith(b'BM') and len(x) > 30},
-    'webp': {'header': b'RIFF', 'footer': None, 'validate': lambda x: x.startswith(b'RIFF') and b'WEBP' in x[:20]},
-    
-    # Document formats
-    'pdf': {'header': b'%PDF', 'footer': b'%%EOF', 'validate': lambda x: x.startswith(b'%PDF') and b'%%EOF' in x[-20:]},
-    'docx': {'header': b'PK\x03\x04', 'footer': None, 'validate': lambda x: x.startswith(b'PK\x03\x04') and b'word/' in x[:1000]},
-    'xlsx': {'header': b'PK\x03\x04', 'footer': None, 'validate': lambda x: x.startswith(b'PK\x03\x04') and b'xl/' in x[:1000]},
-    
-    # Archive formats
-    'zip': {'header': b'PK\x03\x04', 'footer': None, 'validate': lambda x: x.startswith(b'PK\x03\x04')},
-    'gz': {'header': b'\x1f\x8b', 'footer': None, 'validate': lambda x: x.startswith(b'\x1f\x8b')},
-    
-    # Audio/Video
-    'mp3': {'header': b'\xff\xfb', 'footer': None, 'validate': lambda x: x.startswith(b'\xff\xfb')},
-    'mp4': {'header': b'\x00\x00\x00\x18ftyp', 'footer': None, 'validate': lambda x: x.startswith(b'\x00\x00\x00') and b'moov' in x[:1000]}
-}
+def parse_size(text):
+    """Parse a byte count such as ``512M`` or ``2G``."""
+    units = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+    text = text.strip().upper().rstrip('B')
+    try:
+        if text and text[-1] in units:
+            return int(float(text[:-1]) * units[text[-1]])
+        return int(text)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid size: {text!r}")
+
+def add_cache_arguments(parser):
+    """The payload cache options, shared by extraction and ``serve``."""
+    parser.add_argument("--cache", action="store_true",
+                        help="Cache reassembled payloads so re-runs of a capture skip decoding (off by default)")
+    parser.add_argument("--cache-dir", metavar="DIR",
+                        help="Payload cache directory; implies --cache (default: ~/.cache/en1gma)")
+    parser.add_argument("--cache-size", type=parse_size, default=DEFAULT_CACHE_SIZE, metavar="SIZE",
+                        help="Evict least recently used cache entries beyond this size (default: 10G)")
+    # Off is the default now; kept so existing scripts still run
+    parser.add_argument("--no-cache", action="store_true", help=argparse.SUPPRESS)
+
+def cache_options(args):
+    """``(directory, max_size)`` if the payload cache was asked for, else None; says so when on."""
+    if args.no_cache or not (args.cache or args.cache_dir):
+        return None
+    directory = args.cache_dir or default_cache_dir()
+    print(f"[*] Caching payloads in {directory} (up to {args.cache_size / 1024 ** 3:g} GB)")
+    return directory, args.cache_size
+
+def parse_time_arg(text):
+    """Parse --start/--end."""
+    try:
+        return parse_time(text)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
 
-def extract_files(pcap_path, output_dir="extracted_files", selected_types=None):
+def parse_type_size(text):
+    """Parse ``EXT=SIZE`` for --max-size; the type is checked once --signatures are loaded."""
+    ext, sep, size = text.partition('=')
+    if not sep or not ext:
+        raise argparse.ArgumentTypeError(f"expected TYPE=SIZE, got {text!r}")
+    return ext.lower(), parse_size(size)
+
+def list_types():
+    """Print the known file types by category."""
+    for category, exts in categories().items():
+        print(f"{category}:")
+        for ext in exts:
+            print(f"  {ext:<10} {FILE_TYPES[ext]['description']}")
+
+def extract_files(pcap_path, output_dir="extracted_files", selected_types=None, reader="auto", jobs=1,
+                  max_memory=None, max_sizes=None, manifest_path=None, dedup=True, cache=None, stats=None,
+                  http=True, follow=False, idle_timeout=None, capture_filter=None, scan_encrypted=False,
+                  output_format="files", deep_check="off"):
     print(BANNER)
-    os.makedirs(output_dir, exist_ok=True)
     
-    if selected_types is None:
-        selected_types = FILE_TYPES.keys()
+    if capture_filter:
+        print(f"[*] Filtering on {capture_filter.describe()}")
+    if follow:
+        print(f"[*] Following {pcap_path} as it grows (Ctrl-C to stop)...")
+    elif pcap_path == "-":
+        print("[*] Reading capture from stdin...")
+    # Reassemble each TCP flow and stream it straight into the carver so that
+    # memory stays bounded and files are written while the capture is read
+    print("[*] Extracting payloads and scanning for files...")
+    manifest_path = manifest_path or os.path.join(output_dir, "manifest.jsonl")
+    found = 0
+    duplicates = 0
     
-    # Step 1: Extract raw TCP payloads
-    print("[*] Extracting payloads...")
     try:
-        cmd = f"tshark -r {pcap_path} -Y 'tcp.payload' -T fields -e tcp.payload"
-        payloads = subprocess.check_output(cmd, shell=True, stderr=subprocess.DEVNULL).decode().split('\n')
-        raw_data = b"".join(bytes.fromhex(p) for p in payloads if p.strip())
+        for event in extract(pcap_path, output_dir, selected_types, reader, jobs,
+                             max_memory, max_sizes, manifest_path, dedup, cache, stats, http=http,
+                             follow=follow, idle_timeout=idle_timeout, capture_filter=capture_filter,
+                             scan_encrypted=scan_encrypted, output_format=output_format,
+                             deep_check=deep_check):
+            if not isinstance(event, Extracted):
+                continue
+            if event.duplicate_of:
+                duplicates += 1
+                continue
+            meta = event.meta or {}
+            url = f" ({meta['url']})" if meta.get('url') else ''
+            invalid = f" [invalid: {meta['invalid']}]" if meta.get('invalid') else ''
+            print(f"[+] Found {event.ext.upper()}: {event.filename}{url}{invalid}", flush=True)
+            found += 1
     except Exception as e:
         print(f"[-] Error: {e}")
         return
+    
+    if duplicates:
+        print(f"\n[*] Skipped {duplicates} duplicate files (see {manifest_path})")
+    print(f"\n[+] Done! Extracted {found} files to '{container_path(output_format, output_dir) or output_dir + '/'}'")
 
-    # Step 2: Search for selected file types
-    print("[*] Scanning for files...")
+def extract_batch(captures, output_dir="extracted_files", jobs=1, retries=1, selected_types=None, reader="auto",
+                  max_memory=None, max_sizes=None, manifest_path=None, dedup=True, cache_options=None, stats=None,
+                  http=True, capture_filter=None, scan_encrypted=False, output_format="files", deep_check="off"):
+    print(BANNER)
+    
+    if capture_filter:
+        print(f"[*] Filtering on {capture_filter.describe()}")
+    # One worker per capture, each into its own subdirectory; the manifests
+    # are merged so a file seen in several captures is kept only once
+    print(f"[*] Extracting {len(captures)} captures with {jobs} workers...")
     found = 0
+    duplicates = 0
+    failed = []
     
-    for ext in selected_types:
-        spec = FILE_TYPES.get(ext)
-        if not spec:
-            continue
-            
-        header = spec['header']
-        footer = spec['footer']
-        
-        # Find all occurrences of this file type
-        for match in re.finditer(re.escape(header), raw_data):
-            start = match.start()
-            
-            # Determine end position
-            if footer:
-                end = raw_data.find(footer, start)
-                if end == -1: continue
-                end += len(footer)
-            else:
-                # For files without footer, use next header or end of data
-                next_header = raw_data.find(header, start + 1)
-                end = next_header if next_header != -1 else len(raw_data)
-            
-            file_data = raw_data[start:end]
-            
-            # Validate the file
-            if not spec['validate'](file_data):
-                continue
-                
-            # Save the file
-            timestamp = datetime.now().strftime("%H%M%S")
-            filename = f"{output_dir}/{ext}_{timestamp}_{found}.{ext}"
-            with open(filename, 'wb') as f:
-                f.write(file_data)
-            print(f"[+] Found {ext.upper()}: {filename}")
-            found += 1
+    for result in run_batch(captures, output_dir, jobs, retries, selected_types, reader, max_memory,
+                            max_sizes, manifest_path, dedup, cache_options, stats, http, capture_filter,
+                            scan_encrypted, output_format, deep_check):
+        error = result.error.splitlines()[0] if result.error else None
+        if not result.final:
+            print(f"[!] {result.capture}: {error} (attempt {result.attempts}, retrying)")
+        elif error:
+            print(f"[-] {result.capture}: {error} (skipped after {result.attempts} attempts)")
+            failed.append(result.capture)
+        else:
+            found += result.files
+            duplicates += result.duplicates
+            types = ", ".join(f"{n} {ext.upper()}" for ext, n in sorted(result.by_type.items()))
+            dups = f", {result.duplicates} duplicates" if result.duplicates else ""
+            print(f"[+] {result.capture}: {result.files} files{' (' + types + ')' if types else ''}{dups}"
+                  f" in {result.seconds:.1f}s -> {result.output}/")
     
-    print(f"\n[+] Done! Extracted {found} files to '{output_dir}/'")
+    if duplicates:
+        print(f"\n[*] Skipped {duplicates} duplicate files (see {manifest_path or os.path.join(output_dir, 'manifest.jsonl')})")
+    if failed:
+        print(f"[-] {len(failed)} captures failed: {', '.join(failed)}")
+    print(f"\n[+] Done! Extracted {found} files from {len(captures) - len(failed)} captures to '{output_dir}/'"
+          f" (summary in {os.path.join(output_dir, 'summary.json')})")
+
+def serve(argv):
+    """``PCAP_Extractor.py serve``: run the extraction server until Ctrl-C."""
+    from en1gma.client import DEFAULT_TCP_PORT, default_socket, default_token_file
+    from en1gma.server import DEFAULT_MAX_QUEUE, ExtractionServer
+    
+    parser = argparse.ArgumentParser(prog="PCAP_Extractor.py serve",
+                                     description="Keep warm workers running and take jobs from 'PCAP_Extractor.py submit'")
+    parser.add_argument("--socket", metavar="PATH", help=f"Listen on this Unix socket (default: {default_socket()})")
+    parser.add_argument("--tcp", type=int, nargs="?", const=DEFAULT_TCP_PORT, metavar="PORT",
+                        help=f"Listen on localhost:PORT instead (default port: {DEFAULT_TCP_PORT}); clients "
+                             "must then send the token written to --token-file")
+    parser.add_argument("--token-file", metavar="PATH",
+                        help=f"With --tcp, where to write the clients' token (default: {default_token_file()})")
+    parser.add_argument("-j", "--jobs", type=int, default=0,
+                        help="Worker processes, i.e. jobs run at once (default: one per CPU)")
+    parser.add_argument("--max-queue", type=int, default=DEFAULT_MAX_QUEUE,
+                        help=f"Jobs waiting for a worker before new ones are refused (default: {DEFAULT_MAX_QUEUE})")
+    parser.add_argument("--max-memory", type=parse_size, metavar="SIZE", help="Memory budget for carve buffers per job")
+    add_cache_arguments(parser)
+    parser.add_argument("--signatures", action="append", default=[], metavar="PATH",
+                        help="Load more file type definitions from this JSON file (repeatable)")
+    args = parser.parse_args(argv)
+    
+    for error in LOAD_ERRORS:
+        print(f"[!] Skipped signature file {error}")
+    try:
+        # Before the workers start, so they load the same definitions
+        add_signature_files(args.signatures)
+    except SignatureError as e:
+        parser.error(str(e))
+    if args.tcp is None and default_socket() is None and args.socket is None:
+        args.tcp = DEFAULT_TCP_PORT
+    print(BANNER)
+    server = ExtractionServer(args.jobs or os.cpu_count(), args.max_queue, cache_options(args), args.max_memory)
+    try:
+        server.listen(args.socket or default_socket(), args.tcp, args.token_file)
+    except OSError as e:
+        server.close()
+        print(f"[!] {e}")
+        exit(1)
+    where = f"localhost:{args.tcp}" if args.tcp is not None else server.socket_path
+    print(f"[*] Serving on {where} with {server.workers} workers (Ctrl-C to stop)")
+    if server.token_path is not None:
+        print(f"[*] Clients must send the token in {server.token_path}")
+    server.serve_forever()
+    print("[*] Server stopped")
 
 if __name__ == "__main__":
-    import argparse
+    # Subcommands, unless a capture happens to have that name
+    if len(sys.argv) > 1 and sys.argv[1] in ("serve", "submit") and not os.path.exists(sys.argv[1]):
+        if sys.argv[1] == "serve":
+            serve(sys.argv[2:])
+            exit(0)
+        from en1gma.client import main
+        exit(main(sys.argv[2:]))
+    
     parser = argparse.ArgumentParser(description="Extract files from PCAP")
-    parser.add_argument("pcap_file", help="Path to PCAP file")
+    parser.add_argument("captures", nargs="*", metavar="CAPTURE",
+                        help="PCAP file or '-' for stdin; several files, globs, directories or @FILE (one path per line) run as a batch")
     parser.add_argument("-o", "--output", help="Output directory", default="extracted_files")
+    parser.add_argument("--output-format", choices=SINKS, default="files",
+                        help="Write each file separately (default), or all into one OUTPUT/carved.tar, .zip or .sqlite")
+    parser.add_argument("--reader", choices=READERS, default="auto",
+                        help="Packet reader: built-in pcap/pcapng parser, tshark, or auto (native with tshark fallback)")
+    
+    parser.add_argument("--follow", action="store_true",
+                        help="Keep reading a capture that is still being written, carving files as they complete")
+    parser.add_argument("--idle-timeout", type=float, metavar="SECONDS",
+                        help="On stdin or --follow, close flows idle this long (default: 120)")
+    
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="Worker processes for carving, or captures run at once in a batch (0 = one per CPU)")
+    parser.add_argument("--retries", type=int, default=1,
+                        help="In a batch, retry a failed capture this many times before skipping it")
+    parser.add_argument("--max-memory", type=parse_size, metavar="SIZE",
+                        help="Memory budget for carve buffers, e.g. 512M; larger buffers are spilled to disk")
+    parser.add_argument("--max-size", type=parse_type_size, action="append", default=[], metavar="TYPE=SIZE",
+                        help="Abandon a TYPE candidate whose end is not found within SIZE bytes (repeatable)")
+    
+    parser.add_argument("--host", action="append", default=[], metavar="ADDR[/BITS]",
+                        help="Only carve flows to or from this address or network (repeatable)")
+    parser.add_argument("--port", type=int, action="append", default=[],
+                        help="Only carve flows on this port (repeatable)")
+    parser.add_argument("--start", type=parse_time_arg, metavar="TIME",
+                        help="Skip packets before TIME (epoch seconds or 'YYYY-MM-DD HH:MM:SS', local time)")
+    parser.add_argument("--end", type=parse_time_arg, metavar="TIME", help="Skip packets after TIME")
+    parser.add_argument("--stream", type=int, action="append", default=[], metavar="N",
+                        help="Only carve stream N, numbered as in the manifest or tshark's tcp.stream (repeatable)")
+    parser.add_argument("--display-filter", metavar="EXPR",
+                        help="Only decode packets matching this tshark display filter (uses the tshark reader)")
+    parser.add_argument("--udp", action="store_true", help="Also carve UDP payloads, one stream per UDP flow")
+    
+    parser.add_argument("--scan-encrypted", action="store_true",
+                        help="Scan flows that look encrypted (TLS, SSH, QUIC, random bytes) too, e.g. in decrypted captures")
+    parser.add_argument("--deep-check", choices=DEEP_CHECKS, default="off",
+                        help="Fully parse each file in worker processes and flag (or veto, i.e. not save) those that fail")
+    parser.add_argument("--no-http", action="store_true",
+                        help="Scan HTTP flows blind like any other stream instead of extracting each body exactly")
+    
+    parser.add_argument("--manifest", metavar="PATH",
+                        help="Manifest to record carves in and dedupe against (default: OUTPUT/manifest.jsonl); share one across a case")
+    parser.add_argument("--no-dedup", action="store_true",
+                        help="Write every copy of repeated content (still recorded in the manifest)")
+    
+    add_cache_arguments(parser)
     
-    # Add flags for all file types
+    parser.add_argument("--stats", action="store_true", help="Print per-stage timings, counters and peak memory")
+    parser.add_argument("--stats-json", metavar="FILE", help="Write the same statistics as JSON ('-' for stdout)")
+    parser.add_argument("--profile", metavar="FILE", nargs="?", const="",
+                        help="Run under cProfile and report the top functions; save raw pstats to FILE if given")
+    parser.add_argument("--trace-memory", action="store_true",
+                        help="Track Python allocations with tracemalloc and report the top sites")
+    
+    # File types are chosen by name or category rather than a flag each;
+    # the old --jpg style flags are still taken (see below)
     parser.add_argument("--all", help="Extract all file types", action="store_true")
-    for file_type in FILE_TYPES.keys():
-        parser.add_argument(f"--{file_type}", help=f"Extract {file_type.upper()} files", action="store_true")
+    parser.add_argument("-t", "--type", action="append", default=[], metavar="TYPE[,TYPE]",
+                        help="Extract these file types (repeatable); --list-types shows them")
+    parser.add_argument("-c", "--category", action="append", default=[], metavar="NAME[,NAME]",
+                        help="Extract every file type of these categories, e.g. images or archives (repeatable)")
+    parser.add_argument("--signatures", action="append", default=[], metavar="PATH",
+                        help="Load more file type definitions from this JSON file (repeatable)")
+    parser.add_argument("--list-types", action="store_true", help="List the file types by category and exit")
+    
+    args, extra = parser.parse_known_args()
     
-    args = parser.parse_args()
+    for error in LOAD_ERRORS:
+        print(f"[!] Skipped signature file {error}")
+    try:
+        add_signature_files(args.signatures)
+    except SignatureError as e:
+        parser.error(str(e))
+    if args.list_types:
+        list_types()
+        exit(0)
+    if not args.captures:
+        parser.error("the following arguments are required: CAPTURE")
+    
+    # Anything left over must be an old-style type flag, e.g. --jpg
+    legacy = [arg[2:].lower() for arg in extra if arg.startswith("--") and arg[2:].lower() in FILE_TYPES]
+    unknown = [arg for arg in extra if not (arg.startswith("--") and arg[2:].lower() in FILE_TYPES)]
+    if unknown:
+        parser.error(f"unrecognized arguments: {' '.join(unknown)}")
+    bad_sizes = [ext for ext, _ in args.max_size if ext not in FILE_TYPES]
+    if bad_sizes:
+        parser.error(f"--max-size: unknown file types: {', '.join(bad_sizes)}")
     
     # Determine which file types to extract
+    names = [name for value in args.type for name in value.replace(",", " ").split()] + legacy
+    groups = [name for value in args.category for name in value.replace(",", " ").split()]
     if args.all:
-        selected_types = FILE_TYPES.keys()
+        selected_types = list(FILE_TYPES)
+    elif names or groups:
+        try:
+            selected_types = select_types(names, groups)
+        except ValueError as e:
+            parser.error(str(e))
     else:
-        selected_types = [ft for ft in FILE_TYPES.keys() if getattr(args, ft)]
+        print("[!] No file types selected. Use --all, --type or --category (see --list-types).")
+        exit(1)
     
-    if not selected_types:
-        print("[!] No file types selected. Use --all or specify individual file types.")
+    # A single capture file (or stdin) runs as before; anything else is a batch
+    batch = len(args.captures) > 1 or not (args.captures[0] == "-" or os.path.isfile(args.captures[0]))
+    if args.follow and batch:
+        print("[!] --follow takes a single capture file.")
         exit(1)
+    if batch:
+        captures = expand_inputs(args.captures)
+        if not captures:
+            print("[!] No captures found.")
+            exit(1)
+    
+    try:
+        capture_filter = CaptureFilter(args.host, args.port, args.start, args.end, args.stream,
+                                       args.display_filter, args.udp)
+    except ValueError as e:
+        print(f"[!] {e}")
+        exit(1)
+    
+    stats = None
+    if args.stats or args.stats_json or args.profile is not None or args.trace_memory:
+        stats = Stats(profile=args.profile is not None, trace_memory=args.trace_memory)
+    cache = cache_options(args)
+    if batch:
+        extract_batch(captures, args.output, args.jobs or os.cpu_count(), args.retries, selected_types,
+                      args.reader, args.max_memory, dict(args.max_size), args.manifest, not args.no_dedup,
+                      cache, stats, not args.no_http, capture_filter, args.scan_encrypted,
+                      args.output_format, args.deep_check)
+    else:
+        extract_files(args.captures[0], args.output, selected_types, args.reader, args.jobs or os.cpu_count(),
+                      args.max_memory, dict(args.max_size), args.manifest, not args.no_dedup,
+                      PayloadCache(*cache) if cache else None, stats,
+                      not args.no_http, args.follow, args.idle_timeout, capture_filter, args.scan_encrypted,
+                      args.output_format, args.deep_check)
     
-    extract_files(args.pcap_file, args.output, selected_types)
+    if stats is not None:
+        if args.profile:
+            stats.profiler.dump_stats(args.profile)
+        if args.stats or args.profile is not None or args.trace_memory:
+            print("\n[*] Run statistics:")
+            print(stats.table())
+        if args.stats_json == "-":
+            print(json.dumps(stats.report(), indent=1))
+        elif args.stats_json:
+            with open(args.stats_json, "w") as f:
+                json.dump(stats.report(), f, indent=1)
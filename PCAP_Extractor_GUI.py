@@ -1,30 +1,26 @@
 #!/usr/bin/env python3
+import html
 import os
 import sys
-import subprocess
-import re
-from datetime import datetime
+import time
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout, 
                             QLabel, QLineEdit, QPushButton, QProgressBar,
-                            QFileDialog, QMessageBox, QGroupBox, QGridLayout, QSizePolicy)
-from PyQt5.QtCore import Qt, QThread, pyqtSignal
-from PyQt5.QtGui import QFont, QIcon, QPalette, QColor
+                            QFileDialog, QMessageBox, QGroupBox, QGridLayout, QSizePolicy,
+                            QSpinBox, QCheckBox, QComboBox, QTableView, QHeaderView, QAbstractItemView)
+from PyQt5.QtCore import Qt, QThread, pyqtSignal, QAbstractTableModel, QModelIndex, QUrl
+from PyQt5.QtGui import QFont, QIcon, QPalette, QColor, QDesktopServices
 
-# File type definitions
-FILE_TYPES = {
-    'jpg': {'header': b'\xff\xd8\xff', 'footer': b'\xff\xd9'},
-    'png': {'header': b'\x89PNG\r\n\x1a\n', 'footer': b'IEND\xaeB`\x82'},
-    'gif': {'header': b'GIF', 'footer': b'\x00\x3b'},
-    'bmp': {'header': b'BM', 'footer': None},
-    'webp': {'header': b'RIFF', 'footer': None},
-    'pdf': {'header': b'%PDF', 'footer': b'%%EOF'},
-    'docx': {'header': b'PK\x03\x04', 'footer': None},
-    'xlsx': {'header': b'PK\x03\x04', 'footer': None},
-    'zip': {'header': b'PK\x03\x04', 'footer': None},
-    'gz': {'header': b'\x1f\x8b', 'footer': None},
-    'mp3': {'header': b'\xff\xfb', 'footer': None},
-    'mp4': {'header': b'\x00\x00\x00\x18ftyp', 'footer': None}
-}
+from en1gma.cache import PayloadCache, default_cache_dir
+from en1gma.deepcheck import DEEP_CHECKS
+from en1gma.engine import Progress, extract
+from en1gma.filters import CaptureFilter, parse_list, parse_time
+from en1gma.signatures import FILE_TYPES, LOAD_ERRORS, categories
+from en1gma.sinks import SINKS, container_path
+from en1gma.stats import Stats
+
+# The extraction thread sends progress and new results at most this often
+# (seconds), however fast files are carved, so the event queue never floods
+UPDATE_INTERVAL = 0.1
 
 def resource_path(relative_path):
     """ Get absolute path to resource, works for dev and for PyInstaller """
@@ -38,81 +34,154 @@ def resource_path(relative_path):
 
 class ExtractionThread(QThread):
     update_progress = pyqtSignal(int, str)
+    # Rows for ResultsModel, batched per update
+    files_found = pyqtSignal(list)
     finished = pyqtSignal(bool, str)
 
-    def __init__(self, pcap_path, output_dir, selected_types):
+    def __init__(self, pcap_path, output_dir, selected_types, jobs=1, capture_filter=None, scan_encrypted=False,
+                 output_format="files", deep_check="off", cache=False):
         super().__init__()
         self.pcap_path = pcap_path
         self.output_dir = output_dir
         self.selected_types = selected_types
+        self.jobs = jobs
+        self.capture_filter = capture_filter
+        self.scan_encrypted = scan_encrypted
+        self.output_format = output_format
+        self.deep_check = deep_check
+        self.cache = PayloadCache() if cache else None
+        self.stats = Stats()
+        self.cancelled = False
+
+    def cancel(self):
+        """Stop at the next event; files saved so far are kept."""
+        self.cancelled = True
 
     def run(self):
         try:
             self.update_progress.emit(10, "Extracting network payloads...")
-            
-            cmd = f"tshark -r {self.pcap_path} -Y 'tcp.payload' -T fields -e tcp.payload"
-            payloads = subprocess.check_output(cmd, shell=True, stderr=subprocess.DEVNULL).decode().split('\n')
-            raw_data = b"".join(bytes.fromhex(p) for p in payloads if p.strip())
-            
-            self.update_progress.emit(30, "Analyzing payload content...")
-            
             found = 0
-            total_files = sum(1 for _ in re.finditer(b'|'.join(
-                re.escape(FILE_TYPES[ft]['header']) for ft in self.selected_types
-            ), raw_data))
+            duplicates = 0
+            flagged = 0
+            latest = None
+            progress = None
+            rows = []
+            last_update = 0
             
-            if total_files == 0:
-                self.finished.emit(False, "No matching files found in payload")
-                return
+            # Progress follows the payload bytes the engine has consumed;
+            # with the cache on, re-runs over the same capture replay it
+            events = extract(self.pcap_path, self.output_dir, self.selected_types,
+                             jobs=self.jobs, cache=self.cache, stats=self.stats,
+                             capture_filter=self.capture_filter, scan_encrypted=self.scan_encrypted,
+                             output_format=self.output_format, deep_check=self.deep_check)
+            try:
+                for event in events:
+                    if self.cancelled:
+                        break
+                    if isinstance(event, Progress):
+                        progress = event
+                    elif event.duplicate_of:
+                        duplicates += 1
+                    else:
+                        found += 1
+                        latest = event.ext
+                        invalid = (event.meta or {}).get('invalid')
+                        if invalid:
+                            flagged += 1
+                        rows.append((event.ext, event.size, event.stream, event.sha256, event.filename, invalid))
+                    if time.monotonic() - last_update >= UPDATE_INTERVAL:
+                        last_update = time.monotonic()
+                        self._update(progress, found, latest, rows)
+                        rows = []
+            finally:
+                # Lets the engine stop its workers and finish writing
+                events.close()
+            self._update(progress, found, latest, rows)
             
-            progress_step = 60 / total_files
-            current_progress = 30
+            if self.cancelled:
+                skipped = f", {duplicates} duplicates skipped" if duplicates else ""
+                self.finished.emit(False, f"Extraction cancelled: {found} files saved{skipped}")
+                return
             
-            for ext in self.selected_types:
-                spec = FILE_TYPES.get(ext)
-                if not spec:
-                    continue
-                
-                header = spec['header']
-                footer = spec['footer']
-                
-                for match in re.finditer(re.escape(header), raw_data):
-                    start = match.start()
-                    
-                    if footer:
-                        end = raw_data.find(footer, start)
-                        if end == -1: continue
-                        end += len(footer)
-                    else:
-                        next_header = raw_data.find(header, start + 1)
-                        end = next_header if next_header != -1 else len(raw_data)
-                    
-                    file_data = raw_data[start:end]
-                    
-                    if not file_data.startswith(header):
-                        continue
-                    
-                    os.makedirs(self.output_dir, exist_ok=True)
-                    filename = f"{self.output_dir}/{ext}_{datetime.now().strftime('%H%M%S')}_{found}.{ext}"
-                    
-                    with open(filename, 'wb') as f:
-                        f.write(file_data)
-                    
-                    found += 1
-                    current_progress += progress_step
-                    self.update_progress.emit(
-                        min(95, int(current_progress)),
-                        f"Extracted {found} files (latest: {ext.upper()})"
-                    )
+            if found == 0:
+                if duplicates:
+                    self.finished.emit(False, f"No new files: all {duplicates} matches were already extracted")
+                else:
+                    self.finished.emit(False, "No matching files found in payload")
+                return
             
+            skipped = f" ({duplicates} duplicates skipped)" if duplicates else ""
+            invalid = f"\n{flagged} failed the deep check (marked invalid in the manifest)" if flagged else ""
             self.finished.emit(
                 True,
-                f"✔ Success! Extracted {found} files to:\n{os.path.abspath(self.output_dir)}"
+                f"✔ Success! Extracted {found} files{skipped} to:\n"
+                f"{os.path.abspath(container_path(self.output_format, self.output_dir) or self.output_dir)}"
+                f"{invalid}"
             )
             
         except Exception as e:
             self.finished.emit(False, f"✖ Extraction failed: {str(e)}")
 
+    def _update(self, progress, found, latest, rows):
+        if rows:
+            self.files_found.emit(rows)
+        if progress is None:
+            return
+        if latest:
+            message = f"Extracted {found} files (latest: {latest.upper()})"
+        else:
+            message = f"Scanning stream {progress.stream}..."
+        self.update_progress.emit(min(95, 10 + int(85 * progress.done / progress.total)), message)
+
+class ResultsModel(QAbstractTableModel):
+    """Carved files for the results table.
+
+    Rows are plain tuples handed over in batches and cells are only built
+    for the rows on screen, so the view stays fast with 100k+ files.
+    """
+    COLUMNS = ("Type", "Size", "Stream", "SHA-256", "File")
+
+    def __init__(self):
+        super().__init__()
+        self.rows = []
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.COLUMNS)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return self.COLUMNS[section]
+        return None
+
+    def data(self, index, role=Qt.DisplayRole):
+        ext, size, stream, sha256, filename, invalid = self.rows[index.row()]
+        column = index.column()
+        if role == Qt.DisplayRole:
+            return (ext.upper(), f"{size:,}", stream, sha256, filename)[column]
+        if role == Qt.TextAlignmentRole and column in (1, 2):
+            return int(Qt.AlignRight | Qt.AlignVCenter)
+        if role == Qt.ForegroundRole and invalid:
+            return QColor(255, 120, 120)
+        if role == Qt.ToolTipRole:
+            return f"Failed the deep check: {invalid}" if invalid else filename
+        return None
+
+    def add_rows(self, rows):
+        self.beginInsertRows(QModelIndex(), len(self.rows), len(self.rows) + len(rows) - 1)
+        self.rows.extend(rows)
+        self.endInsertRows()
+
+    def clear(self):
+        self.beginResetModel()
+        self.rows = []
+        self.endResetModel()
+
+    def filename(self, row):
+        return self.rows[row][4]
+
 class ForensicExtractor(QMainWindow):
     def __init__(self):
         super().__init__()
@@ -227,16 +296,11 @@ class ForensicExtractor(QMainWindow):
         type_group.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Expanding)
         type_layout = QVBoxLayout()
         
-        categories = {
-            "Images": ['jpg', 'png', 'gif', 'bmp', 'webp'],
-            "Documents": ['pdf', 'docx', 'xlsx'],
-            "Archives": ['zip', 'gz'],
-            "Media": ['mp3', 'mp4']
-        }
-        
+        # Types and their categories come from the signature definitions,
+        # user files included
         self.type_buttons = {}
-        for category, types in categories.items():
-            cat_label = QLabel(category)
+        for category, types in categories().items():
+            cat_label = QLabel(category.title())
             cat_label.setFont(QFont("Helvetica", 10, QFont.Bold))
             cat_label.setStyleSheet("color: white;")
             type_layout.addWidget(cat_label)
@@ -248,6 +312,7 @@ class ForensicExtractor(QMainWindow):
             for i, ftype in enumerate(types):
                 btn = QPushButton(ftype.upper())
                 btn.setCheckable(True)
+                btn.setToolTip(FILE_TYPES[ftype]['description'])
                 btn.setMinimumWidth(80)
                 btn.setSizePolicy(QSizePolicy.MinimumExpanding, QSizePolicy.Fixed)
                 btn.setStyleSheet("""
@@ -335,9 +400,64 @@ class ForensicExtractor(QMainWindow):
         output_browse_btn.clicked.connect(self.browse_output)
         output_layout.addWidget(output_browse_btn)
         
+        jobs_layout = QHBoxLayout()
+        jobs_layout.addWidget(QLabel("Worker processes:"))
+        self.jobs_spin = QSpinBox()
+        self.jobs_spin.setRange(1, os.cpu_count() or 1)
+        self.jobs_spin.setValue(1)
+        jobs_layout.addWidget(self.jobs_spin)
+        output_layout.addLayout(jobs_layout)
+        
+        format_layout = QHBoxLayout()
+        format_layout.addWidget(QLabel("Save as:"))
+        self.format_combo = QComboBox()
+        self.format_combo.addItems(SINKS)
+        self.format_combo.setToolTip("Separate files, or one tar, zip or SQLite file in the output directory")
+        format_layout.addWidget(self.format_combo)
+        output_layout.addLayout(format_layout)
+        
+        check_layout = QHBoxLayout()
+        check_layout.addWidget(QLabel("Deep check:"))
+        self.check_combo = QComboBox()
+        self.check_combo.addItems(DEEP_CHECKS)
+        self.check_combo.setToolTip("Fully parse each file in worker processes; flag the ones that fail, "
+                                    "or veto them so they are not saved")
+        check_layout.addWidget(self.check_combo)
+        output_layout.addLayout(check_layout)
+        
+        self.cache_check = QCheckBox("Cache payloads so re-runs skip decoding")
+        self.cache_check.setToolTip(f"Keeps up to 10 GB of reassembled payloads in {default_cache_dir()}")
+        output_layout.addWidget(self.cache_check)
+        
         output_group.setLayout(output_layout)
         right_panel.addWidget(output_group)
         
+        # Filter group; empty fields select everything
+        filter_group = QGroupBox("Capture Filters")
+        filter_group.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Fixed)
+        filter_layout = QGridLayout()
+        self.filter_entries = {}
+        fields = [
+            ("hosts", "Hosts:", "10.0.0.5, 192.168.1.0/24"),
+            ("ports", "Ports:", "80, 8080"),
+            ("start", "Start time:", "2024-05-01 12:00:00 or epoch"),
+            ("end", "End time:", "2024-05-01 12:05:00 or epoch"),
+            ("streams", "Streams:", "3, 17"),
+            ("display_filter", "Display filter:", "tshark syntax, e.g. http.host contains \"example\""),
+        ]
+        for row, (name, label, hint) in enumerate(fields):
+            filter_layout.addWidget(QLabel(label), row, 0)
+            entry = QLineEdit()
+            entry.setPlaceholderText(hint)
+            filter_layout.addWidget(entry, row, 1)
+            self.filter_entries[name] = entry
+        self.udp_check = QCheckBox("Include UDP payloads")
+        filter_layout.addWidget(self.udp_check, len(fields), 0, 1, 2)
+        self.encrypted_check = QCheckBox("Scan encrypted-looking flows (decrypted captures)")
+        filter_layout.addWidget(self.encrypted_check, len(fields) + 1, 0, 1, 2)
+        filter_group.setLayout(filter_layout)
+        right_panel.addWidget(filter_group)
+        
         # Progress group
         progress_group = QGroupBox("Extraction Progress")
         progress_group.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Fixed)
@@ -348,6 +468,8 @@ class ForensicExtractor(QMainWindow):
         progress_layout.addWidget(self.progress_bar)
         
         self.status_label = QLabel("Ready to begin extraction")
+        if LOAD_ERRORS:
+            self.status_label.setText("Skipped signature file " + "; ".join(LOAD_ERRORS))
         self.status_label.setStyleSheet("color: white;")
         progress_layout.addWidget(self.status_label)
         
@@ -357,6 +479,31 @@ class ForensicExtractor(QMainWindow):
         content_layout.addLayout(right_panel, stretch=1)
         main_layout.addLayout(content_layout, stretch=1)
         
+        # Results table; filled as files are carved
+        results_group = QGroupBox("Extracted Files (double-click to open)")
+        results_layout = QVBoxLayout()
+        self.results_model = ResultsModel()
+        self.results_view = QTableView()
+        self.results_view.setModel(self.results_model)
+        self.results_view.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.results_view.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.results_view.setAlternatingRowColors(True)
+        self.results_view.setWordWrap(False)
+        # Fixed row heights and column widths: nothing is measured per row
+        self.results_view.verticalHeader().setVisible(False)
+        self.results_view.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
+        self.results_view.verticalHeader().setDefaultSectionSize(22)
+        header = self.results_view.horizontalHeader()
+        header.setSectionResizeMode(QHeaderView.Interactive)
+        header.setStretchLastSection(True)
+        for column, width in enumerate((60, 100, 60, 440)):
+            self.results_view.setColumnWidth(column, width)
+        self.results_view.setMinimumHeight(160)
+        self.results_view.doubleClicked.connect(self.open_result)
+        results_layout.addWidget(self.results_view)
+        results_group.setLayout(results_layout)
+        main_layout.addWidget(results_group, stretch=1)
+        
         # Action buttons
         action_layout = QHBoxLayout()
         action_layout.addStretch()
@@ -381,6 +528,46 @@ class ForensicExtractor(QMainWindow):
         self.extract_btn.clicked.connect(self.start_extraction)
         action_layout.addWidget(self.extract_btn)
         
+        self.cancel_btn = QPushButton("Cancel")
+        self.cancel_btn.setFixedWidth(100)
+        self.cancel_btn.setEnabled(False)
+        self.cancel_btn.setStyleSheet("""
+            QPushButton {
+                background-color: #333333;
+                color: white;
+                border: none;
+                padding: 8px 15px;
+            }
+            QPushButton:hover {
+                background-color: #444444;
+            }
+            QPushButton:disabled {
+                color: #777777;
+            }
+        """)
+        self.cancel_btn.clicked.connect(self.cancel_extraction)
+        action_layout.addWidget(self.cancel_btn)
+        
+        self.stats_btn = QPushButton("Run Stats")
+        self.stats_btn.setFixedWidth(100)
+        self.stats_btn.setEnabled(False)
+        self.stats_btn.setStyleSheet("""
+            QPushButton {
+                background-color: #333333;
+                color: white;
+                border: none;
+                padding: 8px 15px;
+            }
+            QPushButton:hover {
+                background-color: #444444;
+            }
+            QPushButton:disabled {
+                color: #777777;
+            }
+        """)
+        self.stats_btn.clicked.connect(self.show_stats)
+        action_layout.addWidget(self.stats_btn)
+        
         exit_btn = QPushButton("Exit")
         exit_btn.setFixedWidth(100)
         exit_btn.setStyleSheet("""
@@ -443,26 +630,76 @@ class ForensicExtractor(QMainWindow):
             QMessageBox.critical(self, "Error", "Please select at least one file type")
             return
         
+        entries = {name: entry.text().strip() for name, entry in self.filter_entries.items()}
+        try:
+            capture_filter = CaptureFilter(
+                parse_list(entries["hosts"]), parse_list(entries["ports"], int),
+                parse_time(entries["start"]) if entries["start"] else None,
+                parse_time(entries["end"]) if entries["end"] else None,
+                parse_list(entries["streams"], int), entries["display_filter"], self.udp_check.isChecked())
+        except ValueError as e:
+            QMessageBox.critical(self, "Error", f"Invalid filter: {e}")
+            return
+        
         self.extract_btn.setEnabled(False)
+        self.stats_btn.setEnabled(False)
+        self.cancel_btn.setEnabled(True)
         self.status_label.setText("Initializing extraction...")
         self.progress_bar.setValue(0)
+        self.results_model.clear()
         
-        self.thread = ExtractionThread(pcap_file, output_dir, selected_types)
+        self.thread = ExtractionThread(pcap_file, output_dir, selected_types, self.jobs_spin.value(),
+                                       capture_filter, self.encrypted_check.isChecked(),
+                                       self.format_combo.currentText(), self.check_combo.currentText(),
+                                       self.cache_check.isChecked())
         self.thread.update_progress.connect(self.update_progress)
+        self.thread.files_found.connect(self.results_model.add_rows)
         self.thread.finished.connect(self.extraction_finished)
         self.thread.start()
     
+    def cancel_extraction(self):
+        self.cancel_btn.setEnabled(False)
+        self.status_label.setText("Cancelling...")
+        self.thread.cancel()
+    
     def update_progress(self, value, message):
+        if self.thread.cancelled:
+            return
         self.progress_bar.setValue(value)
         self.status_label.setText(message)
     
     def extraction_finished(self, success, message):
         self.extract_btn.setEnabled(True)
+        self.stats_btn.setEnabled(True)
+        self.cancel_btn.setEnabled(False)
         self.status_label.setText(message)
         if success:
             self.progress_bar.setValue(100)
         else:
             self.progress_bar.setValue(0)
+    
+    def open_result(self, index):
+        filename = self.results_model.filename(index.row())
+        if not os.path.isfile(filename):
+            # Inside a tar/zip/SQLite container, or still queued for writing
+            self.status_label.setText(f"Cannot open {filename} directly")
+            return
+        QDesktopServices.openUrl(QUrl.fromLocalFile(os.path.abspath(filename)))
+    
+    def closeEvent(self, event):
+        # Stop a running extraction so its workers and writer shut down cleanly
+        thread = getattr(self, 'thread', None)
+        if thread is not None and thread.isRunning():
+            thread.cancel()
+            thread.wait()
+        event.accept()
+    
+    def show_stats(self):
+        # Timings, counters and peak memory of the last run
+        box = QMessageBox(self)
+        box.setWindowTitle("Run Statistics")
+        box.setText(f"<pre>{html.escape(self.thread.stats.table())}</pre>")
+        box.exec_()
 
 if __name__ == "__main__":
     app = QApplication([])
@@ -0,0 +1,438 @@
+#!/usr/bin/env python3
+"""Write a reproducible synthetic capture with known files embedded.
+
+Every format in FILE_TYPES is built from scratch with the standard library
+and sent over TCP flows between random filler, alongside decoys (a bare
+header with nothing behind it) and truncated copies of real files. With
+``--http``, a share of the flows serve their files as HTTP/1.1 responses
+instead, sized by Content-Length or chunked and sometimes gzip-encoded. The
+known files are listed with their SHA-256 in ``<output>.truth.json`` for
+``run.py`` to score recall and precision against.
+"""
+import argparse
+import gzip
+import hashlib
+import io
+import json
+import os
+import random
+import sqlite3
+import struct
+import sys
+import zipfile
+import zlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from en1gma.signatures import FILE_TYPES  # noqa: E402
+
+ZIP_DATE = (2020, 1, 1, 0, 0, 0)
+
+
+def _clean(rnd, n, banned=b''):
+    """Random bytes without any byte in ``banned``."""
+    data = bytearray(rnd.getrandbits(8 * n).to_bytes(n, 'little')) if n else bytearray()
+    for b in banned:
+        data = data.replace(bytes([b]), b' ')
+    return bytes(data)
+
+
+def _split(data, n):
+    return [data[pos:pos + n] for pos in range(0, len(data), n)]
+
+
+def _zip(rnd, entries):
+    out = io.BytesIO()
+    with zipfile.ZipFile(out, 'w', zipfile.ZIP_DEFLATED) as z:
+        for name, data in entries:
+            z.writestr(zipfile.ZipInfo(name, ZIP_DATE), data)
+    return out.getvalue()
+
+
+def _text(rnd, n):
+    words = [b'alpha', b'bravo', b'charlie', b'delta', b'echo', b'foxtrot', b'golf']
+    return b' '.join(rnd.choice(words) for _ in range(n // 6))
+
+
+def _segment(marker, data):
+    return b'\xff' + bytes([marker]) + struct.pack('>H', 2 + len(data)) + data
+
+
+def _box(kind, data):
+    return struct.pack('>I', 8 + len(data)) + kind + data
+
+
+def make_jpg(rnd, size):
+    # Baseline JFIF: quantization and Huffman tables, a 3-component frame,
+    # then one scan of entropy-coded bytes without markers in it
+    jfif = _segment(0xE0, b'JFIF\x00\x01\x01\x00\x00\x01\x00\x01\x00\x00')
+    dqt = _segment(0xDB, b'\x00' + bytes(rnd.randrange(1, 255) for _ in range(64)))
+    sof = _segment(0xC0, struct.pack('>BHHB', 8, 64, 64, 3) + b'\x01\x22\x00\x02\x11\x01\x03\x11\x01')
+    dht = _segment(0xC4, b'\x00' + bytes([0, 1, 5, 1, 1, 1, 1, 1, 1, 0, 0, 0, 0, 0, 0, 0]) + bytes(range(12)))
+    sos = _segment(0xDA, b'\x03\x01\x00\x02\x11\x03\x11\x00\x3f\x00')
+    return b'\xff\xd8' + jfif + dqt + sof + dht + sos + _clean(rnd, size, b'\xff') + b'\xff\xd9'
+
+
+def make_png(rnd, size):
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+    # 64 pixels of 8-bit RGB per row, each row led by its filter byte
+    height = max(1, size // 193)
+    rows = b''.join(b'\x00' + row for row in _split(_clean(rnd, 192 * height), 192))
+    ihdr = struct.pack('>IIBBBBB', 64, height, 8, 2, 0, 0, 0)
+    return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', ihdr) + chunk(b'IDAT', zlib.compress(rows, 1))
+            + chunk(b'IEND', b''))
+
+
+def make_gif(rnd, size):
+    # One image whose LZW data (never a zero byte, so no early footer)
+    # comes in 255-byte sub-blocks
+    image = b'\x2c' + struct.pack('<HHHH', 0, 0, 16, 16) + b'\x00\x08'
+    blocks = b''.join(bytes([len(block)]) + block for block in _split(_clean(rnd, max(size, 1), b'\x00'), 255))
+    return b'GIF89a' + struct.pack('<HH', 16, 16) + b'\x00\x00\x00' + image + blocks + b'\x00\x3b'
+
+
+def make_bmp(rnd, size):
+    # 16 pixels of 24-bit color per row, as many rows as fit in size
+    height = max(1, size // 48)
+    pixels = _clean(rnd, 48 * height)
+    return b'BM' + struct.pack('<IIIIiiHHIIiiII', 54 + len(pixels), 0, 54, 40, 16, height, 1, 24,
+                               0, len(pixels), 2835, 2835, 0, 0) + pixels
+
+
+def make_webp(rnd, size):
+    # A VP8 key frame: frame tag, start code, 16x16
+    size += size & 1
+    frame = b'\x50\x02\x00\x9d\x01\x2a' + struct.pack('<HH', 16, 16) + _clean(rnd, size - 10)
+    body = b'VP8 ' + struct.pack('<I', size) + frame
+    return b'RIFF' + struct.pack('<I', 4 + len(body)) + b'WEBP' + body
+
+
+def make_pdf(rnd, size):
+    body = _text(rnd, size)
+    head = b'%PDF-1.4\n'
+    obj = (b'1 0 obj\n<< /Length ' + str(len(body)).encode() + b' >>\nstream\n'
+           + body + b'\nendstream\nendobj\n')
+    xref = b'xref\n0 2\n0000000000 65535 f \n%010d 00000 n \ntrailer\n<< /Size 2 >>\n' % len(head)
+    return head + obj + xref + b'startxref\n%d\n%%%%EOF' % (len(head) + len(obj))
+
+
+def make_docx(rnd, size):
+    return _zip(rnd, [('[Content_Types].xml', b'<Types/>'), ('word/document.xml', _text(rnd, size))])
+
+
+def make_xlsx(rnd, size):
+    return _zip(rnd, [('[Content_Types].xml', b'<Types/>'), ('xl/workbook.xml', _text(rnd, size))])
+
+
+def make_zip(rnd, size):
+    return _zip(rnd, [('data.bin', _clean(rnd, size)), ('notes.txt', _text(rnd, 200))])
+
+
+def make_gz(rnd, size):
+    return gzip.compress(_text(rnd, size) + _clean(rnd, size // 4), mtime=0)
+
+
+def make_mp3(rnd, size):
+    # MPEG-1 Layer III, 128 kbit/s, 44.1 kHz: 417-byte frames
+    frame = 417
+    return b''.join(b'\xff\xfb\x90\x64' + _clean(rnd, frame - 4, b'\xff')
+                    for _ in range(max(3, size // frame)))
+
+
+def make_mp4(rnd, size):
+    ftyp = b'\x00\x00\x00\x18ftypisom\x00\x00\x02\x00isomiso2'
+    moov = _box(b'moov', _box(b'mvhd', _clean(rnd, 100)) + _box(b'trak', _box(b'tkhd', _clean(rnd, 84))))
+    mdat = _box(b'mdat', _clean(rnd, size))
+    return ftyp + moov + mdat
+
+
+def make_tiff(rnd, size):
+    # 8-bit grayscale, 64 pixels wide, in one strip before the IFD
+    height = max(1, size // 64)
+    pixels = _clean(rnd, 64 * height)
+    entries = [(256, 3, 64), (257, 4, height), (258, 3, 8), (259, 3, 1), (262, 3, 1),
+               (273, 4, 8), (277, 3, 1), (278, 4, height), (279, 4, len(pixels))]
+    ifd = struct.pack('<H', len(entries)) + b''.join(
+        struct.pack('<HHI', tag, kind, 1) + struct.pack('<H2x' if kind == 3 else '<I', value)
+        for tag, kind, value in entries) + b'\x00\x00\x00\x00'
+    return b'II*\x00' + struct.pack('<I', 8 + len(pixels)) + pixels + ifd
+
+
+def _vint(n):
+    out = bytearray()
+    while True:
+        out.append(n & 0x7F | (0x80 if n > 0x7F else 0))
+        n >>= 7
+        if not n:
+            return bytes(out)
+
+
+def make_rar(rnd, size):
+    # Stored members, as RAR 4 or RAR 5 at random
+    members = [(b'data.bin', _clean(rnd, size)), (b'notes.txt', _text(rnd, 200))]
+    if rnd.random() < 0.5:
+        def block(kind, flags, body):
+            head = struct.pack('<BHH', kind, flags, 7 + len(body)) + body
+            return struct.pack('<H', zlib.crc32(head) & 0xFFFF) + head
+        parts = [b'Rar!\x1a\x07\x00', block(0x73, 0, b'\x00' * 6)]
+        for name, data in members:
+            body = struct.pack('<IIBIIBBHI', len(data), len(data), 2, zlib.crc32(data), 0x50210000,
+                               20, 0x30, len(name), 0x20) + name
+            parts.append(block(0x74, 0x8000, body) + data)
+        parts.append(block(0x7B, 0x4000, b''))
+    else:
+        def block(body, data=b''):
+            head = _vint(len(body)) + body
+            return struct.pack('<I', zlib.crc32(head)) + head + data
+        parts = [b'Rar!\x1a\x07\x01\x00', block(b'\x01\x00\x00')]
+        for name, data in members:
+            body = (_vint(2) + _vint(2) + _vint(len(data)) + _vint(4) + _vint(len(data)) + _vint(0o100644)
+                    + struct.pack('<I', zlib.crc32(data)) + _vint(0) + _vint(1) + _vint(len(name)) + name)
+            parts.append(block(body, data))
+        parts.append(block(b'\x05\x00\x00'))
+    return b''.join(parts)
+
+
+def _7z_number(n):
+    # The leading byte's high bits count the little-endian bytes that follow
+    for extra in range(8):
+        if n < 1 << 7 * (extra + 1):
+            return bytes([0xFF << 8 - extra & 0xFF | n >> 8 * extra]) + (n & (1 << 8 * extra) - 1).to_bytes(extra, 'little')
+    return b'\xff' + n.to_bytes(8, 'little')
+
+
+def make_7z(rnd, size):
+    # One file in a single folder with the Copy coder
+    data = _clean(rnd, size)
+    name = 'data.bin\x00'.encode('utf-16-le')
+    header = (b'\x01\x04'
+              + b'\x06\x00\x01\x09' + _7z_number(len(data)) + b'\x00'
+              + b'\x07\x0b\x01\x00\x01\x01\x00\x0c' + _7z_number(len(data)) + b'\x00'
+              + b'\x08\x0a\x01' + struct.pack('<I', zlib.crc32(data)) + b'\x00'
+              + b'\x00'
+              + b'\x05\x01\x11' + _7z_number(1 + len(name)) + b'\x00' + name + b'\x00'
+              + b'\x00')
+    start = struct.pack('<QQI', len(data), len(header), zlib.crc32(header))
+    return b'7z\xbc\xaf\x27\x1c\x00\x04' + struct.pack('<I', zlib.crc32(start)) + start + data + header
+
+
+def make_elf(rnd, size):
+    # x86-64 executable: one loadable segment, .text and the section name table
+    text = _clean(rnd, size)
+    names = b'\x00.text\x00.shstrtab\x00'
+    strtab = 120 + len(text)
+    shoff = (strtab + len(names) + 7) & ~7
+    ehdr = b'\x7fELF\x02\x01\x01' + bytes(9) + struct.pack('<HHIQQQIHHHHHH', 2, 62, 1, 0x400078, 64, shoff,
+                                                          0, 64, 56, 1, 64, 3, 2)
+    phdr = struct.pack('<IIQQQQQQ', 1, 5, 0, 0x400000, 0x400000, strtab, strtab, 0x1000)
+    sections = (bytes(64) + struct.pack('<IIQQQQIIQQ', 1, 1, 6, 0x400078, 120, len(text), 0, 0, 16, 0)
+                + struct.pack('<IIQQQQIIQQ', 7, 3, 0, 0, strtab, len(names), 0, 0, 1, 0))
+    return ehdr + phdr + text + names + bytes(shoff - strtab - len(names)) + sections
+
+
+def make_exe(rnd, size):
+    # PE32+ with one .text section at the file alignment
+    raw = (size + 0x1FF) & ~0x1FF
+    optional = bytearray(240)
+    struct.pack_into('<HBB', optional, 0, 0x20B, 14, 0)
+    struct.pack_into('<II', optional, 32, 0x1000, 0x200)
+    struct.pack_into('<II', optional, 56, 0x1000 + ((raw + 0xFFF) & ~0xFFF), 0x200)
+    struct.pack_into('<HH', optional, 68, 3, 0x8160)
+    struct.pack_into('<I', optional, 108, 16)
+    section = b'.text\x00\x00\x00' + struct.pack('<IIII12xI', size, 0x1000, raw, 0x200, 0x60000020)
+    head = (b'MZ' + bytes(0x3A) + struct.pack('<I', 0x40) + b'PE\x00\x00'
+            + struct.pack('<HHIIIHH', 0x8664, 1, 0, 0, 0, len(optional), 0x22) + bytes(optional) + section)
+    return head + bytes(0x200 - len(head)) + _clean(rnd, size) + bytes(raw - size)
+
+
+def make_sqlite(rnd, size):
+    db = sqlite3.connect(':memory:')
+    db.execute('CREATE TABLE blobs (id INTEGER PRIMARY KEY, name TEXT, data BLOB)')
+    for i in range(max(1, size // 4096)):
+        db.execute('INSERT INTO blobs (name, data) VALUES (?, ?)', (_text(rnd, 64).decode(), _clean(rnd, 4000)))
+    db.commit()
+    data = db.serialize()
+    db.close()
+    return data
+
+
+BUILDERS = {
+    'jpg': make_jpg, 'png': make_png, 'gif': make_gif, 'bmp': make_bmp, 'webp': make_webp, 'tiff': make_tiff,
+    'pdf': make_pdf, 'docx': make_docx, 'xlsx': make_xlsx, 'zip': make_zip, 'gz': make_gz,
+    'rar': make_rar, '7z': make_7z, 'mp3': make_mp3, 'mp4': make_mp4,
+    'elf': make_elf, 'exe': make_exe, 'sqlite': make_sqlite,
+}
+
+
+class CaptureWriter:
+    """Minimal pcap / pcapng writer for Ethernet frames."""
+
+    def __init__(self, f, fmt):
+        self.f = f
+        self.fmt = fmt
+        if fmt == 'pcap':
+            f.write(struct.pack('<IHHiIII', 0xa1b2c3d4, 2, 4, 0, 0, 65535, 1))
+        else:
+            f.write(struct.pack('<IIIHHq', 0x0A0D0D0A, 28, 0x1A2B3C4D, 1, 0, -1) + struct.pack('<I', 28))
+            f.write(struct.pack('<IIHHI', 1, 20, 1, 0, 65535) + struct.pack('<I', 20))
+
+    def write(self, ts, frame):
+        usec = int(ts * 1000000)
+        if self.fmt == 'pcap':
+            self.f.write(struct.pack('<IIII', usec // 1000000, usec % 1000000, len(frame), len(frame)))
+            self.f.write(frame)
+        else:
+            pad = b'\x00' * (-len(frame) % 4)
+            length = 32 + len(frame) + len(pad)
+            self.f.write(struct.pack('<IIIIIII', 6, length, 0, usec >> 32, usec & 0xFFFFFFFF,
+                                     len(frame), len(frame)) + frame + pad + struct.pack('<I', length))
+
+
+def tcp_frame(src, dst, sport, dport, seq, flags, payload):
+    tcp = struct.pack('!HHIIBBHHH', sport, dport, seq & 0xFFFFFFFF, 0, 5 << 4, flags, 65535, 0, 0)
+    ip = struct.pack('!BBHHHBBH4s4s', 0x45, 0, 20 + len(tcp) + len(payload), 0, 0x4000, 64, 6, 0, src, dst)
+    return b'\x00\x00\x00\x00\x00\x02\x00\x00\x00\x00\x00\x01\x08\x00' + ip + tcp + payload
+
+
+def http_payload(rnd, args, truth, flow):
+    """Build a flow of HTTP responses, one per file."""
+    parts = []
+    for _ in range(rnd.randrange(1, args.files_per_flow + 1)):
+        ext = rnd.choice(list(BUILDERS))
+        data = BUILDERS[ext](rnd, rnd.randrange(args.min_file, args.max_file))
+        truth['files'].append({'ext': ext, 'sha256': hashlib.sha256(data).hexdigest(),
+                               'size': len(data), 'flow': flow})
+        head = b'HTTP/1.1 200 OK\r\nContent-Type: application/octet-stream\r\n'
+        body = data
+        if rnd.random() < 0.3:
+            body = gzip.compress(data, mtime=0)
+            head += b'Content-Encoding: gzip\r\n'
+        if rnd.random() < 0.5:
+            chunks = []
+            for pos in range(0, len(body), 8192):
+                piece = body[pos:pos + 8192]
+                chunks.append(b'%x\r\n' % len(piece) + piece + b'\r\n')
+            body = b''.join(chunks) + b'0\r\n\r\n'
+            head += b'Transfer-Encoding: chunked\r\n'
+        else:
+            head += b'Content-Length: %d\r\n' % len(body)
+        parts.append(head + b'\r\n' + body)
+    return b''.join(parts)
+
+
+def flow_payload(rnd, args, truth, flow):
+    """Build one flow's server-to-client byte stream."""
+    if rnd.random() < args.http:
+        return http_payload(rnd, args, truth, flow)
+    parts = [_clean(rnd, rnd.randrange(64, 2048))]
+    for _ in range(rnd.randrange(1, args.files_per_flow + 1)):
+        ext = rnd.choice(list(BUILDERS))
+        data = BUILDERS[ext](rnd, rnd.randrange(args.min_file, args.max_file))
+        roll = rnd.random()
+        if roll < args.decoys:
+            parts.append(FILE_TYPES[ext]['header'])
+            truth['decoys'] += 1
+        elif roll < args.decoys + args.truncated:
+            parts.append(data[:rnd.randrange(len(FILE_TYPES[ext]['header']) + 1, len(data))])
+            truth['truncated'] += 1
+        else:
+            parts.append(data)
+            truth['files'].append({'ext': ext, 'sha256': hashlib.sha256(data).hexdigest(),
+                                   'size': len(data), 'flow': flow})
+        parts.append(_clean(rnd, rnd.randrange(16, 1024)))
+    return b''.join(parts)
+
+
+def generate(args):
+    rnd = random.Random(args.seed)
+    truth = {'capture': os.path.basename(args.output), 'seed': args.seed, 'files': [], 'decoys': 0, 'truncated': 0}
+    target = args.size * 1024 * 1024
+    written = 0
+    ts = 1600000000.0
+    active = []
+    flow = 0
+
+    def open_flow():
+        nonlocal flow
+        client = bytes([10, 0, flow >> 8 & 0xFF, flow & 0xFF])
+        server = bytes([192, 168, 1, 1 + flow % 250])
+        sport = 1024 + flow % 60000
+        state = {'client': client, 'server': server, 'sport': sport,
+                 'seq': rnd.getrandbits(32), 'data': flow_payload(rnd, args, truth, flow), 'pos': 0}
+        active.append(state)
+        flow += 1
+        return state
+
+    with open(args.output, 'wb') as f:
+        writer = CaptureWriter(f, args.format)
+        held = None
+        while written < target or active:
+            while written < target and len(active) < args.flows:
+                state = open_flow()
+                frame = tcp_frame(state['server'], state['client'], 80, state['sport'], state['seq'], 0x12, b'')
+                writer.write(ts, frame)
+                state['seq'] += 1
+            state = rnd.choice(active)
+            for _ in range(rnd.randrange(1, args.burst + 1)):
+                payload = state['data'][state['pos']:state['pos'] + args.mss]
+                if not payload:
+                    # Server FIN, then the client's, so the flow closes
+                    writer.write(ts, tcp_frame(state['server'], state['client'], 80, state['sport'],
+                                               state['seq'], 0x11, b''))
+                    frame = tcp_frame(state['client'], state['server'], state['sport'], 80,
+                                      rnd.getrandbits(32), 0x11, b'')
+                    active.remove(state)
+                else:
+                    frame = tcp_frame(state['server'], state['client'], 80, state['sport'], state['seq'], 0x18, payload)
+                    state['seq'] += len(payload)
+                    state['pos'] += len(payload)
+                ts += 0.0001
+                # Swap neighbouring segments now and then
+                if held is None and payload and rnd.random() < args.reorder:
+                    held = frame
+                else:
+                    writer.write(ts, frame)
+                    written += len(frame) + 16
+                    if held is not None:
+                        writer.write(ts, held)
+                        written += len(held) + 16
+                        held = None
+                if not payload:
+                    break
+        if held is not None:
+            writer.write(ts, held)
+
+    with open(args.output + '.truth.json', 'w') as f:
+        json.dump(truth, f, indent=1)
+    return truth
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic benchmark capture")
+    parser.add_argument("output", help="Capture to write")
+    parser.add_argument("--size", type=int, default=64, help="Approximate capture size in MB; flows still open then are finished")
+    parser.add_argument("--format", choices=("pcap", "pcapng"), default="pcap")
+    parser.add_argument("--flows", type=int, default=32, help="Flows open at the same time")
+    parser.add_argument("--burst", type=int, default=4, help="Most segments sent per flow before switching")
+    parser.add_argument("--mss", type=int, default=1448)
+    parser.add_argument("--files-per-flow", type=int, default=4)
+    parser.add_argument("--min-file", type=int, default=2 * 1024)
+    parser.add_argument("--max-file", type=int, default=512 * 1024)
+    parser.add_argument("--decoys", type=float, default=0.1, help="Share of embeds that are a bare header")
+    parser.add_argument("--truncated", type=float, default=0.1, help="Share of embeds cut short")
+    parser.add_argument("--http", type=float, default=0.0, help="Share of flows sent as HTTP responses")
+    parser.add_argument("--reorder", type=float, default=0.01, help="Chance of swapping two segments")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    missing = set(FILE_TYPES) - set(BUILDERS)
+    if missing:
+        print(f"[!] No builder for: {', '.join(sorted(missing))}")
+    truth = generate(args)
+    print(f"[+] Wrote {args.output}: {len(truth['files'])} files, "
+          f"{truth['decoys']} decoys, {truth['truncated']} truncated")
+
+
+if __name__ == "__main__":
+    main()
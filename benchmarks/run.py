@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""Time each extraction stage on a capture and score the carves.
+
+Each stage runs in a fresh process over the whole capture, adding one step
+to the previous stage's pipeline:
+
+    ingest      decode packets into TCP segments
+    reassembly  + reorder segments into per-flow streams
+    scanning    + search each chunk for signature headers
+    validation  + carve: resolve extents and run validators
+    writing     + hash, dedupe and save (the full engine)
+
+A stage's own cost is its time minus the previous stage's, so the report
+shows MB/s per stage next to each process's peak RSS. With the
+``.truth.json`` written by ``generate.py`` next to the capture, the carves
+of the writing stage are scored for recall and precision by SHA-256.
+With ``--types``, recall counts only the known files of those types, so a
+subset run shows what selecting fewer types costs (e.g. flows given up as
+encrypted because they open with a file of a type not selected).
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from en1gma.deepcheck import DEEP_CHECKS  # noqa: E402
+from en1gma.engine import Extracted, build_specs, extract  # noqa: E402
+from en1gma.http import HttpFlowCarver  # noqa: E402
+from en1gma.ingest import READERS, iter_segments  # noqa: E402
+from en1gma.reassembly import reassemble  # noqa: E402
+from en1gma.scanner import SignatureScanner  # noqa: E402
+
+STAGES = ('ingest', 'reassembly', 'scanning', 'validation', 'writing')
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def peak_rss():
+    """Peak resident set size of this process in bytes, if known."""
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+def run_stage(stage, args):
+    """Run one cumulative pipeline; returns payload bytes and carve hashes."""
+    specs = build_specs(args.types)
+    payload = 0
+    hashes = []
+    if stage == 'ingest':
+        for segment in iter_segments(args.capture, args.reader):
+            payload += len(segment.payload)
+    elif stage == 'reassembly':
+        for chunk in reassemble(iter_segments(args.capture, args.reader)):
+            if chunk.data is not None:
+                payload += len(chunk.data)
+    elif stage == 'scanning':
+        scanner = SignatureScanner(specs)
+        for chunk in reassemble(iter_segments(args.capture, args.reader)):
+            if chunk.data is not None:
+                payload += len(chunk.data)
+                for _ in scanner.scan(chunk.data, 0, len(chunk.data)):
+                    pass
+    elif stage == 'validation':
+        carver = HttpFlowCarver(specs)
+        for chunk in reassemble(iter_segments(args.capture, args.reader)):
+            if chunk.data is not None:
+                payload += len(chunk.data)
+            for _ in carver.feed(chunk):
+                pass
+        for _ in carver.close():
+            pass
+    else:
+        with tempfile.TemporaryDirectory(prefix='en1gma-bench-') as out:
+            for event in extract(args.capture, out, args.types, args.reader, args.jobs, dedup=False,
+                                 deep_check=args.deep_check):
+                if isinstance(event, Extracted):
+                    hashes.append((event.ext, event.sha256))
+                else:
+                    payload = event.done
+    return payload, hashes
+
+
+def score(truth, hashes, types=None):
+    """Recall per type (of ``types`` only, if given) and overall precision, matching carves by SHA-256."""
+    carved = Counter(sha for _, sha in hashes)
+    known = Counter(f['sha256'] for f in truth['files'])
+    per_type = {}
+    for f in truth['files']:
+        if types and f['ext'] not in types:
+            continue
+        hit = carved[f['sha256']] > 0
+        if hit:
+            carved[f['sha256']] -= 1
+        found, total = per_type.get(f['ext'], (0, 0))
+        per_type[f['ext']] = (found + hit, total + 1)
+    correct = sum(1 for _, sha in hashes if sha in known)
+    return per_type, correct, len(hashes)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark extraction stages on a capture")
+    parser.add_argument("capture")
+    parser.add_argument("--reader", choices=READERS, default="native",
+                        help="Packet reader; tshark is only needed when asked for")
+    parser.add_argument("--types", nargs='+', help="File types to carve (default: all)")
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="Worker processes for the writing stage")
+    parser.add_argument("--deep-check", choices=DEEP_CHECKS, default="off",
+                        help="Deep check mode for the writing stage")
+    parser.add_argument("--stages", nargs='+', choices=STAGES, default=list(STAGES))
+    parser.add_argument("--truth", help="Ground truth JSON (default: CAPTURE.truth.json if present)")
+    parser.add_argument("--json", help="Also write the results to this file")
+    parser.add_argument("--stage", choices=STAGES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.stage:
+        # Child process: run one stage and report on stdout
+        start = time.perf_counter()
+        payload, hashes = run_stage(args.stage, args)
+        seconds = time.perf_counter() - start
+        json.dump({'seconds': seconds, 'payload': payload, 'rss': peak_rss(), 'hashes': hashes}, sys.stdout)
+        return
+
+    capture_mb = os.path.getsize(args.capture) / 1e6
+    child = [sys.executable, os.path.abspath(__file__), args.capture, '--reader', args.reader,
+             '--jobs', str(args.jobs), '--deep-check', args.deep_check]
+    if args.types:
+        child += ['--types'] + args.types
+    results = {}
+    for stage in STAGES:
+        if stage not in args.stages:
+            continue
+        out = subprocess.run(child + ['--stage', stage], stdout=subprocess.PIPE, check=True).stdout
+        results[stage] = json.loads(out)
+
+    print(f"[*] {args.capture}: {capture_mb:.1f} MB")
+    print(f"    {'stage':<12}{'total s':>9}{'stage s':>9}{'MB/s':>9}{'peak RSS MB':>13}")
+    previous = 0.0
+    for stage, result in results.items():
+        own = max(result['seconds'] - previous, 1e-9)
+        # Ingest is measured against the capture, later stages against payload
+        volume = capture_mb if stage == 'ingest' else result['payload'] / 1e6
+        rss = f"{result['rss'] / 1e6:.0f}" if result['rss'] else '-'
+        print(f"    {stage:<12}{result['seconds']:>9.2f}{own:>9.2f}{volume / own:>9.1f}{rss:>13}")
+        result['stage_seconds'] = own
+        previous = result['seconds']
+
+    truth_path = args.truth or args.capture + '.truth.json'
+    if 'writing' in results and os.path.exists(truth_path):
+        with open(truth_path) as f:
+            truth = json.load(f)
+        per_type, correct, carved = score(truth, results['writing']['hashes'], args.types)
+        found = sum(hit for hit, _ in per_type.values())
+        total = sum(n for _, n in per_type.values())
+        print(f"\n[*] Recall {found}/{total} ({100 * found / max(total, 1):.1f}%), "
+              f"precision {correct}/{carved} ({100 * correct / max(carved, 1):.1f}%)")
+        for ext, (hit, n) in sorted(per_type.items()):
+            marker = '' if hit == n else '  <-- missed'
+            print(f"    {ext:<6}{hit:>4}/{n:<4}{marker}")
+        results['score'] = {'recall': found / max(total, 1), 'precision': correct / max(carved, 1),
+                            'per_type': per_type}
+
+    if args.json:
+        for result in results.values():
+            result.pop('hashes', None)
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=1)
+
+
+if __name__ == "__main__":
+    main()
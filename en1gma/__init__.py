@@ -0,0 +1 @@
+"""Shared extraction internals used by the CLI and GUI front ends."""
@@ -0,0 +1,300 @@
+"""Batch extraction over many captures, e.g. a sensor's rotated pcap files.
+
+:func:`expand_inputs` turns globs, directories and ``@list`` files into an
+ordered list of captures. :func:`run_batch` carves them on a pool of worker
+processes, each capture into its own subdirectory of the output, with only
+a bounded number of captures queued ahead of the workers. As captures
+finish, their manifests are folded into one combined manifest in input
+order, so content already saved from an earlier capture is removed again
+and recorded as a duplicate. A capture that fails is retried and, once out
+of retries, reported and skipped without stopping the batch.
+"""
+import glob
+import json
+import os
+import re
+import time
+import traceback
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+from .cache import PayloadCache
+from .engine import extract
+from .manifest import Manifest, read_records
+from .stats import Stats
+
+# Rotated captures are often numbered after the extension (trace.pcap12)
+CAPTURE_NAME = re.compile(r'\.(pcap|pcapng|cap)\d*$', re.IGNORECASE)
+
+# SHA-256 -> file of the content the combined manifest listed as a worker
+# process started, handed over once rather than read again per capture
+_known = {}
+
+# ``final`` is False for a failed attempt that will be retried; ``files``
+# counts files kept after deduplicating across captures
+CaptureResult = namedtuple('CaptureResult',
+                           'capture output files duplicates by_type seconds attempts error final')
+
+
+def _natural_key(path):
+    return [int(part) if part.isdigit() else part for part in re.split(r'(\d+)', path)]
+
+
+def expand_inputs(items):
+    """Captures named by paths, globs, directories (searched recursively) and @list files."""
+    captures = []
+    for item in items:
+        if item.startswith('@'):
+            with open(item[1:], encoding='utf-8') as f:
+                listed = [line.strip() for line in f]
+            captures.extend(expand_inputs([line for line in listed if line and not line.startswith('#')]))
+        elif os.path.isdir(item):
+            found = []
+            for root, _, names in os.walk(item):
+                found.extend(os.path.join(root, name) for name in names if CAPTURE_NAME.search(name))
+            captures.extend(sorted(found, key=_natural_key))
+        elif glob.has_magic(item):
+            captures.extend(sorted((p for p in glob.glob(item, recursive=True) if os.path.isfile(p)),
+                                   key=_natural_key))
+        else:
+            # Kept even if missing, so it is reported as a failed capture
+            captures.append(item)
+    unique = []
+    seen = set()
+    for capture in captures:
+        key = os.path.abspath(capture)
+        if key not in seen:
+            seen.add(key)
+            unique.append(capture)
+    return unique
+
+
+def _output_names(captures):
+    """One subdirectory name per capture, made unique with a counter."""
+    names = []
+    used = set()
+    for capture in captures:
+        base = os.path.basename(capture).replace('.', '_') or 'capture'
+        name = base
+        n = 2
+        while name in used:
+            name = f"{base}_{n}"
+            n += 1
+        used.add(name)
+        names.append(name)
+    return names
+
+
+def _init_worker(known):
+    global _known
+    _known = known
+
+
+def _run_capture(capture, output_dir, options, cache_options, collect_stats, known=None):
+    """Carve one capture in a worker; returns (seconds, error, stats snapshot).
+
+    Content in ``known`` (by default, what the worker was started with) is
+    not saved again.
+    """
+    stats = Stats() if collect_stats else None
+    cache = PayloadCache(*cache_options) if cache_options is not None else None
+    start = time.perf_counter()
+    error = None
+    try:
+        for _ in extract(capture, output_dir, cache=cache, stats=stats,
+                         known_digests=_known if known is None else known, **options):
+            pass
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+        if not isinstance(e, (OSError, ValueError)):
+            error += "\n" + traceback.format_exc()
+    seconds = time.perf_counter() - start
+    return seconds, error, stats.snapshot() if stats is not None else None
+
+
+def _discard_attempt(output_dir):
+    """Remove what an unmerged attempt left behind, keeping files of earlier runs."""
+    path = os.path.join(output_dir, "manifest.jsonl")
+    if not os.path.exists(path):
+        return
+    for record in read_records(path):
+        # A container may hold earlier runs' files too, so it is left
+        # as is; the next attempt numbers on past what this one added
+        if record['file'] and not record.get('container'):
+            try:
+                os.remove(record['file'])
+            except OSError:
+                pass
+    os.remove(path)
+    try:
+        os.rmdir(output_dir)
+    except OSError:
+        pass  # Not empty
+
+
+def _merge(manifest, output_dir, dedup):
+    """Fold a capture's manifest into the combined one; returns (files, duplicates, by_type)."""
+    path = os.path.join(output_dir, "manifest.jsonl")
+    files = 0
+    duplicates = 0
+    by_type = {}
+    # Files removed as copies of an earlier capture's, and what they copied
+    moved = {}
+    for record in read_records(path):
+        if record['file']:
+            original = manifest.original(record['sha256']) if dedup else None
+            # A copy inside a container cannot be taken out again
+            if original and original != record['file'] and not record.get('container'):
+                try:
+                    os.remove(record['file'])
+                except OSError:
+                    pass
+                moved[record['file']] = original
+                record['file'] = None
+                record['duplicate_of'] = original
+        elif record['duplicate_of'] in moved:
+            record['duplicate_of'] = moved[record['duplicate_of']]
+        manifest.append(record)
+        if record['file']:
+            files += 1
+            by_type[record['type']] = by_type.get(record['type'], 0) + 1
+        else:
+            duplicates += 1
+    os.remove(path)
+    return files, duplicates, by_type
+
+
+def _start_pool(jobs, known):
+    return ProcessPoolExecutor(jobs, initializer=_init_worker, initargs=(dict(known),))
+
+
+def run_batch(captures, output_dir="extracted_files", jobs=1, retries=1, selected_types=None,
+              reader="auto", max_memory=None, max_sizes=None, manifest_path=None, dedup=True,
+              cache_options=None, stats=None, http=True, capture_filter=None, scan_encrypted=False,
+              output_format="files", deep_check="off"):
+    """Extract every capture, yielding a :class:`CaptureResult` as each one is settled.
+
+    ``jobs`` captures are carved at once, each by one process;
+    ``cache_options`` is ``(directory, max_size)`` for a
+    :class:`~en1gma.cache.PayloadCache`, or None for no cache. Results come
+    in input order apart from failed attempts, which are reported as they
+    happen. ``output_dir/summary.json`` is written at the end.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    manifest_path = manifest_path or os.path.join(output_dir, "manifest.jsonl")
+    manifest = Manifest(manifest_path)
+    names = _output_names(captures)
+    options = {'selected_types': list(selected_types) if selected_types is not None else None,
+               'reader': reader, 'max_memory': max_memory, 'max_sizes': max_sizes, 'dedup': dedup,
+               'http': http, 'capture_filter': capture_filter, 'scan_encrypted': scan_encrypted,
+               'output_format': output_format, 'deep_check': deep_check}
+    # Workers skip content the combined manifest already lists; what they
+    # cannot know of yet, from captures merged since, _merge removes
+    known = manifest.seen if dedup else {}
+    if stats is not None:
+        stats.begin()
+
+    results = [None] * len(captures)
+    attempts = [0] * len(captures)
+    pending = list(range(len(captures)))
+    pending.reverse()
+    released = 0
+    summary = []
+
+    def outdir(i):
+        return os.path.join(output_dir, names[i])
+
+    def settle(i, seconds, error, snapshot):
+        """Record an attempt; returns a result to report now, or None."""
+        if stats is not None and snapshot is not None:
+            stats.merge(snapshot, 'workers/' if jobs > 1 else '')
+        if error is not None:
+            _discard_attempt(outdir(i))
+            if attempts[i] <= retries:
+                pending.append(i)
+                return CaptureResult(captures[i], None, 0, 0, {}, seconds, attempts[i], error, False)
+        results[i] = (seconds, error)
+        return None
+
+    def release():
+        """Merge and report finished captures that no earlier capture is still holding up."""
+        nonlocal released
+        while released < len(captures) and results[released] is not None:
+            i = released
+            seconds, error = results[i]
+            files = duplicates = 0
+            by_type = {}
+            if error is None:
+                files, duplicates, by_type = _merge(manifest, outdir(i), dedup)
+            manifest.file.flush()
+            result = CaptureResult(captures[i], None if error else outdir(i), files, duplicates, by_type,
+                                   seconds, attempts[i], error, True)
+            summary.append(dict(result._asdict()))
+            released += 1
+            yield result
+
+    def attempt(i):
+        attempts[i] += 1
+        _discard_attempt(outdir(i))
+        return (captures[i], outdir(i), options, cache_options, stats is not None)
+
+    pool = None
+    try:
+        if jobs <= 1:
+            while pending:
+                i = pending.pop()
+                # In process, so each capture sees everything merged so far
+                retry = settle(i, *_run_capture(*attempt(i), known=known))
+                if retry is not None:
+                    yield retry
+                yield from release()
+        else:
+            pool = _start_pool(jobs, known)
+            running = {}
+            while pending or running:
+                # A bounded queue: a couple of captures per worker at most
+                while pending and len(running) < 2 * jobs:
+                    i = pending.pop()
+                    running[pool.submit(_run_capture, *attempt(i))] = i
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                broken = False
+                for future in done:
+                    i = running.pop(future)
+                    try:
+                        outcome = future.result()
+                    except BrokenProcessPool:
+                        # A worker died (e.g. killed for memory); the capture
+                        # it had cannot be told apart, so all in flight retry
+                        broken = True
+                        outcome = (0.0, "worker process died", None)
+                    retry = settle(i, *outcome)
+                    if retry is not None:
+                        yield retry
+                if broken:
+                    for future, i in running.items():
+                        retry = settle(i, 0.0, "worker process died", None)
+                        if retry is not None:
+                            yield retry
+                    running.clear()
+                    pool.shutdown(wait=False, cancel_futures=True)
+                    pool = _start_pool(jobs, known)
+                yield from release()
+    finally:
+        if pool is not None:
+            pool.shutdown(wait=True, cancel_futures=True)
+        manifest.close()
+        if stats is not None:
+            stats.finish()
+        totals = {
+            'captures': len(summary),
+            'failed': sum(1 for entry in summary if entry['error']),
+            'files': sum(entry['files'] for entry in summary),
+            'duplicates': sum(entry['duplicates'] for entry in summary),
+            'by_type': {},
+        }
+        for entry in summary:
+            for ext, n in entry['by_type'].items():
+                totals['by_type'][ext] = totals['by_type'].get(ext, 0) + n
+        with open(os.path.join(output_dir, "summary.json"), 'w') as f:
+            json.dump({'manifest': manifest_path, 'totals': totals, 'captures': summary}, f, indent=1)
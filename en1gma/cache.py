@@ -0,0 +1,175 @@
+"""On-disk cache of reassembled stream payloads.
+
+Decoding and reassembling a capture is the slowest stage, and analysts often
+run the same capture several times with different type flags. The first pass
+records every chunk: payload bytes go to ``<key>.data`` back to back, and
+``<key>.idx`` holds one fixed-size record per chunk (stream, direction,
+offset, length), with direction -1 marking the end of a flow. Later passes
+replay the chunks from a memory map of the data file instead of reading the
+capture again.
+
+Entries are keyed on the capture's absolute path, size, mtime, a fingerprint
+of sampled content and the reader used, and are evicted least recently used
+first once the cache grows past its size limit.
+"""
+import hashlib
+import mmap
+import os
+import struct
+
+from .reassembly import Chunk
+
+# Bump when the entry layout or the reassembled output changes
+CACHE_VERSION = 2
+DEFAULT_CACHE_SIZE = 10 * 1024 ** 3
+
+_INDEX = struct.Struct('<QbQQ')
+# Index records read per block when replaying
+_INDEX_BLOCK = 4096
+# Bytes hashed from each sampled region of the capture
+_SAMPLE = 64 * 1024
+_SAMPLES = 16
+
+
+def default_cache_dir():
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'en1gma')
+
+
+def fingerprint(path, size):
+    """Hash of evenly spaced samples of the file, cheap even for huge captures."""
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for i in range(_SAMPLES + 1):
+            f.seek(max(0, (size - _SAMPLE) * i // _SAMPLES))
+            sha.update(f.read(_SAMPLE))
+    return sha.hexdigest()
+
+
+class PayloadCache:
+    """Reassembled-chunk cache rooted at ``directory``, capped at ``max_size`` bytes.
+
+    A capture whose payloads alone outgrow the cap is passed through
+    without being recorded.
+    """
+
+    def __init__(self, directory=None, max_size=DEFAULT_CACHE_SIZE):
+        self.directory = directory or default_cache_dir()
+        self.max_size = max_size
+
+    def key(self, pcap_path, reader):
+        st = os.stat(pcap_path)
+        ident = '\0'.join(str(part) for part in (
+            CACHE_VERSION, os.path.abspath(pcap_path), st.st_size, st.st_mtime_ns,
+            fingerprint(pcap_path, st.st_size), reader))
+        return hashlib.sha256(ident.encode('utf-8', 'surrogateescape')).hexdigest()
+
+    def cached_size(self, pcap_path, reader):
+        """Payload bytes cached for a capture, or None if it is not cached."""
+        base = os.path.join(self.directory, self.key(pcap_path, reader))
+        try:
+            size = os.path.getsize(base + '.data')
+        except OSError:
+            return None
+        return size if os.path.exists(base + '.idx') else None
+
+    def streams(self, pcap_path, reader, chunks):
+        """Replay the cached chunks for a capture, or record ``chunks`` as they pass."""
+        base = os.path.join(self.directory, self.key(pcap_path, reader))
+        if os.path.exists(base + '.idx') and os.path.exists(base + '.data'):
+            # Touch the entry so eviction sees it as recently used
+            os.utime(base + '.idx')
+            return _replay(base)
+        return self._record(base, chunks)
+
+    def _record(self, base, chunks):
+        os.makedirs(self.directory, exist_ok=True)
+        tmp = f"{base}.{os.getpid()}.tmp"
+        chunks = iter(chunks)
+        complete = False
+        oversize = False
+        offset = 0
+        try:
+            with open(tmp + '.data', 'wb') as data_file, open(tmp + '.idx', 'wb') as index_file:
+                for chunk in chunks:
+                    if chunk.data is None:
+                        index_file.write(_INDEX.pack(chunk.stream, -1, offset, 0))
+                    else:
+                        length = len(chunk.data)
+                        index_file.write(_INDEX.pack(chunk.stream, chunk.direction, offset, length))
+                        data_file.write(chunk.data)
+                        offset += length
+                    yield chunk
+                    if offset > self.max_size:
+                        oversize = True
+                        break
+            complete = not oversize
+            if complete:
+                # Data first: an entry counts as present once its index exists
+                os.replace(tmp + '.data', base + '.data')
+                os.replace(tmp + '.idx', base + '.idx')
+        finally:
+            if not complete:
+                for suffix in ('.data', '.idx'):
+                    try:
+                        os.remove(tmp + suffix)
+                    except OSError:
+                        pass
+        if oversize:
+            # The capture will never fit: its partial entry is gone already,
+            # and the rest of the chunks only pass through
+            yield from chunks
+            return
+        self.evict(keep=base)
+
+    def evict(self, keep=None):
+        """Drop least recently used entries until the cache fits its size limit."""
+        entries = []
+        total = 0
+        for name in os.listdir(self.directory):
+            if not name.endswith('.idx') or name.endswith('.tmp.idx'):
+                continue
+            base = os.path.join(self.directory, name[:-4])
+            try:
+                size = os.path.getsize(base + '.idx') + os.path.getsize(base + '.data')
+                used = os.path.getmtime(base + '.idx')
+            except OSError:
+                continue
+            entries.append((used, size, base))
+            total += size
+        for used, size, base in sorted(entries):
+            if total <= self.max_size:
+                break
+            if base == keep:
+                continue
+            for suffix in ('.idx', '.data'):
+                try:
+                    os.remove(base + suffix)
+                except OSError:
+                    pass
+            total -= size
+
+
+def _replay(base):
+    with open(base + '.idx', 'rb') as index_file, open(base + '.data', 'rb') as data_file:
+        data = None
+        if os.fstat(data_file.fileno()).st_size:
+            data = mmap.mmap(data_file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            view = memoryview(data) if data is not None else None
+            while True:
+                block = index_file.read(_INDEX.size * _INDEX_BLOCK)
+                if not block:
+                    break
+                for stream, direction, offset, length in _INDEX.iter_unpack(block):
+                    if direction < 0:
+                        yield Chunk(stream, None, None)
+                    else:
+                        yield Chunk(stream, direction, view[offset:offset + length])
+        finally:
+            if data is not None:
+                view.release()
+                try:
+                    data.close()
+                except BufferError:
+                    pass  # A consumer still holds a chunk; the map goes with it
@@ -0,0 +1,389 @@
+"""Bounded sliding-window file carver."""
+import mmap
+import os
+import shutil
+import tempfile
+from collections import namedtuple
+
+from .resolvers import NEED_MORE
+from .scanner import SignatureScanner
+
+# Bytes a carver keeps in memory before its buffer is spilled to disk
+DEFAULT_WINDOW = 64 * 1024 * 1024
+# Largest carve of a type whose spec sets no ``max_size``
+DEFAULT_MAX_SIZE = 64 * 1024 * 1024
+# Payload bytes collected between scans of the buffer
+DEFAULT_CHUNK = 256 * 1024
+
+# ``data`` is a view over the carver's buffer; carves produced by worker
+# processes have ``path`` set to a temporary file instead, and ``digest``
+# set to the SHA-256 the worker computed while writing it. ``meta`` is a
+# dict of extra manifest fields (e.g. the URL of an HTTP body) or None
+Carve = namedtuple('Carve', 'ext data stream direction offset path digest meta')
+
+
+def checked(validate, data, ext, stats=None):
+    """Run a structural check; one that raises counts as failed (and as an error)."""
+    if stats:
+        stats.start('validation')
+    try:
+        return validate(data)
+    except Exception:
+        if stats:
+            stats.count('errors', ext)
+        return False
+    finally:
+        if stats:
+            stats.stop()
+
+
+class _Candidate:
+    __slots__ = ('ext', 'start', 'search_from', 'stop', 'state')
+
+    def __init__(self, ext, start, search_from):
+        self.ext = ext
+        self.start = start
+        self.search_from = search_from
+        self.stop = None
+        self.state = {}
+
+
+class StreamCarver:
+    """Carve files out of a byte stream that arrives in pieces.
+
+    Only the unscanned tail of the stream and the bytes of candidates that
+    are still waiting for their end are kept. Once that grows past
+    ``window`` bytes the buffer moves to a temporary file in ``spill_dir``
+    and new data is appended there, until the candidates holding it settle
+    and the live tail fits in memory again. A candidate whose end is not
+    found within its type's ``max_size`` is abandoned. Offsets are absolute
+    positions in the stream, the first byte fed being at ``start``;
+    ``stream`` and ``direction`` only tag the carves that come out.
+
+    When several types match at one offset (e.g. DOCX, XLSX and ZIP), they
+    are tried in ``file_types`` order and only the first that validates is
+    carved. Headers of a type found inside a file already carved as that
+    type are skipped.
+
+    ``Carve.data`` is a memoryview into the carver's buffer. It is released
+    when the iterator is advanced, so consume (or copy) it before asking
+    for the next carve.
+    """
+
+    def __init__(self, scanner, stream=None, direction=None,
+                 window=DEFAULT_WINDOW, chunk_size=DEFAULT_CHUNK, spill_dir=None, stats=None, start=0):
+        self.scanner = scanner
+        self.file_types = scanner.file_types
+        self.stream = stream
+        self.direction = direction
+        self.window = window
+        self.chunk_size = chunk_size
+        self.spill_dir = spill_dir
+        self.stats = stats
+        # Keep enough of the tail to catch a header split across chunks
+        self.overlap = scanner.max_header - 1
+        # A bytearray, or an mmap of spill_file once spilled
+        self.buf = bytearray()
+        self.spill_file = None
+        self.base = start
+        self.end = start
+        self.scan_pos = start
+        # Stream end as of the last drain, so an idle poll costs nothing
+        self.drained = start
+        self.pending = []
+        # End of the last carve per type; e.g. every MP3 frame header inside
+        # a carved MP3 would otherwise start a carve of its own
+        self.covered = {}
+
+    @property
+    def held(self):
+        """Buffered bytes held in memory; none while spilled to disk."""
+        return 0 if self.spill_file is not None else len(self.buf)
+
+    def feed(self, data):
+        """Append ``data``; returns an iterator over any completed carves."""
+        if self.spill_file is None:
+            self.buf += data
+        else:
+            self.spill_file.write(data)
+        self.end += len(data)
+        if self.stats:
+            self.stats.count('bytes_copied', n=len(data))
+        if self.end - self.scan_pos < self.chunk_size:
+            return iter(())
+        return self._drain(eof=False)
+
+    def spill(self):
+        """Move the buffer to a temporary file; later data is appended to it."""
+        if self.spill_file is None:
+            self.spill_file = tempfile.TemporaryFile(dir=self.spill_dir)
+            self.spill_file.write(self.buf)
+            if self.stats:
+                self.stats.count('spills')
+                self.stats.count('bytes_spilled', n=len(self.buf))
+            self.buf = None
+
+    def poll(self):
+        """Carve what has arrived without waiting for a full chunk, e.g. on a live capture."""
+        if self.end == self.drained:
+            return iter(())
+        return self._drain(eof=False)
+
+    def close(self):
+        """Flush the stream; returns an iterator over the remaining carves."""
+        return self._drain(eof=True)
+
+    def _drain(self, eof):
+        end = self.drained = self.end
+        if self.spill_file is not None:
+            # Map the file again to take in what was appended since
+            if self.buf is not None:
+                self.buf.close()
+            self.spill_file.flush()
+            self.buf = mmap.mmap(self.spill_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        stats = self.stats
+
+        # Step 1: find headers starting in the newly scannable region
+        limit = end if eof else end - self.overlap
+        if limit > self.scan_pos:
+            if stats:
+                stats.start('scanning')
+            for pos, exts in self.scanner.scan(self.buf, self.scan_pos - self.base, limit - self.base):
+                start = self.base + pos
+                for ext in exts:
+                    search_from = start if self.file_types[ext]['footer'] else start + 1
+                    self.pending.append(_Candidate(ext, start, search_from))
+                    if stats:
+                        stats.count('candidates', ext)
+            if self.scanner.max_offset:
+                # A header at an offset can start its file before earlier hits
+                self.pending.sort(key=lambda cand: cand.start)
+            if stats:
+                stats.stop()
+            self.scan_pos = limit
+
+        # Step 2: settle every candidate whose end is now known
+        waiting = []
+        carved_at = -1
+        for cand in self.pending:
+            if cand.start == carved_at or cand.start < self.covered.get(cand.ext, 0):
+                continue  # Claimed by another type, or inside a file of its own type
+            if waiting and waiting[-1].start == cand.start:
+                waiting.append(cand)  # Wait until the preferred type settles
+                continue
+            spec = self.file_types[cand.ext]
+            if stats:
+                stats.start('resolving')
+            try:
+                stop = self._find_end(cand, spec, end, eof)
+            except Exception:
+                # A resolver tripping over hostile bytes costs this
+                # candidate, not the rest of the capture
+                if stats:
+                    stats.count('rejected', cand.ext)
+                    stats.count('errors', cand.ext)
+                continue
+            finally:
+                if stats:
+                    stats.stop()
+            if stop is None:
+                waiting.append(cand)
+                continue
+            if stop < 0:
+                if stats:
+                    stats.count('abandoned', cand.ext)
+                continue
+            # Validate and hand out a window over the buffer, not a copy
+            file_data = memoryview(self.buf)[cand.start - self.base:stop - self.base]
+            try:
+                validate = spec.get('validate')
+                if validate:
+                    if not checked(validate, file_data, cand.ext, stats):
+                        if stats:
+                            stats.count('rejected', cand.ext)
+                        continue
+                if stats:
+                    stats.count('carved', cand.ext)
+                carved_at = cand.start
+                self.covered[cand.ext] = stop
+                yield Carve(cand.ext, file_data, self.stream, self.direction, cand.start, None, None, None)
+            finally:
+                # The buffer cannot be trimmed while a view is exported
+                file_data.release()
+        self.pending = waiting
+
+        # Step 3: drop everything nothing is waiting on, short of the bytes
+        # a header found next may have before it
+        keep_from = max(self.base, min([c.start for c in waiting] + [self.scan_pos - self.scanner.max_offset]))
+        if self.spill_file is not None:
+            self._trim_spill(keep_from)
+        else:
+            del self.buf[:keep_from - self.base]
+            self.base = keep_from
+            if len(self.buf) > self.window:
+                self.spill()
+
+    def _trim_spill(self, keep_from):
+        live = self.end - keep_from
+        if live > self.chunk_size and keep_from - self.base < live:
+            return  # Still large, and most of the file is still live
+        self.spill_file.seek(keep_from - self.base)
+        if live <= self.chunk_size:
+            # Back to memory
+            data = bytearray(self.spill_file.read())
+            spill = None
+        else:
+            # Copy the live tail to a fresh file rather than keep a dead prefix
+            spill = tempfile.TemporaryFile(dir=self.spill_dir)
+            shutil.copyfileobj(self.spill_file, spill)
+            data = None
+        self.buf.close()
+        self.spill_file.close()
+        self.buf = data
+        self.spill_file = spill
+        self.base = keep_from
+
+    def _find_end(self, cand, spec, end, eof):
+        """Return the carve's end offset, -1 to drop it, or None to wait."""
+        if cand.stop is None:
+            stop = self._resolve(cand, spec, end, eof)
+            if stop is None or stop < 0:
+                return stop
+            cand.stop = stop
+        # The extent is known; wait for the rest of its bytes to arrive
+        if cand.stop - cand.start > spec.get('max_size', DEFAULT_MAX_SIZE):
+            return -1
+        if cand.stop <= end:
+            return cand.stop
+        return -1 if eof else None
+
+    def _resolve(self, cand, spec, end, eof):
+        max_size = spec.get('max_size', DEFAULT_MAX_SIZE)
+        size = spec.get('size')
+        if size:
+            # Read the length from the file's own structure
+            length = size(self.buf, cand.start - self.base, cand.state, eof)
+            if length is None:
+                return -1
+            if length == NEED_MORE:
+                # Out of data, or more than the cap already in or known to come
+                too_long = end - cand.start >= max_size or cand.state.get('least', 0) > max_size
+                return -1 if eof or too_long else None
+            return cand.start + length
+
+        footer = spec['footer']
+        if footer:
+            pos = self.buf.find(footer, cand.search_from - self.base)
+            if pos != -1:
+                return self.base + pos + len(footer)
+            if eof or end - cand.start >= max_size:
+                return -1
+            cand.search_from = max(cand.start, end - len(footer) + 1)
+            return None
+
+        # For files without footer or size, use next header or end of data;
+        # like any other, a candidate that runs past max_size is abandoned
+        # rather than cut at an arbitrary byte
+        header, offset = spec['headers'][0]
+        pos = self.buf.find(header, cand.search_from - self.base + offset)
+        if pos != -1:
+            return self.base + pos - offset
+        if eof:
+            return end
+        if end - cand.start >= max_size:
+            return -1
+        cand.search_from = max(cand.start + 1, end - len(header) + 1 - offset)
+        return None
+
+
+class FlowCarver:
+    """Carve each direction of each reassembled flow independently.
+
+    Chunks (:class:`~en1gma.reassembly.Chunk` records) are pushed in with
+    :meth:`feed`; a flow's carvers are flushed and dropped as soon as its
+    end-of-flow marker arrives. With ``max_memory``, the buffers of all open
+    carvers are kept under that many bytes by spilling the largest ones to
+    disk; a flow that is only scanning still holds up to one chunk.
+    A prebuilt ``scanner`` for ``file_types`` may be passed in to share it.
+    Subclasses choose the carver for each direction in :meth:`_new_carver`.
+    """
+
+    def __init__(self, file_types, max_memory=None, scanner=None, **kwargs):
+        if max_memory:
+            kwargs.setdefault('window', max_memory)
+        self.scanner = scanner or SignatureScanner(file_types)
+        self.max_memory = max_memory
+        self.kwargs = kwargs
+        self.carvers = {}
+        self.held = 0
+
+    def feed(self, chunk):
+        """Add one chunk; yields the carves it completes."""
+        stream, direction, data = chunk
+        if stream is None:
+            # A tick from a live source: hand over what is already complete
+            for carver in list(self.carvers.values()):
+                self.held -= carver.held
+                yield from carver.poll()
+                self.held += carver.held
+            return
+        if data is None:
+            for direction in (0, 1):
+                carver = self.carvers.pop((stream, direction), None)
+                if carver is not None:
+                    self.held -= carver.held
+                    yield from carver.close()
+            return
+        carver = self.carvers.get((stream, direction))
+        if carver is None:
+            carver = self.carvers[stream, direction] = self._new_carver(stream, direction)
+        self.held -= carver.held
+        yield from carver.feed(data)
+        self.held += carver.held
+        if self.max_memory and self.held > self.max_memory:
+            self.held -= _spill_largest(self.carvers.values(), self.held - self.max_memory)
+
+    def _new_carver(self, stream, direction):
+        return StreamCarver(self.scanner, stream, direction, **self.kwargs)
+
+    def close(self):
+        """Flush every flow still open; yields the remaining carves."""
+        carvers, self.carvers = self.carvers, {}
+        self.held = 0
+        for carver in carvers.values():
+            yield from carver.close()
+
+
+def carve_streams(chunks, file_types, max_memory=None, **kwargs):
+    """Carve an iterable of chunks with a :class:`FlowCarver`."""
+    carver = FlowCarver(file_types, max_memory, **kwargs)
+    for chunk in chunks:
+        yield from carver.feed(chunk)
+    yield from carver.close()
+
+
+def _spill_largest(carvers, excess):
+    """Spill the biggest buffers until ``excess`` bytes are freed."""
+    freed = 0
+    for carver in sorted(carvers, key=lambda c: c.held, reverse=True):
+        if freed >= excess or carver.held <= carver.chunk_size:
+            break
+        freed += carver.held
+        carver.spill()
+    return freed
+
+
+def save_carve(carve, filename):
+    """Write a carve to ``filename``, moving it if it is already on disk."""
+    if carve.path:
+        os.replace(carve.path, filename)
+    else:
+        with open(filename, 'wb') as f:
+            f.write(carve.data)
+
+
+def discard_carve(carve):
+    """Drop a carve that will not be saved."""
+    if carve.path:
+        os.remove(carve.path)
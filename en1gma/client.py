@@ -0,0 +1,196 @@
+"""Thin client for the extraction server (see :mod:`en1gma.server`).
+
+Only the standard library's HTTP and JSON modules are loaded, so a call
+costs little more than interpreter startup; run it as
+``python -m en1gma.client`` to skip even the imports of the full command
+line tool. Paths are made absolute here, as the server resolves them in
+its own working directory.
+
+Over TCP every request carries the token the server wrote to
+:func:`default_token_file` (readable by its owner only), since any local
+user can connect to a localhost port.
+"""
+import argparse
+import http.client
+import json
+import os
+import socket
+import sys
+import tempfile
+
+DEFAULT_TCP_PORT = 8750
+
+
+def default_token_file():
+    """Where a TCP server leaves the token its clients must send."""
+    config = os.environ.get('XDG_CONFIG_HOME') or os.path.join(os.path.expanduser('~'), '.config')
+    return os.path.join(config, 'en1gma', 'server.token')
+
+
+def read_token(path=None):
+    """The token a TCP server wrote to ``path``; raises ServerError if there is none."""
+    path = path or default_token_file()
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except OSError as e:
+        raise ServerError(f"cannot read the server token ({e}); is 'PCAP_Extractor.py serve --tcp' running?")
+
+
+def default_socket():
+    """The per-user server socket in the temp directory, or None without Unix sockets."""
+    if not hasattr(socket, 'AF_UNIX'):
+        return None
+    user = os.getuid() if hasattr(os, 'getuid') else os.getlogin()
+    return os.path.join(tempfile.gettempdir(), f"en1gma-{user}.sock")
+
+
+class ServerError(Exception):
+    """The server refused a request or could not be reached."""
+
+
+class _UnixConnection(http.client.HTTPConnection):
+    def __init__(self, socket_path, timeout=None):
+        super().__init__('localhost', timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if self.timeout is not None:
+            self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+def _request(method, path, body=None, socket_path=None, tcp_port=None, token_file=None):
+    """Send a request; returns (connection, response) for a 200, raises ServerError otherwise."""
+    headers = {'Content-Type': 'application/json'}
+    if tcp_port is not None:
+        headers['Authorization'] = f"Bearer {read_token(token_file)}"
+        conn = http.client.HTTPConnection('127.0.0.1', tcp_port)
+    else:
+        conn = _UnixConnection(socket_path or default_socket())
+    try:
+        conn.request(method, path, body, headers)
+        response = conn.getresponse()
+    except OSError as e:
+        conn.close()
+        raise ServerError(f"cannot reach the server ({e}); is 'PCAP_Extractor.py serve' running?")
+    if response.status != 200:
+        try:
+            message = json.loads(response.read())['error']
+        except (ValueError, KeyError, TypeError):
+            message = response.reason
+        conn.close()
+        raise ServerError(f"{response.status}: {message}")
+    return conn, response
+
+
+def submit(job, socket_path=None, tcp_port=None, token_file=None):
+    """Send a job (fields as in :func:`en1gma.server.parse_job`); yields its events as they come."""
+    conn, response = _request('POST', '/jobs', json.dumps(job), socket_path, tcp_port, token_file)
+    try:
+        for line in response:
+            if line.strip():
+                yield json.loads(line)
+    finally:
+        conn.close()
+
+
+def status(socket_path=None, tcp_port=None, token_file=None):
+    """The server's worker and queue counts."""
+    conn, response = _request('GET', '/status', None, socket_path, tcp_port, token_file)
+    try:
+        return json.loads(response.read())
+    finally:
+        conn.close()
+
+
+def _job(args, capture):
+    return {
+        'capture': os.path.abspath(capture),
+        'output': os.path.abspath(args.output),
+        'types': args.types.replace(',', ' ').split() if args.types else None,
+        'categories': args.categories.replace(',', ' ').split() if args.categories else None,
+        'reader': args.reader,
+        'manifest': os.path.abspath(args.manifest) if args.manifest else None,
+        'dedup': not args.no_dedup,
+        'http': not args.no_http,
+        'scan_encrypted': args.scan_encrypted,
+        'output_format': args.output_format,
+        'deep_check': args.deep_check,
+        'hosts': args.host,
+        'ports': args.port,
+        'start': args.start,
+        'end': args.end,
+        'streams': args.stream,
+        'display_filter': args.display_filter,
+        'udp': args.udp,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="PCAP_Extractor.py submit",
+                                     description="Submit captures to a running extraction server")
+    parser.add_argument("captures", nargs="*", metavar="CAPTURE", help="Capture files, one job each")
+    parser.add_argument("-o", "--output", default="extracted_files", help="Output directory")
+    parser.add_argument("--socket", metavar="PATH", help=f"Server socket (default: {default_socket()})")
+    parser.add_argument("--tcp", type=int, metavar="PORT", help="Connect to a server on localhost:PORT instead")
+    parser.add_argument("--token-file", metavar="PATH",
+                        help=f"With --tcp, the server's token file (default: {default_token_file()})")
+    parser.add_argument("--types", metavar="TYPE[,TYPE]", help="File types to extract (default: all)")
+    parser.add_argument("--categories", metavar="NAME[,NAME]",
+                        help="Categories of file types to extract, e.g. images,archives (with --types: both)")
+    parser.add_argument("--reader", default="auto", help="Packet reader: auto, native or tshark")
+    parser.add_argument("--manifest", metavar="PATH", help="Manifest to record carves in and dedupe against")
+    parser.add_argument("--no-dedup", action="store_true", help="Write every copy of repeated content")
+    parser.add_argument("--no-http", action="store_true", help="Scan HTTP flows blind")
+    parser.add_argument("--scan-encrypted", action="store_true", help="Scan flows that look encrypted too")
+    parser.add_argument("--output-format", default="files", help="files, tar, zip or sqlite")
+    parser.add_argument("--deep-check", default="off", help="off, flag or veto")
+    parser.add_argument("--host", action="append", default=[], metavar="ADDR[/BITS]",
+                        help="Only carve flows to or from this address or network (repeatable)")
+    parser.add_argument("--port", type=int, action="append", default=[],
+                        help="Only carve flows on this TCP/UDP port (repeatable)")
+    parser.add_argument("--start", metavar="TIME", help="Skip packets before TIME")
+    parser.add_argument("--end", metavar="TIME", help="Skip packets after TIME")
+    parser.add_argument("--stream", type=int, action="append", default=[], metavar="N",
+                        help="Only carve stream N (repeatable)")
+    parser.add_argument("--display-filter", metavar="EXPR", help="tshark display filter")
+    parser.add_argument("--udp", action="store_true", help="Also carve UDP payloads")
+    parser.add_argument("--json", action="store_true", help="Print the server's events as JSON lines")
+    parser.add_argument("--status", action="store_true", help="Print the server's worker and queue counts")
+    args = parser.parse_args(argv)
+
+    try:
+        if args.status:
+            print(json.dumps(status(args.socket, args.tcp, args.token_file)))
+            return 0
+        if not args.captures:
+            parser.error("no captures given")
+        failed = 0
+        for capture in args.captures:
+            for event in submit(_job(args, capture), args.socket, args.tcp, args.token_file):
+                if args.json:
+                    print(json.dumps(event), flush=True)
+                    failed += event['event'] == 'error'
+                    continue
+                kind = event['event']
+                if kind == 'queued' and event['position']:
+                    print(f"[*] {capture}: queued behind {event['position']} jobs", flush=True)
+                elif kind == 'file' and event['file']:
+                    url = f" ({event['url']})" if event.get('url') else ''
+                    print(f"[+] Found {event['type'].upper()}: {event['file']}{url}", flush=True)
+                elif kind == 'done':
+                    dups = f", {event['duplicates']} duplicates skipped" if event['duplicates'] else ""
+                    print(f"[+] {capture}: {event['files']} files{dups} in {event['seconds']:.2f}s")
+                elif kind == 'error':
+                    print(f"[-] {capture}: {event['error']}")
+                    failed += 1
+    except ServerError as e:
+        print(f"[-] {e}")
+        return 1
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
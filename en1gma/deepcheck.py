@@ -0,0 +1,103 @@
+"""Deep validation of carves in worker processes, off the carving path.
+
+A type's ``verify`` (see :mod:`en1gma.validators`) parses or decodes a
+whole file, which costs far more than carving it. :class:`DeepChecker`
+sends each carve to a process pool and hands carves back in the order
+they came in once their verdict is in, so carving goes on meanwhile and
+output names and order stay those of a run without it. In ``flag`` mode a
+file that fails is still saved, with the reason in its manifest record
+(``invalid``); in ``veto`` mode it is dropped before it is written.
+"""
+import mmap
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+
+from .carver import discard_carve
+
+DEEP_CHECKS = ("off", "flag", "veto")
+
+# Bytes of in-memory carves held waiting for verdicts before the oldest
+# one is waited for
+MAX_PENDING = 64 * 1024 * 1024
+
+
+def _verify(verify, data, path):
+    """Worker: run a deep check on a carve in memory or on disk."""
+    try:
+        if path is None:
+            return verify(data)
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            return verify(mapped)
+    except Exception as e:
+        return f"check failed: {e!r}"
+
+
+class DeepChecker:
+    """Run deep checks on a process pool and release carves in order.
+
+    :meth:`submit` takes a hashed carve; :meth:`ready` yields
+    ``(carve, digest, reason)`` for the carves at the front of the queue
+    whose checks are done, ``reason`` being None for a file that checks out
+    or was not checked. Content checked once is not checked again.
+    """
+
+    def __init__(self, mode, workers=1, stats=None):
+        if mode not in DEEP_CHECKS[1:]:
+            raise ValueError(f"unknown deep check mode {mode!r}")
+        self.veto = mode == "veto"
+        self.stats = stats
+        self.pool = ProcessPoolExecutor(max(workers, 1))
+        self.pending = deque()
+        self.held = 0
+        # Digest -> reason, or the Future that will give it
+        self.verdicts = {}
+
+    def submit(self, carve, digest, verify):
+        """Queue a carve; ``verify`` is its type's deep check, or None to skip it."""
+        if carve.data is not None and not isinstance(carve.data, bytes):
+            # A view into the carver's buffer, which moves on once we return
+            carve = carve._replace(data=bytes(carve.data))
+        verdict = None
+        if verify is not None:
+            if digest in self.verdicts:
+                verdict = self.verdicts[digest]
+            else:
+                verdict = self.verdicts[digest] = self.pool.submit(
+                    _verify, verify, carve.data if carve.path is None else None, carve.path)
+                if self.stats is not None:
+                    self.stats.count('deep_checked', carve.ext)
+        size = len(carve.data) if carve.data is not None else 0
+        self.pending.append((carve, digest, verdict, size))
+        self.held += size
+
+    def ready(self, wait=False):
+        """Yield the queued carves whose verdicts are in, oldest first.
+
+        With ``wait``, wait for all of them; otherwise only for the oldest
+        while more than :data:`MAX_PENDING` bytes are held.
+        """
+        while self.pending:
+            carve, digest, verdict, size = self.pending[0]
+            if isinstance(verdict, Future):
+                if not verdict.done() and not wait and self.held <= MAX_PENDING:
+                    return
+                if self.stats is not None:
+                    self.stats.start('checking')
+                try:
+                    verdict = self.verdicts[digest] = verdict.result()
+                finally:
+                    if self.stats is not None:
+                        self.stats.stop()
+            self.pending.popleft()
+            self.held -= size
+            if verdict is not None and self.stats is not None:
+                self.stats.count('vetoed' if self.veto else 'flagged', carve.ext)
+            yield carve, digest, verdict
+
+    def close(self):
+        """Stop the workers and drop any carves still waiting."""
+        self.pool.shutdown(wait=True, cancel_futures=True)
+        # After the workers, which may still be reading them
+        while self.pending:
+            discard_carve(self.pending.popleft()[0])
+        self.held = 0
@@ -0,0 +1,231 @@
+"""Extraction pipeline shared by the CLI, the GUI and library callers.
+
+:func:`extract` runs ingest, reassembly, carving, deduplication and saving
+as one lazy generator. It yields :class:`Progress` events as payload bytes
+are consumed and an :class:`Extracted` event for every carve, so callers
+get progress without a separate counting pass and can stop at any point by
+breaking out of the loop (or closing the generator); nothing is read ahead
+of what has been consumed.
+"""
+import os
+from collections import namedtuple
+
+from .carver import FlowCarver, discard_carve
+from .deepcheck import DeepChecker
+from .http import HttpFlowCarver
+from .ingest import is_live, iter_streams
+from .manifest import Manifest, carve_digest, carve_size
+from .parallel import ParallelCarver
+from .prefilter import EncryptedFlowFilter
+from .signatures import FILE_TYPES
+from .sinks import open_sink
+
+# ``done`` payload bytes out of an estimated ``total`` (None for live
+# input); ``stream`` is the flow the last chunk belonged to
+Progress = namedtuple('Progress', 'done total stream')
+# ``filename`` is None for a duplicate, which names the first copy instead;
+# ``meta`` holds the URL and Content-Type of a file carved from HTTP
+Extracted = namedtuple('Extracted', 'ext filename sha256 size stream direction offset duplicate_of meta')
+
+# Progress is reported each time this fraction of the total goes by, or
+# this many bytes on live input
+PROGRESS_STEP = 0.005
+PROGRESS_LIVE_STEP = 1024 * 1024
+
+
+def build_specs(selected_types=None, max_sizes=None):
+    """Select signatures from FILE_TYPES, applying per-type size caps."""
+    if selected_types is None:
+        selected_types = FILE_TYPES.keys()
+    specs = {ext: FILE_TYPES[ext] for ext in selected_types if ext in FILE_TYPES}
+    for ext, size in (max_sizes or {}).items():
+        if ext in specs:
+            specs[ext] = dict(specs[ext], max_size=size)
+    return specs
+
+
+def extract(pcap_path, output_dir="extracted_files", selected_types=None, reader="auto", jobs=1,
+            max_memory=None, max_sizes=None, manifest_path=None, dedup=True, cache=None, stats=None,
+            known_manifests=(), known_digests=None, http=True, follow=False, idle_timeout=None,
+            capture_filter=None, scan_encrypted=False, output_format="files", deep_check="off"):
+    """Carve files out of a capture into ``output_dir``, yielding events as it goes.
+
+    Content listed in ``known_manifests`` is skipped as already extracted,
+    without those manifests being written to; ``known_digests`` maps the
+    SHA-256 of more such content to its file, e.g. for a caller that has
+    read the manifests once already. With ``http``, flows that
+    carry HTTP/1.x are parsed and their bodies carved exactly (see
+    :mod:`en1gma.http`) instead of being scanned blind.
+
+    ``pcap_path`` "-" reads a capture piped to stdin, and ``follow`` keeps
+    reading a file that is still being written; files are then carved
+    within about a second of their last byte arriving, and flows idle for
+    ``idle_timeout`` seconds are closed (see :func:`~en1gma.ingest.iter_streams`).
+
+    A :class:`~en1gma.filters.CaptureFilter` limits the run to some hosts,
+    ports, streams or time range, and can add UDP flows; traffic it drops
+    is never reassembled or scanned.
+
+    Flows that look encrypted (TLS, SSH, QUIC or random bytes, see
+    :mod:`en1gma.prefilter`) are skipped unless ``scan_encrypted`` is set,
+    e.g. for a capture that has been decrypted.
+
+    ``output_format`` picks where files go (see :mod:`en1gma.sinks`): one
+    file each (``files``), or one ``tar``, ``zip`` or ``sqlite`` container in
+    ``output_dir``. They are written on a background thread.
+
+    Every carve passes its type's cheap structural check. With
+    ``deep_check`` "flag" or "veto", files are also fully parsed in worker
+    processes (see :mod:`en1gma.deepcheck`); a file that fails is saved with
+    an ``invalid`` reason in the manifest, or not saved at all.
+
+    Pass a :class:`~en1gma.stats.Stats` to collect stage timings, counters
+    and, if it was created with them enabled, profiles of the run.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    specs = build_specs(selected_types, max_sizes)
+    live = is_live(pcap_path, follow)
+    if live:
+        # The parallel carver releases carves in capture order, which would
+        # hold every file back until the flows before it end
+        cache = None
+        jobs = 1
+    if capture_filter:
+        # The cache holds whole captures only
+        cache = None
+
+    # Without a cache hit there is no payload total up front; the capture
+    # size is a close upper bound
+    total = cache.cached_size(pcap_path, reader) if cache is not None else None
+    source = 'reassembly' if total is None else 'cache'
+    if live:
+        total = None
+        step = PROGRESS_LIVE_STEP
+    else:
+        if total is None:
+            total = os.path.getsize(pcap_path)
+        total = max(total, 1)
+        step = max(int(total * PROGRESS_STEP), 1)
+
+    # Every carve is hashed and recorded; content already in the manifest,
+    # from this run or an earlier one sharing it, is not written again
+    manifest = Manifest(manifest_path or os.path.join(output_dir, "manifest.jsonl"), pcap_path,
+                        known_manifests, known_digests)
+    sink = open_sink(output_format, output_dir)
+    if stats is not None:
+        stats.begin()
+    chunks = iter_streams(pcap_path, reader, cache, stats, follow, idle_timeout, capture_filter)
+    # Buffers that outgrow the memory budget are spilled next to the output
+    if jobs > 1:
+        carver = ParallelCarver(specs, jobs, output_dir, max_memory, stats, http)
+    else:
+        carver = (HttpFlowCarver if http else FlowCarver)(specs, max_memory, spill_dir=output_dir, stats=stats)
+    gate = None if scan_encrypted else EncryptedFlowFilter(stats=stats)
+    checker = None
+    if deep_check != "off" and any('verify' in spec for spec in specs.values()):
+        checker = DeepChecker(deep_check, jobs, stats)
+    found = 0
+
+    def timed(iterable, stage):
+        return stats.timed(iterable, stage) if stats is not None else iterable
+
+    def save(carves):
+        for carve in carves:
+            if stats is not None:
+                stats.start('hashing')
+            digest = carve_digest(carve)
+            if stats is not None:
+                stats.stop()
+            if checker is None:
+                yield from store(carve, digest)
+                continue
+            # Content already saved has been checked, or was kept unchecked
+            known = dedup and manifest.original(digest)
+            checker.submit(carve, digest, None if known else specs[carve.ext].get('verify'))
+            yield from checked()
+
+    def checked(wait=False):
+        for carve, digest, reason in checker.ready(wait):
+            if reason is None:
+                yield from store(carve, digest)
+            elif checker.veto:
+                discard_carve(carve)
+            else:
+                yield from store(carve._replace(meta=dict(carve.meta or {}, invalid=reason)), digest)
+
+    def store(carve, digest):
+        nonlocal found
+        size = carve_size(carve)
+        original = manifest.original(digest) if dedup else None
+        if original:
+            discard_carve(carve)
+            manifest.add(carve, digest, size, duplicate_of=original)
+            if stats is not None:
+                stats.count('duplicates', carve.ext)
+            yield Extracted(carve.ext, None, digest, size, carve.stream, carve.direction,
+                            carve.offset, original, carve.meta)
+            return
+
+        filename = sink.name(carve, found)
+        # Only waits for the writer thread when it has fallen behind
+        if stats is not None:
+            stats.start('writing')
+        sink.put(carve, filename, digest)
+        manifest.add(carve, digest, size, filename, container=sink.container)
+        if stats is not None:
+            stats.stop()
+            stats.count('files_written', carve.ext)
+            stats.count('bytes_written', n=size)
+        found += 1
+        yield Extracted(carve.ext, filename, digest, size, carve.stream, carve.direction,
+                        carve.offset, None, carve.meta)
+
+    done = 0
+    reported = 0
+    stream = None
+    try:
+        for chunk in timed(chunks, source):
+            if chunk.stream is not None:
+                stream = chunk.stream
+            elif checker is not None:
+                # A tick from a live source: hand over files checked since
+                yield from checked()
+            if chunk.data is not None:
+                done += len(chunk.data)
+                if done - reported >= step:
+                    reported = done
+                    yield Progress(done, None if live else max(total, done), stream)
+            if gate is None:
+                yield from save(timed(carver.feed(chunk), 'carving'))
+                continue
+            if stats is not None:
+                stats.start('prefilter')
+            passed = gate.feed(chunk)
+            if stats is not None:
+                stats.stop()
+            for chunk in passed:
+                yield from save(timed(carver.feed(chunk), 'carving'))
+        if gate is not None:
+            for chunk in gate.flush():
+                yield from save(timed(carver.feed(chunk), 'carving'))
+        yield from save(timed(carver.close(), 'carving'))
+        if checker is not None:
+            yield from checked(wait=True)
+        # The real total is known now
+        yield Progress(done, done, stream)
+    finally:
+        try:
+            # Before the workers go, as their carves are moved from a
+            # directory removed with them
+            if checker is not None:
+                checker.close()
+            sink.close()
+        finally:
+            # Stop the reader and any workers now rather than when collected
+            chunks.close()
+            if jobs > 1:
+                carver.shutdown()
+            manifest.close()
+            if stats is not None:
+                stats.count('payload_bytes', n=done)
+                stats.finish()
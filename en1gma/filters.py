@@ -0,0 +1,124 @@
+"""Capture filters applied while packets are decoded.
+
+A :class:`CaptureFilter` selects the traffic worth carving: flows to or
+from given hosts or networks, flows on given ports, packets within a time
+range, and flows by stream number. Flows that do not match are still
+numbered, so stream numbers stay those of an unfiltered run, but their
+payload is never reassembled or scanned. With the tshark reader the
+filter is also turned into a display filter, so tshark does not decode
+what would be thrown away; a free-form display filter can be added to it.
+"""
+import ipaddress
+from datetime import datetime
+
+
+def parse_time(text):
+    """Parse a time given as epoch seconds or an ISO 8601 date (local time if no zone)."""
+    text = text.strip()
+    try:
+        return float(text)
+    except ValueError:
+        pass
+    try:
+        return datetime.fromisoformat(text).timestamp()
+    except ValueError:
+        raise ValueError(f"invalid time: {text!r} (use epoch seconds or YYYY-MM-DD[ HH:MM[:SS]])")
+
+
+def parse_list(text, convert=str):
+    """Split a comma or space separated list, e.g. from a GUI field."""
+    return [convert(item) for item in text.replace(',', ' ').split()]
+
+
+class CaptureFilter:
+    """Which traffic to extract from; an empty filter selects everything.
+
+    ``hosts`` are addresses or CIDR networks and ``ports`` TCP/UDP ports; a
+    flow matches if either end does. ``start`` and ``end`` are epoch
+    seconds. ``streams`` are stream numbers as in the manifest (tshark's
+    ``tcp.stream`` for TCP-only runs). ``display_filter`` is passed to tshark
+    as is and needs the tshark reader. ``udp`` adds UDP payloads, each UDP
+    flow being carved like one TCP connection.
+    """
+
+    def __init__(self, hosts=(), ports=(), start=None, end=None, streams=(), display_filter=None,
+                 udp=False):
+        # Raises ValueError for anything that is not an address or network
+        self.networks = [ipaddress.ip_network(host, strict=False) for host in hosts]
+        self.ports = frozenset(int(port) for port in ports)
+        self.start = start
+        self.end = end
+        self.streams = frozenset(int(stream) for stream in streams)
+        self.display_filter = display_filter or None
+        self.udp = udp
+        if start is not None and end is not None and end < start:
+            raise ValueError("the end of the time range is before its start")
+
+    def __bool__(self):
+        return bool(self.networks or self.ports or self.start is not None or self.end is not None
+                    or self.streams or self.display_filter or self.udp)
+
+    @property
+    def selects_flows(self):
+        """Whether some flows or packets are dropped during reassembly."""
+        return bool(self.networks or self.ports or self.streams
+                    or self.start is not None or self.end is not None)
+
+    def flow(self, stream, seg):
+        """Whether the flow numbered ``stream``, first seen in ``seg``, is kept."""
+        if self.streams and stream not in self.streams:
+            return False
+        if self.ports and seg.sport not in self.ports and seg.dport not in self.ports:
+            return False
+        if self.networks:
+            src = ipaddress.ip_address(seg.src)
+            dst = ipaddress.ip_address(seg.dst)
+            if not any(src in net or dst in net for net in self.networks):
+                return False
+        return True
+
+    def packet(self, ts):
+        """Whether a packet captured at ``ts`` is within the time range."""
+        return (self.start is None or ts >= self.start) and (self.end is None or ts <= self.end)
+
+    def tshark_filter(self):
+        """The part of the filter tshark can apply, as a display filter (or None)."""
+        terms = []
+        if self.display_filter:
+            terms.append(f"({self.display_filter})")
+        # Selecting streams by number needs every flow to reach the
+        # reassembler, so nothing that drops whole flows is pushed down
+        if not self.streams:
+            if self.networks:
+                terms.append("(" + " or ".join(
+                    f"{'ip' if net.version == 4 else 'ipv6'}.addr == {net}" for net in self.networks) + ")")
+            if self.ports:
+                ports = " ".join(str(port) for port in sorted(self.ports))
+                clause = f"tcp.port in {{{ports}}}"
+                if self.udp:
+                    clause += f" or udp.port in {{{ports}}}"
+                terms.append(f"({clause})")
+            if self.start is not None:
+                terms.append(f"frame.time_epoch >= {self.start!r}")
+            if self.end is not None:
+                terms.append(f"frame.time_epoch <= {self.end!r}")
+        return " and ".join(terms) or None
+
+    def describe(self):
+        """A short human-readable summary, e.g. for progress messages."""
+        parts = []
+        if self.networks:
+            parts.append("hosts " + ", ".join(str(net) for net in self.networks))
+        if self.ports:
+            parts.append("ports " + ", ".join(str(port) for port in sorted(self.ports)))
+        if self.start is not None or self.end is not None:
+            start = datetime.fromtimestamp(self.start).isoformat(' ') if self.start is not None else "start"
+            end = datetime.fromtimestamp(self.end).isoformat(' ') if self.end is not None else "end"
+            parts.append(f"time {start} to {end}")
+        if self.streams:
+            parts.append("streams " + ", ".join(str(stream) for stream in sorted(self.streams)))
+        if self.display_filter:
+            parts.append(f"display filter '{self.display_filter}'")
+        if self.udp:
+            parts.append("TCP and UDP")
+        return "; ".join(parts)
@@ -0,0 +1,556 @@
+"""HTTP/1.x-aware carving.
+
+A direction of a flow that starts with an HTTP request or status line is
+parsed message by message instead of being scanned blind. Each body is cut
+at its exact length (Content-Length, chunked transfer coding, or the end of
+the connection), de-chunked and, for gzip and deflate content codings,
+decompressed as it arrives. A body that starts with the header of a
+selected type is carved whole; any other body is scanned for signatures
+like a raw stream, so files inside multipart uploads and the like are still
+found. Carves from a body carry the URL and Content-Type of its message in
+``Carve.meta``.
+
+Whatever stops parsing as HTTP (a protocol upgrade, a CONNECT tunnel, a
+malformed message) is handed to a plain :class:`StreamCarver` from that
+offset on.
+"""
+import mmap
+import re
+import tempfile
+import zlib
+from collections import deque
+
+from .carver import DEFAULT_CHUNK, DEFAULT_MAX_SIZE, DEFAULT_WINDOW, Carve, FlowCarver, StreamCarver, checked
+
+# Longest message head, and longest start or chunk-size line, accepted
+MAX_HEAD = 64 * 1024
+MAX_LINE = 4096
+# Most decompressed bytes produced per call, so a small input cannot
+# expand into a huge allocation
+INFLATE_BLOCK = 1024 * 1024
+
+_REQUEST = re.compile(r'([A-Z]+) (\S+) HTTP/1\.[01]$')
+_RESPONSE = re.compile(r'HTTP/1\.[01] (\d{3})(?: .*)?$')
+_HEAD_END = re.compile(rb'\r?\n\r?\n')
+
+
+class _Exchange:
+    """State shared by both directions of a flow."""
+    __slots__ = ('requests', 'tunnel')
+
+    def __init__(self):
+        # (method, url) of requests still waiting for their response
+        self.requests = deque()
+        # Set once the flow switches protocols; neither side is HTTP after
+        self.tunnel = False
+
+
+def _inflater(coding):
+    if coding in ('gzip', 'x-gzip'):
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+    return None  # deflate waits for its first byte, see _Body._decode
+
+
+class _Body:
+    """One message body, decoded and then carved whole or scanned."""
+
+    def __init__(self, owner, offset, meta, coding):
+        self.owner = owner
+        self.offset = offset
+        self.meta = meta
+        self.coding = coding
+        self.inflater = _inflater(coding)
+        self.decoded = 0
+        self.failed = False
+        # sniff -> whole (buffered until the end) or scan; drop discards
+        self.mode = 'sniff'
+        self.prefix = bytearray()
+        self.exts = None
+        self.buf = None
+        self.spill_file = None
+        self.size = 0
+        self.carver = None
+
+    @property
+    def held(self):
+        held = len(self.prefix)
+        if self.buf is not None:
+            held += len(self.buf)
+        if self.carver is not None:
+            held += self.carver.held
+        return held
+
+    def spill(self):
+        if self.buf is not None:
+            self.spill_file = tempfile.TemporaryFile(dir=self.owner.spill_dir)
+            self.spill_file.write(self.buf)
+            stats = self.owner.stats
+            if stats:
+                stats.count('spills')
+                stats.count('bytes_spilled', n=len(self.buf))
+            self.buf = None
+        if self.carver is not None:
+            self.carver.spill()
+
+    def write(self, raw):
+        """Add raw body bytes; yields carves found by a scan."""
+        if self.failed or self.mode == 'drop':
+            return
+        if self.coding is None:
+            yield from self._take(raw)
+            return
+        stats = self.owner.stats
+        for piece in self._decode(raw):
+            self.decoded += len(piece)
+            if self.decoded > self.owner.max_body:
+                self.failed = True  # Decompresses past anything we would carve
+            if self.failed or self.mode == 'drop':
+                break
+            if stats:
+                stats.stop()
+            yield from self._take(piece)
+            if stats:
+                stats.start('decoding')
+        if stats:
+            stats.stop()
+
+    def _decode(self, raw):
+        stats = self.owner.stats
+        if stats:
+            stats.start('decoding')
+        try:
+            if self.inflater is None:
+                # "deflate" should be zlib-wrapped, but some servers send raw
+                # deflate; a zlib stream starts with compression method 8
+                if not raw:
+                    return
+                self.inflater = zlib.decompressobj(zlib.MAX_WBITS if raw[0] & 0x0F == 8 else -zlib.MAX_WBITS)
+            inflater = self.inflater
+            piece = inflater.decompress(raw, INFLATE_BLOCK)
+            while True:
+                if piece:
+                    yield piece
+                if not inflater.unconsumed_tail or self.failed:
+                    break
+                piece = inflater.decompress(inflater.unconsumed_tail, INFLATE_BLOCK)
+        except zlib.error:
+            self.failed = True
+
+    def _take(self, data):
+        if self.mode == 'sniff':
+            self.prefix += data
+            if len(self.prefix) >= self.owner.scanner.max_reach:
+                yield from self._decide()
+        elif self.mode == 'whole':
+            self._store(data)
+        elif self.mode == 'scan':
+            yield from self._scanned(self.carver.feed(data))
+
+    def _decide(self):
+        owner = self.owner
+        prefix, self.prefix = self.prefix, bytearray()
+        exts = owner.scanner.starts(prefix)
+        if exts:
+            # Starts with a header: the body is the file
+            self.mode = 'whole'
+            self.exts = exts
+            self.buf = bytearray()
+            self._store(prefix)
+        else:
+            self.mode = 'scan'
+            self.carver = StreamCarver(owner.scanner, owner.stream, owner.direction, **owner.kwargs)
+            yield from self._scanned(self.carver.feed(prefix))
+
+    def _store(self, data):
+        self.size += len(data)
+        limit = max(self.owner.file_types[ext].get('max_size', DEFAULT_MAX_SIZE) for ext in self.exts)
+        if self.size > limit:
+            self._discard()
+            self.mode = 'drop'
+            if self.owner.stats:
+                self.owner.stats.count('abandoned', self.exts[0])
+            return
+        if self.owner.stats:
+            self.owner.stats.count('bytes_copied', n=len(data))
+        if self.buf is not None:
+            self.buf += data
+            if len(self.buf) > self.owner.window:
+                self.spill()
+        else:
+            self.spill_file.write(data)
+
+    def _scanned(self, carves):
+        # Offsets inside a decoded body mean nothing in the stream, so the
+        # carve is placed at the body and its position inside kept apart
+        for carve in carves:
+            yield carve._replace(offset=self.offset, meta=dict(self.meta, body_offset=carve.offset))
+
+    def _discard(self):
+        self.buf = None
+        if self.spill_file is not None:
+            self.spill_file.close()
+            self.spill_file = None
+
+    def finish(self, complete):
+        """End the body; yields its carves."""
+        stats = self.owner.stats
+        if stats:
+            stats.count('http_bodies')
+        if self.mode == 'sniff':
+            yield from self._decide()
+        if self.mode == 'scan':
+            yield from self._scanned(self.carver.close())
+            self.carver = None
+            return
+        if self.mode != 'whole':
+            return
+        if not complete or self.failed:
+            # A body cut short (lost packets, a bad encoding) is not the file
+            self._discard()
+            if stats:
+                stats.count('abandoned', self.exts[0])
+            return
+        mapped = None
+        if self.spill_file is not None:
+            self.spill_file.flush()
+            mapped = mmap.mmap(self.spill_file.fileno(), 0, access=mmap.ACCESS_READ)
+            data = memoryview(mapped)
+        else:
+            data = memoryview(self.buf)
+        try:
+            for ext in self.exts:
+                spec = self.owner.file_types[ext]
+                if len(data) > spec.get('max_size', DEFAULT_MAX_SIZE):
+                    continue
+                validate = spec.get('validate')
+                if validate and not checked(validate, data, ext, stats):
+                    continue
+                if stats:
+                    stats.count('carved', ext)
+                yield Carve(ext, data, self.owner.stream, self.owner.direction, self.offset, None, None,
+                            self.meta)
+                break
+            else:
+                if stats:
+                    stats.count('rejected', self.exts[0])
+        finally:
+            data.release()
+            if mapped is not None:
+                mapped.close()
+            self._discard()
+
+
+class HttpStreamCarver:
+    """Carve one direction of a flow, parsing it as HTTP/1.x while it is HTTP.
+
+    A drop-in replacement for :class:`StreamCarver` that falls back to one
+    for the rest of the direction when the bytes stop looking like HTTP.
+    ``exchange`` is shared with the carver of the other direction, so a
+    response is matched with the request it answers.
+    """
+
+    def __init__(self, scanner, stream, direction, exchange, window=DEFAULT_WINDOW,
+                 chunk_size=DEFAULT_CHUNK, spill_dir=None, stats=None):
+        self.scanner = scanner
+        self.file_types = scanner.file_types
+        self.stream = stream
+        self.direction = direction
+        self.exchange = exchange
+        self.window = window
+        self.chunk_size = chunk_size
+        self.spill_dir = spill_dir
+        self.stats = stats
+        self.kwargs = {'window': window, 'chunk_size': chunk_size, 'spill_dir': spill_dir, 'stats': stats}
+        self.max_body = max((spec.get('max_size', DEFAULT_MAX_SIZE) for spec in self.file_types.values()),
+                            default=DEFAULT_MAX_SIZE)
+        # Stream offset of the next byte to parse
+        self.pos = 0
+        # head, body, or fallback / tunnel until the plain carver takes over
+        self.state = 'head'
+        self.head = bytearray()
+        self.head_start = 0
+        self.start_line_ok = False
+        self.framing = None
+        self.remaining = 0
+        self.chunk_state = None
+        self.line = bytearray()
+        self.body = None
+        self.plain = None
+
+    @property
+    def held(self):
+        if self.plain is not None:
+            return self.plain.held
+        held = len(self.head) + len(self.line)
+        if self.body is not None:
+            held += self.body.held
+        return held
+
+    def spill(self):
+        if self.plain is not None:
+            self.plain.spill()
+        elif self.body is not None:
+            self.body.spill()
+
+    def feed(self, data):
+        """Append ``data``; returns an iterator over any completed carves."""
+        if self.plain is not None:
+            return self.plain.feed(data)
+        return self._parse(memoryview(data))
+
+    def poll(self):
+        """Carve what has arrived of a scanned body or the plain stream."""
+        if self.plain is not None:
+            return self.plain.poll()
+        body = self.body
+        if body is not None and body.carver is not None:
+            return body._scanned(body.carver.poll())
+        return iter(())
+
+    def close(self):
+        """Flush the stream; returns an iterator over the remaining carves."""
+        if self.plain is not None:
+            return self.plain.close()
+        return self._close()
+
+    def _close(self):
+        if self.body is not None:
+            # Only a body delimited by the connection closing is whole now
+            yield from self._end_body(self.framing == 'close')
+        elif self.head:
+            yield from self._fall_back(self.head_start, self.head)
+            yield from self.plain.close()
+
+    def _fall_back(self, start, data):
+        if self.stats:
+            self.stats.count('http_fallbacks')
+        self.plain = StreamCarver(self.scanner, self.stream, self.direction, start=start, **self.kwargs)
+        carves = self.plain.feed(data)
+        self.head = bytearray()
+        return carves
+
+    def _parse(self, view):
+        i = 0
+        while i < len(view):
+            if self.plain is not None:
+                yield from self.plain.feed(view[i:])
+                return
+            if self.state == 'head':
+                used = self._read_head(view[i:])
+            elif self.framing == 'chunked':
+                used = yield from self._read_chunked(view[i:])
+            else:
+                used = len(view) - i
+                if self.framing == 'length':
+                    used = min(used, self.remaining)
+                    self.remaining -= used
+                yield from self.body.write(view[i:i + used])
+                if self.framing == 'length' and not self.remaining:
+                    yield from self._end_body(True)
+            i += used
+            self.pos += used
+            if self.state == 'fallback':
+                yield from self._fall_back(self.head_start, self.head)
+            elif self.state == 'tunnel':
+                yield from self._fall_back(self.pos, b'')
+
+    def _read_head(self, view):
+        """Collect a message head; returns the bytes of ``view`` used."""
+        skip = 0
+        if not self.head:
+            # Blank lines between messages
+            while skip < len(view) and view[skip] in b'\r\n':
+                skip += 1
+            if skip == len(view):
+                return skip
+            self.head_start = self.pos + skip
+            if self.exchange.tunnel:
+                self.state = 'fallback'
+        old = len(self.head)
+        self.head += view[skip:]
+        if self.state == 'fallback':
+            return len(view)
+        if not self.start_line_ok:
+            # Judge the start line as soon as it is complete, so a stream
+            # that is not HTTP is handed on without waiting for a whole head
+            newline = self.head.find(b'\n')
+            if newline == -1 and len(self.head) <= MAX_LINE:
+                return len(view)
+            line = bytes(self.head[:newline]).rstrip(b'\r').decode('latin-1')
+            if newline == -1 or not (_REQUEST.match(line) or _RESPONSE.match(line)):
+                self.state = 'fallback'
+                return len(view)
+            self.start_line_ok = True
+        end = _HEAD_END.search(self.head, max(0, old - 3))
+        if end is None:
+            if len(self.head) > MAX_HEAD:
+                self.state = 'fallback'
+            return len(view)
+        end = end.end()
+        del self.head[end:]
+        used = skip + end - old
+        self._start_message(bytes(self.head).decode('latin-1'), self.pos + used)
+        if self.state != 'fallback':
+            self.head = bytearray()
+            self.start_line_ok = False
+        return used
+
+    def _start_message(self, head, body_offset):
+        """Parse a message head and set up for its body."""
+        lines = head.split('\n')
+        start = lines[0].rstrip('\r')
+        headers = {}
+        for line in lines[1:]:
+            line = line.rstrip('\r')
+            if not line or line[0] in ' \t':
+                continue  # End of the head, or a folded continuation
+            name, sep, value = line.partition(':')
+            if not sep:
+                self.state = 'fallback'
+                return
+            name = name.strip().lower()
+            value = value.strip()
+            headers[name] = headers[name] + ', ' + value if name in headers else value
+
+        request = _REQUEST.match(start)
+        exchange = self.exchange
+        if request:
+            method, target = request.groups()
+            host = headers.get('host')
+            url = f"http://{host}{target}" if host and target.startswith('/') else target
+            exchange.requests.append((method, url))
+            has_body = True
+        else:
+            status = int(_RESPONSE.match(start).group(1))
+            if 100 <= status < 200 and status != 101:
+                self.state = 'head'
+                return  # Interim response; the real one follows
+            method, url = exchange.requests.popleft() if exchange.requests else (None, None)
+            if status == 101 or (method == 'CONNECT' and 200 <= status < 300):
+                exchange.tunnel = True
+                self.state = 'tunnel'
+                return
+            has_body = method != 'HEAD' and status not in (204, 304)
+        if self.stats:
+            self.stats.count('http_messages')
+
+        transfer = [c.strip().lower() for c in headers.get('transfer-encoding', '').split(',') if c.strip()]
+        lengths = {v.strip() for v in headers.get('content-length', '').split(',') if v.strip()}
+        if not has_body:
+            self.framing = None
+        elif transfer and transfer[-1] == 'chunked':
+            self.framing = 'chunked'
+            self.chunk_state = 'size'
+        elif transfer or (not lengths and not request):
+            if request:
+                self.state = 'fallback'  # A request body cannot run to the close
+                return
+            self.framing = 'close'
+        elif lengths:
+            length = lengths.pop()
+            if lengths or not length.isdigit():
+                self.state = 'fallback'  # Conflicting or bad lengths; the framing is unknown
+                return
+            self.remaining = int(length)
+            self.framing = 'length' if self.remaining else None
+        else:
+            self.framing = None
+        if self.framing is None:
+            self.state = 'head'
+            return
+
+        meta = {'url': url, 'content_type': headers.get('content-type')}
+        codings = [c.strip().lower() for c in headers.get('content-encoding', '').split(',')
+                   if c.strip() and c.strip().lower() != 'identity']
+        coding = None
+        if codings:
+            meta['content_encoding'] = headers['content-encoding']
+            # Other codings (br, zstd, stacked ones) are scanned as they are
+            if len(codings) == 1 and codings[0] in ('gzip', 'x-gzip', 'deflate'):
+                coding = codings[0]
+        self.body = _Body(self, body_offset, meta, coding)
+        self.state = 'body'
+
+    def _read_chunked(self, view):
+        """De-chunk a body; yields carves and returns the bytes of ``view`` used."""
+        i = 0
+        while i < len(view) and self.state == 'body':
+            if self.chunk_state == 'data':
+                take = min(self.remaining, len(view) - i)
+                yield from self.body.write(view[i:i + take])
+                i += take
+                self.remaining -= take
+                if not self.remaining:
+                    self.chunk_state = 'crlf'
+                continue
+            # Chunk-size lines, the CRLF after each chunk and trailers
+            if not self.line:
+                self.head_start = self.pos + i
+            newline = bytes(view[i:i + MAX_LINE + 2]).find(b'\n')
+            if newline == -1:
+                self.line += view[i:i + MAX_LINE + 2]
+                i = min(len(view), i + MAX_LINE + 2)
+                if len(self.line) > MAX_LINE:
+                    yield from self._chunking_error()
+                continue
+            self.line += view[i:i + newline + 1]
+            i += newline + 1
+            line = bytes(self.line).rstrip(b'\r\n')
+            if self.chunk_state == 'crlf':
+                if line:
+                    yield from self._chunking_error()
+                    continue
+                self.chunk_state = 'size'
+            elif self.chunk_state == 'size':
+                try:
+                    size = int(line.split(b';')[0].strip(), 16)
+                except ValueError:
+                    yield from self._chunking_error()
+                    continue
+                if size:
+                    self.remaining = size
+                    self.chunk_state = 'data'
+                else:
+                    self.chunk_state = 'trailer'
+            elif not line:
+                self.line = bytearray()
+                yield from self._end_body(True)
+                continue
+            self.line = bytearray()
+        return i
+
+    def _chunking_error(self):
+        # The body is cut short; carve what follows from the bad line on
+        line, self.line = self.line, bytearray()
+        yield from self._end_body(False)
+        self.head = line
+        self.state = 'fallback'
+
+    def _end_body(self, complete):
+        body, self.body = self.body, None
+        self.state = 'head'
+        self.framing = None
+        yield from body.finish(complete)
+
+
+class HttpFlowCarver(FlowCarver):
+    """:class:`FlowCarver` whose flows are parsed as HTTP where they carry it."""
+
+    def __init__(self, file_types, max_memory=None, scanner=None, **kwargs):
+        super().__init__(file_types, max_memory, scanner, **kwargs)
+        self.exchanges = {}
+
+    def feed(self, chunk):
+        if chunk.data is None:
+            self.exchanges.pop(chunk.stream, None)
+        yield from super().feed(chunk)
+
+    def close(self):
+        self.exchanges.clear()
+        yield from super().close()
+
+    def _new_carver(self, stream, direction):
+        exchange = self.exchanges.get(stream)
+        if exchange is None:
+            exchange = self.exchanges[stream] = _Exchange()
+        return HttpStreamCarver(self.scanner, stream, direction, exchange, **self.kwargs)
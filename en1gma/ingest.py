@@ -0,0 +1,176 @@
+"""Payload ingestion sources."""
+import subprocess
+import sys
+import time
+
+from . import pcap_reader
+from .pcap_reader import PROTO_TCP, PROTO_UDP, CaptureError, Segment
+from .reassembly import DEFAULT_IDLE_TIMEOUT, Tick, reassemble
+
+READERS = ("auto", "native", "tshark")
+# Seconds between ticks on a live capture: the most a finished file waits
+# before it is carved
+POLL_INTERVAL = 0.5
+
+TSHARK_FIELDS = [
+    "frame.time_epoch", "ip.src", "ipv6.src", "tcp.srcport",
+    "ip.dst", "ipv6.dst", "tcp.dstport", "tcp.seq", "tcp.flags", "tcp.payload",
+]
+TSHARK_UDP_FIELDS = ["udp.srcport", "udp.dstport", "udp.payload"]
+# Every TCP segment, payload or not, so flows are numbered as the built-in
+# reader numbers them (handshake-only ones included); ICMP errors quote
+# the TCP header of the segment they answer
+TSHARK_FILTER = "tcp and not icmp and not icmpv6"
+# ICMP errors quote the UDP header of the datagram they answer
+TSHARK_UDP_FILTER = "udp.payload and not icmp and not icmpv6"
+
+
+def tshark_segments(pcap_path, display_filter=None, udp=False):
+    """Yield TCP (and with ``udp``, UDP) segments from tshark as they are decoded.
+
+    tshark's output is read line by line from a pipe, so only the current
+    packet's hex text is held in memory and callers can start carving
+    before tshark has finished reading the capture. ``display_filter``
+    narrows down the packets tshark decodes at all.
+    """
+    fields = TSHARK_FIELDS + (TSHARK_UDP_FIELDS if udp else [])
+    wanted = f"{TSHARK_FILTER} or ({TSHARK_UDP_FILTER})" if udp else TSHARK_FILTER
+    if display_filter:
+        wanted = f"({wanted}) and ({display_filter})"
+    # Tunnelled traffic has a field per layer; the last one is the innermost
+    cmd = ["tshark", "-r", pcap_path, "-Y", wanted, "-T", "fields", "-E", "occurrence=l"]
+    for field in fields:
+        cmd += ["-e", field]
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                            universal_newlines=True, bufsize=1 << 16)
+    try:
+        for line in proc.stdout:
+            # Should a field still list a value per layer, take the innermost
+            values = [value.rsplit(",", 1)[-1] for value in line.rstrip("\n").split("\t")]
+            if len(values) != len(fields):
+                continue
+            ts, src4, src6, sport, dst4, dst6, dport, seq, flags, payload = values[:10]
+            try:
+                if sport:
+                    segment = Segment(float(ts), PROTO_TCP, src4 or src6, int(sport), dst4 or dst6,
+                                      int(dport), int(seq), int(flags, 16), bytes.fromhex(payload))
+                elif udp and values[10]:
+                    usport, udport, upayload = values[10:]
+                    segment = Segment(float(ts), PROTO_UDP, src4 or src6, int(usport), dst4 or dst6,
+                                      int(udport), 0, 0, bytes.fromhex(upayload))
+                else:
+                    continue
+            except ValueError:
+                continue  # A packet tshark could only partly dissect
+            yield segment
+        proc.stdout.close()
+        if proc.wait() != 0:
+            raise subprocess.CalledProcessError(proc.returncode, cmd)
+    finally:
+        # Stopped early: don't leave tshark blocked on a full pipe
+        if proc.poll() is None:
+            proc.kill()
+            proc.wait()
+
+
+def native_segments(pcap_path, udp=False):
+    """Yield TCP (and with ``udp``, UDP) segments decoded by the built-in reader."""
+    for segment in pcap_reader.iter_segments(pcap_path):
+        if segment.proto == PROTO_TCP or udp:
+            yield segment
+
+
+def iter_segments(pcap_path, reader="auto", capture_filter=None):
+    """Yield TCP segments using the selected reader.
+
+    ``native`` decodes the capture in-process, ``tshark`` always shells out,
+    and ``auto`` tries the native reader first and falls back to tshark for
+    captures it cannot decode (e.g. exotic link types). A
+    :class:`~en1gma.filters.CaptureFilter` can add UDP segments and is
+    pushed down into tshark; a free-form display filter needs tshark.
+    """
+    udp = capture_filter is not None and capture_filter.udp
+    display_filter = capture_filter.tshark_filter() if capture_filter is not None else None
+    if capture_filter is not None and capture_filter.display_filter:
+        if reader == "native":
+            raise ValueError("a display filter needs the tshark reader")
+        reader = "tshark"
+    if reader == "tshark":
+        yield from tshark_segments(pcap_path, display_filter, udp)
+        return
+
+    started = False
+    try:
+        for segment in native_segments(pcap_path, udp):
+            started = True
+            yield segment
+    except CaptureError:
+        if reader == "native" or started:
+            raise
+        yield from tshark_segments(pcap_path, display_filter, udp)
+
+
+def is_live(pcap_path, follow=False):
+    """Whether a capture is read as it is written: stdin ("-") or followed."""
+    return follow or pcap_path == "-"
+
+
+def live_segments(pcap_path, follow=False, poll_interval=POLL_INTERVAL, udp=False):
+    """Yield TCP segments from stdin ("-") or a capture still being written.
+
+    A :class:`~en1gma.reassembly.Tick` carrying the capture clock is passed
+    along every ``poll_interval`` seconds. Ctrl-C ends the capture like the
+    end of a file would, so flows still open are flushed and carved.
+    """
+    f = sys.stdin.buffer if pcap_path == "-" else open(pcap_path, "rb")
+    last_ts = None
+    last_seen = None
+    try:
+        for packet in pcap_reader.iter_packets_live(f, follow, poll_interval):
+            if packet is None:
+                # The capture clock runs on with the wall clock between packets
+                if last_ts is not None:
+                    yield Tick(last_ts + time.monotonic() - last_seen)
+                continue
+            last_ts, last_seen = packet.ts, time.monotonic()
+            segment = pcap_reader.parse_frame(*packet)
+            if segment is not None and (segment.proto == PROTO_TCP or udp):
+                yield segment
+    except KeyboardInterrupt:
+        return
+    finally:
+        if f is not sys.stdin.buffer:
+            f.close()
+
+
+def iter_streams(pcap_path, reader="auto", cache=None, stats=None, follow=False, idle_timeout=None,
+                 capture_filter=None):
+    """Yield reassembled per-flow chunks for a capture.
+
+    With a :class:`~en1gma.cache.PayloadCache`, chunks from an earlier pass
+    over the same capture are replayed instead of decoding it again. With a
+    :class:`~en1gma.stats.Stats`, packet decoding is timed as ``ingest``.
+    A :class:`~en1gma.filters.CaptureFilter` is applied while decoding and
+    reassembling; filtered runs are not cached.
+
+    Live input (see :func:`is_live`) is decoded by the native reader as it
+    arrives, is never cached, and has flows idle for ``idle_timeout``
+    seconds closed; its chunks include :data:`~en1gma.reassembly.TICK` marks.
+    """
+    if is_live(pcap_path, follow):
+        if reader == "tshark" or capture_filter is not None and capture_filter.display_filter:
+            raise ValueError("live captures are read by the native reader only")
+        udp = capture_filter is not None and capture_filter.udp
+        segments = live_segments(pcap_path, follow, udp=udp)
+        if stats is not None:
+            segments = stats.timed(segments, 'ingest')
+        return reassemble(segments, idle_timeout=idle_timeout or DEFAULT_IDLE_TIMEOUT,
+                          capture_filter=capture_filter)
+
+    segments = iter_segments(pcap_path, reader, capture_filter)
+    if stats is not None:
+        segments = stats.timed(segments, 'ingest')
+    chunks = reassemble(segments, capture_filter=capture_filter)
+    if cache is None or capture_filter:
+        return chunks
+    return cache.streams(pcap_path, reader, chunks)
@@ -0,0 +1,104 @@
+"""Content-hash manifest of carved files.
+
+Every carve is recorded as one JSON line with its SHA-256, type, size and
+where it was found, plus the URL and Content-Type of files carved from
+HTTP; files written into a tar, zip or SQLite container name it as
+``container``. Loading an existing manifest makes the content it lists
+known, so a later run pointed at the same file (e.g. one per case) skips
+anything already extracted from earlier captures.
+"""
+import hashlib
+import json
+import os
+
+
+def carve_digest(carve):
+    """SHA-256 of a carve, hashed straight from its buffer or file."""
+    if carve.digest:
+        return carve.digest
+    if carve.data is not None:
+        return hashlib.sha256(carve.data).hexdigest()
+    sha = hashlib.sha256()
+    with open(carve.path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def carve_size(carve):
+    return len(carve.data) if carve.data is not None else os.path.getsize(carve.path)
+
+
+def read_records(path):
+    """Yield the records of a manifest file, skipping a torn last line."""
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError:
+                continue  # A run that was killed mid-write
+
+
+class Manifest:
+    """Append-only JSON-lines manifest keyed by content hash.
+
+    Content listed in ``known`` (other manifests, read but not written) is
+    treated as already extracted too, as is that of ``known_digests``, a
+    mapping of SHA-256 to file already read from such a manifest.
+    """
+
+    def __init__(self, path, capture=None, known=(), known_digests=None):
+        self.path = path
+        self.capture = capture
+        # sha256 -> file the content was first saved as
+        self.seen = dict(known_digests or {})
+        for known_path in tuple(known) + (path,):
+            if os.path.exists(known_path):
+                for record in read_records(known_path):
+                    if record.get('file'):
+                        self.seen.setdefault(record['sha256'], record['file'])
+        self.file = open(path, 'a', encoding='utf-8')
+
+    def original(self, digest):
+        """File an earlier carve with this content was saved as, or None."""
+        return self.seen.get(digest)
+
+    def add(self, carve, digest, size, filename=None, duplicate_of=None, container=None):
+        """Record a carve; ``filename`` is None when it was not written."""
+        record = {
+            'sha256': digest,
+            'type': carve.ext,
+            'size': size,
+            'capture': self.capture,
+            'stream': carve.stream,
+            'direction': carve.direction,
+            'offset': carve.offset,
+            'file': filename,
+            'duplicate_of': duplicate_of,
+        }
+        if container:
+            record['container'] = container
+        if carve.meta:
+            record.update(carve.meta)
+        self.append(record)
+
+    def append(self, record):
+        """Record an already built entry, e.g. one copied from another manifest."""
+        self.file.write(json.dumps(record) + '\n')
+        # Keep the manifest current with the files on disk, e.g. while a
+        # live capture is carved or if the run is killed
+        self.file.flush()
+        if record['file']:
+            self.seen.setdefault(record['sha256'], record['file'])
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
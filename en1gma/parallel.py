@@ -0,0 +1,260 @@
+"""Process-pool carving, one reassembled flow per unit of work.
+
+The parent keeps ingesting and reassembling; each flow's chunks are
+collected (spooled to disk once they get large) and handed to a worker
+when the flow ends. Workers run the same :class:`StreamCarver` as a serial
+run and write their carves to temporary files. Every carve is tagged with
+the index of the chunk that produced it, and the parent releases carves in
+tag order once no unfinished flow can still produce an earlier one, so the
+sequence of carves - and therefore output names and counts - is identical
+to a serial run.
+"""
+import hashlib
+import heapq
+import os
+import shutil
+import struct
+import tempfile
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from .carver import DEFAULT_MAX_SIZE, DEFAULT_WINDOW, Carve, FlowCarver
+from .http import HttpFlowCarver
+from .reassembly import Chunk
+from .scanner import SignatureScanner
+from .signatures import FILE_TYPES
+from .stats import Stats
+
+# A flow's chunks move from memory to a spool file past this size, or when
+# all buffered flows together exceed SPOOL_TOTAL (half of max_memory if set)
+SPOOL_UNIT = 1024 * 1024
+SPOOL_TOTAL = 64 * 1024 * 1024
+
+_RECORD = struct.Struct('<QbI')
+
+_scanner = None
+_window = DEFAULT_WINDOW
+_collect_stats = False
+_flow_carver = FlowCarver
+
+
+def _init_worker(max_sizes, window, collect_stats, http):
+    # Specs hold lambdas, so workers rebuild them from FILE_TYPES by name
+    global _scanner, _window, _collect_stats, _flow_carver
+    _scanner = SignatureScanner({ext: dict(FILE_TYPES[ext], max_size=size)
+                                 for ext, size in max_sizes.items()})
+    _window = window
+    _collect_stats = collect_stats
+    _flow_carver = HttpFlowCarver if http else FlowCarver
+
+
+def _unit_events(events, spool_path):
+    if spool_path is None:
+        yield from events
+        return
+    with open(spool_path, 'rb') as f:
+        while True:
+            header = f.read(_RECORD.size)
+            if not header:
+                break
+            event, direction, length = _RECORD.unpack(header)
+            if direction < 0:
+                yield event, None, None
+            else:
+                yield event, direction, f.read(length)
+    os.remove(spool_path)
+
+
+def _carve_unit(stream, events, spool_path, out_dir):
+    """Worker: carve one flow and write each carve to a temporary file."""
+    stats = Stats() if _collect_stats else None
+    results = []
+    carver = _flow_carver(_scanner.file_types, scanner=_scanner, window=_window, spill_dir=out_dir,
+                          stats=stats)
+    event = None
+    seq = 0
+    for event, direction, data in _unit_events(events, spool_path):
+        seq = _keep(carver.feed(Chunk(stream, direction, data)), stream, event, out_dir, stats, results)
+    # A flow cut off at the end of the input has no end marker to flush it
+    _keep(carver.close(), stream, event, out_dir, stats, results, seq)
+    return stream, results, stats.snapshot() if stats else None
+
+
+def _keep(carves, stream, event, out_dir, stats, results, seq=0):
+    """Write carves to temporary files; returns the next sequence number."""
+    for carve in carves:
+        path = os.path.join(out_dir, f"{stream}_{event}_{seq}.{carve.ext}")
+        if stats:
+            stats.start('writing')
+        with open(path, 'wb') as f:
+            f.write(carve.data)
+        if stats:
+            stats.stop()
+            stats.start('hashing')
+        digest = hashlib.sha256(carve.data).hexdigest()
+        if stats:
+            stats.stop()
+        results.append(((event, seq), carve.ext, carve.direction, carve.offset, path, digest, carve.meta))
+        seq += 1
+    return seq
+
+
+class _Unit:
+    """Chunks of one flow waiting to be sent to a worker."""
+    __slots__ = ('stream', 'first_event', 'events', 'size', 'spool')
+
+    def __init__(self, stream, first_event):
+        self.stream = stream
+        self.first_event = first_event
+        self.events = []
+        self.size = 0
+        self.spool = None
+
+    def add(self, event, direction, data):
+        if self.spool is not None:
+            self.spool.write(_RECORD.pack(event, -1 if data is None else direction,
+                                          0 if data is None else len(data)))
+            if data is not None:
+                self.spool.write(data)
+            return 0
+        self.events.append((event, direction, None if data is None else bytes(data)))
+        added = 0 if data is None else len(data)
+        self.size += added
+        return added
+
+    def spool_to(self, path):
+        """Move buffered chunks to disk; returns the bytes freed."""
+        self.spool = open(path, 'wb')
+        events, self.events = self.events, []
+        for event in events:
+            self.add(*event)
+        freed, self.size = self.size, 0
+        return freed
+
+    def job(self):
+        if self.spool is not None:
+            self.spool.close()
+            return self.events, self.spool.name
+        return self.events, None
+
+
+class ParallelCarver:
+    """Carve reassembled chunks on ``jobs`` worker processes.
+
+    Chunks are pushed in with :meth:`feed`, as with
+    :class:`~en1gma.carver.FlowCarver`. ``file_types`` must be entries of
+    :data:`~en1gma.signatures.FILE_TYPES`; only their ``max_size`` may
+    differ. Carves come out as :class:`~en1gma.carver.Carve` records whose
+    ``path`` is a temporary file under ``work_dir`` (``data`` is None); move
+    or copy it before taking the next one. ``max_memory`` is split between
+    the parent's buffered flows and the workers' carvers. With ``stats``,
+    the workers' timers and counters are merged into it. With ``http``,
+    flows are carved by :class:`~en1gma.http.HttpFlowCarver`. Call
+    :meth:`shutdown` when done, which also deletes any leftovers.
+    """
+
+    def __init__(self, file_types, jobs, work_dir, max_memory=None, stats=None, http=True):
+        max_sizes = {ext: spec.get('max_size', DEFAULT_MAX_SIZE) for ext, spec in file_types.items()}
+        self.spool_total = max_memory // 2 if max_memory else SPOOL_TOTAL
+        # Two carvers (one per direction) in each worker
+        window = max_memory // (4 * jobs) if max_memory else DEFAULT_WINDOW
+        self.jobs = jobs
+        self.stats = stats
+        self.tmp_dir = tempfile.mkdtemp(prefix='.carving-', dir=work_dir)
+        self.units = {}
+        self.ready = deque()
+        self.inflight = {}
+        self.finished = []
+        self.buffered = 0
+        self.event = -1
+        self.pool = ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker,
+                                        initargs=(max_sizes, window, stats is not None, http))
+
+    def feed(self, chunk):
+        """Add one chunk; yields any carves that can be released in order."""
+        stream, direction, data = chunk
+        self.event += 1
+        unit = self.units.get(stream)
+        if unit is None:
+            unit = self.units[stream] = _Unit(stream, self.event)
+        self.buffered += unit.add(self.event, direction, data)
+        if data is None:
+            self.buffered -= unit.size
+            self.ready.append(self.units.pop(stream))
+        elif unit.spool is None and (unit.size > SPOOL_UNIT or self.buffered > self.spool_total):
+            self.buffered -= unit.spool_to(os.path.join(self.tmp_dir, f"{stream}.spool"))
+            if self.stats:
+                self.stats.count('spools')
+
+        self._submit()
+        if self.inflight:
+            # Apply back-pressure once the queue of finished flows grows
+            self._collect(block=len(self.ready) > self.jobs * 4)
+        if self.finished:
+            yield from self._release(self._watermark())
+
+    def close(self):
+        """Carve every flow still open; yields the remaining carves."""
+        self.ready.extend(self.units.values())
+        self.units.clear()
+        while self.ready or self.inflight:
+            self._submit()
+            self._collect(block=True)
+            yield from self._release(self._watermark())
+        yield from self._release(self.event + 1)
+
+    def shutdown(self):
+        for future in self.inflight:
+            future.cancel()
+        self.pool.shutdown(wait=True)
+        for unit in list(self.units.values()) + list(self.ready):
+            if unit.spool is not None:
+                unit.spool.close()
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def _submit(self):
+        while self.ready and len(self.inflight) < self.jobs * 2:
+            unit = self.ready.popleft()
+            events, spool_path = unit.job()
+            future = self.pool.submit(_carve_unit, unit.stream, events, spool_path, self.tmp_dir)
+            self.inflight[future] = unit.first_event
+
+    def _collect(self, block):
+        if block:
+            done, _ = wait(list(self.inflight), return_when=FIRST_COMPLETED)
+        else:
+            done = [future for future in self.inflight if future.done()]
+        for future in done:
+            del self.inflight[future]
+            stream, results, snapshot = future.result()
+            if snapshot:
+                # Worker time is summed over processes, so keep it apart
+                self.stats.merge(snapshot, stage_prefix='workers/')
+            for tag, ext, direction, offset, path, digest, meta in results:
+                heapq.heappush(self.finished, (tag, Carve(ext, None, stream, direction, offset, path, digest, meta)))
+
+    def _release(self, watermark):
+        # Nothing still pending can produce a carve tagged before watermark
+        while self.finished and self.finished[0][0][0] < watermark:
+            yield heapq.heappop(self.finished)[1]
+
+    def _watermark(self):
+        firsts = [u.first_event for u in self.units.values()]
+        firsts += [u.first_event for u in self.ready]
+        firsts += list(self.inflight.values())
+        return min(firsts, default=self.event + 1)
+
+
+def carve_streams_parallel(chunks, file_types, jobs, work_dir, max_memory=None):
+    """Carve an iterable of chunks with a :class:`ParallelCarver`.
+
+    Leftover temporary files are deleted when the generator finishes or is
+    closed.
+    """
+    carver = ParallelCarver(file_types, jobs, work_dir, max_memory)
+    try:
+        for chunk in chunks:
+            yield from carver.feed(chunk)
+        yield from carver.close()
+    finally:
+        carver.shutdown()
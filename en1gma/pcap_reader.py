@@ -0,0 +1,391 @@
+"""Native pcap/pcapng reader.
+
+The capture is memory-mapped and payloads are handed out as memoryview
+slices of the mapping, so no packet bytes are copied or hex encoded on the
+way to the carver. Only the link types listed in ``SUPPORTED_LINKTYPES``
+are decoded; anything else raises :class:`CaptureError` so callers can fall
+back to tshark.
+"""
+import mmap
+import os
+import select
+import stat
+import struct
+import time
+from collections import namedtuple
+
+LINKTYPE_NULL = 0
+LINKTYPE_ETHERNET = 1
+LINKTYPE_RAW = 101
+LINKTYPE_LOOP = 108
+LINKTYPE_LINUX_SLL = 113
+LINKTYPE_IPV4 = 228
+LINKTYPE_IPV6 = 229
+LINKTYPE_LINUX_SLL2 = 276
+
+SUPPORTED_LINKTYPES = {
+    LINKTYPE_NULL, LINKTYPE_ETHERNET, LINKTYPE_RAW, LINKTYPE_LOOP,
+    LINKTYPE_LINUX_SLL, LINKTYPE_IPV4, LINKTYPE_IPV6, LINKTYPE_LINUX_SLL2,
+}
+
+PROTO_TCP = 6
+PROTO_UDP = 17
+
+PCAP_MAGICS = {
+    b'\xd4\xc3\xb2\xa1': ('<', 1e-6),
+    b'\xa1\xb2\xc3\xd4': ('>', 1e-6),
+    b'\x4d\x3c\xb2\xa1': ('<', 1e-9),
+    b'\xa1\xb2\x3c\x4d': ('>', 1e-9),
+}
+PCAPNG_SHB = b'\x0a\x0d\x0d\x0a'
+
+Packet = namedtuple('Packet', 'ts linktype data')
+Segment = namedtuple('Segment', 'ts proto src sport dst dport seq flags payload')
+
+# Largest record a live capture may contain; anything bigger is corruption,
+# not a packet worth waiting for
+MAX_RECORD = 16 * 1024 * 1024
+# Bytes read from a live capture at a time
+READ_SIZE = 1024 * 1024
+
+_VLAN_ETHERTYPES = (0x8100, 0x88a8, 0x9100)
+_IPV6_EXT_HEADERS = (0, 43, 60)
+
+
+class CaptureError(Exception):
+    """Raised for captures the native reader cannot decode."""
+
+
+def iter_packets(path):
+    """Yield a :class:`Packet` for every captured frame in ``path``."""
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            magic = mm[:4]
+            if magic == PCAPNG_SHB:
+                yield from _pcapng_packets(mm)
+            elif magic in PCAP_MAGICS:
+                yield from _pcap_packets(mm)
+            else:
+                raise CaptureError("not a pcap or pcapng file")
+        finally:
+            try:
+                mm.close()
+            except BufferError:
+                # The caller still holds a payload slice; the mapping is
+                # released together with it
+                pass
+
+
+def _check_linktype(linktype):
+    if linktype not in SUPPORTED_LINKTYPES:
+        raise CaptureError(f"unsupported link type {linktype}")
+
+
+def _pcap_packets(mm):
+    endian, scale = PCAP_MAGICS[mm[:4]]
+    if len(mm) < 24:
+        raise CaptureError("truncated pcap header")
+    # The upper bits of the link type field carry FCS information
+    linktype = struct.unpack_from(endian + 'I', mm, 20)[0] & 0x0FFFFFFF
+    _check_linktype(linktype)
+
+    record = struct.Struct(endian + 'IIII')
+    view = memoryview(mm)
+    size = len(mm)
+    pos = 24
+    while pos + 16 <= size:
+        sec, frac, caplen, _ = record.unpack_from(mm, pos)
+        pos += 16
+        if pos + caplen > size:
+            break  # Capture was cut off mid-record
+        yield Packet(sec + frac * scale, linktype, view[pos:pos + caplen])
+        pos += caplen
+
+
+def _if_tsresol(mm, pos, end, endian):
+    """Return the timestamp unit from an IDB's options (default 1us)."""
+    while pos + 4 <= end:
+        code, length = struct.unpack_from(endian + 'HH', mm, pos)
+        if code == 0:
+            break
+        if code == 9 and length >= 1:
+            value = mm[pos + 4]
+            return 2.0 ** -(value & 0x7F) if value & 0x80 else 10.0 ** -value
+        pos += 4 + ((length + 3) & ~3)
+    return 1e-6
+
+
+def _interface(interfaces, index):
+    if index >= len(interfaces):
+        raise CaptureError(f"packet references unknown interface {index}")
+    return interfaces[index]
+
+
+def _shb_endian(buf, pos):
+    bom = bytes(buf[pos + 8:pos + 12])
+    if bom == b'\x4d\x3c\x2b\x1a':
+        return '<'
+    if bom == b'\x1a\x2b\x3c\x4d':
+        return '>'
+    raise CaptureError("bad pcapng byte-order magic")
+
+
+def _pcapng_block(buf, pos, btype, blen, endian, interfaces):
+    """Decode one pcapng block; returns (ts, linktype, start, stop) for a packet, else None.
+
+    A Simple Packet Block has no timestamp; its ``ts`` is None.
+    """
+    if btype == 1:  # Interface Description Block
+        linktype = struct.unpack_from(endian + 'H', buf, pos + 8)[0]
+        _check_linktype(linktype)
+        interfaces.append((linktype, _if_tsresol(buf, pos + 16, pos + blen - 4, endian)))
+    elif btype == 6:  # Enhanced Packet Block
+        iface, ts_high, ts_low, caplen = struct.unpack_from(endian + 'IIII', buf, pos + 8)
+        linktype, unit = _interface(interfaces, iface)
+        return ((ts_high << 32) | ts_low) * unit, linktype, pos + 28, pos + 28 + min(caplen, blen - 32)
+    elif btype == 3:  # Simple Packet Block
+        origlen = struct.unpack_from(endian + 'I', buf, pos + 8)[0]
+        return None, _interface(interfaces, 0)[0], pos + 12, pos + 12 + min(origlen, blen - 16)
+    elif btype == 2:  # Obsolete Packet Block
+        iface, _, ts_high, ts_low, caplen = struct.unpack_from(endian + 'HHIII', buf, pos + 8)
+        linktype, unit = _interface(interfaces, iface)
+        return ((ts_high << 32) | ts_low) * unit, linktype, pos + 28, pos + 28 + min(caplen, blen - 32)
+    return None
+
+
+def _pcapng_packets(mm):
+    view = memoryview(mm)
+    size = len(mm)
+    endian = '<'
+    interfaces = []
+    # Packets without a timestamp take the one before them, so a time
+    # range does not drop them all
+    last_ts = 0.0
+    pos = 0
+    while pos + 12 <= size:
+        btype = struct.unpack_from(endian + 'I', mm, pos)[0]
+        if btype == 0x0A0D0D0A:
+            endian = _shb_endian(mm, pos)
+            interfaces = []
+        blen = struct.unpack_from(endian + 'I', mm, pos + 4)[0]
+        if blen < 12 or pos + blen > size:
+            break
+        packet = _pcapng_block(mm, pos, btype, blen, endian, interfaces)
+        if packet is not None:
+            ts, linktype, start, stop = packet
+            last_ts = ts = last_ts if ts is None else ts
+            yield Packet(ts, linktype, view[start:stop])
+        pos += blen
+
+
+class PacketParser:
+    """Incremental pcap/pcapng parser for a capture that arrives in pieces.
+
+    :meth:`feed` takes whatever bytes are available and returns the packets
+    whose records are now complete, keeping a partial record for the next
+    call. Packet data is copied out, so nothing holds on to the buffer.
+    """
+
+    def __init__(self):
+        self.buf = bytearray()
+        self.format = None
+        self.endian = '<'
+        self.scale = 1e-6
+        self.linktype = None
+        self.interfaces = []
+        self.last_ts = 0.0
+
+    def feed(self, data):
+        buf = self.buf
+        buf += data
+        packets = []
+        pos = 0
+        if self.format is None:
+            if len(buf) < 4:
+                return packets
+            magic = bytes(buf[:4])
+            if magic == PCAPNG_SHB:
+                self.format = 'pcapng'
+            elif magic in PCAP_MAGICS:
+                if len(buf) < 24:
+                    return packets
+                self.endian, self.scale = PCAP_MAGICS[magic]
+                self.linktype = struct.unpack_from(self.endian + 'I', buf, 20)[0] & 0x0FFFFFFF
+                _check_linktype(self.linktype)
+                self.format = 'pcap'
+                pos = 24
+            else:
+                raise CaptureError("not a pcap or pcapng stream")
+
+        if self.format == 'pcap':
+            record = struct.Struct(self.endian + 'IIII')
+            while pos + 16 <= len(buf):
+                sec, frac, caplen, _ = record.unpack_from(buf, pos)
+                if caplen > MAX_RECORD:
+                    raise CaptureError(f"record of {caplen} bytes")
+                if pos + 16 + caplen > len(buf):
+                    break
+                packets.append(Packet(sec + frac * self.scale, self.linktype,
+                                      bytes(buf[pos + 16:pos + 16 + caplen])))
+                pos += 16 + caplen
+        else:
+            while pos + 12 <= len(buf):
+                btype = struct.unpack_from(self.endian + 'I', buf, pos)[0]
+                if btype == 0x0A0D0D0A:
+                    self.endian = _shb_endian(buf, pos)
+                blen = struct.unpack_from(self.endian + 'I', buf, pos + 4)[0]
+                if blen < 12 or blen > MAX_RECORD:
+                    raise CaptureError(f"bad pcapng block length {blen}")
+                if pos + blen > len(buf):
+                    break
+                if btype == 0x0A0D0D0A:
+                    self.interfaces = []
+                packet = _pcapng_block(buf, pos, btype, blen, self.endian, self.interfaces)
+                if packet is not None:
+                    ts, linktype, start, stop = packet
+                    self.last_ts = ts = self.last_ts if ts is None else ts
+                    packets.append(Packet(ts, linktype, bytes(buf[start:stop])))
+                pos += blen
+        del buf[:pos]
+        return packets
+
+
+def iter_packets_live(f, follow=False, poll_interval=0.5):
+    """Yield packets from a capture that is still being written.
+
+    ``f`` is a pipe (e.g. stdin fed by ``tcpdump -w -``) or, with
+    ``follow``, a file another process keeps appending to. Each packet comes
+    out as soon as its record is complete, and None is yielded every
+    ``poll_interval`` seconds, busy or not, so the caller can flush and
+    expire state on time. A pipe ends when its writer closes it; a followed
+    file never ends.
+    """
+    parser = PacketParser()
+    fd = f.fileno()
+    regular = stat.S_ISREG(os.fstat(fd).st_mode)
+    # select() only waits on pipes outside Windows; elsewhere reads block
+    waitable = not regular and os.name != 'nt'
+    next_tick = time.monotonic() + poll_interval
+    while True:
+        wait = max(0.0, next_tick - time.monotonic())
+        data = None
+        if regular:
+            data = os.read(fd, READ_SIZE)
+            if not data:
+                if not follow:
+                    break
+                time.sleep(wait)
+                data = None
+        elif not waitable or select.select([fd], [], [], wait)[0]:
+            data = os.read(fd, READ_SIZE)
+            if not data:
+                break  # The writer closed the pipe
+        if data:
+            yield from parser.feed(data)
+        if time.monotonic() >= next_tick:
+            next_tick = time.monotonic() + poll_interval
+            yield None
+
+
+def parse_frame(ts, linktype, frame):
+    """Decode a link-layer frame down to TCP/UDP; returns a Segment or None."""
+    size = len(frame)
+    if linktype == LINKTYPE_ETHERNET:
+        if size < 14:
+            return None
+        ethertype = (frame[12] << 8) | frame[13]
+        off = 14
+        while ethertype in _VLAN_ETHERTYPES and off + 4 <= size:
+            ethertype = (frame[off + 2] << 8) | frame[off + 3]
+            off += 4
+    elif linktype == LINKTYPE_LINUX_SLL:
+        if size < 16:
+            return None
+        ethertype = (frame[14] << 8) | frame[15]
+        off = 16
+    elif linktype == LINKTYPE_LINUX_SLL2:
+        if size < 20:
+            return None
+        ethertype = (frame[0] << 8) | frame[1]
+        off = 20
+    elif linktype in (LINKTYPE_NULL, LINKTYPE_LOOP):
+        if size < 5:
+            return None
+        off = 4
+        ethertype = 0x0800 if frame[4] >> 4 == 4 else 0x86DD
+    else:  # Raw IP
+        if size < 1:
+            return None
+        off = 0
+        ethertype = 0x0800 if frame[0] >> 4 == 4 else 0x86DD
+
+    if ethertype == 0x0800:
+        if size < off + 20:
+            return None
+        ihl = (frame[off] & 0x0F) * 4
+        total_len, frag = struct.unpack_from('!H2xH', frame, off + 2)
+        if frag & 0x3FFF:
+            return None  # IP fragment; tshark would reassemble these
+        proto = frame[off + 9]
+        src = bytes(frame[off + 12:off + 16])
+        dst = bytes(frame[off + 16:off + 20])
+        # Trims Ethernet padding; TSO/LRO captures leave the length 0, and
+        # then the frame is all there is to go by
+        end = size if total_len < ihl else min(size, off + total_len)
+        off += ihl
+    elif ethertype == 0x86DD:
+        if size < off + 40:
+            return None
+        payload_len = (frame[off + 4] << 8) | frame[off + 5]
+        proto = frame[off + 6]
+        src = bytes(frame[off + 8:off + 24])
+        dst = bytes(frame[off + 24:off + 40])
+        # 0 for jumbograms and TSO, as for IPv4
+        end = size if payload_len == 0 else min(size, off + 40 + payload_len)
+        off += 40
+        while off + 8 <= end:
+            if proto in _IPV6_EXT_HEADERS:
+                proto, length = frame[off], (frame[off + 1] + 1) * 8
+            elif proto == 44:  # Fragment
+                return None
+            elif proto == 51:  # Authentication header
+                proto, length = frame[off], (frame[off + 1] + 2) * 4
+            else:
+                break
+            off += length
+    else:
+        return None
+
+    if proto == PROTO_TCP:
+        if end < off + 20:
+            return None
+        sport, dport, seq = struct.unpack_from('!HHI', frame, off)
+        data_off = (frame[off + 12] >> 4) * 4
+        flags = frame[off + 13]
+        return Segment(ts, proto, src, sport, dst, dport, seq, flags,
+                       frame[off + data_off:end])
+    if proto == PROTO_UDP:
+        if end < off + 8:
+            return None
+        sport, dport, length = struct.unpack_from('!HHH', frame, off)
+        return Segment(ts, proto, src, sport, dst, dport, 0, 0,
+                       frame[off + 8:min(end, off + length)])
+    return None
+
+
+def iter_segments(path):
+    """Yield a :class:`Segment` for every TCP/UDP packet in ``path``."""
+    for ts, linktype, frame in iter_packets(path):
+        segment = parse_frame(ts, linktype, frame)
+        if segment is not None:
+            yield segment
+
+
+def tcp_payloads(path):
+    """Yield non-empty TCP payloads in frame order as memoryviews."""
+    for segment in iter_segments(path):
+        if segment.proto == PROTO_TCP and segment.payload:
+            yield segment.payload
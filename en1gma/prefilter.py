@@ -0,0 +1,181 @@
+"""Skip flows that cannot hold carvable plaintext.
+
+Scanning TLS or SSH traffic for signatures is wasted work that only finds
+false positives: two-byte headers like MP3's and BMP's turn up every few
+kilobytes of random bytes. :class:`EncryptedFlowFilter` sits between
+reassembly and carving and holds back the first bytes of each direction of
+a flow until it can tell. A TLS handshake, an SSH banner or a QUIC long
+header marks the whole flow as encrypted. A direction whose first
+:data:`SAMPLE_SIZE` bytes look uniformly random is dropped as well, unless
+it starts with text or holds the start of a file of any known type. That
+includes types not being carved: a compressed file of such a type looks
+just as random, and dropping its direction would lose the files after it.
+"""
+import re
+from collections import Counter
+
+from .resolvers import NEED_MORE
+from .scanner import SignatureScanner
+from .signatures import FILE_TYPES
+
+# Bytes of each direction looked at before it is let through
+SAMPLE_SIZE = 8192
+# Fewer bytes than this cannot be told apart from random
+MIN_RANDOM_SAMPLE = 2048
+# Chi-square of the byte counts (255 degrees of freedom) under which a
+# sample counts as random; random bytes stay under it 999 times in 1000,
+# text and most file framing land far above it
+RANDOM_CHI2 = 330.0
+# A direction whose first bytes are printable speaks a text protocol
+TEXT_PREFIX = 16
+# Headers shorter than this turn up in random bytes too often to go by
+# unless the type's size resolver accepts what follows them
+MIN_HEADER = 3
+
+_TEXT = re.compile(rb'[\t\n\r\x20-\x7e]{%d}' % TEXT_PREFIX)
+_QUIC_VERSIONS = (b'\x00\x00\x00\x01', b'\x6b\x33\x43\xcf')
+
+
+def encrypted_protocol(data):
+    """Name the encrypted protocol a direction's first bytes open, or None."""
+    if len(data) >= 6 and data[0] == 0x16 and data[1] == 3 and data[2] <= 4 and data[5] in (1, 2):
+        return 'tls'  # Handshake record carrying a ClientHello or ServerHello
+    if data[:4] == b'SSH-':
+        return 'ssh'
+    if len(data) >= 5 and data[0] & 0xC0 == 0xC0 and bytes(data[1:5]) in _QUIC_VERSIONS:
+        return 'quic'
+    return None
+
+
+def holds_file(scanner, data):
+    """Whether ``data`` contains a plausible start of a file of the scanner's types."""
+    for start, exts in scanner.scan(data, 0, len(data)):
+        for ext in exts:
+            spec = scanner.file_types[ext]
+            if 'size' in spec:
+                try:
+                    size = spec['size'](data, start, {}, False)
+                except Exception:
+                    continue  # Not a file the carver would take either
+                if size == NEED_MORE or size:
+                    return True
+            elif len(spec['header']) >= MIN_HEADER:
+                return True
+    return False
+
+
+def looks_random(data):
+    """Whether the byte counts of ``data`` pass for uniformly random."""
+    if len(data) < MIN_RANDOM_SAMPLE:
+        return False
+    expected = len(data) / 256
+    counts = Counter(data)
+    chi2 = sum((counts.get(byte, 0) - expected) ** 2 for byte in range(256)) / expected
+    return chi2 < RANDOM_CHI2
+
+
+class EncryptedFlowFilter:
+    """Drop the chunks of encrypted flows before they reach a carver.
+
+    :meth:`feed` takes reassembled chunks and returns the ones to carve,
+    with a direction's first chunks held back until it has been judged.
+    ``file_types`` are the types whose headers spare a random-looking
+    direction, every known type by default. With a
+    :class:`~en1gma.stats.Stats`, skipped flows and bytes are counted per
+    reason (``tls``, ``ssh``, ``quic`` or ``random``).
+    """
+
+    def __init__(self, file_types=None, stats=None):
+        self.scanner = SignatureScanner(file_types if file_types is not None else FILE_TYPES)
+        self.stats = stats
+        self.pending = {}
+        self.passed = set()
+        # Keyed by stream for a whole flow, (stream, direction) for one side
+        self.skipped = {}
+
+    def feed(self, chunk):
+        stream, direction, data = chunk
+        if stream is None:
+            # A tick from a live source: judge what is held so nothing waits
+            out = []
+            for key in list(self.pending):
+                out.extend(self._judge(key))
+            out.append(chunk)
+            return out
+        if data is None:
+            out = []
+            for key in ((stream, 0), (stream, 1)):
+                if key in self.pending:
+                    out.extend(self._judge(key))
+            carved = (stream, 0) in self.passed or (stream, 1) in self.passed
+            for key in (stream, (stream, 0), (stream, 1)):
+                self.passed.discard(key)
+                self.skipped.pop(key, None)
+            if carved:
+                out.append(chunk)
+            return out
+
+        key = (stream, direction)
+        if key in self.passed:
+            return [chunk]
+        reason = self.skipped.get(stream) or self.skipped.get(key)
+        if reason is not None:
+            if self.stats is not None:
+                self.stats.count('bytes_skipped', reason, n=len(data))
+            return []
+        held = self.pending.get(key)
+        if held is None:
+            held = self.pending[key] = [[], 0]
+        held[0].append(chunk)
+        held[1] += len(data)
+        if held[1] >= SAMPLE_SIZE:
+            return self._judge(key)
+        if held[1] >= TEXT_PREFIX > held[1] - len(data):
+            return self._judge(key, early=True)
+        return []
+
+    def flush(self):
+        """Let go of everything still held, e.g. at the end of the input."""
+        out = []
+        for key in list(self.pending):
+            out.extend(self._judge(key))
+        return out
+
+    def _judge(self, key, early=False):
+        """Decide on a held direction; returns the chunks to pass on.
+
+        ``early`` is a first look at its opening bytes, which only settles
+        known protocols and text; otherwise the direction keeps waiting.
+        """
+        chunks, size = self.pending[key]
+        parts = []
+        need = SAMPLE_SIZE
+        for chunk in chunks:
+            parts.append(chunk.data[:need])
+            need -= len(parts[-1])
+            if need <= 0:
+                break
+        sample = b''.join(parts)
+        reason = encrypted_protocol(sample)
+        if reason is not None:
+            self.skipped[key[0]] = reason
+        elif _TEXT.match(sample):
+            pass
+        elif early:
+            return []
+        elif looks_random(sample) and not holds_file(self.scanner, sample):
+            reason = self.skipped[key] = 'random'
+        del self.pending[key]
+        if reason is None:
+            self.passed.add(key)
+            return chunks
+        if self.stats is not None:
+            self.stats.count('flows_skipped', reason)
+            self.stats.count('bytes_skipped', reason, n=size)
+        # The other side of an encrypted flow goes too
+        other = (key[0], 1 - key[1])
+        if key[0] in self.skipped and other in self.pending:
+            if self.stats is not None:
+                self.stats.count('bytes_skipped', reason, n=self.pending[other][1])
+            del self.pending[other]
+        return []
@@ -0,0 +1,258 @@
+"""TCP stream reassembly.
+
+Segments are grouped into flows by their 4-tuple and each direction is put
+back into sequence order, with retransmitted and overlapping bytes dropped.
+The output is a series of :class:`Chunk` records; a chunk with ``data`` set
+to None marks the end of a flow.
+
+Live sources also pass :class:`Tick` marks in with the segments. Each one
+expires flows that have been idle for longer than ``idle_timeout`` and comes
+out as :data:`TICK`, a chunk with ``stream`` set to None, which tells the
+carvers to hand over whatever they have finished.
+
+UDP segments, when fed, make flows of their own: each datagram's payload is
+passed on in arrival order, and a UDP flow ends once it has been quiet for
+:data:`UDP_IDLE_TIMEOUT` seconds. A :class:`~en1gma.filters.CaptureFilter`
+drops the flows and packets it does not select before anything is buffered.
+"""
+import heapq
+from collections import OrderedDict, namedtuple
+
+from .pcap_reader import PROTO_UDP
+
+TCP_FIN = 0x01
+TCP_SYN = 0x02
+TCP_RST = 0x04
+
+# Out-of-order bytes held per direction before a hole is given up on
+DEFAULT_MAX_PENDING = 4 * 1024 * 1024
+
+# Seconds a live flow may go without a segment before it is closed
+DEFAULT_IDLE_TIMEOUT = 120.0
+# UDP has no end of flow; a quiet one is taken to be over
+UDP_IDLE_TIMEOUT = 60.0
+# Flows that ended with FIN+FIN or RST remembered, so the last ACK or a
+# retransmission after the end is not taken for a new flow
+MAX_CLOSED = 65536
+
+Chunk = namedtuple('Chunk', 'stream direction data')
+# The capture clock of a live source, passed along when no packet is
+Tick = namedtuple('Tick', 'ts')
+TICK = Chunk(None, None, None)
+
+
+class _Half:
+    """One direction of a flow."""
+    __slots__ = ('isn', 'next', 'pending', 'pending_bytes', 'fin_at', 'serial')
+
+    def __init__(self):
+        self.isn = None
+        self.next = 0
+        self.pending = []
+        self.pending_bytes = 0
+        self.fin_at = None
+        self.serial = 0
+
+    @property
+    def done(self):
+        return self.fin_at is not None and self.next >= self.fin_at
+
+    def relative(self, seq):
+        """Map a raw sequence number to a stream offset, across wraparound."""
+        delta = (seq - self.isn - self.next) & 0xFFFFFFFF
+        if delta >= 0x80000000:
+            delta -= 0x100000000
+        return self.next + delta
+
+    def push(self, rel, data):
+        self.serial += 1
+        heapq.heappush(self.pending, (rel, self.serial, data))
+        self.pending_bytes += len(data)
+
+    def drain(self, skip_gaps=False):
+        """Pop every pending segment that is now contiguous."""
+        out = []
+        while self.pending and (skip_gaps or self.pending[0][0] <= self.next):
+            rel, _, data = heapq.heappop(self.pending)
+            self.pending_bytes -= len(data)
+            end = rel + len(data)
+            if end <= self.next:
+                continue
+            if rel > self.next:
+                self.next = rel  # Lost bytes; carry on after the hole
+            out.append(data[self.next - rel:])
+            self.next = end
+        return out
+
+
+class _Flow:
+    __slots__ = ('stream', 'key', 'halves', 'last', 'ends')
+
+    def __init__(self, stream, key, selected=True):
+        self.stream = stream
+        self.key = key
+        # A flow the filter dropped only tracks FIN/RST, to know when it ends
+        self.halves = (_Half(), _Half()) if selected else None
+        self.last = 0.0
+        self.ends = 0
+
+
+class TcpReassembler:
+    """Reorder TCP segments into per-flow, per-direction byte streams.
+
+    Flows are numbered in order of first appearance, like tshark's
+    ``tcp.stream``. Direction 0 is whichever side sent the first segment
+    seen for the flow. With ``idle_timeout``, flows are kept in order of
+    their last segment so :meth:`expire` can close the idle ones cheaply.
+    Flows ``capture_filter`` does not select are numbered all the same, so
+    stream numbers do not depend on the filter. As in tshark, a segment on
+    the address/port pair of a flow that has just ended opens a new flow
+    only if it is a SYN; anything else is a straggler of the old one.
+    """
+
+    def __init__(self, max_pending=DEFAULT_MAX_PENDING, idle_timeout=None, capture_filter=None):
+        self.max_pending = max_pending
+        self.idle_timeout = idle_timeout
+        self.flows = OrderedDict() if idle_timeout else {}
+        self.udp_flows = OrderedDict()
+        self.closed = OrderedDict()
+        self.next_stream = 0
+        self.filter = capture_filter if capture_filter and capture_filter.selects_flows else None
+
+    def _flow(self, flows, seg, endpoint, peer, key):
+        """Find or number the flow a segment belongs to."""
+        flow = flows.get(key)
+        if flow is None:
+            stream = self.next_stream
+            self.next_stream += 1
+            selected = self.filter is None or self.filter.flow(stream, seg)
+            flow = flows[key] = _Flow(stream, (endpoint, peer), selected)
+        elif flows is self.udp_flows or self.idle_timeout:
+            flows.move_to_end(key)
+        flow.last = seg.ts
+        return flow
+
+    def feed(self, seg):
+        """Add one segment; returns a list of chunks that became ready."""
+        endpoint = (seg.src, seg.sport)
+        peer = (seg.dst, seg.dport)
+        key = (endpoint, peer) if endpoint <= peer else (peer, endpoint)
+        if seg.proto == PROTO_UDP:
+            return self._feed_udp(seg, endpoint, peer, key)
+        if key in self.closed and key not in self.flows:
+            if not seg.flags & TCP_SYN:
+                return []
+            del self.closed[key]
+        flow = self._flow(self.flows, seg, endpoint, peer, key)
+        direction = 0 if flow.key[0] == endpoint else 1
+        if flow.halves is None:
+            if seg.flags & TCP_FIN:
+                flow.ends |= 1 << direction
+            if seg.flags & TCP_RST or flow.ends == 3:
+                del self.flows[key]
+                self._remember(key)
+            return []
+        half = flow.halves[direction]
+
+        if half.isn is None:
+            half.isn = (seg.seq + 1) & 0xFFFFFFFF if seg.flags & TCP_SYN else seg.seq
+        rel = half.relative(seg.seq)
+        if seg.flags & TCP_SYN:
+            rel += 1
+
+        out = []
+        data = seg.payload
+        if data and self.filter is not None and not self.filter.packet(seg.ts):
+            # Outside the time range: step over the bytes as if they were lost
+            if rel <= half.next < rel + len(data):
+                half.next = rel + len(data)
+                out.extend(half.drain())
+            data = b''
+        if data:
+            if rel <= half.next < rel + len(data):
+                out.append(data[half.next - rel:])
+                half.next = rel + len(data)
+                out.extend(half.drain())
+            elif rel > half.next:
+                half.push(rel, data)
+                if half.pending_bytes > self.max_pending:
+                    out.extend(half.drain(skip_gaps=True))
+        chunks = [Chunk(flow.stream, direction, piece) for piece in out]
+
+        if seg.flags & TCP_FIN and half.fin_at is None:
+            half.fin_at = rel + len(seg.payload)
+        if seg.flags & TCP_RST or all(h.done for h in flow.halves):
+            chunks.extend(self._close(key))
+            self._remember(key)
+        return chunks
+
+    def _remember(self, key):
+        self.closed[key] = None
+        if len(self.closed) > MAX_CLOSED:
+            self.closed.popitem(last=False)
+
+    def _feed_udp(self, seg, endpoint, peer, key):
+        chunks = self._expire_udp(seg.ts)
+        flow = self._flow(self.udp_flows, seg, endpoint, peer, key)
+        if flow.halves is not None and seg.payload and (self.filter is None or self.filter.packet(seg.ts)):
+            chunks.append(Chunk(flow.stream, 0 if flow.key[0] == endpoint else 1, seg.payload))
+        return chunks
+
+    def _expire_udp(self, now):
+        chunks = []
+        cutoff = now - UDP_IDLE_TIMEOUT
+        while self.udp_flows:
+            key, flow = next(iter(self.udp_flows.items()))
+            if flow.last >= cutoff:
+                break
+            del self.udp_flows[key]
+            if flow.halves is not None:
+                chunks.append(Chunk(flow.stream, None, None))
+        return chunks
+
+    def expire(self, now):
+        """Close flows with no segment since ``now - idle_timeout``."""
+        chunks = self._expire_udp(now)
+        if not self.idle_timeout:
+            return chunks
+        cutoff = now - self.idle_timeout
+        while self.flows:
+            key, flow = next(iter(self.flows.items()))
+            if flow.last >= cutoff:
+                break
+            chunks.extend(self._close(key))
+        return chunks
+
+    def flush(self):
+        """Close every open flow, e.g. at the end of the capture."""
+        chunks = []
+        for key in list(self.flows):
+            chunks.extend(self._close(key))
+        for flow in self.udp_flows.values():
+            if flow.halves is not None:
+                chunks.append(Chunk(flow.stream, None, None))
+        self.udp_flows.clear()
+        return chunks
+
+    def _close(self, key):
+        flow = self.flows.pop(key)
+        chunks = []
+        if flow.halves is None:
+            return chunks
+        for direction, half in enumerate(flow.halves):
+            chunks.extend(Chunk(flow.stream, direction, piece)
+                          for piece in half.drain(skip_gaps=True))
+        chunks.append(Chunk(flow.stream, None, None))
+        return chunks
+
+
+def reassemble(segments, **kwargs):
+    """Yield ordered stream chunks for an iterable of TCP/UDP segments (and ticks)."""
+    reassembler = TcpReassembler(**kwargs)
+    for seg in segments:
+        if type(seg) is Tick:
+            yield from reassembler.expire(seg.ts)
+            yield TICK
+            continue
+        yield from reassembler.feed(seg)
+    yield from reassembler.flush()
@@ -0,0 +1,501 @@
+"""Size resolvers for formats without a footer.
+
+A resolver reads a candidate's length from the file's own structure so the
+carve stops exactly where the file does. It is called as
+``resolver(buf, start, state, eof)`` where candidate byte ``i`` is
+``buf[start + i]`` and everything up to ``len(buf)`` has arrived. It returns
+the file length, None when the bytes are not a valid file, or ``NEED_MORE``
+when it cannot tell yet. ``state`` is a per-candidate dict that persists
+between calls, so parsing resumes where it stopped instead of starting over
+each time more data arrives. A resolver that has to wait for a table it
+reads but already knows how long the file is at least stores that as
+``state['least']``: the carver drops a candidate bound to run past its
+type's ``max_size`` then, without holding its bytes first.
+"""
+import struct
+import zlib
+
+NEED_MORE = -1
+
+_BMP_DIB_SIZES = (12, 40, 52, 56, 64, 108, 124)
+
+
+def bmp_size(buf, start, state, eof):
+    """BITMAPFILEHEADER: total file size at offset 2."""
+    if start + 26 > len(buf):
+        return None if eof else NEED_MORE
+    size, reserved, pixel_offset, dib_size = struct.unpack_from('<IIII', buf, start + 2)
+    if reserved or dib_size not in _BMP_DIB_SIZES or not 14 + dib_size <= pixel_offset <= size:
+        return None
+    return size
+
+
+def riff_sizer(form_type):
+    """RIFF container: chunk size at offset 4 plus the 8-byte chunk header."""
+    def riff_size(buf, start, state, eof):
+        if start + 12 > len(buf):
+            return None if eof else NEED_MORE
+        size, form = struct.unpack_from('<I4s', buf, start + 4)
+        if form != form_type or size < 4:
+            return None
+        return size + 8
+    return riff_size
+
+
+def zip_size(buf, start, state, eof):
+    """Find the end-of-central-directory record that belongs to this archive."""
+    pos = state.get('pos', 4)
+    while True:
+        eocd = buf.find(b'PK\x05\x06', start + pos)
+        if eocd == -1 or eocd + 22 > len(buf):
+            # Resume just before the unsearched tail next time
+            state['pos'] = max(pos, len(buf) - start - 21) if eocd == -1 else eocd - start
+            return None if eof else NEED_MORE
+        disk, cd_size, cd_offset, comment_len = struct.unpack_from('<H6xIIH', buf, eocd + 4)
+        pos = eocd - start
+        # The central directory must end right where the record starts;
+        # this skips records of archives stored inside this one
+        if disk == 0 and (cd_offset + cd_size == pos or cd_offset == 0xFFFFFFFF):
+            return pos + 22 + comment_len
+        pos += 1
+
+
+MP4_BOXES = {
+    b'ftyp', b'moov', b'mdat', b'free', b'skip', b'wide', b'udta', b'uuid',
+    b'meta', b'moof', b'mfra', b'sidx', b'styp', b'pdin', b'emsg', b'prft',
+    b'ssix', b'junk', b'pnot',
+}
+
+
+def mp4_size(buf, start, state, eof):
+    """Walk top-level boxes until something that is not a box follows."""
+    pos = state.get('pos', 0)
+    while True:
+        i = start + pos
+        header = 16 if i + 4 <= len(buf) and buf[i:i + 4] == b'\x00\x00\x00\x01' else 8
+        if i + header > len(buf):
+            if eof:
+                return pos or None
+            state['pos'] = pos
+            return NEED_MORE
+        size, kind = struct.unpack_from('>I4s', buf, i)
+        if kind not in MP4_BOXES or (pos == 0 and kind != b'ftyp'):
+            return pos or None
+        if size == 1:
+            size = struct.unpack_from('>Q', buf, i + 8)[0]
+        elif size == 0:
+            # Last box runs to the end of the file
+            if eof:
+                return len(buf) - start
+            state['pos'] = pos
+            return NEED_MORE
+        if size < header:
+            return pos or None
+        pos += size
+
+
+_MP3_BITRATES = {
+    3: (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    2: (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+_MP3_SAMPLE_RATES = {3: (44100, 48000, 32000), 2: (22050, 24000, 16000), 0: (11025, 12000, 8000)}
+# Frames in a row needed before a run is accepted as MP3
+MP3_MIN_FRAMES = 3
+
+
+def _mp3_frame_length(b1, b2):
+    """Length of a Layer III frame from header bytes 1 and 2, or 0."""
+    version = (b1 >> 3) & 3
+    if (b1 >> 1) & 3 != 1 or version == 1:
+        return 0
+    bitrate_index = b2 >> 4
+    rate_index = (b2 >> 2) & 3
+    if bitrate_index in (0, 15) or rate_index == 3:
+        return 0
+    bitrate = _MP3_BITRATES[3 if version == 3 else 2][bitrate_index] * 1000
+    rate = _MP3_SAMPLE_RATES[version][rate_index]
+    return (144 if version == 3 else 72) * bitrate // rate + ((b2 >> 1) & 1)
+
+
+def mp3_size(buf, start, state, eof):
+    """Walk consecutive MPEG audio frames, plus a trailing ID3v1 tag."""
+    if start + 3 > len(buf):
+        return None if eof else NEED_MORE
+    # Later frames must keep the first frame's version, layer and rate
+    stream_id = (buf[start + 1] & 0xFE, buf[start + 2] & 0x0C)
+    pos, last, frames = state.get('walk', (0, 0, 0))
+    while True:
+        i = start + pos
+        if i + 4 > len(buf):
+            if not eof:
+                state['walk'] = (pos, last, frames)
+                return NEED_MORE
+            if i > len(buf):
+                pos, frames = last, frames - 1  # Drop the cut-off last frame
+            break
+        if buf[i] != 0xFF or (buf[i + 1] & 0xFE, buf[i + 2] & 0x0C) != stream_id:
+            break
+        length = _mp3_frame_length(buf[i + 1], buf[i + 2])
+        if not length:
+            break
+        last = pos
+        pos += length
+        frames += 1
+
+    if frames < MP3_MIN_FRAMES:
+        return None
+    i = start + pos
+    if buf[i:i + 3] == b'TAG' and (i + 128 <= len(buf) or not eof):
+        pos += 128
+    return pos
+
+
+# Compressed bytes handed to zlib per step, and the output cap per call
+_GZIP_STEP = 64 * 1024
+_GZIP_OUT = 256 * 1024
+
+
+def _gzip_header_length(buf, start):
+    """Length of a gzip member header, None if invalid, NEED_MORE if cut off."""
+    if start + 10 > len(buf):
+        return NEED_MORE
+    method, flags = buf[start + 2], buf[start + 3]
+    if method != 8 or flags & 0xE0:
+        return None
+    pos = start + 10
+    if flags & 0x04:  # FEXTRA
+        if pos + 2 > len(buf):
+            return NEED_MORE
+        pos += 2 + struct.unpack_from('<H', buf, pos)[0]
+    for flag in (0x08, 0x10):  # FNAME, FCOMMENT
+        if flags & flag:
+            end = buf.find(b'\x00', pos)
+            if end == -1:
+                return NEED_MORE
+            pos = end + 1
+    if flags & 0x02:  # FHCRC
+        pos += 2
+    return pos - start if pos <= len(buf) else NEED_MORE
+
+
+def gzip_size(buf, start, state, eof):
+    """Inflate the member to find where it ends and check its CRC/size."""
+    inflater = state.get('inflater')
+    if inflater is None:
+        header = _gzip_header_length(buf, start)
+        if header is None or header == NEED_MORE:
+            return None if eof else header
+        inflater = state['inflater'] = zlib.decompressobj(-zlib.MAX_WBITS)
+        state.update(pos=header, crc=0, size=0)
+
+    pos = state['pos']
+    try:
+        while not inflater.eof and start + pos < len(buf):
+            data = buf[start + pos:start + pos + _GZIP_STEP]
+            out = inflater.decompress(data, _GZIP_OUT)
+            while True:
+                state['crc'] = zlib.crc32(out, state['crc'])
+                state['size'] += len(out)
+                if inflater.eof or not inflater.unconsumed_tail:
+                    break
+                out = inflater.decompress(inflater.unconsumed_tail, _GZIP_OUT)
+            pos += len(data) - len(inflater.unused_data)
+    except zlib.error:
+        return None
+    state['pos'] = pos
+
+    if not inflater.eof or start + pos + 8 > len(buf):
+        return None if eof else NEED_MORE
+    crc, size = struct.unpack_from('<II', buf, start + pos)
+    if crc != state['crc'] or size != state['size'] & 0xFFFFFFFF:
+        return None
+    return pos + 8
+
+
+# RAR 4 block types, marker to end of archive
+_RAR4_BLOCKS = range(0x72, 0x7C)
+
+
+def _vint(buf, pos, end):
+    """A RAR 5 variable-length integer before ``end``; returns (value, next pos),
+    NEED_MORE if it runs into ``end`` or None if it is too long to be one."""
+    value = shift = 0
+    while shift < 70:
+        if pos >= end:
+            return NEED_MORE
+        byte = buf[pos]
+        value |= (byte & 0x7F) << shift
+        pos += 1
+        if not byte & 0x80:
+            return value, pos
+        shift += 7
+    return None
+
+
+def _rar4_block(buf, i):
+    """(length, type) of the RAR 4 block at ``i``; None if it is not one, NEED_MORE if cut off."""
+    if i + 7 > len(buf):
+        return NEED_MORE
+    crc, kind, flags, size = struct.unpack_from('<HBHH', buf, i)
+    if kind not in _RAR4_BLOCKS or size < 7:
+        return None
+    if i + size > len(buf):
+        return NEED_MORE
+    if zlib.crc32(buf[i + 2:i + size]) & 0xFFFF != crc:
+        return None
+    data = 0
+    if flags & 0x8000 or kind == 0x74:
+        # Long block: packed data follows the header
+        if size < 11:
+            return None
+        data = struct.unpack_from('<I', buf, i + 7)[0]
+        if kind == 0x74 and flags & 0x100 and size >= 36:
+            data += struct.unpack_from('<I', buf, i + 32)[0] << 32
+    return size + data, kind
+
+
+def _rar5_fields(buf, pos, end, count):
+    """``count`` vints of a header ending at ``end``; (values, next pos), or None if they run past it."""
+    values = []
+    for _ in range(count):
+        field = _vint(buf, pos, end)
+        if field is None or field == NEED_MORE:
+            return None
+        value, pos = field
+        values.append(value)
+    return values, pos
+
+
+def _rar5_block(buf, i):
+    """(length, type) of the RAR 5 block at ``i``; None if it is not one, NEED_MORE if cut off."""
+    field = _vint(buf, i + 4, len(buf))
+    if field is None or field == NEED_MORE:
+        return field
+    header_size, body = field
+    if not 2 <= header_size <= 2 * 1024 * 1024:
+        return None
+    end = body + header_size
+    if end > len(buf):
+        return NEED_MORE
+    if zlib.crc32(buf[i + 4:end]) != struct.unpack_from('<I', buf, i)[0]:
+        return None
+    # The header is all here, so a field running past its end is malformed
+    fields = _rar5_fields(buf, body, end, 2)
+    if fields is None:
+        return None
+    (kind, flags), pos = fields
+    data = 0
+    if flags & 3:
+        fields = _rar5_fields(buf, pos, end, (flags & 1) + (flags >> 1 & 1))
+        if fields is None:
+            return None
+        if flags & 2:
+            data = fields[0][-1]  # After the extra area size, if any
+    return end - i + data, kind
+
+
+def rar_size(buf, start, state, eof):
+    """Walk RAR 4 or RAR 5 blocks, checking each header CRC, to the end-of-archive block."""
+    if start + 8 > len(buf):
+        return None if eof else NEED_MORE
+    rar5 = buf[start + 6] == 1
+    if buf[start + 6:start + 8 if rar5 else start + 7] != (b'\x01\x00' if rar5 else b'\x00'):
+        return None
+    block, last = (_rar5_block, 5) if rar5 else (_rar4_block, 0x7B)
+    pos, blocks = state.get('walk', (8 if rar5 else 7, 0))
+    while True:
+        found = block(buf, start + pos)
+        if found == NEED_MORE:
+            if eof:
+                return None
+            state['walk'] = (pos, blocks)
+            return NEED_MORE
+        if found is None:
+            # Old archives may lack the end block and stop after their last
+            # good one; without even a main header and one more it is no archive
+            return pos if blocks >= 2 else None
+        length, kind = found
+        pos += length
+        blocks += 1
+        if kind == last:
+            return pos
+
+
+def sevenzip_size(buf, start, state, eof):
+    """Signature header: the next (last) header's offset and size, under a CRC."""
+    if start + 32 > len(buf):
+        return None if eof else NEED_MORE
+    major, crc, next_offset, next_size = struct.unpack_from('<BxIQQ', buf, start + 6)
+    if major != 0 or zlib.crc32(buf[start + 12:start + 32]) != crc or not next_size:
+        return None
+    return 32 + next_offset + next_size
+
+
+def elf_size(buf, start, state, eof):
+    """The furthest end of the ELF header, segments, sections and header tables."""
+    if start + 64 > len(buf):
+        return None if eof else NEED_MORE
+    wide, order, version = buf[start + 4], buf[start + 5], buf[start + 6]
+    if wide not in (1, 2) or order not in (1, 2) or version != 1:
+        return None
+    e = '<' if order == 1 else '>'
+    if wide == 1:
+        kind, _, version, _, phoff, shoff, _, ehsize, phentsize, phnum, shentsize, shnum = \
+            struct.unpack_from(e + 'HHIIIIIHHHHH', buf, start + 16)
+        ph, sh = (e + '4xI8xI', 32), (e + '4xI8xII', 40)
+    else:
+        kind, _, version, _, phoff, shoff, _, ehsize, phentsize, phnum, shentsize, shnum = \
+            struct.unpack_from(e + 'HHIQQQIHHHHH', buf, start + 16)
+        ph, sh = (e + '8xQ16xQ', 56), (e + '4xI16xQQ', 64)
+    if kind not in (1, 2, 3, 4) or version != 1 or ehsize != (52 if wide == 1 else 64):
+        return None
+    if phnum and phentsize != ph[1] or shnum and shentsize != sh[1]:
+        return None
+    end = max(ehsize, phoff + phnum * phentsize, shoff + shnum * shentsize)
+    if start + end > len(buf):
+        # The header tables are not all in yet, but the file reaches past them
+        state['least'] = end
+        return None if eof else NEED_MORE
+    for i in range(phnum):
+        offset, size = struct.unpack_from(ph[0], buf, start + phoff + i * phentsize)
+        end = max(end, offset + size)
+    for i in range(shnum):
+        kind, offset, size = struct.unpack_from(sh[0], buf, start + shoff + i * shentsize)
+        if kind != 8:  # SHT_NOBITS takes no room in the file
+            end = max(end, offset + size)
+    return end
+
+
+def pe_size(buf, start, state, eof):
+    """DOS stub to PE header; the furthest section, or the signature appended after them."""
+    if start + 64 > len(buf):
+        return None if eof else NEED_MORE
+    pe = struct.unpack_from('<I', buf, start + 0x3C)[0]
+    if not 0x40 <= pe <= 0x1000:
+        return None
+    if start + pe + 24 + 96 > len(buf):
+        return None if eof else NEED_MORE
+    if buf[start + pe:start + pe + 4] != b'PE\x00\x00':
+        return None
+    sections, optional_size = struct.unpack_from('<2xH12xH', buf, start + pe + 4)
+    optional = pe + 24
+    magic = struct.unpack_from('<H', buf, start + optional)[0]
+    if magic not in (0x10B, 0x20B) or not 0 < sections <= 96:
+        return None
+    directories = optional + (96 if magic == 0x10B else 112)
+    table = optional + optional_size
+    end = table + sections * 40
+    if directories > table:
+        return None
+    if start + end > len(buf):
+        return None if eof else NEED_MORE
+    end = max(end, struct.unpack_from('<I', buf, start + optional + 60)[0])  # SizeOfHeaders
+    for i in range(sections):
+        size, offset = struct.unpack_from('<II', buf, start + table + i * 40 + 16)
+        if size:
+            end = max(end, offset + size)
+    # The certificate table (directory 4) is the one given as a file offset
+    count = struct.unpack_from('<I', buf, start + directories - 4)[0]
+    if count > 4 and directories + 40 <= table:
+        offset, size = struct.unpack_from('<II', buf, start + directories + 32)
+        if offset and size:
+            end = max(end, offset + size)
+    return end
+
+
+def sqlite_size(buf, start, state, eof):
+    """Page size times the page count, when the header's count is current."""
+    if start + 100 > len(buf):
+        return None if eof else NEED_MORE
+    page_size, write, read, _, payload = struct.unpack_from('>HBBB3s', buf, start + 16)
+    page_size = 65536 if page_size == 1 else page_size
+    if page_size < 512 or page_size & (page_size - 1) or write not in (1, 2) or read not in (1, 2):
+        return None
+    if payload != b'\x40\x20\x20':
+        return None
+    changes, pages = struct.unpack_from('>II', buf, start + 24)
+    if not pages or struct.unpack_from('>I', buf, start + 92)[0] != changes:
+        return None  # Written by a version that did not keep the count
+    return pages * page_size
+
+
+# Bytes per value of each TIFF field type
+_TIFF_TYPES = {1: 1, 2: 1, 3: 2, 4: 4, 5: 8, 6: 1, 7: 1, 8: 2, 9: 4, 10: 8, 11: 4, 12: 8, 13: 4}
+# Strip/tile offsets and their byte counts
+_TIFF_DATA = {273: 279, 324: 325}
+# Tags that point at further IFDs: SubIFDs, Exif, GPS, Interoperability
+_TIFF_IFDS = (330, 34665, 34853, 40965)
+
+
+def _tiff_values(buf, start, e, kind, count, field):
+    """The values of an IFD entry, read in place or at the offset it holds."""
+    code = {3: 'H', 4: 'I', 13: 'I'}.get(kind)
+    if code is None:
+        return ()
+    if count * _TIFF_TYPES[kind] > 4:
+        field = start + struct.unpack_from(e + 'I', buf, field)[0]
+    return struct.unpack_from(f'{e}{count}{code}', buf, field)
+
+
+def tiff_size(buf, start, state, eof):
+    """Walk every IFD; the file ends with the furthest IFD, value or strip/tile."""
+    walk = state.get('walk')
+    if walk is None:
+        if start + 8 > len(buf):
+            return None if eof else NEED_MORE
+        e = '<' if buf[start] == 0x49 else '>'
+        walk = state['walk'] = {'e': e, 'ifds': [struct.unpack_from(e + 'I', buf, start + 4)[0]],
+                                'seen': set(), 'end': 8}
+    # IFDs still to read, and how far the file reaches so far
+    e, ifds, seen, end = walk['e'], walk['ifds'], walk['seen'], walk['end']
+    while ifds:
+        ifd = ifds[-1]
+        if ifd in seen or len(seen) > 1024:
+            ifds.pop()
+            continue
+        if ifd < 8:
+            return None
+        # Only the IFD and the offset arrays it points at are read; values
+        # and strips that have not arrived just move the end
+        needed = ifd + 2
+        if start + needed <= len(buf):
+            count = struct.unpack_from(e + 'H', buf, start + ifd)[0]
+            if not 0 < count <= 4096:
+                return None
+            table_end = needed = ifd + 2 + 12 * count + 4
+        if start + needed <= len(buf):
+            entries = {}
+            reach = table_end
+            for i in range(count):
+                field = start + ifd + 2 + 12 * i
+                tag, kind, n = struct.unpack_from(e + 'HHI', buf, field)
+                if kind not in _TIFF_TYPES:
+                    continue
+                size = n * _TIFF_TYPES[kind]
+                if size > 4:
+                    value_end = struct.unpack_from(e + 'I', buf, field + 8)[0] + size
+                    reach = max(reach, value_end)
+                if tag in _TIFF_DATA or tag in _TIFF_DATA.values() or tag in _TIFF_IFDS:
+                    entries[tag] = (kind, n, field + 8)
+                    if size > 4:
+                        needed = max(needed, value_end)
+        if start + needed > len(buf):
+            if eof:
+                return None
+            walk['end'] = state['least'] = max(end, needed)
+            return NEED_MORE
+        ifds.pop()
+        seen.add(ifd)
+        end = max(end, reach)
+        for tag in _TIFF_IFDS:
+            if tag in entries:
+                ifds.extend(_tiff_values(buf, start, e, *entries[tag]))
+        for offsets, counts in _TIFF_DATA.items():
+            if offsets in entries and counts in entries:
+                pairs = zip(_tiff_values(buf, start, e, *entries[offsets]),
+                            _tiff_values(buf, start, e, *entries[counts]))
+                end = max([end] + [offset + size for offset, size in pairs])
+        following = struct.unpack_from(e + 'I', buf, start + table_end - 4)[0]
+        if following:
+            ifds.append(following)
+    return end
@@ -0,0 +1,99 @@
+"""Single-pass multi-signature scanner."""
+import re
+from functools import lru_cache
+
+
+def _trie_pattern(headers):
+    """A regex for a set of byte strings, factored into a trie.
+
+    ``re`` tries the branches of a flat alternation one by one at every
+    position, so its cost grows with the number of headers; factored by
+    common prefix, each position costs one branch per distinct leading
+    byte. Where one header prefixes another the longer one matches.
+    """
+    trie = {}
+    for header in headers:
+        node = trie
+        for byte in header:
+            node = node.setdefault(byte, {})
+        node[None] = {}
+
+    def branch(node):
+        alternatives = [re.escape(bytes([byte])) + branch(node[byte])
+                        for byte in sorted(byte for byte in node if byte is not None)]
+        if not alternatives:
+            return b''
+        body = alternatives[0] if len(alternatives) == 1 else b'(?:' + b'|'.join(alternatives) + b')'
+        # Greedy: a header that goes on is preferred to one that ends here
+        return b'(?:' + body + b')?' if None in node else body
+
+    return branch(trie)
+
+
+@lru_cache(maxsize=32)
+def _compile(headers):
+    # Every carver, prefilter and worker of a run selects the same headers
+    return re.compile(_trie_pattern(headers))
+
+
+class SignatureScanner:
+    """Find the headers of every selected file type in one pass.
+
+    All distinct headers are compiled into a single trie-shaped pattern, so
+    a buffer is walked once however many types are selected, and types
+    that share a header (ZIP, DOCX and XLSX all start with ``PK\\x03\\x04``)
+    cost nothing extra. A type's ``headers`` are ``(bytes, offset)`` pairs,
+    the offset being where the header sits in the file; a hit is reported
+    at the start of the file. Each hit is dispatched to every type whose
+    header matches there, in ``file_types`` order; picking between them is
+    left to the carver once the candidate's extent is known.
+    """
+
+    def __init__(self, file_types):
+        self.file_types = file_types
+        headers = {}
+        for ext, spec in file_types.items():
+            for header, offset in spec['headers']:
+                headers.setdefault(header, []).append((ext, offset))
+        self.pattern = _compile(tuple(sorted(headers)))
+        order = list(file_types)
+        # Header matched -> ((offset, exts), ...): a match also counts for
+        # every shorter header that prefixes it
+        self.dispatch = {}
+        for header in headers:
+            by_offset = {}
+            for other, hits in headers.items():
+                if header.startswith(other):
+                    for ext, offset in hits:
+                        by_offset.setdefault(offset, set()).add(ext)
+            self.dispatch[header] = tuple((offset, sorted(exts, key=order.index))
+                                          for offset, exts in sorted(by_offset.items()))
+        self.max_header = max((len(h) for h in headers), default=1)
+        # Bytes before a header that belong to its file
+        self.max_offset = max((offset for hits in headers.values() for _, offset in hits), default=0)
+        # Bytes from the start of a file needed to see any of its headers
+        self.max_reach = max((len(h) + offset for h, hits in headers.items() for _, offset in hits), default=1)
+
+    def scan(self, buf, pos, limit):
+        """Yield ``(start, exts)`` for each file whose header starts in [pos, limit).
+
+        ``start`` is where the file begins, before ``pos`` for a header at
+        an offset; files that would begin before the buffer are skipped.
+        """
+        search = self.pattern.search
+        dispatch = self.dispatch
+        while True:
+            match = search(buf, pos)
+            if match is None or match.start() >= limit:
+                return
+            pos = match.start()
+            for offset, exts in dispatch[match.group()]:
+                if pos >= offset:
+                    yield pos - offset, exts
+            # Step one byte at a time so overlapping headers are not skipped
+            pos += 1
+
+    def starts(self, data):
+        """The types ``data`` opens with a header of, in ``file_types`` order."""
+        return [ext for ext, spec in self.file_types.items()
+                if any(data[offset:offset + len(header)] == header for header, offset in spec['headers'])]
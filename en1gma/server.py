@@ -0,0 +1,432 @@
+"""Extraction server for many small jobs, e.g. from automation.
+
+Each run of the command line tool pays for interpreter startup, imports
+and cold caches, which on a small capture can cost more than the
+extraction. :class:`ExtractionServer` pays for them once: it keeps a pool
+of worker processes with the engine imported, the signature tables
+compiled and a payload cache open, and takes jobs over HTTP on a Unix
+socket or on localhost (see :mod:`en1gma.client`).
+
+A job names files to read and a directory to write as the server's user,
+so only that user may submit one. The Unix socket is created readable by
+its owner only and is the safe default. On TCP, which any local user can
+reach, each request must carry a random token that the server writes to a
+file only its owner can read (:func:`en1gma.client.default_token_file`).
+
+``POST /jobs`` takes a JSON object (see :func:`parse_job`) and answers with
+one JSON object per line as the job runs: ``queued``, ``started``,
+``progress``, a ``file`` per carve (with the fields of its manifest
+record), and last ``done`` or ``error``. Up to ``workers`` jobs run at once
+and ``max_queue`` more wait; past that a job is refused with a 503.
+``GET /status`` reports the counts. Jobs writing into the same output
+directory run one after the other.
+"""
+import hmac
+import json
+import multiprocessing
+import os
+import queue
+import secrets
+import signal
+import socket
+import socketserver
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from .cache import PayloadCache
+from .client import default_token_file
+from .deepcheck import DEEP_CHECKS
+from .engine import Progress, extract
+from .filters import CaptureFilter, parse_time
+from .ingest import READERS
+from .scanner import SignatureScanner
+from .signatures import FILE_TYPES, select_types
+from .sinks import SINKS
+
+DEFAULT_MAX_QUEUE = 32
+
+# The fields of a job and their defaults
+JOB_FIELDS = {
+    'capture': None, 'output': "extracted_files", 'types': None, 'categories': None, 'reader': "auto", 'manifest': None,
+    'dedup': True, 'http': True, 'scan_encrypted': False, 'output_format': "files", 'deep_check': "off",
+    'hosts': [], 'ports': [], 'start': None, 'end': None, 'streams': [], 'display_filter': None, 'udp': False,
+}
+
+
+class QueueFull(Exception):
+    """More jobs are waiting than the server takes."""
+
+
+def _choice(job, field, choices):
+    if job[field] not in choices:
+        raise ValueError(f"'{field}' must be one of {', '.join(choices)}")
+    return job[field]
+
+
+def parse_job(request):
+    """Check a job request; returns ``(capture, output_dir, options)`` for :func:`extract`.
+
+    ``capture`` names a capture file on this host; ``types`` and
+    ``categories`` list file types and categories of them (all types if
+    both are null); ``start`` and ``end`` take what ``--start`` does.
+    The other fields match the command line options of the same names.
+    Raises ValueError (or TypeError) for anything malformed.
+    """
+    if not isinstance(request, dict):
+        raise ValueError("a job is a JSON object")
+    unknown = set(request) - set(JOB_FIELDS)
+    if unknown:
+        raise ValueError(f"unknown job fields: {', '.join(sorted(unknown))}")
+    job = dict(JOB_FIELDS, **request)
+    capture = job['capture']
+    if not isinstance(capture, str) or not os.path.isfile(capture):
+        raise ValueError(f"no such capture file: {capture!r}")
+    types = None
+    if job['types'] is not None or job['categories'] is not None:
+        for field in ('types', 'categories'):
+            if job[field] is not None and not (isinstance(job[field], list)
+                                               and all(isinstance(name, str) for name in job[field])):
+                raise ValueError(f"'{field}' must be a list of names")
+        types = select_types(job['types'], job['categories'])
+        if not types:
+            raise ValueError("no file types selected")
+    start = parse_time(str(job['start'])) if job['start'] is not None else None
+    end = parse_time(str(job['end'])) if job['end'] is not None else None
+    capture_filter = CaptureFilter(job['hosts'], job['ports'], start, end, job['streams'],
+                                   job['display_filter'], bool(job['udp']))
+    options = {
+        'selected_types': types,
+        'reader': _choice(job, 'reader', READERS),
+        'manifest_path': job['manifest'],
+        'dedup': bool(job['dedup']),
+        'http': bool(job['http']),
+        'capture_filter': capture_filter or None,
+        'scan_encrypted': bool(job['scan_encrypted']),
+        'output_format': _choice(job, 'output_format', SINKS),
+        'deep_check': _choice(job, 'deep_check', DEEP_CHECKS),
+    }
+    return capture, str(job['output']), options
+
+
+_events = None
+_cache = None
+_max_memory = None
+
+
+def _init_worker(events, cache_options, max_memory):
+    global _events, _cache, _max_memory
+    _events = events
+    _cache = PayloadCache(*cache_options) if cache_options is not None else None
+    _max_memory = max_memory
+    # Ctrl-C reaches the whole process group; the server stops the workers
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # Compile the signature tables now rather than in the first job
+    SignatureScanner(FILE_TYPES)
+
+
+def _warm():
+    return os.getpid()
+
+
+def _run_job(job_id, capture, output_dir, options):
+    """Worker: run one job, sending its events back tagged with ``job_id``."""
+    _events.put((job_id, {'event': 'started'}))
+    start = time.perf_counter()
+    files = duplicates = 0
+    try:
+        for event in extract(capture, output_dir, cache=_cache, max_memory=_max_memory, **options):
+            if isinstance(event, Progress):
+                message = {'event': 'progress', 'done': event.done, 'total': event.total}
+            else:
+                message = {'event': 'file', 'type': event.ext, 'file': event.filename, 'sha256': event.sha256,
+                           'size': event.size, 'stream': event.stream, 'direction': event.direction,
+                           'offset': event.offset, 'duplicate_of': event.duplicate_of}
+                message.update(event.meta or {})
+                if event.duplicate_of:
+                    duplicates += 1
+                else:
+                    files += 1
+            _events.put((job_id, message))
+    except Exception as e:
+        _events.put((job_id, {'event': 'error', 'error': f"{type(e).__name__}: {e}"}))
+        return
+    _events.put((job_id, {'event': 'done', 'files': files, 'duplicates': duplicates,
+                          'seconds': round(time.perf_counter() - start, 3)}))
+
+
+class _Job:
+    __slots__ = ('events', 'running')
+
+    def __init__(self):
+        self.events = queue.Queue()
+        self.running = False
+
+
+class ExtractionServer:
+    """Run jobs on a pool of warm worker processes; see the module docs.
+
+    ``cache_options`` is ``(directory, max_size)`` for each worker's
+    :class:`~en1gma.cache.PayloadCache`, or None for no cache.
+    """
+
+    def __init__(self, workers=1, max_queue=DEFAULT_MAX_QUEUE, cache_options=None, max_memory=None):
+        self.workers = max(workers, 1)
+        self.max_queue = max_queue
+        self.worker_args = (cache_options, max_memory)
+        # Events from every worker, sorted out to their jobs by a thread
+        self.events = multiprocessing.Queue()
+        self.lock = threading.Lock()
+        self.jobs = {}
+        self.next_id = 1
+        self.completed = 0
+        self.failed = 0
+        # Output directory -> [lock, jobs using it]
+        self.outputs = {}
+        self.httpd = None
+        self.socket_path = None
+        self.token = None
+        self.token_path = None
+        self.pool = self._new_pool()
+        self.router = threading.Thread(target=self._route, name="en1gma-router", daemon=True)
+        self.router.start()
+
+    def _new_pool(self):
+        pool = ProcessPoolExecutor(self.workers, initializer=_init_worker,
+                                   initargs=(self.events,) + self.worker_args)
+        # Workers start on demand; start them all now
+        for _ in range(self.workers):
+            pool.submit(_warm)
+        return pool
+
+    def status(self):
+        with self.lock:
+            running = sum(job.running for job in self.jobs.values())
+            return {'workers': self.workers, 'running': running, 'queued': len(self.jobs) - running,
+                    'max_queue': self.max_queue, 'completed': self.completed, 'failed': self.failed}
+
+    def run(self, capture, output_dir, options):
+        """Run a job, yielding its events; raises :class:`QueueFull` if it cannot be taken."""
+        with self.lock:
+            if len(self.jobs) >= self.workers + self.max_queue:
+                raise QueueFull(f"{len(self.jobs)} jobs running or queued")
+            job_id = self.next_id
+            self.next_id += 1
+            position = max(0, len(self.jobs) - self.workers + 1)
+            job = self.jobs[job_id] = _Job()
+            output = self.outputs.setdefault(os.path.abspath(output_dir), [threading.Lock(), 0])
+            output[1] += 1
+        future = None
+        finished = False
+        try:
+            yield {'event': 'queued', 'job': job_id, 'position': position}
+            with output[0]:
+                future = self._submit(job_id, capture, output_dir, options)
+                while not finished:
+                    event = self._next(job)
+                    finished = event['event'] in ('done', 'error')
+                    yield dict(event, job=job_id)
+        finally:
+            # A job whose client went away finishes before its output is
+            # free for the next one
+            if not finished and future is not None and not future.cancel():
+                while self._next(job)['event'] not in ('done', 'error'):
+                    pass
+            with self.lock:
+                del self.jobs[job_id]
+                output[1] -= 1
+                if not output[1]:
+                    del self.outputs[os.path.abspath(output_dir)]
+
+    def _next(self, job):
+        event = job.events.get()
+        with self.lock:
+            self.completed += event['event'] == 'done'
+            self.failed += event['event'] == 'error'
+        return event
+
+    def _submit(self, job_id, capture, output_dir, options):
+        with self.lock:
+            pool = self.pool
+        try:
+            future = pool.submit(_run_job, job_id, capture, output_dir, options)
+        except BrokenProcessPool:
+            pool = self._replace_pool(pool)
+            future = pool.submit(_run_job, job_id, capture, output_dir, options)
+        future.add_done_callback(lambda f: self._settled(job_id, pool, f))
+        return future
+
+    def _replace_pool(self, broken):
+        with self.lock:
+            if self.pool is broken:
+                broken.shutdown(wait=False, cancel_futures=True)
+                self.pool = self._new_pool()
+            return self.pool
+
+    def _settled(self, job_id, pool, future):
+        """A worker died (e.g. killed for memory) without reporting the end of its job."""
+        if future.cancelled() or future.exception() is None:
+            return
+        if isinstance(future.exception(), BrokenProcessPool):
+            self._replace_pool(pool)
+        with self.lock:
+            job = self.jobs.get(job_id)
+        if job is not None:
+            job.events.put({'event': 'error', 'error': "worker process died"})
+
+    def _route(self):
+        while True:
+            item = self.events.get()
+            if item is None:
+                return
+            job_id, event = item
+            with self.lock:
+                job = self.jobs.get(job_id)
+                if job is not None and event['event'] == 'started':
+                    job.running = True
+            if job is not None:
+                job.events.put(event)
+
+    def listen(self, socket_path=None, tcp_port=None, token_path=None):
+        """Bind to a Unix socket, or to ``tcp_port`` on localhost only.
+
+        On TCP a fresh token is written to ``token_path`` (by default
+        :func:`~en1gma.client.default_token_file`) for clients to send.
+        """
+        if tcp_port is not None:
+            httpd = ThreadingHTTPServer(('127.0.0.1', tcp_port), _Handler)
+            try:
+                self._write_token(token_path or default_token_file())
+            except OSError:
+                httpd.server_close()
+                raise
+        else:
+            if os.path.exists(socket_path):
+                probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                try:
+                    probe.connect(socket_path)
+                except OSError:
+                    os.remove(socket_path)  # Left behind by a server that died
+                else:
+                    raise OSError(f"a server is already listening on {socket_path}")
+                finally:
+                    probe.close()
+            # Jobs read and write files as this user; keep other users out,
+            # from the moment the socket exists
+            umask = os.umask(0o077)
+            try:
+                httpd = _UnixHTTPServer(socket_path, _Handler)
+            finally:
+                os.umask(umask)
+            os.chmod(socket_path, 0o600)
+            self.socket_path = socket_path
+        httpd.extraction = self
+        self.httpd = httpd
+
+    def _write_token(self, path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, mode=0o700, exist_ok=True)
+        token = secrets.token_urlsafe(32)
+        # Replace any old file rather than write through it, e.g. a symlink
+        if os.path.lexists(path):
+            os.remove(path)
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            f.write(token + '\n')
+        self.token = token
+        self.token_path = path
+
+    def authorized(self, header):
+        """Whether a request's Authorization header carries the token, if one is needed."""
+        if self.token is None:
+            return True
+        return hmac.compare_digest((header or '').encode(), f"Bearer {self.token}".encode())
+
+    def serve_forever(self):
+        """Take jobs until interrupted (Ctrl-C or SIGTERM), then stop the workers."""
+        signal.signal(signal.SIGTERM, signal.default_int_handler)
+        try:
+            self.httpd.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.close()
+
+    def close(self):
+        if self.httpd is not None:
+            self.httpd.server_close()
+            if self.socket_path is not None and os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+            if self.token_path is not None and os.path.exists(self.token_path):
+                os.remove(self.token_path)
+        self.pool.shutdown(wait=True, cancel_futures=True)
+        self.events.put(None)
+        self.router.join()
+
+
+class _UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server_version = "en1gma"
+
+    def address_string(self):
+        # Unix socket peers have no address
+        return self.client_address[0] if isinstance(self.client_address, tuple) else "local"
+
+    def _reply(self, code, body):
+        data = json.dumps(body).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _allowed(self):
+        if self.server.extraction.authorized(self.headers.get('Authorization')):
+            return True
+        self._reply(401, {'error': "missing or wrong token"})
+        return False
+
+    def do_GET(self):
+        if not self._allowed():
+            return
+        if self.path != '/status':
+            self._reply(404, {'error': "not found"})
+            return
+        self._reply(200, self.server.extraction.status())
+
+    def do_POST(self):
+        if not self._allowed():
+            return
+        if self.path != '/jobs':
+            self._reply(404, {'error': "not found"})
+            return
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+            capture, output_dir, options = parse_job(json.loads(self.rfile.read(length) or b'null'))
+        except (ValueError, TypeError) as e:
+            self._reply(400, {'error': str(e)})
+            return
+        events = self.server.extraction.run(capture, output_dir, options)
+        try:
+            first = next(events)
+        except QueueFull as e:
+            self._reply(503, {'error': str(e)})
+            return
+        # Streamed until the connection closes, one event per line
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.end_headers()
+        try:
+            self.wfile.write(json.dumps(first).encode() + b'\n')
+            for event in events:
+                self.wfile.write(json.dumps(event).encode() + b'\n')
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            events.close()
@@ -0,0 +1,229 @@
+"""File type signatures shared by the CLI and GUI.
+
+The built-in types are defined in ``signatures.json`` next to this module;
+more can be added, or built-ins redefined, in JSON files of the same shape
+in ``$XDG_CONFIG_HOME/en1gma/signatures/`` (``~/.config`` by default), in
+the files listed in ``EN1GMA_SIGNATURES`` (separated like ``PATH``), or
+with :func:`add_signature_files`. Later definitions replace earlier ones of
+the same name. A definition file maps each type's name, which is also the
+extension of its carves, to::
+
+    {
+        "category": "archives",
+        "description": "RAR archive",
+        "headers": ["52617221", {"text": "Rar!", "offset": 0}],
+        "footer": "ffd9",
+        "max_size": "64M",
+        "size": "rar_size",
+        "validate": "rar_valid",
+        "verify": "mymodule:rar_verify"
+    }
+
+Headers and the footer are hex strings, or objects giving ``hex`` or
+``text`` and an ``offset`` into the file at which the header sits. Formats
+without a footer name a ``size`` resolver (see :mod:`en1gma.resolvers`)
+that reads the file's length from its structure. ``validate`` is a cheap
+structural check run on every carve and ``verify`` an optional deep check
+run in worker processes when asked for (see :mod:`en1gma.validators`).
+Functions are named in those modules or as ``module:function``; a factory
+is called as ``{"function": "riff_sizer", "args": ["WEBP"]}``, string
+arguments being passed as bytes. ``max_size`` caps a carve of the type; a
+candidate whose end is not found within it is abandoned.
+
+Definitions are compiled into :data:`FILE_TYPES` once, at import; the
+scanner compiles the headers of a selection into one pattern, also once
+per process (see :mod:`en1gma.scanner`).
+"""
+import importlib
+import json
+import os
+import re
+
+from . import resolvers, validators
+
+MB = 1024 * 1024
+
+# Environment variable listing extra definition files; it is also how
+# worker processes learn of files added with add_signature_files
+ENV_VAR = 'EN1GMA_SIGNATURES'
+
+BUILTIN_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'signatures.json')
+
+_SIZE_UNITS = {'K': 1024, 'M': MB, 'G': 1024 * MB}
+# Type names double as the extension of carved files
+_NAME = re.compile(r'[a-z0-9_]+')
+_FIELDS = frozenset(('category', 'description', 'headers', 'footer', 'max_size', 'size', 'validate', 'verify'))
+
+
+class SignatureError(ValueError):
+    """A signature definition file could not be read or compiled."""
+
+
+def user_signature_dir():
+    """The per-user directory of definition files."""
+    config = os.environ.get('XDG_CONFIG_HOME') or os.path.join(os.path.expanduser('~'), '.config')
+    return os.path.join(config, 'en1gma', 'signatures')
+
+
+def _pattern(value, what):
+    """Compile a header or footer definition to (bytes, offset)."""
+    if isinstance(value, str):
+        value = {'hex': value}
+    if not isinstance(value, dict) or ('hex' in value) == ('text' in value):
+        raise SignatureError(f"{what} must be a hex string or an object with 'hex' or 'text'")
+    try:
+        if 'hex' in value:
+            pattern = bytes.fromhex(value['hex'])
+        else:
+            pattern = value['text'].encode('latin-1')
+    except (TypeError, ValueError, AttributeError) as e:
+        raise SignatureError(f"{what}: {e}")
+    offset = value.get('offset', 0)
+    if not pattern or not isinstance(offset, int) or offset < 0:
+        raise SignatureError(f"{what} must be non-empty at an offset >= 0")
+    return pattern, offset
+
+
+def _size(value, what):
+    if isinstance(value, int) and value > 0:
+        return value
+    if isinstance(value, str) and value[-1:].upper() in _SIZE_UNITS and value[:-1].isdigit():
+        return int(value[:-1]) * _SIZE_UNITS[value[-1].upper()]
+    raise SignatureError(f"{what} must be a byte count or a size like '64M'")
+
+
+def _function(value, module, what):
+    """Look up a function by name, calling it when given as a factory."""
+    args = []
+    if isinstance(value, dict):
+        args = [arg.encode('latin-1') if isinstance(arg, str) else arg for arg in value.get('args', [])]
+        value = value.get('function')
+    if not isinstance(value, str):
+        raise SignatureError(f"{what} must name a function")
+    name = value
+    if ':' in value:
+        module_name, name = value.split(':', 1)
+        try:
+            module = importlib.import_module(module_name)
+        except ImportError as e:
+            raise SignatureError(f"{what}: {e}")
+    function = getattr(module, name, None)
+    if not callable(function):
+        raise SignatureError(f"{what}: no function {value!r}")
+    return function(*args) if args else function
+
+
+def compile_definition(name, definition):
+    """Turn one definition into the spec the scanner and carvers use."""
+    if not isinstance(definition, dict):
+        raise SignatureError(f"{name}: definition must be an object")
+    unknown = set(definition) - _FIELDS
+    if unknown:
+        raise SignatureError(f"{name}: unknown fields {', '.join(sorted(unknown))}")
+    headers = definition.get('headers')
+    if not isinstance(headers, list) or not headers:
+        raise SignatureError(f"{name}: 'headers' must be a non-empty list")
+    spec = {
+        'headers': [_pattern(header, f"{name}: header") for header in headers],
+        'footer': None,
+        'max_size': _size(definition.get('max_size', '64M'), f"{name}: max_size"),
+        'category': str(definition.get('category', 'other')).lower(),
+        'description': definition.get('description', name),
+    }
+    # The first header, as the scanner of a single-header type sees it
+    spec['header'] = spec['headers'][0][0]
+    if definition.get('footer') is not None:
+        footer, offset = _pattern(definition['footer'], f"{name}: footer")
+        if offset:
+            raise SignatureError(f"{name}: a footer takes no offset")
+        spec['footer'] = footer
+    if 'size' in definition:
+        if spec['footer']:
+            raise SignatureError(f"{name}: give a footer or a size resolver, not both")
+        spec['size'] = _function(definition['size'], resolvers, f"{name}: size")
+    for field in ('validate', 'verify'):
+        if field in definition:
+            spec[field] = _function(definition[field], validators, f"{name}: {field}")
+    if 'verify' in spec and isinstance(definition['verify'], dict):
+        # Deep checks are pickled to worker processes by name
+        raise SignatureError(f"{name}: verify must name a plain function")
+    return spec
+
+
+def load_signature_file(path):
+    """Compile every definition in a file, in file order."""
+    try:
+        with open(path, encoding='utf-8') as f:
+            definitions = json.load(f)
+    except (OSError, ValueError) as e:
+        raise SignatureError(f"{path}: {e}")
+    if not isinstance(definitions, dict):
+        raise SignatureError(f"{path}: expected an object mapping type names to definitions")
+    types = {}
+    for name, definition in definitions.items():
+        if not _NAME.fullmatch(name.lower()):
+            raise SignatureError(f"{path}: type name {name!r} is not a usable file extension")
+        try:
+            types[name.lower()] = compile_definition(name, definition)
+        except SignatureError as e:
+            raise SignatureError(f"{path}: {e}")
+    return types
+
+
+def _signature_files():
+    user_dir = user_signature_dir()
+    paths = []
+    if os.path.isdir(user_dir):
+        paths += sorted(os.path.join(user_dir, name) for name in os.listdir(user_dir) if name.endswith('.json'))
+    paths += [path for path in os.environ.get(ENV_VAR, '').split(os.pathsep) if path]
+    return paths
+
+
+def load_file_types():
+    """The built-in types, updated with the user's definition files.
+
+    A user file that fails to load is skipped and its error kept in
+    :data:`LOAD_ERRORS`, for the front ends to report.
+    """
+    types = load_signature_file(BUILTIN_FILE)
+    for path in _signature_files():
+        try:
+            types.update(load_signature_file(path))
+        except SignatureError as e:
+            LOAD_ERRORS.append(str(e))
+    return types
+
+
+def add_signature_files(paths):
+    """Load more definition files into FILE_TYPES, for this process and the ones it starts."""
+    paths = [os.path.abspath(path) for path in paths]
+    for path in paths:
+        FILE_TYPES.update(load_signature_file(path))
+    os.environ[ENV_VAR] = os.pathsep.join([p for p in os.environ.get(ENV_VAR, '').split(os.pathsep) if p] + paths)
+
+
+def categories():
+    """Category -> names of its types, both in definition order."""
+    grouped = {}
+    for ext, spec in FILE_TYPES.items():
+        grouped.setdefault(spec['category'], []).append(ext)
+    return grouped
+
+
+def select_types(types=None, category_names=None):
+    """Names of the types given by name or category, or of every type when neither is given."""
+    if not types and not category_names:
+        return list(FILE_TYPES)
+    grouped = categories()
+    unknown = [ext for ext in types or () if ext.lower() not in FILE_TYPES]
+    unknown += [category for category in category_names or () if category.lower() not in grouped]
+    if unknown:
+        raise ValueError(f"unknown file types or categories: {', '.join(unknown)}")
+    wanted = {ext.lower() for ext in types or ()}
+    for category in category_names or ():
+        wanted.update(grouped[category.lower()])
+    return [ext for ext in FILE_TYPES if ext in wanted]
+
+
+LOAD_ERRORS = []
+FILE_TYPES = load_file_types()
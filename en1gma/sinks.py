@@ -0,0 +1,293 @@
+"""Where carved files are written: plain files, a tar or zip, or SQLite.
+
+Every sink writes on a background thread, so carving never waits on the
+disk unless more than :data:`MAX_QUEUED` bytes are waiting to be written.
+:meth:`Sink.put` hands a carve over (moving it if it was spilled to a
+temporary file) and :meth:`Sink.close` waits for everything queued; an
+error on the writer thread is raised from the next call of either. A
+large carve still in the carver's buffer is not copied: put() waits while
+the writer takes it from there.
+
+The container sinks collect every carve of a run in one file in the output
+directory, named by type, number and stream (``jpg/000012_s3.jpg``). Runs
+into the same output directory add to it, numbering on from the last. A
+carve's name is given as ``<container>/<member>``, e.g. for the manifest.
+"""
+import os
+import queue
+import sqlite3
+import tarfile
+import threading
+import time
+import zipfile
+from datetime import datetime
+
+from .carver import save_carve
+
+SINKS = ("files", "tar", "zip", "sqlite")
+
+# Bytes of carves held in memory for the writer before put() blocks
+MAX_QUEUED = 64 * 1024 * 1024
+# Carves in the carver's buffer up to this size are copied and queued;
+# bigger ones are written from the buffer while put() waits
+COPY_LIMIT = 1024 * 1024
+# The SQLite sink commits once this many rows are in, or the queue runs dry
+SQLITE_BATCH = 256
+# Large spilled carves are copied into SQLite blobs in pieces this big
+BLOB_STEP = 1024 * 1024
+
+
+class Sink:
+    """Writes carves on a background thread; subclasses implement :meth:`_write`.
+
+    ``container`` is the single file a container sink writes to, or None.
+    """
+
+    container = None
+    # Carves already in the container, so the names of a new run follow on
+    start = 0
+
+    def __init__(self):
+        self.queue = queue.Queue()
+        self.queued = 0
+        self.room = threading.Condition()
+        self.error = None
+        self.thread = threading.Thread(target=self._run, name="en1gma-writer", daemon=True)
+        self.thread.start()
+
+    def name(self, carve, number):
+        """The name the ``number``-th saved carve of the run is stored under."""
+        return f"{self.container}/{carve.ext}/{self.start + number:06d}_s{carve.stream}.{carve.ext}"
+
+    def _member(self, name):
+        return name[len(self.container) + 1:]
+
+    def put(self, carve, name, digest):
+        """Queue a carve with SHA-256 ``digest`` for writing under ``name``."""
+        self._check()
+        written = None
+        size = 0
+        if carve.data is not None and not isinstance(carve.data, bytes):
+            # A view into the carver's buffer, which moves on once we return
+            if len(carve.data) > COPY_LIMIT:
+                written = threading.Event()
+            else:
+                carve = carve._replace(data=bytes(carve.data))
+        if carve.data is not None and written is None:
+            size = len(carve.data)
+        with self.room:
+            # A carve bigger than the whole budget still goes through alone
+            while self.queued and self.queued + size > MAX_QUEUED and self.error is None:
+                self.room.wait()
+            self.queued += size
+        self.queue.put((carve, name, digest, size, written))
+        if written is not None:
+            written.wait()
+            self._check()
+
+    def close(self):
+        """Write everything still queued and close the output."""
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+        self._check()
+
+    def _check(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def _run(self):
+        try:
+            while True:
+                try:
+                    item = self.queue.get_nowait()
+                except queue.Empty:
+                    # Nothing waiting: a good moment to make writes durable
+                    self._idle()
+                    item = self.queue.get()
+                if item is None:
+                    break
+                carve, name, digest, size, written = item
+                try:
+                    self._write(carve, name, digest)
+                finally:
+                    if written is not None:
+                        written.set()
+                with self.room:
+                    self.queued -= size
+                    self.room.notify_all()
+        except Exception as e:
+            self.error = e
+            with self.room:
+                self.room.notify_all()
+            # Keep taking carves so put() never blocks on a dead writer
+            for item in iter(self.queue.get, None):
+                if item[4] is not None:
+                    item[4].set()
+        finally:
+            try:
+                self._finish()
+            except Exception as e:
+                self.error = self.error or e
+
+    def _write(self, carve, name, digest):
+        raise NotImplementedError
+
+    def _idle(self):
+        pass
+
+    def _finish(self):
+        pass
+
+
+class DirectorySink(Sink):
+    """Each carve as its own file in the output directory (the default)."""
+
+    def __init__(self, output_dir):
+        self.output_dir = output_dir
+        super().__init__()
+
+    def name(self, carve, number):
+        timestamp = datetime.now().strftime("%H%M%S")
+        return f"{self.output_dir}/{carve.ext}_{timestamp}_{number}.{carve.ext}"
+
+    def _write(self, carve, name, digest):
+        save_carve(carve, name)
+
+
+class TarSink(Sink):
+    """All carves in one uncompressed tar, appended to if it exists."""
+
+    def __init__(self, path):
+        self.container = path
+        self.tar = tarfile.open(path, 'a' if os.path.exists(path) else 'w', format=tarfile.PAX_FORMAT)
+        self.start = len(self.tar.getmembers())
+        super().__init__()
+
+    def _write(self, carve, name, digest):
+        info = tarfile.TarInfo(self._member(name))
+        info.mtime = time.time()
+        if carve.path:
+            info.size = os.path.getsize(carve.path)
+            with open(carve.path, 'rb') as f:
+                self.tar.addfile(info, f)
+            os.remove(carve.path)
+        else:
+            info.size = len(carve.data)
+            self.tar.addfile(info, _Reader(carve.data))
+
+    def _finish(self):
+        self.tar.close()
+
+
+class ZipSink(Sink):
+    """All carves in one zip, stored without compression (most are compressed already)."""
+
+    def __init__(self, path):
+        self.container = path
+        self.zip = zipfile.ZipFile(path, 'a' if os.path.exists(path) else 'w', zipfile.ZIP_STORED)
+        self.start = len(self.zip.namelist())
+        super().__init__()
+
+    def _write(self, carve, name, digest):
+        if carve.path:
+            self.zip.write(carve.path, self._member(name))
+            os.remove(carve.path)
+        else:
+            info = zipfile.ZipInfo(self._member(name), time.localtime()[:6])
+            self.zip.writestr(info, carve.data)
+
+    def _finish(self):
+        self.zip.close()
+
+
+class SqliteSink(Sink):
+    """All carves as blobs in one SQLite database, with their manifest fields as columns."""
+
+    def __init__(self, path):
+        self.container = path
+        self.path = path
+        self.pending = 0
+        db = sqlite3.connect(path)
+        with db:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS files (name TEXT PRIMARY KEY, type TEXT, sha256 TEXT, size INTEGER,"
+                " stream INTEGER, direction INTEGER, \"offset\" INTEGER, url TEXT, content_type TEXT,"
+                " data BLOB)")
+            self.start = db.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+        db.close()
+        # SQLite connections stay on the thread that made them
+        self.db = None
+        super().__init__()
+
+    def _write(self, carve, name, digest):
+        if self.db is None:
+            self.db = sqlite3.connect(self.path)
+        meta = carve.meta or {}
+        head = (self._member(name), carve.ext, digest)
+        tail = (carve.stream, carve.direction, carve.offset, meta.get('url'), meta.get('content_type'))
+        if carve.path and hasattr(self.db, 'blobopen'):
+            size = os.path.getsize(carve.path)
+            cursor = self.db.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, zeroblob(?))",
+                                     head + (size,) + tail + (size,))
+            with self.db.blobopen('files', 'data', cursor.lastrowid) as blob, open(carve.path, 'rb') as f:
+                for block in iter(lambda: f.read(BLOB_STEP), b''):
+                    blob.write(block)
+            os.remove(carve.path)
+        else:
+            if carve.path:
+                with open(carve.path, 'rb') as f:
+                    data = f.read()
+                os.remove(carve.path)
+            else:
+                data = carve.data
+            self.db.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                            head + (len(data),) + tail + (data,))
+        self.pending += 1
+        if self.pending >= SQLITE_BATCH:
+            self._idle()
+
+    def _idle(self):
+        if self.db is not None and self.pending:
+            self.db.commit()
+            self.pending = 0
+
+    def _finish(self):
+        if self.db is not None:
+            self.db.commit()
+            self.db.close()
+
+
+class _Reader:
+    """File-like view of an in-memory carve for tarfile, without another copy."""
+
+    def __init__(self, data):
+        self.view = memoryview(data)
+        self.pos = 0
+
+    def read(self, n=-1):
+        end = len(self.view) if n < 0 else self.pos + n
+        data = self.view[self.pos:end]
+        self.pos += len(data)
+        return data
+
+
+_CONTAINERS = {"tar": TarSink, "zip": ZipSink, "sqlite": SqliteSink}
+
+
+def container_path(kind, output_dir):
+    """The file sink ``kind`` collects carves in, or None for plain files."""
+    if kind == "files":
+        return None
+    if kind not in _CONTAINERS:
+        raise ValueError(f"unknown output format {kind!r}")
+    return os.path.join(output_dir, f"carved.{kind}")
+
+
+def open_sink(kind, output_dir):
+    """Create the sink ``kind`` (one of :data:`SINKS`) writing into ``output_dir``."""
+    path = container_path(kind, output_dir)
+    if path is None:
+        return DirectorySink(output_dir)
+    return _CONTAINERS[kind](path)
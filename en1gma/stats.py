@@ -0,0 +1,184 @@
+"""Run statistics: per-stage timers, counters, peak memory and profiling.
+
+Stages nest (scanning runs inside the pull of the next chunk, which runs
+ingest, and so on); each timer records only its own time, with time spent
+in stages started inside it going to those instead. Instrumented code takes
+an optional :class:`Stats` and does nothing extra when it is None.
+"""
+import cProfile
+import io
+import pstats
+import sys
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Display order for the table; other stages follow in the order first seen
+STAGE_ORDER = ('ingest', 'reassembly', 'cache', 'prefilter', 'carving', 'decoding', 'scanning', 'resolving',
+               'validation', 'checking', 'hashing', 'writing')
+
+
+def _peak_rss(who):
+    if resource is None:
+        return None
+    rss = resource.getrusage(who).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+class Stats:
+    """Collects what one extraction run spent its time and memory on."""
+
+    def __init__(self, profile=False, trace_memory=False):
+        self.stages = {}
+        self.counters = {}
+        self.profile = profile
+        self.trace_memory = trace_memory
+        self.profiler = None
+        self.wall = None
+        self.tracemalloc_peak = None
+        self.top_allocations = []
+        self._stack = []
+        self._started = None
+
+    def begin(self):
+        """Start the wall clock and any profiling hooks."""
+        self._started = time.perf_counter()
+        if self.trace_memory:
+            tracemalloc.start()
+        if self.profile:
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+
+    def finish(self):
+        """Stop the wall clock and profiling hooks."""
+        if self.profiler is not None:
+            self.profiler.disable()
+        if self.trace_memory and tracemalloc.is_tracing():
+            self.tracemalloc_peak = tracemalloc.get_traced_memory()[1]
+            snapshot = tracemalloc.take_snapshot()
+            self.top_allocations = [
+                {'where': str(stat.traceback), 'bytes': stat.size, 'count': stat.count}
+                for stat in snapshot.statistics('lineno')[:10]
+            ]
+            tracemalloc.stop()
+        if self._started is not None:
+            self.wall = time.perf_counter() - self._started
+
+    def start(self, stage):
+        self._stack.append([stage, time.perf_counter(), 0.0])
+
+    def stop(self):
+        stage, started, inner = self._stack.pop()
+        elapsed = time.perf_counter() - started
+        self.stages[stage] = self.stages.get(stage, 0.0) + elapsed - inner
+        if self._stack:
+            self._stack[-1][2] += elapsed
+
+    def timed(self, iterable, stage):
+        """Wrap an iterator, charging the time spent producing items to ``stage``."""
+        it = iter(iterable)
+        try:
+            while True:
+                self.start(stage)
+                try:
+                    item = next(it)
+                except StopIteration:
+                    return
+                finally:
+                    self.stop()
+                yield item
+        finally:
+            close = getattr(it, 'close', None)
+            if close is not None:
+                close()
+
+    def count(self, name, key=None, n=1):
+        """Add ``n`` to a counter, or to one key (e.g. a file type) of it."""
+        if key is None:
+            self.counters[name] = self.counters.get(name, 0) + n
+        else:
+            per_key = self.counters.setdefault(name, {})
+            per_key[key] = per_key.get(key, 0) + n
+
+    def snapshot(self):
+        """Timers and counters only, e.g. to send back from a worker process."""
+        return {'stages': dict(self.stages), 'counters': self.counters}
+
+    def merge(self, snapshot, stage_prefix=''):
+        for stage, seconds in snapshot['stages'].items():
+            stage = stage_prefix + stage
+            self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+        for name, value in snapshot['counters'].items():
+            if isinstance(value, dict):
+                for key, n in value.items():
+                    self.count(name, key, n)
+            else:
+                self.count(name, None, value)
+
+    def top_functions(self, limit=15):
+        if self.profiler is None:
+            return []
+        entries = pstats.Stats(self.profiler).stats
+        rows = sorted(entries.items(), key=lambda item: item[1][3], reverse=True)[:limit]
+        return [{'function': f"{path}:{line}({name})", 'calls': calls, 'own': own, 'cumulative': cumulative}
+                for (path, line, name), (_, calls, own, cumulative, _) in rows]
+
+    def report(self):
+        """Everything collected, as JSON-ready data."""
+        return {
+            'wall_seconds': self.wall,
+            'stages': self.stages,
+            'counters': self.counters,
+            'peak_rss': _peak_rss(resource.RUSAGE_SELF) if resource else None,
+            'peak_rss_workers': _peak_rss(resource.RUSAGE_CHILDREN) if resource else None,
+            'tracemalloc_peak': self.tracemalloc_peak,
+            'top_allocations': self.top_allocations,
+            'top_functions': self.top_functions(),
+        }
+
+    def table(self):
+        """Human-readable summary of the report."""
+        report = self.report()
+        lines = []
+        if report['wall_seconds'] is not None:
+            lines.append(f"Wall time: {report['wall_seconds']:.2f} s")
+        stages = sorted(self.stages, key=lambda s: (STAGE_ORDER.index(s) if s in STAGE_ORDER
+                                                    else len(STAGE_ORDER), s))
+        if stages:
+            lines.append(f"{'stage':<22}{'seconds':>10}")
+            for stage in stages:
+                lines.append(f"{stage:<22}{self.stages[stage]:>10.3f}")
+        if self.counters:
+            lines.append("")
+            for name in sorted(self.counters):
+                value = self.counters[name]
+                if isinstance(value, dict):
+                    detail = ", ".join(f"{key}={n}" for key, n in sorted(value.items()))
+                    lines.append(f"{name:<22}{sum(value.values()):>10}  ({detail})")
+                else:
+                    lines.append(f"{name:<22}{value:>10}")
+        memory = []
+        for label, key in (('peak RSS', 'peak_rss'), ('workers peak RSS', 'peak_rss_workers'),
+                           ('traced peak', 'tracemalloc_peak')):
+            if key == 'peak_rss_workers' and not any(s.startswith('workers/') for s in self.stages):
+                continue
+            if report[key]:
+                memory.append(f"{label} {report[key] / 1e6:.1f} MB")
+        if memory:
+            lines.append("")
+            lines.append("Memory: " + ", ".join(memory))
+        if report['top_allocations']:
+            lines.append("")
+            lines.append("Largest allocations still held at the end:")
+            lines.extend(f"  {a['bytes'] / 1e6:8.2f} MB  {a['where']}" for a in report['top_allocations'])
+        if self.profiler is not None:
+            lines.append("")
+            out = io.StringIO()
+            pstats.Stats(self.profiler, stream=out).sort_stats('cumulative').print_stats(15)
+            lines.append(out.getvalue().strip())
+        return "\n".join(lines)
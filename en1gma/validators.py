@@ -0,0 +1,648 @@
+"""Structural checks of carved files, in two tiers.
+
+A spec's ``validate`` is the cheap tier: it runs inline on every carve,
+before it is hashed or written, and only reads fixed fields at either end
+of the file (the PNG IHDR and its CRC, the JPEG frame header, the first
+ZIP local header) or jumps along a chain of length fields. It receives a
+memoryview over the carver's buffer and returns whether the carve can be
+the file it claims to be.
+
+A spec's ``verify`` is the deep tier: it parses or decodes the whole file
+(every PNG chunk CRC and the inflated image size, every ZIP member's CRC,
+the GIF block chain) and returns why the file is broken, or None if it
+checks out. It runs in worker processes (see :mod:`en1gma.deepcheck`), so
+it must be a module-level function; it receives bytes or an mmap of the
+file. Formats whose size resolver already walks or decodes the whole file
+(GZIP, MP3, RAR, TIFF) have no deep check.
+"""
+import io
+import mmap
+import re
+import sqlite3
+import struct
+import zipfile
+import zlib
+
+# Bytes read per step when inflating or reading a whole member
+_STEP = 1024 * 1024
+
+
+def _box_chain(data, pos, end):
+    """Walk ISO BMFF boxes in ``data[pos:end]``; yields (type, body start, box end).
+
+    Raises ValueError if a box does not fit.
+    """
+    while pos < end:
+        if pos + 8 > end:
+            raise ValueError("box header cut off")
+        size, kind = struct.unpack_from('>I4s', data, pos)
+        header = 8
+        if size == 1:
+            if pos + 16 > end:
+                raise ValueError("box header cut off")
+            size = struct.unpack_from('>Q', data, pos + 8)[0]
+            header = 16
+        elif size == 0:
+            size = end - pos
+        if size < header or pos + size > end:
+            raise ValueError(f"'{kind.decode('latin-1')}' box overruns its parent")
+        yield kind, pos + header, pos + size
+        pos += size
+
+
+# --- JPEG ---
+
+# Start-of-frame markers (not DHT, JPG or DAC, which share the range)
+_SOF = frozenset(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+# A marker inside entropy-coded data: 0xFF not followed by stuffing, a
+# restart marker or fill
+_JPEG_MARKER = re.compile(rb'\xff[^\x00\xd0-\xd7\xff]')
+
+
+def jpg_valid(x):
+    """SOI and EOI, and a frame header before the first scan."""
+    if x[:3] != b'\xff\xd8\xff' or x[-2:] != b'\xff\xd9':
+        return False
+    pos = 2
+    end = len(x)
+    while pos + 4 <= end:
+        if x[pos] != 0xFF:
+            return False
+        marker = x[pos + 1]
+        if marker == 0xFF:
+            pos += 1  # Fill byte
+            continue
+        if marker in _SOF:
+            if pos + 10 > end:
+                return False
+            length, precision, _, width, components = struct.unpack_from('>HBHHB', x, pos + 2)
+            return length == 8 + 3 * components and precision in (8, 12, 16) and width and 1 <= components <= 4
+        if marker in (0xDA, 0xD9) or 0xD0 <= marker <= 0xD7 or marker == 0x01:
+            return False  # A scan, the end or a restart before any frame
+        length = struct.unpack_from('>H', x, pos + 2)[0]
+        if length < 2:
+            return False
+        pos += 2 + length
+    return False
+
+
+def jpg_verify(data):
+    """Walk every marker segment and scan, up to an EOI that ends the file."""
+    end = len(data)
+    pos = 2
+    frame = None
+    scans = 0
+    while True:
+        if pos + 2 > end:
+            return "cut off before EOI"
+        if data[pos] != 0xFF:
+            return f"no marker at {pos}"
+        marker = data[pos + 1]
+        if marker == 0xFF:
+            pos += 1
+            continue
+        if marker == 0xD9:
+            if not scans:
+                return "no scan"
+            return None if pos + 2 == end else "data after EOI"
+        if 0xD0 <= marker <= 0xD7 or marker == 0x01:
+            pos += 2
+            continue
+        if pos + 4 > end:
+            return "cut off in a segment header"
+        length = struct.unpack_from('>H', data, pos + 2)[0]
+        if length < 2 or pos + 2 + length > end:
+            return f"segment {marker:02X} overruns the file"
+        if marker in _SOF:
+            frame = data[pos + 9]
+        elif marker == 0xDA:
+            if frame is None:
+                return "scan before frame header"
+            components = data[pos + 4]
+            if not 1 <= components <= frame or length != 6 + 2 * components:
+                return "bad scan header"
+            scans += 1
+            # Entropy-coded data runs to the next real marker
+            match = _JPEG_MARKER.search(data, pos + 2 + length)
+            if match is None:
+                return "scan data runs off the end"
+            pos = match.start()
+            continue
+        pos += 2 + length
+
+
+# --- PNG ---
+
+_PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+_PNG_IEND = b'\x00\x00\x00\x00IEND\xaeB`\x82'
+# Allowed bit depths per color type, and samples per pixel
+_PNG_DEPTHS = {0: (1, 2, 4, 8, 16), 2: (8, 16), 3: (1, 2, 4, 8), 4: (8, 16), 6: (8, 16)}
+_PNG_CHANNELS = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}
+_ADAM7 = ((0, 0, 8, 8), (4, 0, 8, 8), (0, 4, 4, 8), (2, 0, 4, 4), (0, 2, 2, 4), (1, 0, 2, 2), (0, 1, 1, 2))
+
+
+def _png_header(x):
+    """(width, height, depth, color, interlace) from a valid IHDR, or None."""
+    if len(x) < 45 or x[:16] != _PNG_SIGNATURE + b'\x00\x00\x00\x0dIHDR':
+        return None
+    width, height, depth, color, compression, filtering, interlace, crc = struct.unpack_from('>IIBBBBBI', x, 16)
+    if zlib.crc32(x[12:29]) != crc:
+        return None
+    if not width or not height or depth not in _PNG_DEPTHS.get(color, ()):
+        return None
+    if compression or filtering or interlace > 1:
+        return None
+    return width, height, depth, color, interlace
+
+
+def png_valid(x):
+    """Signature, an IHDR whose CRC and fields check out, and IEND last."""
+    return _png_header(x) is not None and x[-12:] == _PNG_IEND
+
+
+def _png_raw_size(width, height, depth, color, interlace):
+    """Bytes of filtered scanlines the image data must inflate to."""
+    bits = depth * _PNG_CHANNELS[color]
+    if not interlace:
+        return height * (1 + (width * bits + 7) // 8)
+    size = 0
+    for x0, y0, dx, dy in _ADAM7:
+        w = (width - x0 + dx - 1) // dx
+        h = (height - y0 + dy - 1) // dy
+        if w and h:
+            size += h * (1 + (w * bits + 7) // 8)
+    return size
+
+
+def png_verify(data):
+    """Check every chunk's CRC and that the image data inflates to the image size."""
+    header = _png_header(data)
+    if header is None:
+        return "bad IHDR"
+    expected = _png_raw_size(*header)
+    inflater = zlib.decompressobj()
+    inflated = 0
+    palette = False
+    pos = 8
+    end = len(data)
+    seen_idat = False
+    while True:
+        if pos + 12 > end:
+            return "cut off before IEND"
+        length, kind = struct.unpack_from('>I4s', data, pos)
+        if pos + 12 + length > end:
+            return f"chunk {kind!r} overruns the file"
+        if not kind.isalpha():
+            return f"bad chunk type at {pos}"
+        crc = struct.unpack_from('>I', data, pos + 8 + length)[0]
+        if zlib.crc32(data[pos + 4:pos + 8 + length]) != crc:
+            return f"CRC mismatch in {kind.decode('latin-1')} chunk at {pos}"
+        if kind == b'PLTE':
+            palette = True
+        elif kind == b'IDAT':
+            if header[3] == 3 and not palette:
+                return "IDAT before PLTE"
+            seen_idat = True
+            try:
+                for piece in range(pos + 8, pos + 8 + length, _STEP):
+                    out = inflater.decompress(data[piece:min(piece + _STEP, pos + 8 + length)], _STEP)
+                    while True:
+                        inflated += len(out)
+                        if inflated > expected:
+                            return "image data inflates past the image size"
+                        if not inflater.unconsumed_tail:
+                            break
+                        out = inflater.decompress(inflater.unconsumed_tail, _STEP)
+            except zlib.error as e:
+                return f"image data does not inflate: {e}"
+        elif kind == b'IEND':
+            if pos + 12 != end:
+                return "data after IEND"
+            break
+        pos += 12 + length
+    if not seen_idat:
+        return "no IDAT"
+    if not inflater.eof or inflated != expected:
+        return f"image data inflates to {inflated} bytes, expected {expected}"
+    return None
+
+
+# --- GIF ---
+
+def gif_valid(x):
+    """Header, a non-empty logical screen and the trailer."""
+    if bytes(x[:6]) not in (b'GIF87a', b'GIF89a') or x[-2:] != b'\x00\x3b' or len(x) < 14:
+        return False
+    width, height = struct.unpack_from('<HH', x, 6)
+    return bool(width and height)
+
+
+def _gif_sub_blocks(data, pos, end):
+    """Position after a chain of data sub-blocks, or None if it runs off."""
+    while pos < end:
+        size = data[pos]
+        pos += 1 + size
+        if not size:
+            return pos
+    return None
+
+
+def gif_verify(data):
+    """Walk the block chain from the logical screen to the trailer."""
+    end = len(data)
+    flags = data[10]
+    pos = 13
+    if flags & 0x80:
+        pos += 3 << ((flags & 7) + 1)
+    images = 0
+    while pos < end:
+        block = data[pos]
+        if block == 0x3B:
+            if not images:
+                return "no image"
+            return None if pos + 1 == end else "data after the trailer"
+        if block == 0x21:
+            pos = _gif_sub_blocks(data, pos + 2, end)
+        elif block == 0x2C:
+            if pos + 11 > end:
+                break
+            flags = data[pos + 9]
+            pos += 10
+            if flags & 0x80:
+                pos += 3 << ((flags & 7) + 1)
+            if pos >= end or not 1 <= data[pos] <= 11:
+                return "bad LZW code size"
+            pos = _gif_sub_blocks(data, pos + 1, end)
+            images += 1
+        else:
+            return f"unknown block {block:02X} at {pos}"
+        if pos is None:
+            break
+    return "cut off before the trailer"
+
+
+# --- BMP ---
+
+def _bmp_header(x):
+    """(DIB size, width, height, bits per pixel, compression, colors used) or None."""
+    if len(x) < 30 or x[:2] != b'BM':
+        return None
+    dib = struct.unpack_from('<I', x, 14)[0]
+    if dib == 12:
+        width, height, planes, bits = struct.unpack_from('<HHHH', x, 18)
+        compression = colors = 0
+    else:
+        if len(x) < 50:
+            return None
+        width, height, planes, bits, compression, _, _, _, colors = struct.unpack_from('<iiHHIIiiI', x, 18)
+    if planes != 1 or bits not in (1, 4, 8, 16, 24, 32) or width <= 0 or not height:
+        return None
+    return dib, width, abs(height), bits, compression, colors
+
+
+def bmp_valid(x):
+    """One plane, a known bit depth and a non-empty image."""
+    return _bmp_header(x) is not None
+
+
+def bmp_verify(data):
+    """The palette and pixel array fit between the headers and the end."""
+    header = _bmp_header(data)
+    if header is None:
+        return "bad header"
+    dib, width, height, bits, compression, colors = header
+    pixel_offset = struct.unpack_from('<I', data, 10)[0]
+    if bits <= 8:
+        entries = colors or 1 << bits
+        if 14 + dib + entries * (3 if dib == 12 else 4) > pixel_offset:
+            return "palette overlaps the pixel data"
+    if compression in (0, 3, 6):
+        needed = ((width * bits + 31) // 32) * 4 * height
+        if pixel_offset + needed > len(data):
+            return f"pixel data needs {needed} bytes, file has {len(data) - pixel_offset}"
+    return None
+
+
+# --- WEBP ---
+
+def webp_valid(x):
+    """RIFF/WEBP with an image chunk first."""
+    return x[:4] == b'RIFF' and x[8:12] == b'WEBP' and bytes(x[12:16]) in (b'VP8 ', b'VP8L', b'VP8X')
+
+
+def webp_verify(data):
+    """Walk the RIFF chunks and check the image chunk's own signature."""
+    image = False
+    try:
+        pos = 12
+        while pos < len(data):
+            if pos + 8 > len(data):
+                return "chunk header cut off"
+            kind, size = struct.unpack_from('<4sI', data, pos)
+            body = pos + 8
+            if body + size > len(data):
+                return f"chunk {kind!r} overruns the file"
+            if kind == b'VP8 ':
+                # Key frame: frame tag, then the start code
+                if size < 10 or data[body] & 1 or data[body + 3:body + 6] != b'\x9d\x01\x2a':
+                    return "bad VP8 frame header"
+                image = True
+            elif kind == b'VP8L':
+                if size < 5 or data[body] != 0x2F:
+                    return "bad VP8L signature"
+                image = True
+            elif kind == b'ANIM':
+                image = True
+            pos = body + size + (size & 1)
+    except struct.error:
+        return "chunk header cut off"
+    return None if image else "no image chunk"
+
+
+# --- PDF ---
+
+_STARTXREF = re.compile(rb'startxref\s+(\d+)\s+%%EOF\s*$')
+_XREF_STREAM = re.compile(rb'\d+\s+\d+\s+obj\b')
+
+
+def pdf_valid(x):
+    """Header with a version and %%EOF at the end."""
+    return x[:5] == b'%PDF-' and bytes(x[5:6]).isdigit() and b'%%EOF' in bytes(x[-20:])
+
+
+def pdf_verify(data):
+    """The trailing startxref points at a cross-reference table or stream."""
+    match = _STARTXREF.search(bytes(data[-1024:]))
+    if match is None:
+        return "no startxref before %%EOF"
+    offset = int(match.group(1))
+    if offset >= len(data):
+        return "startxref points past the end"
+    target = bytes(data[offset:offset + 32])
+    if not target.startswith(b'xref') and not _XREF_STREAM.match(target):
+        return "startxref does not point at a cross-reference section"
+    return None
+
+
+# --- ZIP and Office ---
+
+# Stored, deflate, deflate64, implode, bzip2, LZMA, zstd, xz, JPEG, WavPack, PPMd, AES
+_ZIP_METHODS = frozenset((0, 1, 6, 8, 9, 10, 12, 14, 93, 95, 96, 97, 98, 99))
+
+
+def zip_valid(x):
+    """A first local file header with sane version, method and name."""
+    if len(x) < 52 or x[:4] != b'PK\x03\x04':
+        return False
+    version, flags, method = struct.unpack_from('<HHH', x, 4)
+    name_len, extra_len = struct.unpack_from('<HH', x, 26)
+    if version & 0xFF > 63 or method not in _ZIP_METHODS or not 0 < name_len < 1024:
+        return False
+    return 30 + name_len + extra_len <= len(x) and b'\x00' not in bytes(x[30:30 + name_len])
+
+
+def _zip_names(x):
+    """The central directory of an archive ending at the end of ``x`` (raw bytes)."""
+    tail = bytes(x[-65557:])
+    eocd = tail.rfind(b'PK\x05\x06')
+    if eocd == -1 or eocd + 22 > len(tail):
+        return None
+    cd_size, cd_offset = struct.unpack_from('<II', tail, eocd + 12)
+    if cd_offset == 0xFFFFFFFF or cd_offset + cd_size > len(x):
+        return None  # ZIP64: not worth following here
+    return bytes(x[cd_offset:cd_offset + cd_size])
+
+
+def office_validator(folder):
+    """Build a check for an Office Open XML package with parts under ``folder``."""
+    def office_valid(x):
+        if not zip_valid(x):
+            return False
+        names = _zip_names(x)
+        if names is None:
+            names = bytes(x[:1000])
+        return folder in names
+    return office_valid
+
+
+class _MappedFile:
+    """An mmap as the seekable file zipfile wants."""
+
+    def __init__(self, mapped):
+        self.mapped = mapped
+
+    def seekable(self):
+        return True
+
+    def __getattr__(self, name):
+        return getattr(self.mapped, name)
+
+
+def zip_verify(data, required=()):
+    """Read every member to its end, so each one's CRC is checked."""
+    source = _MappedFile(data) if isinstance(data, mmap.mmap) else io.BytesIO(data)
+    try:
+        with zipfile.ZipFile(source) as archive:
+            names = archive.namelist()
+            for name in required:
+                if not any(n == name or n.startswith(name) for n in names):
+                    return f"no {name}"
+            for info in archive.infolist():
+                if info.flag_bits & 1 or info.is_dir():
+                    continue  # Encrypted members cannot be checked
+                try:
+                    with archive.open(info) as member:
+                        while member.read(_STEP):
+                            pass
+                except NotImplementedError:
+                    continue  # A compression method zipfile lacks
+    except (zipfile.BadZipFile, zlib.error, EOFError, OSError, ValueError) as e:
+        return f"bad archive: {e}"
+    return None
+
+
+def docx_verify(data):
+    return zip_verify(data, ('[Content_Types].xml', 'word/'))
+
+
+def xlsx_verify(data):
+    return zip_verify(data, ('[Content_Types].xml', 'xl/'))
+
+
+# --- GZIP, MP3 ---
+
+def gz_valid(x):
+    """Deflate method and no reserved flags; the size resolver checks the rest."""
+    return x[:3] == b'\x1f\x8b\x08' and not x[3] & 0xE0
+
+
+def mp3_valid(x):
+    """A MPEG-1 Layer III frame header; the size resolver walks the frames."""
+    return x[:2] == b'\xff\xfb' and len(x) > 4
+
+
+# --- MP4 ---
+
+def mp4_valid(x):
+    """An ftyp box with a printable brand, and a moov box at the top level."""
+    if len(x) < 16 or x[4:8] != b'ftyp' or not bytes(x[8:12]).isascii():
+        return False
+    try:
+        return any(kind == b'moov' for kind, _, _ in _box_chain(x, 0, len(x)))
+    except (ValueError, struct.error):
+        return False
+
+
+def mp4_verify(data):
+    """Boxes tile the file exactly; moov holds a movie header and a track."""
+    try:
+        moov = None
+        for kind, body, end in _box_chain(data, 0, len(data)):
+            if kind == b'moov':
+                moov = (body, end)
+        if moov is None:
+            return "no moov box"
+        children = {kind for kind, _, _ in _box_chain(data, *moov)}
+    except (ValueError, struct.error) as e:
+        return str(e) or "box header cut off"
+    if b'mvhd' not in children:
+        return "no movie header"
+    if b'trak' not in children:
+        return "no track"
+    return None
+
+
+# --- RAR, 7z ---
+
+def rar_valid(x):
+    """A main archive header right after the marker, matching its CRC."""
+    if len(x) < 20:
+        return False
+    if x[6] == 1:
+        # RAR 5: CRC32, size and type as vints (one byte each for a main header)
+        size = x[12]
+        return size < 0x80 and x[13] == 1 and len(x) >= 13 + size and \
+            zlib.crc32(x[12:13 + size]) == struct.unpack_from('<I', x, 8)[0]
+    crc, kind, _, size = struct.unpack_from('<HBHH', x, 7)
+    return kind == 0x73 and size >= 13 and len(x) >= 7 + size and \
+        zlib.crc32(x[9:7 + size]) & 0xFFFF == crc
+
+
+def sevenzip_valid(x):
+    """Both headers match their CRCs; the last one, at the end of the file, opens a (packed) header."""
+    if len(x) < 33 or zlib.crc32(x[12:32]) != struct.unpack_from('<I', x, 8)[0]:
+        return False
+    crc = struct.unpack_from('<I', x, 28)[0]
+    header = x[32 + struct.unpack_from('<Q', x, 12)[0]:]
+    return len(header) > 0 and header[0] in (0x01, 0x17) and zlib.crc32(header) == crc
+
+
+# --- ELF, PE ---
+
+def elf_valid(x):
+    """A known machine, and a section name table that is a string table."""
+    try:
+        e = '<' if x[5] == 1 else '>'
+        wide = x[4] == 2
+        machine = struct.unpack_from(e + 'H', x, 18)[0]
+        shoff = struct.unpack_from(e + ('Q' if wide else 'I'), x, 40 if wide else 32)[0]
+        shentsize, shnum, shstrndx = struct.unpack_from(e + 'HHH', x, 58 if wide else 46)
+        if not machine:
+            return False
+        if not shnum:
+            return True  # Stripped of section headers
+        if shstrndx >= shnum:
+            return False
+        return struct.unpack_from(e + 'I', x, shoff + shstrndx * shentsize + 4)[0] == 3  # SHT_STRTAB
+    except (struct.error, IndexError):
+        return False
+
+
+def _pe_headers(x):
+    """Offsets of the PE signature and optional header; raises ValueError if there is none."""
+    pe = struct.unpack_from('<I', x, 0x3C)[0]
+    if x[pe:pe + 4] != b'PE\x00\x00' or struct.unpack_from('<H', x, pe + 24)[0] not in (0x10B, 0x20B):
+        raise ValueError("no PE header")
+    return pe, pe + 24
+
+
+def pe_valid(x):
+    """A PE header, and a power-of-two file alignment no larger than the section alignment."""
+    try:
+        pe, optional = _pe_headers(x)
+        section_align, file_align = struct.unpack_from('<II', x, optional + 32)
+    except (struct.error, ValueError):
+        return False
+    return 0 < file_align <= max(section_align, 512) and not file_align & (file_align - 1)
+
+
+def pe_verify(data):
+    """Sections lie within the file, and the image checksum matches when one is set."""
+    pe, optional = _pe_headers(data)
+    sections, optional_size = struct.unpack_from('<2xH12xH', data, pe + 4)
+    for i in range(sections):
+        size, offset = struct.unpack_from('<II', data, optional + optional_size + i * 40 + 16)
+        if size and offset + size > len(data):
+            return f"section {i} runs past the end of the file"
+    field = optional + 64
+    expected = struct.unpack_from('<I', data, field)[0]
+    if not expected:
+        return None  # Most executables leave it unset
+    # Ones' complement sum of the 16-bit words with the checksum field left out
+    total = 0
+    for pos in range(0, len(data), _STEP):
+        block = bytes(data[pos:pos + _STEP])
+        if len(block) & 1:
+            block += b'\x00'
+        total += sum(memoryview(block).cast('H'))
+    total -= sum(struct.unpack_from('<HH', data, field))
+    while total > 0xFFFF:
+        total = (total & 0xFFFF) + (total >> 16)
+    if total + len(data) != expected:
+        return f"image checksum is {total + len(data):#x}, the header says {expected:#x}"
+    return None
+
+
+# --- SQLite, TIFF ---
+
+def sqlite_valid(x):
+    """Fixed header fields, and page 1 (the schema table's root) is a table b-tree page."""
+    if len(x) <= 100:
+        return False
+    page_size = struct.unpack_from('>H', x, 16)[0]
+    if page_size != 1 and (page_size < 512 or page_size & (page_size - 1)):
+        return False
+    return x[21:24] == b'\x40\x20\x20' and x[100] in (0x05, 0x0D)
+
+
+def sqlite_verify(data):
+    """SQLite's own quick_check over the whole database."""
+    if not hasattr(sqlite3.Connection, 'deserialize'):
+        return None  # Python before 3.11 cannot open a database from memory; skip the check
+    image = bytearray(data)
+    # A WAL database cannot be opened from memory; its pages read the same
+    # in rollback-journal mode (bytes 18 and 19 are the read/write versions)
+    image[18:20] = b'\x01\x01'
+    db = sqlite3.connect(':memory:')
+    try:
+        db.deserialize(image)
+        problems = [row[0] for row in db.execute("PRAGMA quick_check")]
+    except sqlite3.DatabaseError as e:
+        return f"bad database: {e}"
+    finally:
+        db.close()
+    if problems != ['ok']:
+        return problems[0]
+    return None
+
+
+def tiff_valid(x):
+    """The first IFD describes an image: width, length and strips or tiles."""
+    e = '<' if x[0] == 0x49 else '>'
+    try:
+        ifd = struct.unpack_from(e + 'I', x, 4)[0]
+        count = struct.unpack_from(e + 'H', x, ifd)[0]
+        tags = {struct.unpack_from(e + 'H', x, ifd + 2 + 12 * i)[0] for i in range(count)}
+    except struct.error:
+        return False
+    return {256, 257} <= tags and bool(tags & {273, 324})
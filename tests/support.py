@@ -0,0 +1,75 @@
+"""Capture building and extraction helpers shared by the tests.
+
+Captures are written with the benchmark generator's pcap writer, so the
+tests need neither capture files nor scapy.
+"""
+import io
+import os
+import random
+import struct
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+from generate import BUILDERS, CaptureWriter, tcp_frame  # noqa: E402
+from en1gma.engine import Extracted, extract  # noqa: E402
+
+SYN, FIN, ACK = 0x02, 0x01, 0x10
+MSS = 1400
+
+
+def sample(ext, seed=1, size=5000):
+    """A well-formed file of type ``ext``."""
+    return BUILDERS[ext](random.Random(seed), size)
+
+
+def flow_frames(payload, port, ts=1000.0, mss=MSS, close=True):
+    """(ts, frame) pairs of one TCP flow from 10.0.0.1:``port`` to 10.0.0.2:80.
+
+    The client sends a SYN and then ``payload`` in ``mss`` byte segments,
+    and both sides close with a FIN unless ``close`` is False.
+    """
+    client, server = bytes([10, 0, 0, 1]), bytes([10, 0, 0, 2])
+    isn = 1000 + port
+    frames = [(ts, tcp_frame(client, server, port, 80, isn, SYN, b''))]
+    seq = isn + 1
+    for pos in range(0, len(payload), mss):
+        ts += 0.001
+        frames.append((ts, tcp_frame(client, server, port, 80, seq, ACK, payload[pos:pos + mss])))
+        seq += len(payload[pos:pos + mss])
+    if close:
+        frames.append((ts + 0.001, tcp_frame(client, server, port, 80, seq, FIN | ACK, b'')))
+        frames.append((ts + 0.002, tcp_frame(server, client, 80, port, 5000, FIN | ACK, b'')))
+    return frames
+
+
+def capture_bytes(payloads, fmt='pcap', ts=1000.0, **kwargs):
+    """A capture with one flow per payload, flows one after another."""
+    f = io.BytesIO()
+    writer = CaptureWriter(f, fmt)
+    for number, payload in enumerate(payloads):
+        for frame_ts, frame in flow_frames(payload, 40000 + number, ts + number, **kwargs):
+            writer.write(frame_ts, frame)
+    return f.getvalue()
+
+
+def write_capture(path, payloads, fmt='pcap', **kwargs):
+    with open(path, 'wb') as f:
+        f.write(capture_bytes(payloads, fmt, **kwargs))
+    return path
+
+
+def run(pcap_path, output_dir, types, **options):
+    """Extract and return the files found, without progress events."""
+    return [event for event in extract(pcap_path, output_dir, types, **options) if isinstance(event, Extracted)]
+
+
+def padded(*files, filler=b'\x00' * 300):
+    """Files one after another with filler before, between and after them."""
+    return filler + filler.join(files) + filler
+
+
+def pcap_record(ts, frame):
+    return struct.pack('<IIII', int(ts), int(ts % 1 * 1e6), len(frame), len(frame)) + frame
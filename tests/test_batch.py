@@ -0,0 +1,120 @@
+"""Batch mode: finding captures, merging manifests, retries and the summary.
+
+Run with ``python -m pytest tests`` (or ``python -m unittest``).
+"""
+import json
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from support import padded, sample, write_capture  # noqa: E402
+from en1gma import manifest as manifest_module  # noqa: E402
+from en1gma.batch import _output_names, expand_inputs, run_batch  # noqa: E402
+from en1gma.manifest import read_records  # noqa: E402
+
+
+def touch(path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    open(path, 'wb').close()
+    return path
+
+
+class ExpandInputsTest(unittest.TestCase):
+    def test_directories_globs_and_lists(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            rotated = [touch(os.path.join(tmp, 'sensor', f'trace.pcap{n}')) for n in (10, 2, 1)]
+            nested = touch(os.path.join(tmp, 'sensor', 'old', 'a.pcapng'))
+            touch(os.path.join(tmp, 'sensor', 'notes.txt'))
+            loose = [touch(os.path.join(tmp, name)) for name in ('b.cap', 'a.cap')]
+            listing = os.path.join(tmp, 'list')
+            with open(listing, 'w') as f:
+                f.write(f"# captures\n{loose[0]}\n\n{os.path.join(tmp, 'missing.pcap')}\n")
+            found = expand_inputs([os.path.join(tmp, 'sensor'), os.path.join(tmp, '*.cap'), '@' + listing])
+        self.assertEqual(found, [nested, rotated[2], rotated[1], rotated[0], loose[1], loose[0],
+                                 os.path.join(tmp, 'missing.pcap')])
+
+    def test_output_names(self):
+        self.assertEqual(_output_names(['x/a.pcap', 'y/a.pcap', 'a_pcap', '']),
+                         ['a_pcap', 'a_pcap_2', 'a_pcap_3', 'capture'])
+
+
+class RunBatchTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.tmp = self.directory.name
+        self.png, self.gif, self.jpg = sample('png'), sample('gif'), sample('jpg')
+        self.captures = [
+            write_capture(os.path.join(self.tmp, 'one.pcap'), [padded(self.png, self.gif)]),
+            write_capture(os.path.join(self.tmp, 'two.pcap'), [padded(self.gif, self.jpg)]),
+            write_capture(os.path.join(self.tmp, 'three.pcap'), [padded(self.png)]),
+        ]
+        self.out = os.path.join(self.tmp, 'out')
+
+    def batch(self, captures, **kwargs):
+        return list(run_batch(captures, self.out, selected_types=['png', 'gif', 'jpg'], **kwargs))
+
+    def saved(self):
+        return sorted(os.path.relpath(os.path.join(root, name), self.out)
+                      for root, _, names in os.walk(self.out) for name in names
+                      if name not in ('manifest.jsonl', 'summary.json'))
+
+    def check(self, results):
+        self.assertEqual([r.capture for r in results], self.captures)
+        self.assertEqual([(r.files, r.duplicates) for r in results], [(2, 0), (1, 1), (0, 1)])
+        self.assertEqual(results[1].by_type, {'jpg': 1})
+        saved = self.saved()
+        self.assertEqual([name.split(os.sep)[0] for name in saved], ['one_pcap', 'one_pcap', 'two_pcap'])
+        records = list(read_records(os.path.join(self.out, 'manifest.jsonl')))
+        self.assertEqual(len(records), 5)
+        # Duplicates name the file that was kept, in an earlier capture
+        for record in records:
+            if record['duplicate_of']:
+                self.assertIsNone(record['file'])
+                self.assertIn(os.path.relpath(record['duplicate_of'], self.out), saved)
+        with open(os.path.join(self.out, 'summary.json')) as f:
+            totals = json.load(f)['totals']
+        self.assertEqual(totals, {'captures': 3, 'failed': 0, 'files': 3, 'duplicates': 2,
+                                  'by_type': {'png': 1, 'gif': 1, 'jpg': 1}})
+
+    def test_serial(self):
+        self.check(self.batch(self.captures))
+
+    def test_workers(self):
+        self.check(self.batch(self.captures, jobs=2))
+
+    def test_combined_manifest_read_once(self):
+        read = []
+
+        def recording(path):
+            read.append(path)
+            return read_records(path)
+
+        self.batch(self.captures[:1])
+        with mock.patch.object(manifest_module, 'read_records', recording):
+            self.batch(self.captures)
+        # Not again for each capture
+        self.assertEqual(read.count(os.path.join(self.out, 'manifest.jsonl')), 1)
+
+    def test_later_batch_knows_earlier_files(self):
+        self.batch(self.captures[:1], jobs=2)
+        results = self.batch(self.captures, jobs=2)
+        self.assertEqual([(r.files, r.duplicates) for r in results], [(0, 2), (1, 1), (0, 1)])
+        self.assertEqual(len(self.saved()), 3)
+
+    def test_failed_capture_is_retried_then_skipped(self):
+        captures = [self.captures[0], os.path.join(self.tmp, 'missing.pcap'), self.captures[1]]
+        results = self.batch(captures, retries=1)
+        self.assertEqual([(r.capture, r.final, r.attempts) for r in results],
+                         [(captures[0], True, 1), (captures[1], False, 1), (captures[1], True, 2),
+                          (captures[2], True, 1)])
+        self.assertTrue(results[2].error.startswith('FileNotFoundError'))
+        self.assertEqual(results[3].files, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
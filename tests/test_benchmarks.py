@@ -0,0 +1,76 @@
+"""The benchmark generator and runner, on a capture of about a megabyte.
+
+Run with ``python -m pytest tests`` (or ``python -m unittest``).
+"""
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from support import ROOT  # noqa: E402
+from run import score  # noqa: E402
+
+BENCHMARKS = os.path.join(ROOT, 'benchmarks')
+SMALL = ['--size', '1', '--flows', '4', '--max-file', '20000', '--http', '0.3']
+
+
+def generate(path, *args):
+    subprocess.run([sys.executable, os.path.join(BENCHMARKS, 'generate.py'), path] + SMALL + list(args),
+                   stdout=subprocess.DEVNULL, check=True)
+    with open(path + '.truth.json') as f:
+        return json.load(f)
+
+
+class GenerateTest(unittest.TestCase):
+    def test_reproducible(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            captures = []
+            for name, seed in (('a', '7'), ('b', '7'), ('c', '8')):
+                truth = generate(os.path.join(tmp, name + '.pcap'), '--seed', seed)
+                with open(os.path.join(tmp, name + '.pcap'), 'rb') as f:
+                    captures.append((f.read(), truth['files']))
+        self.assertEqual(captures[0], captures[1])
+        self.assertNotEqual(captures[0][0], captures[2][0])
+        self.assertTrue(captures[0][1])
+
+
+class RunTest(unittest.TestCase):
+    def test_stages_and_score(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            capture = os.path.join(tmp, 'c.pcap')
+            truth = generate(capture, '--format', 'pcapng')
+            report = os.path.join(tmp, 'report.json')
+            out = subprocess.run([sys.executable, os.path.join(BENCHMARKS, 'run.py'), capture, '--json', report],
+                                 stdout=subprocess.PIPE, check=True, universal_newlines=True).stdout
+            with open(report) as f:
+                results = json.load(f)
+        self.assertIn('Recall', out)
+        self.assertEqual(list(results), ['ingest', 'reassembly', 'scanning', 'validation', 'writing', 'score'])
+        # Every stage sees the same payload, less what reassembly drops
+        payloads = [results[stage]['payload'] for stage in ('reassembly', 'scanning', 'validation', 'writing')]
+        self.assertEqual(len(set(payloads)), 1)
+        self.assertGreaterEqual(results['ingest']['payload'], payloads[0])
+        self.assertEqual(results['score']['recall'], 1.0)
+        self.assertEqual(sum(n for _, n in results['score']['per_type'].values()), len(truth['files']))
+
+
+class ScoreTest(unittest.TestCase):
+    TRUTH = {'files': [{'ext': 'png', 'sha256': 'a'}, {'ext': 'png', 'sha256': 'a'},
+                       {'ext': 'gif', 'sha256': 'b'}, {'ext': 'zip', 'sha256': 'c'}]}
+
+    def test_copies_count_once_each(self):
+        per_type, correct, carved = score(self.TRUTH, [('png', 'a'), ('gif', 'b'), ('jpg', 'x')])
+        self.assertEqual(per_type, {'png': (1, 2), 'gif': (1, 1), 'zip': (0, 1)})
+        self.assertEqual((correct, carved), (2, 3))
+
+    def test_selected_types(self):
+        per_type, _, _ = score(self.TRUTH, [('gif', 'b')], types=['gif', 'zip'])
+        self.assertEqual(per_type, {'gif': (1, 1), 'zip': (0, 1)})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+"""The payload cache: replay, keys, eviction and captures too big to keep.
+
+Run with ``python -m pytest tests`` (or ``python -m unittest``).
+"""
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from support import padded, run, sample, write_capture  # noqa: E402
+from en1gma.cache import PayloadCache  # noqa: E402
+from en1gma.reassembly import Chunk  # noqa: E402
+
+CHUNKS = [Chunk(0, 0, b'abc'), Chunk(1, 1, b'defgh'), Chunk(0, None, None), Chunk(1, 0, b''),
+          Chunk(1, 1, b'ij'), Chunk(1, None, None)]
+
+
+def plain(chunks):
+    return [(c.stream, c.direction, None if c.data is None else bytes(c.data)) for c in chunks]
+
+
+class PayloadCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.cache_dir = os.path.join(self.directory.name, 'cache')
+        self.pcap = self.capture('a.pcap', b'first')
+
+    def capture(self, name, content):
+        path = os.path.join(self.directory.name, name)
+        with open(path, 'wb') as f:
+            f.write(content)
+        return path
+
+    def entries(self):
+        return sorted(os.listdir(self.cache_dir))
+
+    def test_replays_what_was_recorded(self):
+        cache = PayloadCache(self.cache_dir)
+        self.assertIsNone(cache.cached_size(self.pcap, 'native'))
+        self.assertEqual(plain(cache.streams(self.pcap, 'native', CHUNKS)), plain(CHUNKS))
+        self.assertEqual(cache.cached_size(self.pcap, 'native'), 10)
+        self.assertEqual(plain(cache.streams(self.pcap, 'native', iter(()))), plain(CHUNKS))
+        # Only whole entries are left behind
+        self.assertEqual(len(self.entries()), 2)
+
+    def test_key(self):
+        cache = PayloadCache(self.cache_dir)
+        key = cache.key(self.pcap, 'native')
+        self.assertNotEqual(cache.key(self.pcap, 'tshark'), key)
+        with open(self.pcap, 'wb') as f:
+            f.write(b'other')
+        self.assertNotEqual(cache.key(self.pcap, 'native'), key)
+
+    def test_stopped_run_is_not_kept(self):
+        cache = PayloadCache(self.cache_dir)
+        chunks = cache.streams(self.pcap, 'native', CHUNKS)
+        next(chunks)
+        chunks.close()
+        self.assertEqual(self.entries(), [])
+
+    def test_least_recently_used_is_evicted(self):
+        # An entry is a 25 byte index record and 60 bytes of data: two fit
+        cache = PayloadCache(self.cache_dir, max_size=200)
+        other = self.capture('b.pcap', b'second')
+        for path in (self.pcap, other):
+            list(cache.streams(path, 'native', [Chunk(0, 0, b'x' * 60)]))
+            os.utime(os.path.join(self.cache_dir, cache.key(path, 'native') + '.idx'), (0, 0))
+        # Replaying the first makes the second the least recently used
+        self.assertEqual(plain(cache.streams(self.pcap, 'native', ())), [(0, 0, b'x' * 60)])
+        third = self.capture('c.pcap', b'third')
+        list(cache.streams(third, 'native', [Chunk(0, 0, b'y' * 60)]))
+        self.assertEqual(cache.cached_size(self.pcap, 'native'), 60)
+        self.assertIsNone(cache.cached_size(other, 'native'))
+        self.assertEqual(cache.cached_size(third, 'native'), 60)
+
+    def test_too_big_stops_recording_at_once(self):
+        cache = PayloadCache(self.cache_dir, max_size=100)
+        chunks = [Chunk(0, 0, b'x' * 60) for _ in range(4)] + [Chunk(0, None, None)]
+        replayed = cache.streams(self.pcap, 'native', chunks)
+        out = plain([next(replayed), next(replayed)])
+        self.assertEqual(len(self.entries()), 2)
+        # Past the limit: the partial entry is deleted before the rest passes
+        out += plain([next(replayed)])
+        self.assertEqual(self.entries(), [])
+        out += plain(replayed)
+        self.assertEqual(out, plain(chunks))
+        self.assertEqual(self.entries(), [])
+        self.assertIsNone(cache.cached_size(self.pcap, 'native'))
+
+
+class CachedExtractionTest(unittest.TestCase):
+    def test_second_run_from_the_cache(self):
+        files = [sample('png'), sample('zip'), sample('gif')]
+        with tempfile.TemporaryDirectory() as tmp:
+            pcap = write_capture(os.path.join(tmp, 'in.pcap'), [padded(*files), padded(files[0])])
+            cache = PayloadCache(os.path.join(tmp, 'cache'))
+            runs = []
+            for number in range(2):
+                found = run(pcap, os.path.join(tmp, str(number)), ['png', 'zip', 'gif'], cache=cache)
+                runs.append([(e.ext, e.sha256, e.stream, e.direction, e.offset, e.duplicate_of is None)
+                             for e in found])
+            self.assertIsNotNone(cache.cached_size(pcap, 'auto'))
+        self.assertEqual(len(runs[0]), 4)
+        self.assertEqual(runs[1], runs[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,224 @@
+"""The sliding-window carver: extents, choice between types, failures, the
+memoryview windows carves are handed out in, and the memory budget.
+
+Run with ``python -m pytest tests`` (or ``python -m unittest``).
+"""
+import os
+import struct
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from support import padded, run, sample, write_capture  # noqa: E402
+from en1gma.carver import FlowCarver, StreamCarver, save_carve  # noqa: E402
+from en1gma.reassembly import Chunk  # noqa: E402
+from en1gma.resolvers import NEED_MORE  # noqa: E402
+from en1gma.scanner import SignatureScanner  # noqa: E402
+from en1gma.signatures import FILE_TYPES  # noqa: E402
+from en1gma.stats import Stats  # noqa: E402
+
+
+def carve(data, file_types, piece=4096, stats=None, **kwargs):
+    """Feed ``data`` in pieces; returns (ext, offset, bytes) per carve."""
+    carver = StreamCarver(SignatureScanner(file_types), stats=stats, chunk_size=piece, **kwargs)
+    out = []
+    for pos in range(0, len(data), piece):
+        out += [(c.ext, c.offset, bytes(c.data)) for c in carver.feed(data[pos:pos + piece])]
+    out += [(c.ext, c.offset, bytes(c.data)) for c in carver.close()]
+    return out
+
+
+def types(*names):
+    return {name: FILE_TYPES[name] for name in names}
+
+
+class ExtentTest(unittest.TestCase):
+    SIZED = ('bmp', 'webp', 'tiff', 'zip', 'gz', 'rar', '7z', 'mp4', 'elf', 'exe', 'sqlite')
+
+    def test_footerless_types_back_to_back(self):
+        # No filler: each file must end exactly where its structure says
+        files = [sample(ext, seed) for seed, ext in enumerate(self.SIZED)]
+        carves = carve(b''.join(files), types(*self.SIZED))
+        self.assertEqual([(ext, data) for ext, _, data in carves], list(zip(self.SIZED, files)))
+
+    def test_offsets_in_the_stream(self):
+        png, gif = sample('png'), sample('gif')
+        data = padded(png, gif)
+        carves = carve(data, types('png', 'gif'), piece=333)
+        self.assertEqual([(ext, offset) for ext, offset, _ in carves],
+                         [('png', data.index(png)), ('gif', data.index(gif))])
+
+    def test_first_type_that_validates(self):
+        docx, zipped = sample('docx'), sample('zip')
+        carves = carve(padded(docx, zipped), types('docx', 'xlsx', 'zip'))
+        self.assertEqual([(ext, data) for ext, _, data in carves], [('docx', docx), ('zip', zipped)])
+
+    def test_headers_inside_a_carve_are_skipped(self):
+        carves = carve(padded(sample('mp3')), types('mp3'))
+        self.assertEqual(len(carves), 1)
+
+    def test_cut_off_file_is_dropped(self):
+        png = sample('png')
+        self.assertEqual(carve(padded(png[:-100])[:-300], types('png')), [])
+
+
+class ZeroCopyTest(unittest.TestCase):
+    def carves(self, data, **kwargs):
+        carver = StreamCarver(SignatureScanner(types('png', 'gif')), chunk_size=1024, **kwargs)
+        for pos in range(0, len(data), 1024):
+            yield from carver.feed(data[pos:pos + 1024])
+        yield from carver.close()
+
+    def test_carve_is_a_window_released_on_the_next(self):
+        png, gif = sample('png'), sample('gif')
+        carves = self.carves(padded(png, gif))
+        first = next(carves)
+        self.assertIsInstance(first.data, memoryview)
+        self.assertEqual(first.data, png)
+        second = next(carves)
+        with self.assertRaises(ValueError):
+            first.data.tobytes()
+        self.assertEqual(second.data, gif)
+        self.assertEqual(list(carves), [])
+
+    def test_validator_gets_the_window(self):
+        seen = []
+        spec = dict(FILE_TYPES['png'], validate=lambda data: seen.append(type(data)) or True)
+        carver = StreamCarver(SignatureScanner({'png': spec}))
+        self.assertEqual(len(list(carver.feed(padded(sample('png')))) + list(carver.close())), 1)
+        self.assertEqual(seen, [memoryview])
+
+    def test_saved_from_memory_and_from_a_spilled_buffer(self):
+        png, gif = sample('png', size=20000), sample('gif')
+        with tempfile.TemporaryDirectory() as out:
+            for window in (1 << 20, 2048):
+                saved = []
+                for number, carve in enumerate(self.carves(padded(png, gif), window=window, spill_dir=out)):
+                    filename = os.path.join(out, '%d-%d' % (window, number))
+                    save_carve(carve, filename)
+                    with open(filename, 'rb') as f:
+                        saved.append(f.read())
+                with self.subTest(window=window):
+                    self.assertEqual(saved, [png, gif])
+
+    def test_extracted_files_match(self):
+        files = [sample(ext, seed) for seed, ext in enumerate(('png', 'jpg', 'zip', 'pdf'))]
+        with tempfile.TemporaryDirectory() as tmp:
+            out = os.path.join(tmp, 'out')
+            found = run(write_capture(os.path.join(tmp, 'in.pcap'), [padded(*files)]), out,
+                        ['png', 'jpg', 'zip', 'pdf'])
+            saved = []
+            for event in found:
+                with open(os.path.join(out, event.filename), 'rb') as f:
+                    saved.append(f.read())
+        self.assertEqual(saved, files)
+
+
+class SpillTest(unittest.TestCase):
+    TYPES = ('png', 'gif', 'zip', 'pdf')
+
+    def test_spilled_carves_are_the_same(self):
+        files = [sample(ext, seed, size=30000) for seed, ext in enumerate(self.TYPES * 2)]
+        data = padded(*files)
+        stats = Stats()
+        with tempfile.TemporaryDirectory() as spill_dir:
+            spilled = carve(data, types(*self.TYPES), piece=1000, stats=stats, window=4096,
+                            spill_dir=spill_dir)
+            self.assertEqual(os.listdir(spill_dir), [])
+        self.assertEqual([c for _, _, c in spilled], files)
+        self.assertEqual(stats.counters['spills'], len(files))
+
+    def test_back_in_memory_once_settled(self):
+        carver = StreamCarver(SignatureScanner(types('png')), window=4096, chunk_size=1000)
+        data = padded(sample('png', size=30000))
+        self.assertEqual(list(carver.feed(data[:20000])), [])
+        self.assertEqual(carver.held, 0)
+        self.assertEqual(len(list(carver.feed(data[20000:]))), 1)
+        self.assertIsInstance(carver.buf, bytearray)
+        self.assertLessEqual(carver.held, 1000)
+
+    def test_flows_kept_under_max_memory(self):
+        flows = {stream: padded(sample('png', stream, size=20000)) for stream in range(10)}
+        chunks = [Chunk(stream, 0, data[pos:pos + 500])
+                  for pos in range(0, 25000, 500) for stream, data in flows.items() if pos < len(data)]
+        chunks += [Chunk(stream, None, None) for stream in flows]
+        results = {}
+        for max_memory in (None, 20000):
+            carver = FlowCarver(types('png'), max_memory, chunk_size=1000)
+            found = []
+            for chunk in chunks:
+                found += [(c.stream, bytes(c.data)) for c in carver.feed(chunk)]
+                if max_memory:
+                    self.assertLessEqual(sum(c.held for c in carver.carvers.values()), max_memory)
+            results[max_memory] = found
+        self.assertEqual(len(results[None]), 10)
+        self.assertEqual(results[20000], results[None])
+
+
+class MaxSizeTest(unittest.TestCase):
+    RAW = {'raw': {'headers': [(b'RAW!', 0)], 'footer': None, 'max_size': 1000}}
+
+    def test_ends_at_the_next_header(self):
+        data = b'RAW!' + b'.' * 500 + b'RAW!' + b'.' * 100
+        self.assertEqual([c for _, _, c in carve(data, self.RAW, piece=64)], [data[:504], data[504:]])
+
+    def test_abandoned_past_max_size(self):
+        stats = Stats()
+        data = b'RAW!' + b'.' * 3000 + b'RAW!' + b'.' * 100
+        self.assertEqual([c for _, _, c in carve(data, self.RAW, piece=64, stats=stats)], [data[3004:]])
+        self.assertEqual(stats.counters['abandoned'], {'raw': 1})
+
+    def test_footer_and_size_past_max_size(self):
+        png, zipped = sample('png'), sample('zip')
+        small = {ext: dict(FILE_TYPES[ext], max_size=len(png) - 1) for ext in ('png', 'zip')}
+        stats = Stats()
+        self.assertEqual(carve(padded(png, zipped), small, stats=stats), [])
+        self.assertEqual(set(stats.counters['abandoned']), {'png', 'zip'})
+
+    def test_declared_past_max_size_is_dropped_at_once(self):
+        # Neither candidate is held until max_size bytes have gone by
+        elf, tiff = bytearray(sample('elf')), bytearray(sample('tiff'))
+        struct.pack_into('<Q', elf, 40, 1 << 40)
+        struct.pack_into('<HHII', tiff, tiff.index(struct.pack('<HHI', 258, 3, 1)), 258, 3, 1000, 1 << 30)
+        for ext, data in (('elf', elf), ('tiff', tiff)):
+            stats = Stats()
+            carver = StreamCarver(SignatureScanner(types(ext)), stats=stats, chunk_size=1024)
+            with self.subTest(ext=ext):
+                self.assertEqual(list(carver.feed(padded(bytes(data)))), [])
+                self.assertEqual((carver.pending, stats.counters['abandoned']), ([], {ext: 1}))
+
+
+def _raising_size(buf, start, state, eof):
+    if start + 8 > len(buf):
+        return None if eof else NEED_MORE
+    if buf[start + 6] == ord('!'):
+        raise ValueError("resolver bug")
+    return 16
+
+
+def _raising_validate(data):
+    if bytes(data[6:7]) == b'?':
+        raise IndexError("validator bug")
+    return True
+
+
+class FailureTest(unittest.TestCase):
+    TYPES = {'boom': {'headers': [(b'BOOM', 0)], 'footer': None, 'max_size': 1024, 'size': _raising_size,
+                      'validate': _raising_validate}}
+
+    def test_raising_resolver_and_validator_reject_the_candidate(self):
+        good = b'BOOM..' + b'=' * 10
+        data = padded(good, b'BOOM..!' + b'=' * 9, b'BOOM..?' + b'=' * 9, good, filler=b' ' * 40)
+        stats = Stats()
+        carves = carve(data, self.TYPES, piece=17, stats=stats)
+        self.assertEqual([bytes(c) for _, _, c in carves], [good, good])
+        self.assertEqual(stats.counters['errors'], {'boom': 2})
+        self.assertEqual(stats.counters['rejected'], {'boom': 2})
+        # Every timer started was stopped
+        self.assertEqual(stats._stack, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+"""The shared extraction generator: progress, laziness and type selection.
+
+Run with ``python -m pytest tests`` (or ``python -m unittest``).
+"""
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from support import padded, sample, write_capture  # noqa: E402
+from en1gma.cache import PayloadCache  # noqa: E402
+from en1gma.engine import PROGRESS_STEP, Extracted, Progress, build_specs, extract  # noqa: E402
+from en1gma.signatures import FILE_TYPES  # noqa: E402
+
+
+class ExtractTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.tmp = self.directory.name
+        self.flows = [padded(sample('png', n), sample('gif', n), sample('zip', n)) for n in range(5)]
+        self.pcap = write_capture(os.path.join(self.tmp, 'in.pcap'), self.flows)
+        self.out = os.path.join(self.tmp, 'out')
+
+    def test_progress(self):
+        events = list(extract(self.pcap, self.out, ['png', 'gif', 'zip']))
+        progress = [e for e in events if isinstance(e, Progress)]
+        payload = sum(len(flow) for flow in self.flows)
+        # Steady, bounded by the capture size, and exact at the end
+        self.assertGreater(len(progress), 10)
+        self.assertLessEqual(len(progress), 1 / PROGRESS_STEP + 1)
+        self.assertEqual([e.done for e in progress], sorted(e.done for e in progress))
+        for event in progress[:-1]:
+            self.assertEqual(event.total, os.path.getsize(self.pcap))
+        self.assertEqual(progress[-1][:2], (payload, payload))
+        self.assertIs(events[-1], progress[-1])
+
+    def test_files_come_as_their_flows_are_read(self):
+        events = list(extract(self.pcap, self.out, ['png', 'gif', 'zip']))
+        streams = [e.stream for e in events if isinstance(e, Extracted)]
+        self.assertEqual(streams, sorted(streams))
+        first_of_last = next(i for i, e in enumerate(events) if isinstance(e, Extracted) and e.stream == 4)
+        self.assertTrue(any(isinstance(e, Progress) and e.stream == 4 for e in events[:first_of_last]))
+        self.assertLess(max(i for i, e in enumerate(events) if isinstance(e, Extracted) and e.stream == 0),
+                        first_of_last)
+
+    def test_stopping_early(self):
+        events = extract(self.pcap, self.out, ['png'])
+        first = next(e for e in events if isinstance(e, Extracted))
+        events.close()
+        self.assertEqual(sorted(os.listdir(self.out)), ['manifest.jsonl', os.path.basename(first.filename)])
+        with open(os.path.join(self.out, 'manifest.jsonl')) as f:
+            self.assertEqual(len(f.readlines()), 1)
+
+    def test_total_from_the_cache(self):
+        cache = PayloadCache(os.path.join(self.tmp, 'cache'))
+        list(extract(self.pcap, self.out, ['png'], cache=cache))
+        progress = [e for e in extract(self.pcap, self.out, ['png'], cache=cache) if isinstance(e, Progress)]
+        payload = sum(len(flow) for flow in self.flows)
+        self.assertEqual({e.total for e in progress}, {payload})
+
+
+class BuildSpecsTest(unittest.TestCase):
+    def test_selection_and_caps(self):
+        self.assertEqual(list(build_specs()), list(FILE_TYPES))
+        specs = build_specs(['gif', 'png', 'nope'], {'png': 1000, 'zip': 5})
+        self.assertEqual(list(specs), ['gif', 'png'])
+        self.assertEqual(specs['png']['max_size'], 1000)
+        self.assertIs(specs['gif'], FILE_TYPES['gif'])
+        self.assertNotEqual(FILE_TYPES['png']['max_size'], 1000)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+"""Capture filters: matching, tshark pushdown and filtered extraction.
+
+Run with ``python -m pytest tests`` (or ``python -m unittest``).
+"""
+import hashlib
+import os
+import sys
+import tempfile
+import unittest
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from support import padded, run, sample, write_capture  # noqa: E402
+from en1gma.filters import CaptureFilter, parse_list, parse_time  # noqa: E402
+from en1gma.pcap_reader import Segment  # noqa: E402
+
+
+def segment(src='10.0.0.1', sport=40000, dst='10.0.0.2', dport=80):
+    return Segment(1.0, 6, src, sport, dst, dport, 0, 0, b'')
+
+
+class CaptureFilterTest(unittest.TestCase):
+    def test_empty_selects_everything(self):
+        f = CaptureFilter()
+        self.assertFalse(f)
+        self.assertFalse(f.selects_flows)
+        self.assertTrue(f.flow(7, segment()))
+        self.assertTrue(f.packet(0.0))
+        self.assertIsNone(f.tshark_filter())
+
+    def test_hosts_either_end(self):
+        f = CaptureFilter(hosts=['10.0.0.0/24', '2001:db8::1'])
+        self.assertTrue(f.flow(0, segment()))
+        self.assertTrue(f.flow(0, segment(src='192.0.2.1')))
+        self.assertTrue(f.flow(0, segment(src='2001:db8::5', dst='2001:db8::1')))
+        self.assertFalse(f.flow(0, segment(src='192.0.2.1', dst='10.0.1.2')))
+        self.assertFalse(f.flow(0, segment(src='2001:db8::5', dst='2001:db8::6')))
+
+    def test_ports_and_streams(self):
+        f = CaptureFilter(ports=['443', 80], streams=[3])
+        self.assertTrue(f.flow(3, segment()))
+        self.assertFalse(f.flow(4, segment()))
+        self.assertFalse(f.flow(3, segment(sport=1, dport=2)))
+
+    def test_time_range(self):
+        f = CaptureFilter(start=10.0, end=20.0)
+        self.assertEqual([f.packet(ts) for ts in (9.9, 10.0, 20.0, 20.1)], [False, True, True, False])
+        self.assertTrue(CaptureFilter(end=5.0).packet(-1.0))
+
+    def test_errors(self):
+        with self.assertRaises(ValueError):
+            CaptureFilter(hosts=['example.com'])
+        with self.assertRaises(ValueError):
+            CaptureFilter(start=20.0, end=10.0)
+        with self.assertRaises(ValueError):
+            parse_time('yesterday')
+
+    def test_tshark_filter(self):
+        f = CaptureFilter(hosts=['10.0.0.0/8', '2001:db8::/32'], ports=[443, 80], start=1.5, end=2.5,
+                          display_filter='http', udp=True)
+        self.assertEqual(f.tshark_filter(),
+                         "(http) and (ip.addr == 10.0.0.0/8 or ipv6.addr == 2001:db8::/32)"
+                         " and (tcp.port in {80 443} or udp.port in {80 443})"
+                         " and frame.time_epoch >= 1.5 and frame.time_epoch <= 2.5")
+        # Stream numbers need every flow numbered, so only the free-form part goes
+        self.assertEqual(CaptureFilter(ports=[80], streams=[1], display_filter='http').tshark_filter(), "(http)")
+        self.assertIsNone(CaptureFilter(udp=True).tshark_filter())
+
+    def test_parsing(self):
+        self.assertEqual(parse_time(' 1600000000.5 '), 1600000000.5)
+        self.assertEqual(parse_time('2020-09-13 12:26'), datetime(2020, 9, 13, 12, 26).timestamp())
+        self.assertEqual(parse_list('80, 443 8080', int), [80, 443, 8080])
+
+    def test_describe(self):
+        f = CaptureFilter(hosts=['10.0.0.1'], ports=[80], streams=[2, 1], udp=True)
+        self.assertEqual(f.describe(), "hosts 10.0.0.1/32; ports 80; streams 1, 2; TCP and UDP")
+
+
+class FilteredExtractionTest(unittest.TestCase):
+    """Flow n comes from port 40000 + n and starts at 1000 + n seconds."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        cls.files = [sample('png', n) for n in range(4)]
+        cls.pcap = write_capture(os.path.join(cls.directory.name, 'in.pcap'), [padded(f) for f in cls.files])
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.directory.cleanup()
+
+    def streams(self, **kwargs):
+        out = tempfile.mkdtemp(dir=self.directory.name)
+        found = run(self.pcap, out, ['png'], capture_filter=CaptureFilter(**kwargs))
+        for event in found:
+            self.assertEqual(event.sha256, hashlib.sha256(self.files[event.stream]).hexdigest())
+        return [event.stream for event in found]
+
+    def test_filters(self):
+        cases = [
+            ({}, [0, 1, 2, 3]),
+            ({'ports': [40001, 40003]}, [1, 3]),
+            ({'streams': [2]}, [2]),
+            ({'start': 1001.5, 'end': 1002.5}, [2]),
+            ({'hosts': ['10.0.0.0/30']}, [0, 1, 2, 3]),
+            ({'hosts': ['192.168.0.0/16']}, []),
+            ({'ports': [40000, 40002], 'streams': [2, 3]}, [2]),
+        ]
+        for kwargs, expected in cases:
+            with self.subTest(**kwargs):
+                self.assertEqual(self.streams(**kwargs), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
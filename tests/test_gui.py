@@ -0,0 +1,160 @@
+"""The GUI's results table and extraction thread: rows handed over in
+batches, throttled updates and cancelling a run. Needs PyQt5; the Qt
+platform is set to offscreen so no display is needed.
+
+Run with ``python -m pytest tests`` (or ``python -m unittest``).
+"""
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+from support import ROOT, padded, sample, write_capture  # noqa: E402
+
+try:
+    from PyQt5.QtCore import QCoreApplication, Qt
+    sys.path.insert(0, ROOT)
+    import PCAP_Extractor_GUI as gui
+except ImportError:
+    gui = None
+
+
+@unittest.skipUnless(gui, "PyQt5 is not installed")
+class ResultsModelTest(unittest.TestCase):
+    ROWS = [('png', 5000, 0, 'a' * 64, 'out/png_1.png', None),
+            ('zip', 1234567, 3, 'b' * 64, 'out/zip_2.zip', 'bad central directory')]
+
+    def setUp(self):
+        self.model = gui.ResultsModel()
+
+    def test_rows_are_added_in_batches(self):
+        inserted = []
+        self.model.rowsInserted.connect(lambda parent, first, last: inserted.append((first, last)))
+        self.model.add_rows(self.ROWS[:1])
+        self.model.add_rows(self.ROWS[1:])
+        self.assertEqual(inserted, [(0, 0), (1, 1)])
+        self.assertEqual((self.model.rowCount(), self.model.columnCount()), (2, 5))
+        # A table model: no rows under a cell
+        self.assertEqual(self.model.rowCount(self.model.index(0, 0)), 0)
+        self.assertEqual(self.model.filename(1), 'out/zip_2.zip')
+
+    def test_cells(self):
+        self.model.add_rows(self.ROWS)
+        cells = [[self.model.data(self.model.index(row, column)) for column in range(5)] for row in range(2)]
+        self.assertEqual(cells, [['PNG', '5,000', 0, 'a' * 64, 'out/png_1.png'],
+                                 ['ZIP', '1,234,567', 3, 'b' * 64, 'out/zip_2.zip']])
+        self.assertEqual([self.model.headerData(column, Qt.Horizontal) for column in range(5)],
+                         list(gui.ResultsModel.COLUMNS))
+        self.assertIsNone(self.model.headerData(0, Qt.Vertical))
+        self.assertTrue(self.model.data(self.model.index(0, 1), Qt.TextAlignmentRole) & Qt.AlignRight)
+        self.assertIsNone(self.model.data(self.model.index(0, 0), Qt.TextAlignmentRole))
+
+    def test_invalid_rows_are_marked(self):
+        self.model.add_rows(self.ROWS)
+        self.assertIsNone(self.model.data(self.model.index(0, 0), Qt.ForegroundRole))
+        self.assertIsNotNone(self.model.data(self.model.index(1, 0), Qt.ForegroundRole))
+        self.assertEqual(self.model.data(self.model.index(0, 4), Qt.ToolTipRole), 'out/png_1.png')
+        self.assertEqual(self.model.data(self.model.index(1, 4), Qt.ToolTipRole),
+                         'Failed the deep check: bad central directory')
+
+    def test_clear(self):
+        reset = []
+        self.model.modelReset.connect(lambda: reset.append(True))
+        self.model.add_rows(self.ROWS)
+        self.model.clear()
+        self.assertEqual((self.model.rowCount(), reset), (0, [True]))
+
+
+@unittest.skipUnless(gui, "PyQt5 is not installed")
+class ExtractionThreadTest(unittest.TestCase):
+    FILES = [sample(ext, seed) for seed, ext in enumerate(('png', 'gif', 'pdf'))]
+
+    @classmethod
+    def setUpClass(cls):
+        cls.app = QCoreApplication.instance() or QCoreApplication([])
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.out = os.path.join(directory.name, 'out')
+        self.pcap = write_capture(os.path.join(directory.name, 'in.pcap'), [padded(f) for f in self.FILES])
+
+    def thread(self, types=('png', 'gif', 'pdf')):
+        """A thread and the (signal, arguments) it emits, recorded in order."""
+        thread = gui.ExtractionThread(self.pcap, self.out, list(types))
+        emitted = []
+        thread.update_progress.connect(lambda *args: emitted.append(('progress', args)), Qt.DirectConnection)
+        thread.files_found.connect(lambda rows: emitted.append(('files', rows)), Qt.DirectConnection)
+        thread.finished.connect(lambda *args: emitted.append(('finished', args)), Qt.DirectConnection)
+        return thread, emitted
+
+    def test_finished(self):
+        thread, emitted = self.thread()
+        thread.run()
+        rows = [row for signal, args in emitted if signal == 'files' for row in args]
+        self.assertEqual([(ext, size, stream) for ext, size, stream, _, _, _ in rows],
+                         [('png', len(self.FILES[0]), 0), ('gif', len(self.FILES[1]), 1),
+                          ('pdf', len(self.FILES[2]), 2)])
+        self.assertTrue(all(os.path.isfile(row[4]) for row in rows))
+        success, message = emitted[-1][1]
+        self.assertTrue(success)
+        self.assertTrue(message.startswith("✔ Success! Extracted 3 files to:"))
+
+    def test_nothing_new(self):
+        thread, emitted = self.thread(['jpg'])
+        thread.run()
+        self.assertEqual(emitted[-1], ('finished', (False, "No matching files found in payload")))
+        self.thread()[0].run()
+        thread, emitted = self.thread()
+        thread.run()
+        self.assertEqual(emitted[-1], ('finished', (False, "No new files: all 3 matches were already extracted")))
+
+    def test_updates_are_throttled(self):
+        # Updates due every event, then never: rows go out per file, or all at the end
+        for interval, batches in ((0, [1, 1, 1]), (float('inf'), [3])):
+            with self.subTest(interval=interval), mock.patch.object(gui, 'UPDATE_INTERVAL', interval):
+                thread, emitted = self.thread()
+                # A fresh output directory, or the second run only finds duplicates
+                thread.output_dir = os.path.join(self.out, str(interval))
+                thread.run()
+                self.assertEqual([len(args) for signal, args in emitted if signal == 'files'], batches)
+                progress = [args for signal, args in emitted if signal == 'progress']
+                self.assertEqual(progress[0], (10, "Extracting network payloads..."))
+                self.assertEqual(progress[-1][1], "Extracted 3 files (latest: PDF)")
+                self.assertTrue(all(10 <= value <= 95 for value, _ in progress))
+                if interval:
+                    self.assertEqual(len(progress), 2)
+
+    def test_cancel(self):
+        thread, emitted = self.thread()
+        # Cancelled as soon as the first file reaches the table
+        thread.files_found.connect(lambda rows: thread.cancel(), Qt.DirectConnection)
+        with mock.patch.object(gui, 'UPDATE_INTERVAL', 0):
+            thread.run()
+        self.assertEqual(emitted[-1], ('finished', (False, "Extraction cancelled: 1 files saved")))
+        self.assertEqual(sum(len(args) for signal, args in emitted if signal == 'files'), 1)
+        saved = [name for name in os.listdir(self.out) if name != 'manifest.jsonl']
+        self.assertEqual(len(saved), 1)
+
+    def test_cancel_a_running_thread(self):
+        thread, emitted = self.thread()
+        thread.cancel()
+        thread.start()
+        self.assertTrue(thread.wait(10000))
+        self.assertEqual(emitted[-1], ('finished', (False, "Extraction cancelled: 0 files saved")))
+
+    def test_failure_is_reported(self):
+        thread, emitted = self.thread()
+        thread.pcap_path = os.path.join(self.out, 'missing.pcap')
+        thread.run()
+        success, message = emitted[-1][1]
+        self.assertFalse(success)
+        self.assertTrue(message.startswith("✖ Extraction failed:"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,160 @@
+"""HTTP-aware carving: framing, de-chunking, content codings and fallback.
+
+Run with ``python -m pytest tests`` (or ``python -m unittest``).
+"""
+import gzip
+import os
+import sys
+import unittest
+import zlib
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from support import padded, sample  # noqa: E402
+from en1gma.http import HttpFlowCarver  # noqa: E402
+from en1gma.reassembly import Chunk  # noqa: E402
+from en1gma.signatures import FILE_TYPES  # noqa: E402
+from en1gma.stats import Stats  # noqa: E402
+
+TYPES = ('png', 'gif', 'zip')
+REQUEST = b'GET /a.png HTTP/1.1\r\nHost: example.com\r\n\r\n'
+
+
+def response(body, *headers, status=b'200 OK'):
+    return b'HTTP/1.1 ' + status + b'\r\n' + b''.join(h + b'\r\n' for h in headers) + b'\r\n' + body
+
+
+def sized(body, *headers, status=b'200 OK'):
+    return response(body, b'Content-Length: %d' % len(body), *headers, status=status)
+
+
+def chunked(body, *headers, size=1000):
+    pieces = [b'%x;ext=1\r\n' % len(body[pos:pos + size]) + body[pos:pos + size] + b'\r\n'
+              for pos in range(0, len(body), size)]
+    return response(b''.join(pieces) + b'0\r\nX-Trailer: yes\r\n\r\n', b'Transfer-Encoding: chunked', *headers)
+
+
+def carve(client, server, piece=4096, types=TYPES, stats=None, close=True, **specs):
+    """Carve a flow of ``client`` then ``server`` bytes; returns (ext, offset, bytes, meta) per carve."""
+    file_types = {ext: dict(FILE_TYPES[ext], **specs) for ext in types}
+    carver = HttpFlowCarver(file_types, stats=stats)
+    chunks = [Chunk(0, 0, client[pos:pos + piece]) for pos in range(0, len(client), piece)]
+    chunks += [Chunk(0, 1, server[pos:pos + piece]) for pos in range(0, len(server), piece)]
+    if close:
+        chunks.append(Chunk(0, None, None))
+    out = []
+    for chunk in chunks:
+        out += [(c.ext, c.offset, bytes(c.data), c.meta) for c in carver.feed(chunk)]
+    out += [(c.ext, c.offset, bytes(c.data), c.meta) for c in carver.close()]
+    return out
+
+
+class FramingTest(unittest.TestCase):
+    def setUp(self):
+        self.png, self.gif = sample('png'), sample('gif')
+
+    def test_content_length(self):
+        server = sized(self.png, b'Content-Type: image/png')
+        for piece in (1, 7, 4096):
+            with self.subTest(piece=piece):
+                self.assertEqual(carve(REQUEST, server, piece), [
+                    ('png', server.index(self.png), self.png,
+                     {'url': 'http://example.com/a.png', 'content_type': 'image/png'})])
+
+    def test_chunked(self):
+        for piece in (1, 13, 4096):
+            with self.subTest(piece=piece):
+                self.assertEqual([data for _, _, data, _ in carve(REQUEST, chunked(self.png), piece)], [self.png])
+
+    def test_until_the_connection_closes(self):
+        self.assertEqual([data for _, _, data, _ in carve(REQUEST, response(self.png))], [self.png])
+
+    def test_pipelined_and_bodiless(self):
+        client = (REQUEST + b'HEAD /b HTTP/1.1\r\n\r\n' + b'GET /c HTTP/1.1\r\n\r\n'
+                  + b'GET /d.gif HTTP/1.1\r\nHost: h\r\n\r\n')
+        server = (sized(self.png) + response(b'', b'Content-Length: 500') + response(b'', status=b'304 Not Modified')
+                  + response(b'', status=b'100 Continue') + chunked(self.gif))
+        self.assertEqual([(ext, meta['url']) for ext, _, _, meta in carve(client, server)],
+                         [('png', 'http://example.com/a.png'), ('gif', 'http://h/d.gif')])
+
+    def test_body_cut_short_is_not_carved(self):
+        stats = Stats()
+        server = sized(self.png)[:-100]
+        self.assertEqual(carve(REQUEST, server, stats=stats), [])
+        self.assertEqual(stats.counters['abandoned'], {'png': 1})
+
+    def test_other_bodies_are_scanned(self):
+        body = b'--boundary\r\nContent-Type: image/gif\r\n\r\n' + self.gif + b'\r\n--boundary--\r\n'
+        client = b'POST /up HTTP/1.1\r\nContent-Length: %d\r\n\r\n' % len(body) + body
+        server = sized(b'ok')
+        (ext, offset, data, meta), = carve(client, server)
+        self.assertEqual((ext, data), ('gif', self.gif))
+        self.assertEqual(offset, client.index(body))
+        self.assertEqual(meta['body_offset'], body.index(self.gif))
+        self.assertEqual(meta['url'], '/up')
+
+
+class ContentCodingTest(unittest.TestCase):
+    def setUp(self):
+        self.png = sample('png', size=30000)
+
+    def check(self, server, piece=4096):
+        (ext, _, data, meta), = carve(REQUEST, server, piece)
+        self.assertEqual((ext, data), ('png', self.png))
+        return meta
+
+    def test_gzip(self):
+        meta = self.check(sized(gzip.compress(self.png), b'Content-Encoding: gzip'))
+        self.assertEqual(meta['content_encoding'], 'gzip')
+
+    def test_deflate_wrapped_and_raw(self):
+        raw = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+        for body in (zlib.compress(self.png), raw.compress(self.png) + raw.flush()):
+            with self.subTest(wrapped=body[0] & 0x0F == 8):
+                self.check(sized(body, b'Content-Encoding: deflate'))
+
+    def test_chunked_gzip(self):
+        for piece in (1, 700):
+            with self.subTest(piece=piece):
+                self.check(chunked(gzip.compress(self.png), b'Content-Encoding: gzip', size=333), piece)
+
+    def test_bad_encoding_is_not_carved(self):
+        body = bytearray(gzip.compress(self.png))
+        body[len(body) // 2] ^= 0xFF
+        self.assertEqual(carve(REQUEST, sized(bytes(body), b'Content-Encoding: gzip')), [])
+
+    def test_inflating_past_max_size_stops(self):
+        stats = Stats()
+        body = gzip.compress(self.png + bytes(200000))
+        self.assertEqual(carve(REQUEST, sized(body, b'Content-Encoding: gzip'), types=('png',), stats=stats,
+                               max_size=50000), [])
+        self.assertEqual(stats.counters['abandoned'], {'png': 1})
+
+    def test_unknown_coding_is_scanned_as_is(self):
+        meta = self.check(sized(b'\x00' * 10 + self.png, b'Content-Encoding: br'))
+        self.assertEqual(meta['body_offset'], 10)
+
+
+class FallbackTest(unittest.TestCase):
+    def setUp(self):
+        self.png, self.gif = sample('png'), sample('gif')
+
+    def test_not_http(self):
+        data = padded(self.png)
+        self.assertEqual(carve(b'', data), [('png', 300, self.png, None)])
+
+    def test_upgrade(self):
+        server = response(b'', b'Upgrade: websocket', status=b'101 Switching Protocols') + padded(self.png)
+        self.assertEqual(carve(REQUEST, server), [('png', server.index(self.png), self.png, None)])
+
+    def test_bad_chunk_size(self):
+        server = response(b'zz\r\n' + padded(self.gif), b'Transfer-Encoding: chunked')
+        self.assertEqual(carve(REQUEST, server), [('gif', server.index(self.gif), self.gif, None)])
+
+    def test_conflicting_lengths(self):
+        server = response(padded(self.gif), b'Content-Length: 10', b'Content-Length: 20')
+        self.assertEqual([data for _, _, data, _ in carve(REQUEST, server)], [self.gif])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+"""Reading segments from tshark's field output, and the reader fallback.
+
+Run with ``python -m pytest tests`` (or ``python -m unittest``). A small
+script stands in for tshark: it prints the lines a test gives it and
+records the arguments it was called with.
+"""
+import os
+import stat
+import subprocess
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from support import capture_bytes  # noqa: E402
+from en1gma.ingest import iter_segments, tshark_segments  # noqa: E402
+from en1gma.pcap_reader import PROTO_TCP, PROTO_UDP, CaptureError  # noqa: E402
+
+FAKE_TSHARK = """#!{python}
+import sys
+with open({args!r}, 'w') as f:
+    f.write('\\n'.join(sys.argv[1:]))
+with open({output!r}) as f:
+    sys.stdout.write(f.read())
+sys.exit({status})
+"""
+
+
+def tcp_line(*values):
+    return "\t".join(values) + "\n"
+
+
+class FakeTsharkTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.path = os.environ['PATH']
+        self.addCleanup(os.environ.__setitem__, 'PATH', self.path)
+
+    def tshark(self, output, status=0):
+        """Put a tshark on PATH that prints ``output``; returns where its arguments go."""
+        base = self.directory.name
+        args = os.path.join(base, 'args')
+        with open(os.path.join(base, 'output'), 'w') as f:
+            f.write(output)
+        script = os.path.join(base, 'tshark')
+        with open(script, 'w') as f:
+            f.write(FAKE_TSHARK.format(python=sys.executable, args=args, output=os.path.join(base, 'output'),
+                                       status=status))
+        os.chmod(script, os.stat(script).st_mode | stat.S_IXUSR)
+        os.environ['PATH'] = base + os.pathsep + self.path
+        return args
+
+    def test_tcp_and_udp_fields(self):
+        self.tshark(
+            tcp_line("1.5", "10.0.0.1", "", "40000", "10.0.0.2", "", "80", "1", "0x0018", "68656c6c6f", "", "", "")
+            + tcp_line("1.6", "", "2001:db8::1", "40001", "", "2001:db8::2", "80", "1", "0x0011", "", "", "", "")
+            + tcp_line("1.7", "10.0.0.1", "", "", "10.0.0.3", "", "", "", "", "", "53", "5353", "6869"))
+        segments = list(tshark_segments("any.pcap", udp=True))
+        self.assertEqual([(s.proto, s.src, s.sport, s.dst, s.dport, s.seq, s.flags, s.payload) for s in segments], [
+            (PROTO_TCP, "10.0.0.1", 40000, "10.0.0.2", 80, 1, 0x18, b"hello"),
+            (PROTO_TCP, "2001:db8::1", 40001, "2001:db8::2", 80, 1, 0x11, b""),
+            (PROTO_UDP, "10.0.0.1", 53, "10.0.0.3", 5353, 0, 0, b"hi"),
+        ])
+        self.assertEqual(segments[0].ts, 1.5)
+
+    def test_tunnelled_fields_take_the_innermost(self):
+        args = self.tshark(tcp_line("2.0", "192.0.2.1,10.0.0.1", "", "4789,40000", "192.0.2.2,10.0.0.2", "",
+                                    "4789,80", "7,1", "0x0018", "6869"))
+        segments = list(tshark_segments("any.pcap"))
+        self.assertEqual([(s.src, s.sport, s.dst, s.dport, s.seq, s.payload) for s in segments],
+                         [("10.0.0.1", 40000, "10.0.0.2", 80, 1, b"hi")])
+        with open(args) as f:
+            self.assertIn("occurrence=l", f.read().split("\n"))
+
+    def test_lines_that_do_not_parse_are_skipped(self):
+        self.tshark(tcp_line("3.0", "10.0.0.1", "", "n/a", "10.0.0.2", "", "80", "1", "0x0018", "6869")
+                    + tcp_line("3.1", "10.0.0.1", "", "40000", "10.0.0.2", "", "80", "1", "0x0018", "zz")
+                    + "cut off\n"
+                    + tcp_line("3.2", "10.0.0.1", "", "40000", "10.0.0.2", "", "80", "3", "0x0018", "6869"))
+        self.assertEqual([s.ts for s in tshark_segments("any.pcap")], [3.2])
+
+    def test_filters_reach_tshark(self):
+        args = self.tshark("")
+        list(tshark_segments("any.pcap", display_filter="tcp.port == 80", udp=True))
+        with open(args) as f:
+            argv = f.read().split("\n")
+        wanted = argv[argv.index("-Y") + 1]
+        self.assertTrue(wanted.startswith("(tcp and not icmp"))
+        self.assertTrue(wanted.endswith("and (tcp.port == 80)"))
+        self.assertIn("udp.payload", argv)
+
+    def test_failure_is_raised(self):
+        self.tshark("", status=2)
+        with self.assertRaises(subprocess.CalledProcessError):
+            list(tshark_segments("any.pcap"))
+
+    def test_auto_falls_back_for_other_link_types(self):
+        self.tshark(tcp_line("4.0", "10.0.0.1", "", "40000", "10.0.0.2", "", "80", "1", "0x0018", "6869"))
+        with tempfile.NamedTemporaryFile(suffix='.pcap') as f:
+            data = bytearray(capture_bytes([b"hi"]))
+            data[20:24] = (147).to_bytes(4, 'little')  # A user link type
+            f.write(data)
+            f.flush()
+            self.assertEqual([s.payload for s in iter_segments(f.name, "auto")], [b"hi"])
+            with self.assertRaises(CaptureError):
+                list(iter_segments(f.name, "native"))
+
+
+if __name__ == '__main__':
+    unittest.main()
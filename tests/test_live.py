@@ -0,0 +1,113 @@
+"""Reading captures as they are written: pipes, followed files and stdin.
+
+Run with ``python -m pytest tests`` (or ``python -m unittest``).
+"""
+import io
+import os
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from support import capture_bytes, padded, sample  # noqa: E402
+from en1gma.engine import Extracted, extract  # noqa: E402
+from en1gma.pcap_reader import PacketParser, iter_packets, iter_packets_live  # noqa: E402
+
+
+def feed_pipe(data, step=997, done=None):
+    """A pipe's read end, written ``data`` in pieces from a thread.
+
+    The pipe is closed once everything is written, or with ``done`` once
+    that event is set (or after five seconds).
+    """
+    read_fd, write_fd = os.pipe()
+
+    def writer():
+        with os.fdopen(write_fd, 'wb', buffering=0) as f:
+            for pos in range(0, len(data), step):
+                f.write(data[pos:pos + step])
+            if done is not None:
+                done.wait(5)
+
+    thread = threading.Thread(target=writer, daemon=True)
+    thread.start()
+    return os.fdopen(read_fd, 'rb'), thread
+
+
+class LiveReaderTest(unittest.TestCase):
+    CAPTURE = capture_bytes([padded(sample('png')), padded(sample('gif'))])
+
+    def expected(self):
+        with tempfile.NamedTemporaryFile(suffix='.pcap') as f:
+            f.write(self.CAPTURE)
+            f.flush()
+            return [(packet.ts, bytes(packet.data)) for packet in iter_packets(f.name)]
+
+    def test_parser_any_split(self):
+        for step in (1, 13, 4096):
+            parser = PacketParser()
+            packets = []
+            for pos in range(0, len(self.CAPTURE), step):
+                packets += [(p.ts, p.data) for p in parser.feed(self.CAPTURE[pos:pos + step])]
+            with self.subTest(step=step):
+                self.assertEqual(packets, self.expected())
+
+    def test_pipe(self):
+        f, thread = feed_pipe(self.CAPTURE)
+        with f:
+            packets = [(p.ts, p.data) for p in iter_packets_live(f, poll_interval=0.05) if p is not None]
+        thread.join()
+        self.assertEqual(packets, self.expected())
+
+    def test_followed_file_ticks_while_idle(self):
+        half = len(self.CAPTURE) // 2
+        with tempfile.NamedTemporaryFile(suffix='.pcap') as out, open(out.name, 'rb') as f:
+            out.write(self.CAPTURE[:half])
+            out.flush()
+            packets, ticks = [], 0
+            for packet in iter_packets_live(f, follow=True, poll_interval=0.05):
+                if packet is not None:
+                    packets.append((packet.ts, packet.data))
+                    continue
+                ticks += 1
+                if ticks == 3:
+                    # Nothing new for a while: the file grows on
+                    out.write(self.CAPTURE[half:])
+                    out.flush()
+                if len(packets) == len(self.expected()):
+                    break
+                self.assertLess(ticks, 100)
+        self.assertEqual(packets, self.expected())
+
+
+class StdinExtractionTest(unittest.TestCase):
+    def test_carved_before_the_capture_ends(self):
+        # The flow stays open and the pipe with it, until the file is out
+        data = padded(sample('png'))
+        carved = threading.Event()
+        f, thread = feed_pipe(capture_bytes([data], close=False), done=carved)
+        stdin = sys.stdin
+        sys.stdin = io.TextIOWrapper(f)
+        try:
+            with tempfile.TemporaryDirectory() as out:
+                found = []
+                start = time.monotonic()
+                for event in extract('-', out, ['png']):
+                    if not isinstance(event, Extracted):
+                        continue
+                    found.append(event)
+                    self.assertFalse(carved.is_set())
+                    carved.set()
+                    elapsed = time.monotonic() - start
+        finally:
+            sys.stdin = stdin
+            thread.join()
+        self.assertEqual([event.ext for event in found], ['png'])
+        self.assertLess(elapsed, 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
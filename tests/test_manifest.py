@@ -0,0 +1,80 @@
+"""Deduplication by content hash, within a run and across runs.
+
+Run with ``python -m pytest tests`` (or ``python -m unittest``).
+"""
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from support import padded, run, sample, write_capture  # noqa: E402
+from en1gma.manifest import read_records  # noqa: E402
+
+
+class DedupTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.tmp = self.directory.name
+        self.png, self.gif = sample('png'), sample('gif')
+        self.pcap = write_capture(os.path.join(self.tmp, 'in.pcap'),
+                                  [padded(self.png, self.gif, self.png), padded(self.png)])
+        self.out = os.path.join(self.tmp, 'out')
+
+    def records(self, path=None):
+        return list(read_records(path or os.path.join(self.out, 'manifest.jsonl')))
+
+    def saved(self):
+        return sorted(name for name in os.listdir(self.out) if name != 'manifest.jsonl')
+
+    def test_within_a_run(self):
+        found = run(self.pcap, self.out, ['png', 'gif'])
+        self.assertEqual([(e.ext, e.stream) for e in found], [('png', 0), ('gif', 0), ('png', 0), ('png', 1)])
+        first = found[0].filename
+        self.assertEqual([e.duplicate_of for e in found], [None, None, first, first])
+        self.assertEqual([e.filename is None for e in found], [False, False, True, True])
+        self.assertEqual(len(self.saved()), 2)
+        # Every carve is recorded, duplicates with the file they repeat
+        records = self.records()
+        self.assertEqual([(r['file'], r['duplicate_of']) for r in records],
+                         [(e.filename, e.duplicate_of) for e in found])
+        self.assertEqual({r['sha256'] for r in records}, {found[0].sha256, found[1].sha256})
+        self.assertEqual({r['capture'] for r in records}, {self.pcap})
+
+    def test_across_runs(self):
+        first = run(self.pcap, self.out, ['png'])
+        again = run(self.pcap, self.out, ['png', 'gif'])
+        # Only the type not asked for before is new
+        self.assertEqual([e.ext for e in again if e.duplicate_of is None], ['gif'])
+        self.assertEqual({e.duplicate_of for e in again if e.ext == 'png'}, {first[0].filename})
+        self.assertEqual(len(self.saved()), 2)
+        self.assertEqual(len(self.records()), 7)
+
+    def test_known_manifests_are_read_not_written(self):
+        run(self.pcap, self.out, ['png'])
+        known = os.path.join(self.out, 'manifest.jsonl')
+        before = self.records()
+        other = os.path.join(self.tmp, 'other')
+        found = run(self.pcap, other, ['png', 'gif'], known_manifests=[known])
+        self.assertEqual([e.ext for e in found if e.duplicate_of is None], ['gif'])
+        self.assertEqual(self.records(), before)
+        self.assertEqual(len(self.records(os.path.join(other, 'manifest.jsonl'))), 4)
+
+    def test_without_dedup(self):
+        found = run(self.pcap, self.out, ['png', 'gif'], dedup=False)
+        self.assertEqual([e.duplicate_of for e in found], [None] * 4)
+        self.assertEqual(len(self.saved()), 4)
+
+    def test_torn_last_line(self):
+        run(self.pcap, self.out, ['png'])
+        with open(os.path.join(self.out, 'manifest.jsonl'), 'a') as f:
+            f.write('{"sha256": "cut o')
+        self.assertEqual(len(self.records()), 3)
+        # The next run still knows what the good lines list
+        self.assertEqual([e.duplicate_of is None for e in run(self.pcap, self.out, ['png'])], [False] * 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+"""Process-pool carving: the same carves in the same order as a serial run.
+
+Run with ``python -m pytest tests`` (or ``python -m unittest``).
+"""
+import hashlib
+import os
+import random
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from support import padded, run, sample, write_capture  # noqa: E402
+from en1gma import parallel  # noqa: E402
+from en1gma.carver import FlowCarver  # noqa: E402
+from en1gma.parallel import ParallelCarver  # noqa: E402
+from en1gma.reassembly import Chunk  # noqa: E402
+from en1gma.signatures import FILE_TYPES  # noqa: E402
+
+TYPES = ('png', 'gif', 'jpg', 'zip', 'pdf')
+
+
+def interleaved(seed=5, flows=8):
+    """Chunks of several flows whose pieces and ends arrive interleaved.
+
+    Flow 0 opens first and ends last, so everything the other flows carve
+    has to wait for it.
+    """
+    rnd = random.Random(seed)
+    pending = {}
+    for stream in range(flows):
+        files = [sample(rnd.choice(TYPES), rnd.randrange(100)) for _ in range(rnd.randrange(1, 4))]
+        data = padded(*files)
+        direction = stream % 2
+        pending[stream] = [(stream, direction, data[pos:pos + 1000]) for pos in range(0, len(data), 1000)]
+    chunks = [Chunk(*pending[0].pop(0))]
+    while any(pending.values()):
+        stream = rnd.choice([s for s, left in pending.items() if left and (s or len(pending) == 1)] or [0])
+        chunks.append(Chunk(*pending[stream].pop(0)))
+        if not pending[stream] and stream:
+            chunks.append(Chunk(stream, None, None))
+            del pending[stream]
+    chunks.append(Chunk(0, None, None))
+    return chunks
+
+
+class ParallelCarverTest(unittest.TestCase):
+    def serial(self, chunks):
+        carver = FlowCarver({ext: FILE_TYPES[ext] for ext in TYPES})
+        out = []
+        for chunk in chunks:
+            out += [(c.stream, c.direction, c.ext, c.offset, hashlib.sha256(c.data).hexdigest())
+                    for c in carver.feed(chunk)]
+        out += [(c.stream, c.direction, c.ext, c.offset, hashlib.sha256(c.data).hexdigest())
+                for c in carver.close()]
+        return out
+
+    def parallel(self, chunks, jobs=2, **kwargs):
+        with tempfile.TemporaryDirectory() as work_dir:
+            carver = ParallelCarver({ext: FILE_TYPES[ext] for ext in TYPES}, jobs, work_dir, **kwargs)
+            out = []
+            try:
+                for carve in [c for chunk in chunks for c in carver.feed(chunk)] + list(carver.close()):
+                    self.assertIsNone(carve.data)
+                    with open(carve.path, 'rb') as f:
+                        self.assertEqual(hashlib.sha256(f.read()).hexdigest(), carve.digest)
+                    out.append((carve.stream, carve.direction, carve.ext, carve.offset, carve.digest))
+            finally:
+                carver.shutdown()
+            # Spools, carves and the carving directory are all gone
+            self.assertEqual(os.listdir(work_dir), [])
+        return out
+
+    def test_released_in_serial_order(self):
+        chunks = interleaved()
+        expected = self.serial(chunks)
+        self.assertGreater(len(expected), 8)
+        self.assertEqual(self.parallel(chunks), expected)
+
+    def test_spooled_flows(self):
+        chunks = interleaved(seed=6)
+        with mock.patch.object(parallel, 'SPOOL_UNIT', 2000):
+            self.assertEqual(self.parallel(chunks, jobs=3), self.serial(chunks))
+
+    def test_flows_left_open(self):
+        # No end markers: every flow is carved on close. Reassembly ends
+        # every flow before that, so only the carves count, not their order
+        chunks = [chunk for chunk in interleaved(seed=7) if chunk.data is not None]
+        self.assertEqual(sorted(self.parallel(chunks)), sorted(self.serial(chunks)))
+
+
+class ParallelExtractionTest(unittest.TestCase):
+    def test_same_names_as_serial(self):
+        rnd = random.Random(8)
+        flows = [padded(*[sample(rnd.choice(TYPES), rnd.randrange(100)) for _ in range(3)]) for _ in range(6)]
+        with tempfile.TemporaryDirectory() as tmp:
+            pcap = write_capture(os.path.join(tmp, 'in.pcap'), flows)
+            runs = []
+            for jobs in (1, 2):
+                out = os.path.join(tmp, str(jobs))
+                found = run(pcap, out, list(TYPES), jobs=jobs)
+                names = [os.path.relpath(e.filename, out) for e in found]
+                self.assertEqual(sorted(os.listdir(out)), sorted(names + ['manifest.jsonl']))
+                # Names are <type>_<time of day>_<number>.<type>
+                runs.append([(name.split('_')[0], name.rsplit('_', 1)[1], e.sha256, e.stream, e.offset)
+                             for name, e in zip(names, found)])
+        self.assertEqual(len(runs[0]), 18)
+        self.assertEqual(runs[1], runs[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,184 @@
+"""The built-in reader: capture formats, link types and IP/TCP decoding.
+
+Run with ``python -m pytest tests`` (or ``python -m unittest``).
+"""
+import os
+import struct
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from support import capture_bytes  # noqa: E402
+from en1gma.pcap_reader import (  # noqa: E402
+    LINKTYPE_ETHERNET, LINKTYPE_LINUX_SLL, LINKTYPE_LINUX_SLL2, LINKTYPE_NULL, LINKTYPE_RAW, PROTO_TCP,
+    PROTO_UDP, CaptureError, PacketParser, iter_packets, iter_segments, parse_frame)
+
+SRC4, DST4 = bytes([10, 0, 0, 1]), bytes([10, 0, 0, 2])
+SRC6, DST6 = bytes(15) + b'\x01', bytes(15) + b'\x02'
+
+
+def block(btype, body):
+    body += b'\x00' * (-len(body) % 4)
+    length = len(body) + 12
+    return struct.pack('<II', btype, length) + body + struct.pack('<I', length)
+
+
+def pcapng(*packets):
+    """A pcapng capture of one raw-IP interface; ``ts`` None makes a Simple Packet Block."""
+    data = block(0x0A0D0D0A, struct.pack('<IHHq', 0x1A2B3C4D, 1, 0, -1))
+    data += block(1, struct.pack('<HHI', LINKTYPE_RAW, 0, 65535))
+    for ts, frame in packets:
+        if ts is None:
+            data += block(3, struct.pack('<I', len(frame)) + frame)
+        else:
+            micros = int(ts * 1e6)
+            data += block(6, struct.pack('<IIIII', 0, micros >> 32, micros & 0xFFFFFFFF,
+                                         len(frame), len(frame)) + frame)
+    return data
+
+
+class SimplePacketBlockTest(unittest.TestCase):
+    CAPTURE = pcapng((None, b'a'), (1000.5, b'b'), (None, b'c'), (None, b'd'), (2000.0, b'e'))
+    EXPECTED = [(0.0, b'a'), (1000.5, b'b'), (1000.5, b'c'), (1000.5, b'd'), (2000.0, b'e')]
+
+    def test_takes_previous_timestamp(self):
+        with tempfile.NamedTemporaryFile(suffix='.pcapng') as f:
+            f.write(self.CAPTURE)
+            f.flush()
+            packets = [(packet.ts, bytes(packet.data)) for packet in iter_packets(f.name)]
+        self.assertEqual(packets, self.EXPECTED)
+
+    def test_live_takes_previous_timestamp(self):
+        parser = PacketParser()
+        packets = []
+        for pos in range(0, len(self.CAPTURE), 7):
+            packets += [(packet.ts, packet.data) for packet in parser.feed(self.CAPTURE[pos:pos + 7])]
+        self.assertEqual(packets, self.EXPECTED)
+
+
+def tcp(payload, sport=40000, dport=80, seq=7, flags=0x18):
+    return struct.pack('!HHIIBBHHH', sport, dport, seq, 0, 5 << 4, flags, 65535, 0, 0) + payload
+
+
+def ipv4(transport, proto=PROTO_TCP, total_len=None, frag=0x4000):
+    if total_len is None:
+        total_len = 20 + len(transport)
+    return struct.pack('!BBHHHBBH4s4s', 0x45, 0, total_len, 0, frag, 64, proto, 0, SRC4, DST4) + transport
+
+
+def ipv6(transport, proto=PROTO_TCP, payload_len=None, hop_by_hop=False):
+    if hop_by_hop:
+        transport = bytes([proto, 0]) + bytes(6) + transport
+        proto = 0
+    if payload_len is None:
+        payload_len = len(transport)
+    return struct.pack('!IHBB16s16s', 6 << 28, payload_len, proto, 64, SRC6, DST6) + transport
+
+
+def ethernet(packet, ethertype=0x0800, vlans=0):
+    tags = struct.pack('!HH', 0x8100, 5) * vlans
+    return bytes(12) + tags + struct.pack('!H', ethertype) + packet
+
+
+def pcap(frames, magic=0xA1B2C3D4, endian='<', linktype=LINKTYPE_ETHERNET):
+    """A classic pcap; ``magic`` 0xA1B23C4D has nanosecond timestamps."""
+    scale = 1e9 if magic == 0xA1B23C4D else 1e6
+    data = struct.pack(endian + 'IHHiIII', magic, 2, 4, 0, 0, 65535, linktype)
+    for ts, frame in frames:
+        data += struct.pack(endian + 'IIII', int(ts), round(ts % 1 * scale), len(frame), len(frame)) + frame
+    return data
+
+
+def packets_of(data):
+    with tempfile.NamedTemporaryFile(suffix='.pcap') as f:
+        f.write(data)
+        f.flush()
+        return [(packet.ts, packet.linktype, bytes(packet.data)) for packet in iter_packets(f.name)]
+
+
+class CaptureFormatTest(unittest.TestCase):
+    FRAMES = [(1000.25, b'first'), (1001.5, b'second')]
+
+    def test_pcap_byte_orders_and_resolutions(self):
+        for magic in (0xA1B2C3D4, 0xA1B23C4D):
+            for endian in '<>':
+                with self.subTest(magic=hex(magic), endian=endian):
+                    self.assertEqual(packets_of(pcap(self.FRAMES, magic, endian)),
+                                     [(ts, LINKTYPE_ETHERNET, frame) for ts, frame in self.FRAMES])
+
+    def test_pcapng(self):
+        self.assertEqual(packets_of(pcapng(*self.FRAMES)), [(ts, LINKTYPE_RAW, frame) for ts, frame in self.FRAMES])
+
+    def test_cut_off_record(self):
+        self.assertEqual(len(packets_of(pcap(self.FRAMES)[:-3])), 1)
+        self.assertEqual(len(packets_of(pcapng(*self.FRAMES)[:-3])), 1)
+
+    def test_other_files(self):
+        with self.assertRaises(CaptureError):
+            packets_of(b'not a capture at all')
+        with self.assertRaises(CaptureError):
+            packets_of(pcap(self.FRAMES, linktype=147))
+
+    def test_segments_of_a_capture(self):
+        with tempfile.NamedTemporaryFile(suffix='.pcap') as f:
+            f.write(capture_bytes([b'x' * 3000, b'y' * 10]))
+            f.flush()
+            payloads = [bytes(segment.payload) for segment in iter_segments(f.name) if segment.payload]
+        self.assertEqual(payloads, [b'x' * 1400, b'x' * 1400, b'x' * 200, b'y' * 10])
+
+
+class ParseFrameTest(unittest.TestCase):
+    def assertSegment(self, segment, proto=PROTO_TCP, payload=b'data', src=SRC4, dst=DST4):
+        self.assertIsNotNone(segment)
+        self.assertEqual((segment.proto, segment.src, segment.dst, bytes(segment.payload)),
+                         (proto, src, dst, payload))
+
+    def test_link_types(self):
+        packet = ipv4(tcp(b'data'))
+        frames = {
+            LINKTYPE_ETHERNET: ethernet(packet),
+            LINKTYPE_LINUX_SLL: bytes(14) + b'\x08\x00' + packet,
+            LINKTYPE_LINUX_SLL2: b'\x08\x00' + bytes(18) + packet,
+            LINKTYPE_NULL: struct.pack('<I', 2) + packet,
+            LINKTYPE_RAW: packet,
+        }
+        for linktype, frame in frames.items():
+            with self.subTest(linktype=linktype):
+                self.assertSegment(parse_frame(1.0, linktype, frame))
+
+    def test_tcp_fields(self):
+        segment = parse_frame(1.0, LINKTYPE_RAW, ipv4(tcp(b'data', 1234, 443, 99, 0x11)))
+        self.assertEqual((segment.sport, segment.dport, segment.seq, segment.flags), (1234, 443, 99, 0x11))
+
+    def test_vlan_tags(self):
+        self.assertSegment(parse_frame(1.0, LINKTYPE_ETHERNET, ethernet(ipv4(tcp(b'data')), vlans=2)))
+
+    def test_ethernet_padding_is_trimmed(self):
+        self.assertSegment(parse_frame(1.0, LINKTYPE_ETHERNET, ethernet(ipv4(tcp(b'data')) + bytes(12))))
+
+    def test_zero_ipv4_length_from_segmentation_offload(self):
+        packet = ipv4(tcp(b'data' * 4000), total_len=0)
+        self.assertSegment(parse_frame(1.0, LINKTYPE_ETHERNET, ethernet(packet)), payload=b'data' * 4000)
+
+    def test_ipv6(self):
+        self.assertSegment(parse_frame(1.0, LINKTYPE_ETHERNET, ethernet(ipv6(tcp(b'data')), 0x86DD)),
+                           src=SRC6, dst=DST6)
+        self.assertSegment(parse_frame(1.0, LINKTYPE_RAW, ipv6(tcp(b'data'), hop_by_hop=True)), src=SRC6, dst=DST6)
+        self.assertSegment(parse_frame(1.0, LINKTYPE_RAW, ipv6(tcp(b'data'), payload_len=0)), src=SRC6, dst=DST6)
+
+    def test_udp(self):
+        datagram = struct.pack('!HHHH', 53, 5353, 12, 0) + b'data'
+        self.assertSegment(parse_frame(1.0, LINKTYPE_RAW, ipv4(datagram, PROTO_UDP)), PROTO_UDP)
+
+    def test_skipped(self):
+        self.assertIsNone(parse_frame(1.0, LINKTYPE_RAW, ipv4(tcp(b'data'), frag=0x2000)))
+        self.assertIsNone(parse_frame(1.0, LINKTYPE_RAW, ipv4(b'\x08\x00' + bytes(6), proto=1)))
+        self.assertIsNone(parse_frame(1.0, LINKTYPE_ETHERNET, ethernet(bytes(28), 0x0806)))
+        self.assertIsNone(parse_frame(1.0, LINKTYPE_RAW, ipv4(tcp(b'')[:10])))
+        self.assertIsNone(parse_frame(1.0, LINKTYPE_ETHERNET, bytes(10)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+"""The encrypted-flow pre-filter: protocols, random bytes and what is spared.
+
+Run with ``python -m pytest tests`` (or ``python -m unittest``).
+"""
+import gzip
+import os
+import random
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from support import padded, run, sample, write_capture  # noqa: E402
+from en1gma.prefilter import (  # noqa: E402
+    SAMPLE_SIZE, EncryptedFlowFilter, encrypted_protocol, holds_file, looks_random)
+from en1gma.reassembly import TICK, Chunk  # noqa: E402
+from en1gma.scanner import SignatureScanner  # noqa: E402
+from en1gma.signatures import FILE_TYPES  # noqa: E402
+from en1gma.stats import Stats  # noqa: E402
+
+CLIENT_HELLO = b'\x16\x03\x01\x02\x00\x01\x00\x01\xfc\x03\x03' + bytes(32)
+
+
+def noise(n, seed=1):
+    return random.Random(seed).randbytes(n)
+
+
+class DetectionTest(unittest.TestCase):
+    def test_protocols(self):
+        self.assertEqual(encrypted_protocol(CLIENT_HELLO), 'tls')
+        self.assertEqual(encrypted_protocol(b'\x16\x03\x03\x00\x40\x02'), 'tls')
+        self.assertEqual(encrypted_protocol(b'SSH-2.0-OpenSSH_9.0\r\n'), 'ssh')
+        self.assertEqual(encrypted_protocol(b'\xc3\x00\x00\x00\x01\x08'), 'quic')
+        self.assertIsNone(encrypted_protocol(b'\x16\x03\x01\x02\x00\x0b'))  # Not a hello
+        self.assertIsNone(encrypted_protocol(b'GET / HTTP/1.1\r\n'))
+        self.assertIsNone(encrypted_protocol(b''))
+
+    def test_random(self):
+        self.assertTrue(looks_random(noise(SAMPLE_SIZE)))
+        self.assertFalse(looks_random(noise(1000)))
+        self.assertFalse(looks_random(bytes(SAMPLE_SIZE)))
+        self.assertFalse(looks_random(b'lorem ipsum dolor sit amet ' * 400))
+
+    def test_holds_file(self):
+        scanner = SignatureScanner(FILE_TYPES)
+        self.assertFalse(holds_file(scanner, noise(SAMPLE_SIZE)))
+        for ext in ('png', 'zip', 'gz', 'pdf'):
+            with self.subTest(ext=ext):
+                data = noise(1000) + sample(ext)
+                self.assertTrue(holds_file(scanner, data[:SAMPLE_SIZE]))
+
+
+class FilterTest(unittest.TestCase):
+    def run_filter(self, chunks, **kwargs):
+        gate = EncryptedFlowFilter(**kwargs)
+        out = []
+        for chunk in chunks:
+            out += gate.feed(chunk)
+        return out + gate.flush()
+
+    def test_encrypted_flow_goes_whole(self):
+        stats = Stats()
+        # The server's side goes too, whether it came before or after
+        chunks = [Chunk(0, 1, noise(100)), Chunk(0, 0, CLIENT_HELLO), Chunk(0, 0, noise(SAMPLE_SIZE)),
+                  Chunk(0, 1, noise(200)), Chunk(0, None, None)]
+        self.assertEqual(self.run_filter(chunks, stats=stats), [])
+        self.assertEqual(stats.counters['flows_skipped'], {'tls': 1})
+        self.assertEqual(stats.counters['bytes_skipped'], {'tls': len(CLIENT_HELLO) + SAMPLE_SIZE + 300})
+
+    def test_random_direction_only(self):
+        stats = Stats()
+        request = b'GET /download HTTP/1.1\r\n\r\n'
+        chunks = [Chunk(0, 0, request)] + [Chunk(0, 1, noise(1000, n)) for n in range(10)] + [Chunk(0, None, None)]
+        self.assertEqual(self.run_filter(chunks, stats=stats), [chunks[0], chunks[-1]])
+        self.assertEqual(stats.counters['flows_skipped'], {'random': 1})
+
+    def test_random_with_a_file_is_spared(self):
+        for data in (gzip.compress(noise(20000)), noise(3000) + sample('png')):
+            chunks = [Chunk(0, 0, data[pos:pos + 1400]) for pos in range(0, len(data), 1400)]
+            with self.subTest(size=len(data)):
+                self.assertEqual(self.run_filter(chunks), chunks)
+
+    def test_text_passes_without_waiting(self):
+        gate = EncryptedFlowFilter()
+        self.assertEqual(gate.feed(Chunk(0, 0, b'USER anonymous')), [])
+        chunks = [Chunk(0, 0, b'USER anonymous'), Chunk(0, 0, b'\r\n')]
+        self.assertEqual(gate.feed(chunks[1]), chunks)
+        self.assertEqual(gate.feed(Chunk(0, 0, b'PASS x\r\n')), [Chunk(0, 0, b'PASS x\r\n')])
+
+    def test_held_bytes_let_go(self):
+        # Too short to judge: passed on at the end of the flow, on a tick,
+        # or when the input ends
+        self.assertEqual(self.run_filter([Chunk(0, 0, b'\x01\x02'), Chunk(0, None, None)]),
+                         [Chunk(0, 0, b'\x01\x02'), Chunk(0, None, None)])
+        gate = EncryptedFlowFilter()
+        self.assertEqual(gate.feed(Chunk(0, 0, b'\x01\x02')), [])
+        self.assertEqual(gate.feed(TICK), [Chunk(0, 0, b'\x01\x02'), TICK])
+        self.assertEqual(self.run_filter([Chunk(0, 0, b'\x01\x02')]), [Chunk(0, 0, b'\x01\x02')])
+
+
+class PrefilteredExtractionTest(unittest.TestCase):
+    def test_scan_encrypted(self):
+        png = sample('png')
+        with tempfile.TemporaryDirectory() as tmp:
+            pcap = write_capture(os.path.join(tmp, 'in.pcap'), [CLIENT_HELLO + padded(png), padded(png)])
+            skipped = run(pcap, os.path.join(tmp, 'a'), ['png'])
+            scanned = run(pcap, os.path.join(tmp, 'b'), ['png'], scan_encrypted=True)
+        self.assertEqual([e.stream for e in skipped], [1])
+        self.assertEqual([e.stream for e in scanned], [0, 1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,144 @@
+"""Ordering, numbering and closing of flows in the reassembler.
+
+Run with ``python -m pytest tests`` (or ``python -m unittest``).
+"""
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from en1gma.filters import CaptureFilter  # noqa: E402
+from en1gma.pcap_reader import PROTO_TCP, PROTO_UDP, Segment  # noqa: E402
+from en1gma.reassembly import TCP_FIN, TCP_RST, TCP_SYN, TICK, UDP_IDLE_TIMEOUT, Tick, reassemble  # noqa: E402
+
+ACK = 0x10
+CLIENT = ('10.0.0.1', 40000)
+SERVER = ('10.0.0.2', 80)
+
+
+def seg(ts, sender, seq, flags=ACK, payload=b'', proto=PROTO_TCP):
+    receiver = SERVER if sender == CLIENT else CLIENT
+    return Segment(ts, proto, sender[0], sender[1], receiver[0], receiver[1], seq, flags, payload)
+
+
+def connection(ts, client_isn=1000, server_isn=5000, body=b'hello', close=TCP_FIN):
+    """A handshake, one request, then a FIN from each side or a RST."""
+    segments = [
+        seg(ts, CLIENT, client_isn, TCP_SYN),
+        seg(ts, SERVER, server_isn, TCP_SYN | ACK),
+        seg(ts, CLIENT, client_isn + 1),
+        seg(ts, CLIENT, client_isn + 1, ACK, body),
+    ]
+    if close == TCP_RST:
+        return segments + [seg(ts, SERVER, server_isn + 1, TCP_RST)]
+    return segments + [
+        seg(ts, CLIENT, client_isn + 1 + len(body), TCP_FIN | ACK),
+        seg(ts, SERVER, server_isn + 1, TCP_FIN | ACK),
+    ]
+
+
+def streams(segments):
+    chunks = list(reassemble(segments))
+    data = {}
+    for chunk in chunks:
+        if chunk.data:
+            data.setdefault(chunk.stream, b'')
+            data[chunk.stream] += chunk.data
+    ends = [chunk.stream for chunk in chunks if chunk.data is None]
+    return data, ends
+
+
+def directions(segments, **kwargs):
+    """Bytes per (stream, direction), and the streams in the order they ended."""
+    data = {}
+    ends = []
+    for chunk in reassemble(segments, **kwargs):
+        if chunk.data is not None:
+            data[chunk.stream, chunk.direction] = data.get((chunk.stream, chunk.direction), b'') + chunk.data
+        elif chunk.stream is not None:
+            ends.append(chunk.stream)
+    return data, ends
+
+
+def pieces(isn, data, size):
+    """Segments of ``data`` from the client, ``size`` bytes each, in order."""
+    return [seg(1.0, CLIENT, (isn + 1 + pos) & 0xFFFFFFFF, ACK, data[pos:pos + size])
+            for pos in range(0, len(data), size)]
+
+
+class OrderTest(unittest.TestCase):
+    DATA = bytes(range(256)) * 8
+
+    def test_out_of_order(self):
+        parts = pieces(1000, self.DATA, 100)
+        segments = [seg(1.0, CLIENT, 1000, TCP_SYN)] + parts[::-1]
+        self.assertEqual(directions(segments)[0], {(0, 0): self.DATA})
+
+    def test_overlapping_retransmissions(self):
+        parts = pieces(1000, self.DATA, 100)
+        overlap = seg(1.0, CLIENT, 1001 + 150, ACK, self.DATA[150:420])
+        segments = [seg(1.0, CLIENT, 1000, TCP_SYN)] + parts[:3] + [overlap] + parts[1:]
+        self.assertEqual(directions(segments)[0], {(0, 0): self.DATA})
+
+    def test_sequence_wraparound(self):
+        isn = 0xFFFFFFFF - 300
+        segments = [seg(1.0, CLIENT, isn, TCP_SYN)] + pieces(isn, self.DATA, 100)
+        self.assertEqual(directions(segments)[0], {(0, 0): self.DATA})
+
+    def test_hole_given_up_past_max_pending(self):
+        parts = pieces(1000, self.DATA, 100)
+        segments = [seg(1.0, CLIENT, 1000, TCP_SYN)] + parts[:2] + parts[3:]
+        data, _ = directions(segments, max_pending=500)
+        self.assertEqual(data, {(0, 0): self.DATA[:200] + self.DATA[300:]})
+
+    def test_directions_and_midstream_start(self):
+        # No handshake seen: the first sender is direction 0
+        segments = [seg(1.0, SERVER, 77, ACK, b'banner'), seg(1.0, CLIENT, 9, ACK, b'hi'),
+                    seg(1.0, SERVER, 83, ACK, b'!')]
+        self.assertEqual(directions(segments), ({(0, 0): b'banner!', (0, 1): b'hi'}, [0]))
+
+
+class ExpiryTest(unittest.TestCase):
+    def test_idle_flow_closed_on_tick(self):
+        segments = [seg(1.0, CLIENT, 1000, TCP_SYN), seg(1.0, CLIENT, 1001, ACK, b'open'), Tick(5.0), Tick(20.0)]
+        chunks = list(reassemble(segments, idle_timeout=10.0))
+        self.assertEqual(chunks, [(0, 0, b'open'), TICK, (0, None, None), TICK])
+
+    def test_udp_flows(self):
+        segments = [seg(1.0, CLIENT, 0, 0, b'one', PROTO_UDP), seg(2.0, SERVER, 0, 0, b'two', PROTO_UDP),
+                    seg(3.0 + UDP_IDLE_TIMEOUT, CLIENT, 0, 0, b'three', PROTO_UDP)]
+        self.assertEqual(directions(segments), ({(0, 0): b'one', (0, 1): b'two', (1, 0): b'three'}, [0, 1]))
+
+
+class FilteredNumberingTest(unittest.TestCase):
+    def test_numbers_do_not_depend_on_the_filter(self):
+        other = ('10.0.0.3', 41000)
+        segments = connection(1.0) + [Segment(2.0, PROTO_TCP, other[0], other[1], SERVER[0], 8080, 1, ACK, b'kept')]
+        data, ends = directions(segments, capture_filter=CaptureFilter(ports=[8080]))
+        self.assertEqual((data, ends), ({(1, 0): b'kept'}, [1]))
+
+
+class ClosedFlowTest(unittest.TestCase):
+    def test_last_ack_after_fins(self):
+        segments = connection(1.0) + [seg(1.1, CLIENT, 1007)]
+        self.assertEqual(streams(segments), ({0: b'hello'}, [0]))
+
+    def test_retransmissions_after_close(self):
+        segments = connection(1.0) + [
+            seg(1.1, SERVER, 5001, TCP_FIN | ACK),
+            seg(1.2, CLIENT, 1001, ACK, b'hello'),
+        ]
+        self.assertEqual(streams(segments), ({0: b'hello'}, [0]))
+
+    def test_ack_after_reset(self):
+        segments = connection(1.0, close=TCP_RST) + [seg(1.1, CLIENT, 1006)]
+        self.assertEqual(streams(segments), ({0: b'hello'}, [0]))
+
+    def test_port_reuse_opens_new_flow(self):
+        segments = connection(1.0) + [seg(1.1, CLIENT, 1007)] + connection(2.0, 9000, 7000, b'again')
+        self.assertEqual(streams(segments), ({0: b'hello', 1: b'again'}, [0, 1]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,180 @@
+"""Size resolvers on cut-off and malformed input.
+
+Run with ``python -m pytest tests`` (or ``python -m unittest``). Samples
+come from the benchmark builders, so no capture files are needed.
+"""
+import os
+import random
+import struct
+import sys
+import unittest
+import zlib
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+from generate import BUILDERS  # noqa: E402
+from en1gma.resolvers import NEED_MORE  # noqa: E402
+from en1gma.signatures import FILE_TYPES  # noqa: E402
+
+# Every built-in type whose end is read from its structure
+TYPES = [ext for ext in BUILDERS if 'size' in FILE_TYPES[ext]]
+# Chains of frames or boxes: one is not over until something else follows
+# or the data ends, and when it ends cut off only the whole links count
+CHAINS = ('mp3', 'mp4')
+
+
+def samples(ext):
+    """A few files of ``ext``; RAR comes as both RAR 4 and RAR 5."""
+    return [BUILDERS[ext](random.Random(seed), 3000 + seed * 997) for seed in range(4)]
+
+
+def resolve(ext, data, eof):
+    return FILE_TYPES[ext]['size'](bytearray(data), 0, {}, eof)
+
+
+def prefixes(data):
+    """Every cut in the first bytes, then one in every 97."""
+    return list(range(min(len(data), 300))) + list(range(300, len(data), 97))
+
+
+class WholeFileTest(unittest.TestCase):
+    def test_exact_length(self):
+        for ext in TYPES:
+            for data in samples(ext):
+                with self.subTest(ext=ext):
+                    self.assertEqual(resolve(ext, data + os.urandom(512), False), len(data))
+
+    def test_rar_both_versions(self):
+        versions = {data[6] for data in samples('rar')}
+        self.assertEqual(versions, {0, 1})
+
+
+class CutOffTest(unittest.TestCase):
+    def test_waits_then_gives_up(self):
+        # Short of the end: more data may still come, or none will
+        for ext in TYPES:
+            for data in samples(ext)[:2]:
+                for cut in prefixes(data):
+                    with self.subTest(ext=ext, cut=cut):
+                        self.assertIn(resolve(ext, data[:cut], False), (NEED_MORE, len(data)))
+                        result = resolve(ext, data[:cut], True)
+                        if ext in CHAINS:
+                            self.assertTrue(result is None or result > 0, result)
+                        else:
+                            self.assertIn(result, (None, len(data)))
+
+    def test_resumes_with_state(self):
+        for ext in TYPES:
+            data = samples(ext)[0]
+            buf, state = bytearray(), {}
+            for pos in range(0, len(data), 701):
+                buf += data[pos:pos + 701]
+                result = FILE_TYPES[ext]['size'](buf, 0, state, pos + 701 >= len(data))
+                if result != NEED_MORE:
+                    break
+            with self.subTest(ext=ext):
+                self.assertEqual(result, len(data))
+
+
+def _rar5_header(body):
+    head = bytes([len(body)]) + body
+    return struct.pack('<I', zlib.crc32(head)) + head
+
+
+class MalformedTest(unittest.TestCase):
+    def assertResult(self, ext, data, eof):
+        result = resolve(ext, data, eof)
+        self.assertTrue(result is None or result == NEED_MORE or (isinstance(result, int) and result > 0),
+                        f"{ext}: {result!r}")
+
+    def test_rar5_field_past_header(self):
+        # A header whose CRC checks out but whose flags vint runs past its size
+        data = b'Rar!\x1a\x07\x01\x00' + _rar5_header(b'\x02\x80\x80') + os.urandom(64)
+        self.assertIsNone(resolve('rar', data, False))
+        self.assertIsNone(resolve('rar', data, True))
+
+    def test_rar5_overlong_vint(self):
+        data = b'Rar!\x1a\x07\x01\x00' + b'\x00' * 4 + b'\xff' * 12 + os.urandom(64)
+        self.assertIsNone(resolve('rar', data, False))
+
+    def test_rar4_bad_block(self):
+        data = b'Rar!\x1a\x07\x00' + b'\x00\x00\x73\x00\x00\x03\x00' + os.urandom(64)
+        self.assertIsNone(resolve('rar', data, True))
+
+    def test_corrupted_bytes(self):
+        # Random damage never raises; the resolver only says yes, no or wait
+        rnd = random.Random(7)
+        for ext in TYPES:
+            for data in samples(ext)[:2]:
+                for _ in range(300):
+                    damaged = bytearray(data)
+                    for _ in range(rnd.randrange(1, 4)):
+                        pos = rnd.randrange(min(len(damaged), 512))
+                        damaged[pos] = rnd.randrange(256)
+                    cut = rnd.randrange(len(damaged) + 1)
+                    with self.subTest(ext=ext):
+                        self.assertResult(ext, damaged[:cut], False)
+                        self.assertResult(ext, damaged[:cut], True)
+
+    def test_headers_followed_by_noise(self):
+        rnd = random.Random(11)
+        for ext in TYPES:
+            for header, offset in FILE_TYPES[ext]['headers']:
+                for _ in range(200):
+                    noise = bytes(rnd.randrange(256) for _ in range(rnd.randrange(0, 400)))
+                    with self.subTest(ext=ext):
+                        self.assertResult(ext, header + noise, False)
+                        self.assertResult(ext, header + noise, True)
+
+
+def tiff_chain(data):
+    """A sample TIFF given a second IFD after its first, for the same strip."""
+    ifd = data.index(struct.pack('<HH', 9, 256))
+    second = data[ifd:-4] + bytes(4)
+    return data[:-4] + struct.pack('<I', len(data)) + second
+
+
+class DeclaredExtentTest(unittest.TestCase):
+    def test_elf_tables_out_of_reach(self):
+        # The section header table claims to sit far past the data
+        data = bytearray(samples('elf')[0])
+        struct.pack_into('<Q', data, 40, 1 << 62)
+        state = {}
+        self.assertEqual(FILE_TYPES['elf']['size'](data, 0, state, False), NEED_MORE)
+        self.assertEqual(state['least'], (1 << 62) + 3 * 64)
+        self.assertIsNone(resolve('elf', data, True))
+
+    def test_tiff_value_past_the_data(self):
+        # BitsPerSample grown to 1000 values, stored far past the data
+        data = bytearray(samples('tiff')[0])
+        struct.pack_into('<HHII', data, data.index(struct.pack('<HHI', 258, 3, 1)), 258, 3, 1000, 1 << 30)
+        # Known as soon as the IFD is in, however far away the value is
+        self.assertEqual(resolve('tiff', data, False), (1 << 30) + 2000)
+        self.assertEqual(resolve('tiff', data, True), (1 << 30) + 2000)
+
+    def test_tiff_offsets_past_the_data(self):
+        # The strip offsets themselves are out of reach: wait, knowing the least
+        data = bytearray(samples('tiff')[0])
+        struct.pack_into('<HHII', data, data.index(struct.pack('<HHI', 273, 4, 1)), 273, 4, 2, 1 << 30)
+        state = {}
+        self.assertEqual(FILE_TYPES['tiff']['size'](data, 0, state, False), NEED_MORE)
+        self.assertEqual(state['least'], (1 << 30) + 8)
+
+    def test_tiff_walk_resumes(self):
+        data = tiff_chain(samples('tiff')[0])
+        self.assertEqual(resolve('tiff', data, False), len(data))
+        first = data.index(struct.pack('<HH', 9, 256))
+        buf, state = bytearray(data[:len(data) - 20]), {}
+        self.assertEqual(FILE_TYPES['tiff']['size'](buf, 0, state, False), NEED_MORE)
+        self.assertEqual(state['walk']['seen'], {first})
+        # The first IFD is not read again: damage to it changes nothing now
+        buf[first:first + 2] = b'\x00\x00'
+        buf += data[len(data) - 20:]
+        self.assertEqual(FILE_TYPES['tiff']['size'](buf, 0, state, False), len(data))
+        self.assertIsNone(resolve('tiff', buf, False))
+
+
+if __name__ == '__main__':
+    unittest.main()
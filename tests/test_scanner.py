@@ -0,0 +1,83 @@
+"""The single-pass scanner against a plain search, header by header.
+
+Run with ``python -m pytest tests`` (or ``python -m unittest``).
+"""
+import os
+import random
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from en1gma.scanner import SignatureScanner  # noqa: E402
+from en1gma.signatures import FILE_TYPES  # noqa: E402
+
+
+def naive(file_types, buf, pos, limit):
+    """Every (start, ext) a byte-by-byte search for each header finds."""
+    hits = set()
+    for ext, spec in file_types.items():
+        for header, offset in spec['headers']:
+            at = buf.find(header, pos)
+            while at != -1 and at < limit:
+                if at >= offset:
+                    hits.add((at - offset, ext))
+                at = buf.find(header, at + 1)
+    return hits
+
+
+def scanned(scanner, buf, pos=0, limit=None):
+    limit = len(buf) if limit is None else limit
+    return {(start, ext) for start, exts in scanner.scan(buf, pos, limit) for ext in exts}
+
+
+def spec(*headers):
+    return {'headers': list(headers)}
+
+
+class ScannerTest(unittest.TestCase):
+    def test_matches_a_plain_search(self):
+        rnd = random.Random(3)
+        headers = [header for s in FILE_TYPES.values() for header, _ in s['headers']]
+        buf = bytearray(rnd.randrange(256) for _ in range(20000))
+        for _ in range(300):
+            header = rnd.choice(headers)
+            at = rnd.randrange(len(buf) - len(header))
+            buf[at:at + len(header)] = header
+        scanner = SignatureScanner(FILE_TYPES)
+        self.assertEqual(scanned(scanner, buf), naive(FILE_TYPES, buf, 0, len(buf)))
+        self.assertEqual(scanned(scanner, buf, 5000, 9000), naive(FILE_TYPES, buf, 5000, 9000))
+
+    def test_shared_header_goes_to_every_type_in_order(self):
+        types = {name: FILE_TYPES[name] for name in ('docx', 'xlsx', 'zip')}
+        hits = list(SignatureScanner(types).scan(b'..PK\x03\x04..', 0, 10))
+        self.assertEqual(hits, [(2, ['docx', 'xlsx', 'zip'])])
+
+    def test_overlapping_and_prefixed_headers(self):
+        types = {'a': spec((b'AAB', 0)), 'b': spec((b'AA', 0)), 'c': spec((b'ABA', 0))}
+        hits = list(SignatureScanner(types).scan(b'xAABAAx', 0, 7))
+        self.assertEqual(hits, [(1, ['a', 'b']), (2, ['c']), (4, ['b'])])
+
+    def test_header_at_an_offset(self):
+        types = {'far': spec((b'MAGIC', 4)), 'near': spec((b'GI', 0))}
+        scanner = SignatureScanner(types)
+        self.assertEqual(list(scanner.scan(b'....MAGIC', 0, 9)), [(0, ['far']), (6, ['near'])])
+        # The file would begin before the buffer
+        self.assertEqual(list(scanner.scan(b'..MAGIC', 0, 7)), [(4, ['near'])])
+        self.assertEqual((scanner.max_offset, scanner.max_reach, scanner.max_header), (4, 9, 5))
+
+    def test_limit_is_where_headers_start(self):
+        scanner = SignatureScanner({'x': spec((b'XYZ', 0))})
+        self.assertEqual(list(scanner.scan(b'..XYZ', 0, 3)), [(2, ['x'])])
+        self.assertEqual(list(scanner.scan(b'..XYZ', 0, 2)), [])
+        self.assertEqual(list(scanner.scan(b'..XYZ', 3, 5)), [])
+
+    def test_starts(self):
+        scanner = SignatureScanner(FILE_TYPES)
+        self.assertEqual(scanner.starts(b'PK\x03\x04rest'), ['docx', 'xlsx', 'zip'])
+        self.assertEqual(scanner.starts(b'GIF89a'), ['gif'])
+        self.assertEqual(scanner.starts(b'nothing'), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
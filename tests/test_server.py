@@ -0,0 +1,150 @@
+"""The extraction server and its client, over a Unix socket and TCP.
+
+Run with ``python -m pytest tests`` (or ``python -m unittest``).
+"""
+import os
+import stat
+import sys
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from support import padded, sample, write_capture  # noqa: E402
+from en1gma import client  # noqa: E402
+from en1gma.client import ServerError  # noqa: E402
+from en1gma.server import ExtractionServer, QueueFull, parse_job  # noqa: E402
+
+
+class ParseJobTest(unittest.TestCase):
+    def setUp(self):
+        f = tempfile.NamedTemporaryFile(suffix='.pcap')
+        self.addCleanup(f.close)
+        self.capture = f.name
+
+    def test_defaults(self):
+        capture, output, options = parse_job({'capture': self.capture})
+        self.assertEqual((capture, output), (self.capture, 'extracted_files'))
+        self.assertIsNone(options['selected_types'])
+        self.assertIsNone(options['capture_filter'])
+        self.assertEqual((options['reader'], options['output_format'], options['deep_check']),
+                         ('auto', 'files', 'off'))
+
+    def test_types_and_filters(self):
+        _, _, options = parse_job({'capture': self.capture, 'types': ['png'], 'categories': ['archives'],
+                                   'ports': [80], 'start': 1000, 'end': '2020-01-01'})
+        self.assertIn('png', options['selected_types'])
+        self.assertIn('zip', options['selected_types'])
+        self.assertNotIn('jpg', options['selected_types'])
+        self.assertEqual((options['capture_filter'].ports, options['capture_filter'].start), ({80}, 1000.0))
+
+    def test_bad_jobs(self):
+        bad = [
+            ['not', 'an', 'object'],
+            {'capture': self.capture, 'colour': 'red'},
+            {'capture': self.capture + '.missing'},
+            {'capture': self.capture, 'types': 'png'},
+            {'capture': self.capture, 'types': ['nope']},
+            {'capture': self.capture, 'reader': 'scapy'},
+            {'capture': self.capture, 'output_format': 'rar'},
+            {'capture': self.capture, 'hosts': ['not a host']},
+            {'capture': self.capture, 'start': 'soon'},
+        ]
+        for request in bad:
+            with self.subTest(request=request):
+                with self.assertRaises(ValueError):
+                    parse_job(request)
+
+
+class ServerTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        cls.png, cls.gif = sample('png'), sample('gif')
+        cls.capture = write_capture(os.path.join(cls.directory.name, 'in.pcap'), [padded(cls.png, cls.gif)])
+        cls.server = ExtractionServer(workers=1, max_queue=0)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.close()
+        cls.directory.cleanup()
+
+    def serve(self, **listen):
+        """Listen and serve from a thread until the test ends."""
+        self.server.listen(**listen)
+        thread = threading.Thread(target=self.server.httpd.serve_forever, daemon=True)
+        thread.start()
+
+        def stop():
+            self.server.httpd.shutdown()
+            thread.join()
+            self.server.httpd.server_close()
+            for path in (self.server.socket_path, self.server.token_path):
+                if path is not None and os.path.exists(path):
+                    os.remove(path)
+            self.server.httpd = self.server.socket_path = self.server.token = self.server.token_path = None
+
+        self.addCleanup(stop)
+
+    def job(self, name, **fields):
+        return dict({'capture': self.capture, 'output': os.path.join(self.directory.name, name),
+                     'types': ['png', 'gif']}, **fields)
+
+    def test_unix_socket(self):
+        path = os.path.join(self.directory.name, 'server.sock')
+        self.serve(socket_path=path)
+        self.assertEqual(stat.S_IMODE(os.stat(path).st_mode), 0o600)
+        before = client.status(path)['completed']
+        events = list(client.submit(self.job('unix'), path))
+        kinds = [event['event'] for event in events]
+        self.assertEqual(kinds[:2], ['queued', 'started'])
+        self.assertEqual(kinds[-1], 'done')
+        self.assertEqual(len({event['job'] for event in events}), 1)
+        found = [event for event in events if event['event'] == 'file']
+        self.assertEqual([event['type'] for event in found], ['png', 'gif'])
+        with open(found[0]['file'], 'rb') as f:
+            self.assertEqual(f.read(), self.png)
+        self.assertEqual((events[-1]['files'], events[-1]['duplicates']), (2, 0))
+        status = client.status(path)
+        self.assertEqual((status['completed'] - before, status['running'], status['queued']), (1, 0, 0))
+
+        with self.assertRaises(ServerError) as raised:
+            list(client.submit(self.job('bad', reader='scapy'), path))
+        self.assertTrue(str(raised.exception).startswith('400'))
+
+    def test_tcp_token(self):
+        token_file = os.path.join(self.directory.name, 'config', 'server.token')
+        self.serve(tcp_port=0, token_path=token_file)
+        port = self.server.httpd.server_address[1]
+        self.assertEqual(stat.S_IMODE(os.stat(token_file).st_mode), 0o600)
+        events = list(client.submit(self.job('tcp'), tcp_port=port, token_file=token_file))
+        self.assertEqual(events[-1]['event'], 'done')
+
+        wrong = os.path.join(self.directory.name, 'wrong.token')
+        with open(wrong, 'w') as f:
+            f.write('guess\n')
+        for call in (lambda: client.status(tcp_port=port, token_file=wrong),
+                     lambda: list(client.submit(self.job('tcp'), tcp_port=port, token_file=wrong))):
+            with self.assertRaises(ServerError) as raised:
+                call()
+            self.assertTrue(str(raised.exception).startswith('401'))
+
+    def test_failed_job(self):
+        _, output, options = parse_job(self.job('failed'))
+        events = list(self.server.run(self.capture + '.gone', output, options))
+        self.assertEqual(events[-1]['event'], 'error')
+        self.assertIn('FileNotFoundError', events[-1]['error'])
+
+    def test_queue_full(self):
+        capture, output, options = parse_job(self.job('full'))
+        first = self.server.run(capture, output, options)
+        self.assertEqual(next(first)['event'], 'queued')
+        with self.assertRaises(QueueFull):
+            next(self.server.run(capture, output, options))
+        first.close()
+        self.assertEqual(self.server.status()['queued'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
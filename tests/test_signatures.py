@@ -0,0 +1,155 @@
+"""Signature definitions: compiling them, user files on top of the built-ins,
+and picking types by name or category.
+
+Run with ``python -m pytest tests`` (or ``python -m unittest``).
+"""
+import json
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from support import padded, run, write_capture  # noqa: E402
+from en1gma import resolvers, signatures, validators  # noqa: E402
+from en1gma.signatures import (  # noqa: E402
+    FILE_TYPES, SignatureError, add_signature_files, categories, compile_definition, load_file_types,
+    load_signature_file, select_types)
+
+# A made-up format: a text header, a footer and its own size cap
+DEFINITION = {"category": "Test", "description": "Test blob", "headers": [{"text": "BLOB", "offset": 0}],
+              "footer": "454e44", "max_size": "2K"}
+
+
+def write_json(path, content):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(content if isinstance(content, str) else json.dumps(content))
+    return path
+
+
+class CompileTest(unittest.TestCase):
+    def test_fields(self):
+        spec = compile_definition('blob', dict(DEFINITION, headers=["424c4f42", {"hex": "4f4b", "offset": 4}]))
+        self.assertEqual(spec['headers'], [(b'BLOB', 0), (b'OK', 4)])
+        self.assertEqual((spec['header'], spec['footer'], spec['max_size']), (b'BLOB', b'END', 2048))
+        self.assertEqual((spec['category'], spec['description']), ('test', 'Test blob'))
+        self.assertNotIn('size', spec)
+
+    def test_defaults(self):
+        spec = compile_definition('blob', {"headers": ["00ff"]})
+        self.assertEqual((spec['footer'], spec['max_size'], spec['category'], spec['description']),
+                         (None, 64 * 1024 * 1024, 'other', 'blob'))
+
+    def test_functions(self):
+        spec = compile_definition('blob', {"headers": ["00"], "size": {"function": "riff_sizer", "args": ["WEBP"]},
+                                           "validate": "en1gma.validators:gif_valid", "verify": "zip_verify"})
+        # A factory is called, its string arguments turned to bytes
+        self.assertEqual(spec['size'].__qualname__, resolvers.riff_sizer(b'WEBP').__qualname__)
+        self.assertIs(spec['validate'], validators.gif_valid)
+        self.assertIs(spec['verify'], validators.zip_verify)
+
+    def test_errors(self):
+        bad = {
+            'unknown field': dict(DEFINITION, colour="red"),
+            'no headers': dict(DEFINITION, headers=[]),
+            'empty header': dict(DEFINITION, headers=[""]),
+            'bad hex': dict(DEFINITION, headers=["zz"]),
+            'hex and text': dict(DEFINITION, headers=[{"hex": "00", "text": "a"}]),
+            'negative offset': dict(DEFINITION, headers=[{"text": "a", "offset": -1}]),
+            'footer offset': dict(DEFINITION, footer={"text": "END", "offset": 2}),
+            'footer and size': dict(DEFINITION, size="bmp_size"),
+            'bad max_size': dict(DEFINITION, max_size="lots"),
+            'missing function': dict(DEFINITION, validate="no_such_check"),
+            'missing module': dict(DEFINITION, validate="no_such_module:check"),
+            'verify factory': dict(DEFINITION, verify={"function": "zip_verify"}),
+            'not an object': "BLOB",
+        }
+        for what, definition in bad.items():
+            with self.subTest(what=what), self.assertRaises(SignatureError) as raised:
+                compile_definition('blob', definition)
+            self.assertTrue(str(raised.exception).startswith('blob'))
+
+    def test_builtins(self):
+        self.assertLessEqual(set(load_signature_file(signatures.BUILTIN_FILE)), set(FILE_TYPES))
+        for ext, spec in FILE_TYPES.items():
+            with self.subTest(ext=ext):
+                self.assertTrue(spec['headers'])
+                self.assertFalse(spec['footer'] and 'size' in spec)
+
+
+class FileTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.dir = directory.name
+        patcher = mock.patch.dict(os.environ, {'XDG_CONFIG_HOME': self.dir, signatures.ENV_VAR: ''})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_file_errors_name_the_file(self):
+        bad = {'broken.json': '{"blob": ', 'list.json': [], 'name.json': {"../blob": DEFINITION},
+               'field.json': {"blob": dict(DEFINITION, colour="red")}}
+        for name, content in bad.items():
+            path = write_json(os.path.join(self.dir, name), content)
+            with self.subTest(name=name), self.assertRaises(SignatureError) as raised:
+                load_signature_file(path)
+            self.assertTrue(str(raised.exception).startswith(path))
+        with self.assertRaises(SignatureError):
+            load_signature_file(os.path.join(self.dir, 'missing.json'))
+
+    def test_user_files_over_the_builtins(self):
+        user_dir = signatures.user_signature_dir()
+        self.assertEqual(user_dir, os.path.join(self.dir, 'en1gma', 'signatures'))
+        os.makedirs(user_dir)
+        write_json(os.path.join(user_dir, 'a.json'), {"BLOB": DEFINITION, "png": dict(DEFINITION, max_size=100)})
+        write_json(os.path.join(user_dir, 'b.json'), '{"cut off')
+        write_json(os.path.join(user_dir, 'notes.txt'), 'not a definition file')
+        listed = write_json(os.path.join(self.dir, 'listed.json'), {"png": dict(DEFINITION, max_size=200)})
+        os.environ[signatures.ENV_VAR] = listed
+        with mock.patch.object(signatures, 'LOAD_ERRORS', []):
+            types = load_file_types()
+            errors = signatures.LOAD_ERRORS
+        # The listed file comes last; the broken one is skipped and reported
+        self.assertEqual((types['blob']['footer'], types['png']['max_size']), (b'END', 200))
+        self.assertEqual(list(types)[-1], 'blob')
+        self.assertEqual(len(errors), 1)
+        self.assertIn('b.json', errors[0])
+
+    def test_added_files_reach_new_processes(self):
+        path = write_json(os.path.join(self.dir, 'blob.json'), {"blob": DEFINITION})
+        with mock.patch.dict(FILE_TYPES):
+            add_signature_files([os.path.relpath(path)])
+            self.assertEqual(FILE_TYPES['blob']['header'], b'BLOB')
+            self.assertEqual(os.environ[signatures.ENV_VAR], path)
+            # What a freshly started worker loads
+            self.assertIn('blob', load_file_types())
+            blob = b'BLOB' + b'=' * 100 + b'END'
+            with tempfile.TemporaryDirectory() as tmp:
+                found = run(write_capture(os.path.join(tmp, 'in.pcap'), [padded(blob)]), os.path.join(tmp, 'out'),
+                            ['blob'])
+                self.assertEqual([(event.ext, event.size) for event in found], [('blob', len(blob))])
+        with self.assertRaises(SignatureError):
+            add_signature_files([os.path.join(self.dir, 'missing.json')])
+
+
+class SelectTest(unittest.TestCase):
+    def test_by_name_and_category(self):
+        grouped = categories()
+        self.assertEqual(sorted(ext for exts in grouped.values() for ext in exts), sorted(FILE_TYPES))
+        self.assertEqual(select_types(), list(FILE_TYPES))
+        archives = select_types(category_names=['ARCHIVES'])
+        self.assertEqual(archives, grouped['archives'])
+        # Definition order, whatever order they were asked for in
+        wanted = select_types(['PDF', 'png'], ['archives'])
+        self.assertEqual(wanted, [ext for ext in FILE_TYPES if ext in {'pdf', 'png'} | set(archives)])
+
+    def test_unknown(self):
+        with self.assertRaises(ValueError) as raised:
+            select_types(['png', 'nope'], ['nothing'])
+        self.assertIn('nope, nothing', str(raised.exception))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,174 @@
+"""Output sinks: containers, numbering across runs, the writer thread.
+
+Run with ``python -m pytest tests`` (or ``python -m unittest``).
+"""
+import os
+import sqlite3
+import sys
+import tarfile
+import tempfile
+import threading
+import time
+import unittest
+import zipfile
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from support import padded, run, sample, write_capture  # noqa: E402
+from en1gma import sinks  # noqa: E402
+from en1gma.carver import Carve  # noqa: E402
+from en1gma.manifest import read_records  # noqa: E402
+from en1gma.sinks import DirectorySink, Sink, container_path, open_sink  # noqa: E402
+
+
+def members(kind, path):
+    """{member name: bytes} of a container."""
+    if kind == 'tar':
+        with tarfile.open(path) as tar:
+            return {m.name: tar.extractfile(m).read() for m in tar.getmembers()}
+    if kind == 'zip':
+        with zipfile.ZipFile(path) as z:
+            return {name: z.read(name) for name in z.namelist()}
+    db = sqlite3.connect(path)
+    try:
+        return {name: data for name, data in db.execute("SELECT name, data FROM files")}
+    finally:
+        db.close()
+
+
+class ContainerTest(unittest.TestCase):
+    def test_runs_number_on(self):
+        png, gif, jpg = sample('png'), sample('gif'), sample('jpg')
+        with tempfile.TemporaryDirectory() as tmp:
+            first = write_capture(os.path.join(tmp, 'first.pcap'), [padded(png, gif)])
+            second = write_capture(os.path.join(tmp, 'second.pcap'), [padded(jpg), padded(png)])
+            for kind in ('tar', 'zip', 'sqlite'):
+                out = os.path.join(tmp, kind)
+                found = run(first, out, ['png', 'gif', 'jpg'], output_format=kind)
+                found += run(second, out, ['png', 'gif', 'jpg'], output_format=kind)
+                path = container_path(kind, out)
+                with self.subTest(kind=kind):
+                    self.assertEqual(sorted(os.listdir(out)), ['carved.' + kind, 'manifest.jsonl'])
+                    self.assertEqual([e.filename for e in found], [
+                        path + '/png/000000_s0.png', path + '/gif/000001_s0.gif', path + '/jpg/000002_s0.jpg',
+                        None])
+                    self.assertEqual(members(kind, path), {'png/000000_s0.png': png, 'gif/000001_s0.gif': gif,
+                                                           'jpg/000002_s0.jpg': jpg})
+                    records = list(read_records(os.path.join(out, 'manifest.jsonl')))
+                    self.assertEqual([r.get('container') for r in records], [path] * 3 + [None])
+
+    def test_spilled_carves_are_moved_in(self):
+        png = sample('png')
+        with tempfile.TemporaryDirectory() as tmp:
+            for kind in sinks.SINKS:
+                out = os.path.join(tmp, kind)
+                os.makedirs(out)
+                spilled = os.path.join(tmp, 'spilled')
+                with open(spilled, 'wb') as f:
+                    f.write(png)
+                sink = open_sink(kind, out)
+                carve = Carve('png', None, 3, 1, 0, spilled, None, None)
+                name = sink.name(carve, 0)
+                sink.put(carve, name, 'digest')
+                sink.close()
+                with self.subTest(kind=kind):
+                    self.assertFalse(os.path.exists(spilled))
+                    if kind == 'files':
+                        with open(name, 'rb') as f:
+                            self.assertEqual(f.read(), png)
+                    else:
+                        self.assertEqual(members(kind, sink.container), {'png/000000_s3.png': png})
+
+    def test_unknown_format(self):
+        with self.assertRaises(ValueError):
+            container_path('rar', 'out')
+
+
+class Recording(Sink):
+    """Keeps what it is given; each write waits until ``go`` is set."""
+
+    def __init__(self, fail=False):
+        self.written = []
+        self.go = threading.Event()
+        self.fail = fail
+        super().__init__()
+
+    def _write(self, carve, name, digest):
+        self.go.wait(5)
+        if self.fail:
+            raise OSError("disk full")
+        self.written.append((name, bytes(carve.data)))
+
+
+class WriterThreadTest(unittest.TestCase):
+    def carve(self, buf):
+        return Carve('bin', memoryview(buf), 0, 0, 0, None, None, None)
+
+    def test_small_carves_are_copied(self):
+        buf = bytearray(b'a' * 100)
+        sink = Recording()
+        sink.put(self.carve(buf), 'x', None)
+        # Returned before the write; the carver may reuse its buffer now
+        buf[:] = b'b' * 100
+        sink.go.set()
+        sink.close()
+        self.assertEqual(sink.written, [('x', b'a' * 100)])
+
+    def test_large_carves_are_written_from_the_buffer(self):
+        buf = bytearray(b'a' * 100)
+        sink = Recording()
+        with mock.patch.object(sinks, 'COPY_LIMIT', 10):
+            timer = threading.Timer(0.2, sink.go.set)
+            timer.start()
+            sink.put(self.carve(buf), 'x', None)
+        # put() only returns once the writer is done with the view
+        self.assertTrue(sink.go.is_set())
+        self.assertEqual(sink.written, [('x', b'a' * 100)])
+        sink.close()
+        timer.join()
+
+    def test_queue_is_bounded(self):
+        sink = Recording()
+        with mock.patch.object(sinks, 'MAX_QUEUED', 250):
+            for n in range(2):
+                sink.put(self.carve(bytearray(100)), str(n), None)
+            blocked = threading.Thread(target=sink.put, args=(self.carve(bytearray(100)), '2', None))
+            blocked.start()
+            blocked.join(0.2)
+            self.assertTrue(blocked.is_alive())
+            sink.go.set()
+            blocked.join(5)
+        sink.close()
+        self.assertEqual([name for name, _ in sink.written], ['0', '1', '2'])
+
+    def test_writer_errors_are_raised(self):
+        sink = Recording(fail=True)
+        sink.go.set()
+        sink.put(self.carve(bytearray(10)), 'x', None)
+        deadline = time.monotonic() + 5
+        while sink.error is None and time.monotonic() < deadline:
+            time.sleep(0.01)
+        with self.assertRaises(OSError):
+            sink.put(self.carve(bytearray(10)), 'y', None)
+        # Raised once; closing after that does not hang
+        sink.close()
+
+    def test_error_on_close(self):
+        sink = Recording(fail=True)
+        sink.put(self.carve(bytearray(10)), 'x', None)
+        sink.go.set()
+        with self.assertRaises(OSError):
+            sink.close()
+
+    def test_directory_names(self):
+        with tempfile.TemporaryDirectory() as out:
+            sink = DirectorySink(out)
+            name = sink.name(Carve('gif', b'', 0, 0, 0, None, None, None), 7)
+            sink.close()
+        self.assertTrue(name.startswith(out + '/gif_'))
+        self.assertTrue(name.endswith('_7.gif'))
+
+
+if __name__ == '__main__':
+    unittest.main()
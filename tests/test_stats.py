@@ -0,0 +1,146 @@
+"""Run statistics: nested timers, counters, merging and a run's report.
+
+Run with ``python -m pytest tests`` (or ``python -m unittest``).
+"""
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from support import ROOT, padded, run, sample, write_capture  # noqa: E402
+from en1gma.stats import Stats  # noqa: E402
+
+
+class Clock:
+    """A perf_counter that moves only when told to."""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TimerTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = Clock()
+        patcher = mock.patch('en1gma.stats.time.perf_counter', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_nested_stages_keep_their_own_time(self):
+        stats = Stats()
+        stats.start('outer')
+        self.clock.now += 1
+        stats.start('inner')
+        self.clock.now += 2
+        stats.stop()
+        self.clock.now += 3
+        stats.start('inner')
+        self.clock.now += 4
+        stats.stop()
+        stats.stop()
+        self.assertEqual(stats.stages, {'outer': 4.0, 'inner': 6.0})
+        self.assertEqual(stats._stack, [])
+
+    def test_timed_charges_producing_not_consuming(self):
+        clock = self.clock
+
+        def produce():
+            for item in range(3):
+                clock.now += 1
+                yield item
+
+        stats = Stats()
+        items = []
+        for item in stats.timed(produce(), 'source'):
+            clock.now += 10
+            items.append(item)
+        self.assertEqual(items, [0, 1, 2])
+        self.assertEqual(stats.stages, {'source': 3.0})
+
+    def test_timed_closes_what_it_wraps(self):
+        closed = []
+
+        def produce():
+            try:
+                yield 1
+                yield 2
+            finally:
+                closed.append(True)
+
+        stats = Stats()
+        timed = stats.timed(produce(), 'source')
+        next(timed)
+        timed.close()
+        self.assertEqual(closed, [True])
+        self.assertEqual(stats._stack, [])
+
+
+class CounterTest(unittest.TestCase):
+    def test_count_and_merge(self):
+        worker = Stats()
+        worker.count('carved', 'png')
+        worker.count('carved', 'png')
+        worker.count('bytes_copied', n=100)
+        worker.stages['scanning'] = 1.5
+        stats = Stats()
+        stats.count('carved', 'gif')
+        stats.count('bytes_copied', n=5)
+        stats.merge(worker.snapshot(), stage_prefix='workers/')
+        stats.merge(worker.snapshot(), stage_prefix='workers/')
+        self.assertEqual(stats.counters, {'carved': {'gif': 1, 'png': 4}, 'bytes_copied': 205})
+        self.assertEqual(stats.stages, {'workers/scanning': 3.0})
+
+    def test_table(self):
+        stats = Stats()
+        stats.count('carved', 'png', 2)
+        stats.count('carved', 'gif')
+        stats.stages.update({'writing': 0.5, 'ingest': 1.0, 'custom': 0.1})
+        lines = stats.table().splitlines()
+        self.assertEqual([line.split()[0] for line in lines[1:4]], ['ingest', 'writing', 'custom'])
+        self.assertIn('carved                         3  (gif=1, png=2)', lines)
+
+
+class RunStatsTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        files = [sample('png'), sample('zip'), sample('png')]
+        self.pcap = write_capture(os.path.join(self.directory.name, 'in.pcap'), [padded(*files)])
+        self.payload = len(padded(*files))
+
+    def test_extraction_is_counted(self):
+        stats = Stats()
+        run(self.pcap, os.path.join(self.directory.name, 'out'), ['png', 'zip'], stats=stats)
+        self.assertEqual(stats.counters['payload_bytes'], self.payload)
+        self.assertEqual(stats.counters['carved'], {'png': 2, 'zip': 1})
+        self.assertEqual(stats.counters['files_written'], {'png': 1, 'zip': 1})
+        self.assertEqual(stats.counters['duplicates'], {'png': 1})
+        self.assertLessEqual({'reassembly', 'scanning', 'hashing', 'writing'}, set(stats.stages))
+        self.assertEqual(stats._stack, [])
+        self.assertIsNotNone(stats.wall)
+        json.dumps(stats.report())
+
+    def test_parallel_workers_are_merged(self):
+        stats = Stats()
+        run(self.pcap, os.path.join(self.directory.name, 'out'), ['png', 'zip'], jobs=2, stats=stats)
+        self.assertEqual(stats.counters['carved'], {'png': 2, 'zip': 1})
+        self.assertIn('workers/scanning', stats.stages)
+
+    def test_stats_json_from_the_command_line(self):
+        out = subprocess.run([sys.executable, os.path.join(ROOT, 'PCAP_Extractor.py'), self.pcap, '-o',
+                              os.path.join(self.directory.name, 'out'), '-t', 'png', '--stats-json', '-'],
+                             stdout=subprocess.PIPE, check=True, universal_newlines=True).stdout
+        report = json.loads(out[out.index('\n{') + 1:])
+        self.assertEqual(report['counters']['files_written'], {'png': 1})
+        self.assertIsNotNone(report['wall_seconds'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+"""Structural checks and deep checks on whole, cut-off and altered files.
+
+Run with ``python -m pytest tests`` (or ``python -m unittest``). Samples
+come from the benchmark builders, so no capture files are needed.
+"""
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+from generate import BUILDERS  # noqa: E402
+from en1gma.carver import Carve  # noqa: E402
+from en1gma.deepcheck import DeepChecker  # noqa: E402
+from en1gma.signatures import FILE_TYPES  # noqa: E402
+from en1gma.validators import sqlite_valid, sqlite_verify  # noqa: E402
+
+DESERIALIZE = hasattr(sqlite3.Connection, 'deserialize')
+
+
+def sample(ext, seed=1):
+    return BUILDERS[ext](random.Random(seed), 5000)
+
+
+class StructuralCheckTest(unittest.TestCase):
+    def test_accepts_whole_files(self):
+        for ext in BUILDERS:
+            with self.subTest(ext=ext):
+                self.assertTrue(FILE_TYPES[ext]['validate'](memoryview(sample(ext))))
+
+
+class DeepCheckTest(unittest.TestCase):
+    TYPES = [ext for ext in BUILDERS if 'verify' in FILE_TYPES[ext]]
+
+    def test_passes_whole_files(self):
+        for ext in self.TYPES:
+            with self.subTest(ext=ext):
+                self.assertIsNone(FILE_TYPES[ext]['verify'](sample(ext)))
+
+    def test_names_the_fault_in_cut_off_files(self):
+        for ext in self.TYPES:
+            if ext == 'sqlite' and not DESERIALIZE:
+                continue
+            data = sample(ext)
+            with self.subTest(ext=ext):
+                reason = FILE_TYPES[ext]['verify'](data[:len(data) // 2])
+                self.assertIsInstance(reason, str)
+                self.assertTrue(reason)
+
+
+def _database(journal_mode):
+    """A small database written to disk in ``journal_mode``, as its file bytes."""
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'test.db')
+        db = sqlite3.connect(path)
+        db.execute(f"PRAGMA journal_mode={journal_mode}")
+        db.execute("CREATE TABLE t (id INTEGER PRIMARY KEY, name TEXT)")
+        db.executemany("INSERT INTO t (name) VALUES (?)", [(f"row {i}",) for i in range(200)])
+        db.commit()
+        # Move the WAL's pages into the database file before reading it
+        db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        db.close()
+        with open(path, 'rb') as f:
+            return f.read()
+
+
+@unittest.skipUnless(DESERIALIZE, "sqlite3 cannot deserialize before Python 3.11")
+class SqliteJournalModeTest(unittest.TestCase):
+    def test_wal_database(self):
+        data = _database('WAL')
+        self.assertEqual(data[18:20], b'\x02\x02')
+        self.assertTrue(sqlite_valid(memoryview(data)))
+        self.assertIsNone(sqlite_verify(data))
+        self.assertIsNone(sqlite_verify(memoryview(data)))
+
+    def test_rollback_journal_database(self):
+        data = _database('DELETE')
+        self.assertEqual(data[18:20], b'\x01\x01')
+        self.assertTrue(sqlite_valid(memoryview(data)))
+        self.assertIsNone(sqlite_verify(data))
+
+    def test_damaged_wal_database(self):
+        data = bytearray(_database('WAL'))
+        half = len(data) // 2
+        data[half:] = bytes(len(data) - half)
+        self.assertIsInstance(sqlite_verify(bytes(data)), str)
+
+
+class DeepCheckerTest(unittest.TestCase):
+    def test_verdicts_in_submission_order(self):
+        files = [('png', sample('png')), ('png', sample('png', 2)[:3000]), ('gif', sample('gif')),
+                 ('tiff', sample('tiff')), ('png', sample('png'))]
+        checker = DeepChecker('veto', workers=2)
+        try:
+            for number, (ext, data) in enumerate(files):
+                carve = Carve(ext, memoryview(data), 0, 0, number, None, None, None)
+                checker.submit(carve, f"{ext}{len(data)}", FILE_TYPES[ext].get('verify'))
+            released = list(checker.ready(wait=True))
+        finally:
+            checker.close()
+        self.assertEqual([carve.offset for carve, _, _ in released], list(range(len(files))))
+        self.assertEqual([reason is None for _, _, reason in released], [True, False, True, True, True])
+        self.assertIsInstance(released[0][0].data, bytes)
+
+
+if __name__ == '__main__':
+    unittest.main()